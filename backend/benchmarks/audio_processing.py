@@ -0,0 +1,150 @@
+# benchmarks/audio_processing.py
+"""
+PCM 処理の計測: pydub (AudioSegment / audioop) と services.audio_core (NumPy) の比較
+
+合成したステレオの WAV をメモリ上で処理し、処理時間（最小値）と tracemalloc のピークメモリを比較します。
+デコード・エンコードは ffmpeg に任せる部分のため含めません。
+- convert: WAV 読み込み → モノラル化 → リサンプリング → WAV 書き出し（AudioConversionService の変換）
+- postprocess: WAV 読み込み → ピーク正規化 → フェードイン/アウト → WAV 書き出し
+- mix: 同じ長さの複数パートの加算（パートごとの合成結果のミックス）
+
+使い方 (backend ディレクトリで実行):
+    python benchmarks/audio_processing.py [--seconds 60] [--sample-rate 48000] [--parts 4] [--repeat 5]
+"""
+
+import argparse
+import io
+import math
+import os
+import sys
+import time
+import tracemalloc
+import warnings
+from typing import Any, Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from services import audio_core  # noqa: E402
+
+OUTPUT_SAMPLE_RATE = 44100
+
+
+def make_wav(seconds: float, sample_rate: int, channels: int, frequency: float = 220.0) -> bytes:
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames, dtype=np.float32) / sample_rate
+    tone = 0.4 * np.sin(2 * math.pi * frequency * t) + 0.05 * np.random.default_rng(0).standard_normal(frames).astype(np.float32)
+    samples = np.repeat(tone[:, None], channels, axis=1)
+    if channels > 1:
+        samples[:, 1] *= 0.8
+    return audio_core.write_wav(audio_core.PcmAudio(samples.astype(np.float32), sample_rate))
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Tuple[float, int, Any]:
+    """(最小の処理時間 秒, tracemalloc のピーク バイト, 最後の戻り値)"""
+    best = math.inf
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+# --- pydub --------------------------------------------------------------------
+
+def pydub_convert(wav: bytes) -> bytes:
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_wav(io.BytesIO(wav))
+    audio = audio.set_channels(1).set_frame_rate(OUTPUT_SAMPLE_RATE)
+    output = io.BytesIO()
+    audio.export(output, format="wav")
+    return output.getvalue()
+
+
+def pydub_postprocess(wav: bytes) -> bytes:
+    from pydub import AudioSegment, effects
+
+    audio = AudioSegment.from_wav(io.BytesIO(wav))
+    audio = effects.normalize(audio, headroom=1.0).fade_in(500).fade_out(2000)
+    output = io.BytesIO()
+    audio.export(output, format="wav")
+    return output.getvalue()
+
+
+def pydub_mix(parts: List[bytes]) -> bytes:
+    from pydub import AudioSegment
+
+    segments = [AudioSegment.from_wav(io.BytesIO(part)) for part in parts]
+    mixed = segments[0]
+    for segment in segments[1:]:
+        mixed = mixed.overlay(segment)
+    return mixed.raw_data
+
+
+# --- NumPy (audio_core) ---------------------------------------------------------
+
+def numpy_convert(wav: bytes) -> bytes:
+    audio = audio_core.read_wav(wav)
+    audio = audio_core.resample(audio_core.downmix(audio, 1), OUTPUT_SAMPLE_RATE)
+    return audio_core.write_wav(audio)
+
+
+def numpy_postprocess(wav: bytes) -> bytes:
+    audio = audio_core.normalize_peak(audio_core.read_wav(wav), -1.0)
+    audio = audio_core.fade(audio, fade_in_seconds=0.5, fade_out_seconds=2.0)
+    return audio_core.write_wav(audio)
+
+
+def numpy_mix(parts: List[bytes]) -> bytes:
+    # 合成時の _PcmMixer と同じく、WAV のヘッダーを除いた s16le をそのまま加算する
+    buffers = [audio_core.pcm16_buffer(audio_core.read_wav(part)) for part in parts]
+    return audio_core.mix_pcm16(buffers, channels=2).tobytes()
+
+
+def _wav_duration(wav: bytes) -> float:
+    return audio_core.read_wav(wav).duration_seconds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=60.0, help="入力音声の長さ（秒）")
+    parser.add_argument("--sample-rate", type=int, default=48000, help="入力のサンプリングレート")
+    parser.add_argument("--parts", type=int, default=4, help="mix で加算するパート数")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # pydub は audioop の非推奨警告を出すため抑止する
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+
+    stereo = make_wav(args.seconds, args.sample_rate, channels=2)
+    parts = [make_wav(args.seconds, OUTPUT_SAMPLE_RATE, channels=2, frequency=110.0 * (i + 1)) for i in range(args.parts)]
+    print(f"input: {args.seconds:.0f}s stereo {args.sample_rate}Hz ({len(stereo) / 1e6:.1f} MB), mix: {args.parts} parts")
+    print(f"{'case':>12} {'impl':>6} {'best ms':>10} {'peak MB':>10} {'speedup':>8} {'mem ratio':>10}")
+
+    cases = [
+        ("convert", lambda: pydub_convert(stereo), lambda: numpy_convert(stereo)),
+        ("postprocess", lambda: pydub_postprocess(stereo), lambda: numpy_postprocess(stereo)),
+        ("mix", lambda: pydub_mix(parts), lambda: numpy_mix(parts)),
+    ]
+    for name, pydub_func, numpy_func in cases:
+        pydub_time, pydub_peak, pydub_result = measure(pydub_func, args.repeat)
+        numpy_time, numpy_peak, numpy_result = measure(numpy_func, args.repeat)
+        print(f"{name:>12} {'pydub':>6} {pydub_time * 1000:>10.1f} {pydub_peak / 1e6:>10.1f}")
+        print(
+            f"{name:>12} {'numpy':>6} {numpy_time * 1000:>10.1f} {numpy_peak / 1e6:>10.1f}"
+            f" {pydub_time / numpy_time:>7.1f}x {numpy_peak / pydub_peak:>10.2f}"
+        )
+        if name != "mix":
+            # 出力の長さがそろっていることを確認する（内容はリサンプリング方式の違いで一致しない）
+            print(f"{'':>12} output: pydub {_wav_duration(pydub_result):.3f}s / numpy {_wav_duration(numpy_result):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
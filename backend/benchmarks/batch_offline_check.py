@@ -0,0 +1,204 @@
+# benchmarks/batch_offline_check.py
+"""
+オフライン一括処理（Vertex AI バッチ予測）の動作確認
+
+Vertex AI の代わりに benchmarks/fakes.py の FakeBatchPredictionClient（出力の行は順不同、要求ごとの失敗を注入）を使い、
+services.batch_prediction.run_offline_workflow の結果と /api/process/batch (mode=offline) の NDJSON 応答を検証します。
+- 出力の行が順不同でも、ITEM_LABEL によって各項目に自分の応答が対応付けられること
+- 生成の要求が失敗した項目は、その項目だけのエラー (GENERATION_FAILED) になること
+- MusicXML解析の要求が失敗した項目は、音楽的特徴なしで成功すること
+期待と異なる点があれば一覧を出力し、終了コード1で終了します。
+
+使い方 (backend ディレクトリで実行):
+    python benchmarks/batch_offline_check.py [--seed 0]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+ITEM_COUNT = 4
+# 生成の要求が失敗する項目と、MusicXML解析の要求が失敗する項目（いずれも項目の順番）
+GENERATION_FAILED_ITEM = 1
+ANALYSIS_FAILED_ITEM = 2
+REJECTED_FILE = ("rejected.txt", b"not audio", "text/plain")
+
+
+def item_theme(index: int) -> str:
+    return f"確認用のテーマ {index}"
+
+
+def item_bpm(index: int) -> int:
+    return 100 + index
+
+
+def make_batch_client(seed: int) -> Any:
+    """項目ごとに異なる応答を返し、所定の要求を失敗させるバッチ予測クライアントの代替を作る。"""
+    from benchmarks.fakes import FakeBatchPredictionClient, LatencyDistribution, VertexRecording, load_recordings
+    from services.batch_prediction import GENERATION_TASK, MUSICXML_ANALYSIS_TASK
+
+    no_latency = LatencyDistribution("fixed", [0.0])
+    recordings = load_recordings(latency_override="fixed:0")
+    # 応答は要求の順に再生されるため、どの項目の応答かを内容から判別できるようにする
+    recordings["humming_analysis"] = VertexRecording([item_theme(index) for index in range(ITEM_COUNT)], no_latency)
+    analysis_targets = [index for index in range(ITEM_COUNT) if index != GENERATION_FAILED_ITEM]
+    recordings["musicxml_analysis"] = VertexRecording(
+        [{"key": "C Major", "bpm": item_bpm(index), "chords": ["C", "G", "Am", "F"], "genre": "J-POP"} for index in analysis_targets],
+        no_latency,
+    )
+    # 失敗させる要求は、その段階のジョブ内での順番で指定する（前の段階で失敗した項目は要求に含まれない）
+    failures = {
+        GENERATION_TASK: {GENERATION_FAILED_ITEM},
+        MUSICXML_ANALYSIS_TASK: {analysis_targets.index(ANALYSIS_FAILED_ITEM)},
+    }
+    return FakeBatchPredictionClient(recordings, failures=failures, rng=random.Random(seed))
+
+
+class Checker:
+    def __init__(self) -> None:
+        self.failures: List[str] = []
+
+    def check(self, condition: bool, message: str) -> None:
+        if not condition:
+            self.failures.append(message)
+
+    def check_item(
+        self, label: str, index: int, error_code: Optional[str], humming_theme: Optional[str], bpm: Optional[int],
+    ) -> None:
+        """1項目分の結果（エラーコード・テーマ・BPM）を期待値と比べる。"""
+        if index == GENERATION_FAILED_ITEM:
+            self.check(error_code == "GENERATION_FAILED", f"{label}: 生成が失敗した項目のエラーが GENERATION_FAILED ではありません: {error_code}")
+            return
+        self.check(error_code is None, f"{label}: 成功するはずの項目がエラーになりました: {error_code}")
+        self.check(humming_theme == item_theme(index), f"{label}: 別の項目のテーマが対応付けられました: {humming_theme!r}")
+        expected_bpm = None if index == ANALYSIS_FAILED_ITEM else item_bpm(index)
+        self.check(bpm == expected_bpm, f"{label}: 音楽的特徴の BPM が {bpm} です（期待値: {expected_bpm}）")
+
+
+async def check_offline_workflow(checker: Checker, seed: int) -> None:
+    """run_offline_workflow を直接実行し、各項目の結果を確認する。"""
+    from config import settings
+    from services.batch_prediction import OfflineItem, new_batch_id, run_offline_workflow
+
+    client = make_batch_client(seed)
+    items = [
+        OfflineItem(gcs_uri=f"gs://{settings.GCS_UPLOAD_BUCKET}/check/{index}.wav", mime_type="audio/wav")
+        for index in range(ITEM_COUNT)
+    ]
+    stages: List[Dict[str, Any]] = []
+    await run_offline_workflow(items, client, new_batch_id(), lambda stage, count: stages.append({"stage": stage, "items": count}))
+
+    for index, item in enumerate(items):
+        checker.check_item(
+            f"workflow item {index}", index, item.error.error_code.value if item.error else None,
+            item.humming_theme, item.music_analysis_features.bpm if item.music_analysis_features else None,
+        )
+    expected_stages = [ITEM_COUNT, ITEM_COUNT, ITEM_COUNT - 1]
+    checker.check(
+        [stage["items"] for stage in stages] == expected_stages,
+        f"workflow: 段階ごとの要求数が {stages} です（期待値: {expected_stages}）",
+    )
+    checker.check(
+        any(job["output_order"] != sorted(job["output_order"]) for job in client.jobs),
+        "workflow: 出力の行がすべて要求と同じ順序でした（順不同の対応付けを確認できていません）",
+    )
+
+
+def check_batch_endpoint(checker: Checker, app: Any, seed: int) -> None:
+    """/api/process/batch (mode=offline) の NDJSON 応答を確認する。"""
+    from fastapi.testclient import TestClient
+
+    from benchmarks.load_test import make_wav
+    from services import batch_prediction
+
+    batch_prediction._batch_prediction_client_instance = make_batch_client(seed)
+    files = [("files", (f"humming-{index}.wav", make_wav(0.5), "audio/wav")) for index in range(ITEM_COUNT)]
+    files.append(("files", REJECTED_FILE))
+    with TestClient(app) as client:
+        response = client.post("/api/process/batch", data={"mode": "offline"}, files=files)
+    checker.check(response.status_code == 200, f"endpoint: ステータスコードが {response.status_code} です")
+    if response.status_code != 200:
+        return
+
+    items: Dict[str, Dict[str, Any]] = {}
+    summary: Optional[Dict[str, Any]] = None
+    for line in response.text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record["type"] == "item":
+            items[record["source"]] = record
+        elif record["type"] == "summary":
+            summary = record
+
+    rejected = items.get(REJECTED_FILE[0])
+    checker.check(
+        rejected is not None and rejected["status"] == "failed" and rejected["error"]["code"] == "UNSUPPORTED_MEDIA_TYPE",
+        f"endpoint: 受け付けない項目の結果が不正です: {rejected}",
+    )
+    for index in range(ITEM_COUNT):
+        source = f"humming-{index}.wav"
+        item = items.get(source)
+        if item is None:
+            checker.check(False, f"endpoint: {source} の行がありません")
+            continue
+        checker.check(item["index"] == index, f"endpoint: {source} の index が {item['index']} です")
+        checker.check(
+            (item["status"] == "failed") == (index == GENERATION_FAILED_ITEM),
+            f"endpoint: {source} の status が {item['status']} です",
+        )
+        result = item.get("result") or {}
+        analysis = result.get("analysis") or {}
+        checker.check_item(
+            f"endpoint {source}", index, (item.get("error") or {}).get("code"), result.get("humming_theme"), analysis.get("bpm"),
+        )
+    expected_summary = {"total": ITEM_COUNT + 1, "succeeded": ITEM_COUNT - 1, "failed": 2}
+    checker.check(
+        summary is not None and all(summary.get(key) == value for key, value in expected_summary.items()),
+        f"endpoint: summary が {summary} です（期待値: {expected_summary}）",
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="オフライン一括処理（バッチ予測）の動作確認")
+    parser.add_argument("--seed", type=int, default=0, help="出力の行の並べ替えに使う乱数のシード")
+    args = parser.parse_args()
+
+    # 設定は main の import 時に読み込まれるため、先に環境変数を整える
+    os.environ.setdefault("GCS_UPLOAD_BUCKET", "batch-check-upload")
+    os.environ.setdefault("GCS_TRACK_BUCKET", "batch-check-track")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    os.environ["LLM_CACHE_BACKEND"] = "none"
+
+    from benchmarks.load_test import install_fakes
+    from main import app
+
+    checker = Checker()
+    with tempfile.TemporaryDirectory(prefix="batch-check-gcs-") as storage_root:
+        fake_args = argparse.Namespace(
+            seed=args.seed, recordings=None, vertex_latency="fixed:0", gcs_latency=None, synthesis_latency=None,
+        )
+        install_fakes(fake_args, storage_root)
+        asyncio.run(check_offline_workflow(checker, args.seed))
+        check_batch_endpoint(checker, app, args.seed)
+
+    if checker.failures:
+        print(f"NG ({len(checker.failures)}件)")
+        for failure in checker.failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("OK: オフライン一括処理の項目ごとの結果・失敗の扱い・順不同の出力の対応付け")
+
+
+if __name__ == "__main__":
+    main()
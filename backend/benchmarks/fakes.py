@@ -0,0 +1,473 @@
+# benchmarks/fakes.py
+"""
+負荷試験用のローカル代替実装（Vertex AI / GCS / 音声合成）
+
+実際の Vertex AI クォータや GCS のトラフィックを使わずに /api/process と /api/chat を
+エンドツーエンドで動かすための代替実装です。既存の DI ポイント
+(get_gcs_service / get_vertex_chat_service / get_audio_analyzer / get_audio_synthesis_service)
+が返すシングルトンを差し替えるため、アプリケーション側のコードには手を入れません。
+
+- FakeStorageClient: ファイルシステムをバケットとして扱う storage.Client の代替。
+  GCSService 自体は本物を使うため、スレッドプール経由のアップロード・ダウンロードの経路も計測対象になる。
+- FakeChatModel: 記録済みの応答を設定したレイテンシ分布で再生する ChatVertexAI の代替。
+  ainvoke / astream / with_structured_output に対応する。
+- FakeAudioSynthesisService: FluidSynth / SoundFont なしで固定のMP3バイト列を返す合成サービスの代替。
+- FakeBatchPredictionClient: 記録済み応答でバッチ予測ジョブを即座に（ジョブ1件分のレイテンシで）完了させる代替。
+  出力の行は順不同で、要求ごとの失敗も注入できる。
+
+記録済み応答は JSON ファイルで差し替えられます（形式は DEFAULT_RECORDINGS を参照）。
+"""
+
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Set
+
+from fastapi.concurrency import run_in_threadpool
+from google.api_core import exceptions as google_exceptions
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from config import settings
+from services.audio_analysis_service import AudioAnalyzer
+from services.batch_prediction import (
+    GENERATION_TASK,
+    ITEM_LABEL,
+    MUSICXML_ANALYSIS_TASK,
+    TASK_LABEL,
+    BatchPredictionClient,
+    labeled_request,
+    responses_from_output_rows,
+)
+from services.audio_synthesis_service import AudioSynthesisService
+from services.renditions import RenderedAudio, StemAudio, list_score_parts
+
+
+class LatencyDistribution:
+    """
+    レイテンシ分布。文字列の指定から生成する。
+        fixed:0.5            常に 0.5 秒
+        uniform:0.2,1.0      0.2〜1.0 秒の一様分布
+        normal:1.0,0.2       平均 1.0 秒・標準偏差 0.2 秒（0 未満は 0）
+        lognormal:1.2,0.4    中央値 1.2 秒・形状パラメータ 0.4 の対数正規分布（裾の重い応答時間向け）
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    def __init__(self, kind: str, params: Sequence[float], rng: Optional[random.Random] = None):
+        if kind not in self.KINDS:
+            raise ValueError(f"未対応のレイテンシ分布です: {kind} (対応: {', '.join(self.KINDS)})")
+        expected = 1 if kind == "fixed" else 2
+        if len(params) != expected:
+            raise ValueError(f"{kind} には {expected} 個のパラメータが必要です: {params}")
+        self.kind = kind
+        self.params = tuple(params)
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec: str, rng: Optional[random.Random] = None) -> "LatencyDistribution":
+        kind, _, raw_params = spec.partition(":")
+        params = [float(p) for p in raw_params.split(",") if p.strip()] if raw_params else [0.0]
+        return cls(kind.strip(), params, rng)
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(*self.params))
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+    def __repr__(self) -> str:
+        return f"{self.kind}:{','.join(str(p) for p in self.params)}"
+
+
+def _build_backing_track_musicxml(chords: Sequence[str] = ("C", "G", "A", "F"), bpm: int = 100) -> str:
+    """記録済み応答用の、構造検証を通る小さなバッキングトラック（ルート音の全音符）。"""
+    measures = []
+    for number, root in enumerate(chords, start=1):
+        attributes = ""
+        direction = ""
+        if number == 1:
+            attributes = (
+                "<attributes><divisions>1</divisions><key><fifths>0</fifths></key>"
+                "<time><beats>4</beats><beat-type>4</beat-type></time><clef><sign>F</sign><line>4</line></clef></attributes>"
+            )
+            direction = (
+                '<direction placement="above"><direction-type><metronome><beat-unit>quarter</beat-unit>'
+                f"<per-minute>{bpm}</per-minute></metronome></direction-type><sound tempo=\"{bpm}\"/></direction>"
+            )
+        measures.append(
+            f'<measure number="{number}">{attributes}{direction}'
+            f"<note><pitch><step>{root}</step><octave>3</octave></pitch><duration>4</duration><type>whole</type></note>"
+            "</measure>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>\n'
+        '<score-partwise version="3.1"><part-list><score-part id="P1"><part-name>Bass</part-name></score-part></part-list>'
+        f'<part id="P1">{"".join(measures)}</part></score-partwise>'
+    )
+
+
+BACKING_TRACK_MUSICXML = _build_backing_track_musicxml()
+
+# 同じバッキングトラックを音符イベント形式 (services.note_events) で書いたもの
+BACKING_TRACK_NOTE_EVENTS = "\n".join(
+    ["TEMPO 100", "KEY C", "TIME 4/4", "PART P1 33 Bass"]
+    + [f"{number} P1: {root}3/1" for number, root in enumerate(("C", "G", "A", "F"), start=1)]
+)
+
+# タスクごとの記録済み応答とレイテンシ分布。応答は順番に（循環して）再生する。
+DEFAULT_RECORDINGS: Dict[str, Dict[str, Any]] = {
+    "humming_analysis": {
+        "latency": "lognormal:2.5,0.35",
+        "responses": ["明るく軽快なJ-POP。跳ねるリズムで、サビに向かって盛り上がる雰囲気。"],
+    },
+    "musicxml_generation": {
+        "latency": "lognormal:6.0,0.4",
+        "responses": [f"MUSICXML_START\n{BACKING_TRACK_MUSICXML}\nMUSICXML_END"],
+    },
+    "note_events_generation": {
+        # 出力トークンが MusicXML の数分の一になる分だけ短い
+        "latency": "lognormal:2.0,0.4",
+        "responses": [f"NOTES_START\n{BACKING_TRACK_NOTE_EVENTS}\nNOTES_END"],
+    },
+    "musicxml_analysis": {
+        "latency": "lognormal:1.5,0.3",
+        "responses": [{"key": "C Major", "bpm": 100, "chords": ["C", "G", "Am", "F"], "genre": "J-POP"}],
+    },
+    "chat": {
+        "latency": "lognormal:0.8,0.3",
+        "chunk_latency": "uniform:0.02,0.08",
+        "chunk_chars": 24,
+        "responses": [
+            "いいですね！サビの前に一小節だけベースを休ませると、サビの入りがより印象的になります。"
+            "コード進行は C - G - Am - F のままで、Am の小節だけ8分音符で刻んでみてください。",
+        ],
+    },
+}
+
+# AudioAnalyzer のタスク説明（の先頭）と記録済み応答のキーの対応
+ANALYZER_TASK_KEYS = {
+    "Humming Audio Analysis": "humming_analysis",
+    "MusicXML Generation": "musicxml_generation",
+    "Note Events Generation": "note_events_generation",
+    "MusicXML Analysis": "musicxml_analysis",
+}
+
+
+class VertexRecording:
+    """1タスク分の記録済み応答とレイテンシ分布。"""
+
+    def __init__(
+        self,
+        responses: List[Any],
+        latency: LatencyDistribution,
+        chunk_latency: Optional[LatencyDistribution] = None,
+        chunk_chars: int = 24,
+    ):
+        if not responses:
+            raise ValueError("記録済み応答が空です。")
+        self.responses = responses
+        self.latency = latency
+        self.chunk_latency = chunk_latency or LatencyDistribution("fixed", [0.0])
+        self.chunk_chars = max(1, chunk_chars)
+        self._cycle = itertools.cycle(responses)
+
+    def next_response(self) -> Any:
+        return next(self._cycle)
+
+
+def load_recordings(
+    path: Optional[str] = None,
+    latency_override: Optional[str] = None,
+    rng: Optional[random.Random] = None,
+) -> Dict[str, VertexRecording]:
+    """DEFAULT_RECORDINGS に JSON ファイルの内容を重ねて読み込む。latency_override は全タスクのレイテンシを上書きする。"""
+    raw: Dict[str, Dict[str, Any]] = {key: dict(value) for key, value in DEFAULT_RECORDINGS.items()}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for key, value in json.load(f).items():
+                raw.setdefault(key, {}).update(value)
+    recordings = {}
+    for key, value in raw.items():
+        recordings[key] = VertexRecording(
+            responses=list(value["responses"]),
+            latency=LatencyDistribution.parse(latency_override or value.get("latency", "fixed:0"), rng),
+            chunk_latency=LatencyDistribution.parse(value["chunk_latency"], rng) if value.get("chunk_latency") else None,
+            chunk_chars=int(value.get("chunk_chars", 24)),
+        )
+    return recordings
+
+
+def _usage_metadata(messages: Any, content: str) -> Dict[str, int]:
+    # 1トークン ≒ 4文字として概算する（トークン計測の経路を本番と同じように通すため）
+    input_tokens = max(1, len(str(messages)) // 4)
+    output_tokens = max(1, len(content) // 4)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+
+class FakeChatModel:
+    """記録済み応答を再生する ChatVertexAI の代替。呼び出しごとにレイテンシ分布から待ち時間を引く。"""
+
+    def __init__(self, model_name: str, recording: VertexRecording):
+        self.model_name = model_name
+        self.recording = recording
+        self.calls = 0
+
+    async def ainvoke(self, messages: Any, **kwargs: Any) -> AIMessage:
+        self.calls += 1
+        await asyncio.sleep(self.recording.latency.sample())
+        content = str(self.recording.next_response())
+        return AIMessage(content=content, usage_metadata=_usage_metadata(messages, content))
+
+    async def astream(self, messages: Any, **kwargs: Any) -> AsyncIterator[AIMessageChunk]:
+        self.calls += 1
+        # latency は最初のチャンクまでの時間、chunk_latency はチャンク間の時間として扱う
+        await asyncio.sleep(self.recording.latency.sample())
+        content = str(self.recording.next_response())
+        size = self.recording.chunk_chars
+        for start in range(0, len(content), size):
+            if start:
+                await asyncio.sleep(self.recording.chunk_latency.sample())
+            # Vertex AI と同様に、使用量は最後のチャンクで報告する
+            last = start + size >= len(content)
+            yield AIMessageChunk(content=content[start:start + size], usage_metadata=_usage_metadata(messages, content) if last else None)
+
+    def with_structured_output(self, schema: Any, include_raw: bool = False, **kwargs: Any) -> "FakeStructuredChatModel":
+        return FakeStructuredChatModel(self, schema, include_raw)
+
+
+class FakeStructuredChatModel:
+    """with_structured_output() の戻り値の代替。記録済みの dict をスキーマのインスタンスにして返す。"""
+
+    def __init__(self, model: FakeChatModel, schema: Any, include_raw: bool = False):
+        self.model = model
+        self.schema = schema
+        self.include_raw = include_raw
+
+    async def ainvoke(self, messages: Any, **kwargs: Any) -> Any:
+        self.model.calls += 1
+        await asyncio.sleep(self.model.recording.latency.sample())
+        recorded = self.model.recording.next_response()
+        parsed = self.schema(**recorded)
+        if not self.include_raw:
+            return parsed
+        raw = AIMessage(content="", usage_metadata=_usage_metadata(messages, json.dumps(recorded, ensure_ascii=False)))
+        return {"raw": raw, "parsed": parsed, "parsing_error": None}
+
+
+class FakeAudioAnalyzer(AudioAnalyzer):
+    """LLM クライアントの生成だけを FakeChatModel に差し替えた AudioAnalyzer。検証・修復・カスケード等は本物を通る。"""
+
+    def __init__(self, recordings: Dict[str, VertexRecording]):
+        super().__init__()
+        self.recordings = recordings
+        self.fake_models: Dict[str, FakeChatModel] = {}
+
+    def _get_llm(self, task_description: str, model_name: str, for_generation: bool = False) -> FakeChatModel:
+        # 対応する記録がないタスク（ウォームアップ等）にはチャットの記録を汎用の応答として使う
+        key = next((k for prefix, k in ANALYZER_TASK_KEYS.items() if task_description.startswith(prefix)), "chat")
+        model = self.fake_models.get(key)
+        if model is None:
+            model = FakeChatModel(model_name, self.recordings[key])
+            self.fake_models[key] = model
+        return model
+
+
+class FakeBatchPredictionClient(BatchPredictionClient):
+    """
+    要求のタスクラベルに対応する記録済み応答を GenerateContentResponse の形で返すバッチ予測クライアントの代替。
+    本物と同じく出力の行は順不同（rng でシャッフル）で、ITEM_LABEL による要求との対応付けは本物のコードを通る。
+    failures にはタスクごとに、失敗させる要求のジョブ内での順番を指定できる（出力の行に status が入る）。
+    """
+
+    def __init__(
+        self,
+        recordings: Dict[str, VertexRecording],
+        failures: Optional[Dict[str, Set[int]]] = None,
+        rng: Optional[random.Random] = None,
+    ):
+        self.recordings = recordings
+        self.failures = failures or {}
+        self.rng = rng or random.Random(0)
+        self.jobs: List[Dict[str, Any]] = []
+
+    def _recording_key(self, task: str) -> str:
+        if task == GENERATION_TASK:
+            return f"{settings.MUSICXML_GENERATION_FORMAT}_generation"
+        return task
+
+    async def predict(self, model_name: str, requests: List[Dict[str, Any]], job_name: str) -> List[Optional[Dict[str, Any]]]:
+        tasks = {request["labels"][TASK_LABEL] for request in requests}
+        self.jobs.append({"job_name": job_name, "model": model_name, "requests": len(requests)})
+        # ジョブ全体で1回分のレイテンシを待つ（ポーリング間隔は再現しない）
+        await asyncio.sleep(max(self.recordings[self._recording_key(task)].latency.sample() for task in tasks))
+        rows = []
+        for index, request in enumerate(requests):
+            task = request["labels"][TASK_LABEL]
+            recorded = self.recordings[self._recording_key(task)].next_response()
+            row = labeled_request(request, index)
+            if index in self.failures.get(task, ()):
+                row["status"] = "INTERNAL: injected failure"
+                rows.append(row)
+                continue
+            text = json.dumps(recorded, ensure_ascii=False) if task == MUSICXML_ANALYSIS_TASK else str(recorded)
+            usage = _usage_metadata(request["contents"], text)
+            row["response"] = {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": usage["input_tokens"], "candidatesTokenCount": usage["output_tokens"]},
+            }
+            rows.append(row)
+        self.rng.shuffle(rows)
+        self.jobs[-1]["output_order"] = [int(row["request"]["labels"][ITEM_LABEL]) for row in rows]
+        return responses_from_output_rows(rows, len(requests), job_name)
+
+
+class _FakeBlob:
+    def __init__(self, client: "FakeStorageClient", bucket_name: str, name: str):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.name = name
+        # 本物と同じく、アップロード後・メタデータ取得後にのみ値が入る（ファイルの更新時刻 ns を generation とする）
+        self.generation: Optional[int] = None
+        self.md5_hash: Optional[str] = None
+        self.crc32c: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.client.root_dir, self.bucket_name, self.name)
+
+    def upload_from_file(self, file_obj: Any, content_type: Optional[str] = None, **kwargs: Any) -> None:
+        self.client.simulate_latency()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "wb") as f:
+            while True:
+                chunk = file_obj.read(1024 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        stat = os.stat(self.path)
+        self.generation = stat.st_mtime_ns
+        self.client.record("upload", stat.st_size)
+
+    def download_as_bytes(self, if_generation_match: Optional[int] = None, **kwargs: Any) -> bytes:
+        self.client.simulate_latency()
+        with open(self.path, "rb") as f:
+            if if_generation_match is not None and os.fstat(f.fileno()).st_mtime_ns != if_generation_match:
+                raise google_exceptions.PreconditionFailed(f"generation mismatch: {self.bucket_name}/{self.name}")
+            data = f.read()
+        self.client.record("download", len(data))
+        return data
+
+
+class _FakeBucket:
+    def __init__(self, client: "FakeStorageClient", name: str):
+        self.client = client
+        self.name = name
+
+    def blob(self, blob_name: str) -> _FakeBlob:
+        return _FakeBlob(self.client, self.name, blob_name)
+
+    def get_blob(self, blob_name: str) -> Optional[_FakeBlob]:
+        """メタデータの取得（本物と同じく1往復分のレイテンシがかかる）。存在しない場合は None。"""
+        self.client.simulate_latency()
+        blob = _FakeBlob(self.client, self.name, blob_name)
+        try:
+            blob.generation = os.stat(blob.path).st_mtime_ns
+            with open(blob.path, "rb") as f:
+                blob.md5_hash = base64.b64encode(hashlib.md5(f.read()).digest()).decode("ascii")
+        except FileNotFoundError:
+            return None
+        self.client.record("metadata", 0)
+        return blob
+
+
+class FakeStorageClient:
+    """
+    root_dir/<bucket>/<blob> にオブジェクトを保存する storage.Client の代替。
+    本物と同じくブロッキング呼び出しなので、GCSService からはスレッドプールで実行される。
+    """
+
+    def __init__(self, root_dir: str, latency: Optional[LatencyDistribution] = None):
+        self.root_dir = root_dir
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.operations: Dict[str, int] = {"upload": 0, "download": 0, "metadata": 0}
+        self.bytes_transferred: Dict[str, int] = {"upload": 0, "download": 0, "metadata": 0}
+
+    def bucket(self, bucket_name: str) -> _FakeBucket:
+        return _FakeBucket(self, bucket_name)
+
+    def list_blobs(self, bucket_name: str, prefix: Optional[str] = None, **kwargs: Any) -> List[_FakeBlob]:
+        """prefix で始まるオブジェクトの一覧（1往復分のレイテンシがかかる）。"""
+        self.simulate_latency()
+        bucket_dir = os.path.join(self.root_dir, bucket_name)
+        names = []
+        for dir_path, _, file_names in os.walk(bucket_dir):
+            for file_name in file_names:
+                name = os.path.relpath(os.path.join(dir_path, file_name), bucket_dir).replace(os.sep, "/")
+                if name.startswith(prefix or ""):
+                    names.append(name)
+        self.record("metadata", 0)
+        return [_FakeBlob(self, bucket_name, name) for name in sorted(names)]
+
+    def simulate_latency(self) -> None:
+        if self.latency is not None:
+            time.sleep(self.latency.sample())
+
+    def record(self, operation: str, size: int) -> None:
+        with self._lock:
+            self.operations[operation] += 1
+            self.bytes_transferred[operation] += size
+
+
+class FakeAudioSynthesisService(AudioSynthesisService):
+    """FluidSynth / SoundFont を使わずに、レイテンシ分布に従って待ってから固定のMP3バイト列を返す。"""
+
+    # MPEG-1 Layer III のフレームヘッダー + 無音のペイロード
+    SILENT_MP3 = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+    def __init__(self, latency: Optional[LatencyDistribution] = None, frames: int = 40):
+        self.latency = latency
+        self.mp3_data = self.SILENT_MP3 * frames
+
+    async def synthesize_musicxml_to_mp3(self, musicxml_content: str) -> bytes:
+        if self.latency is not None:
+            # 本物の合成と同じく CPU/サブプロセス処理はスレッドプールで行われるため、スレッドで待つ
+            await run_in_threadpool(time.sleep, self.latency.sample())
+        return self.mp3_data
+
+    async def render_rendition(self, musicxml_content: str, spec: Any, with_stems: bool = False) -> RenderedAudio:
+        if self.latency is not None:
+            # 合成コストは出力サンプル数にほぼ比例するため、full（44.1kHz ステレオ）との比で待ち時間を縮める
+            ratio = (spec.sample_rate * spec.channels) / (44100 * 2)
+            await run_in_threadpool(time.sleep, self.latency.sample() * ratio)
+        # 形式にかかわらず同じバイト列を返す（負荷試験では中身を検証しない）
+        return RenderedAudio(data=self.mp3_data, stems=self._stems(musicxml_content) if with_stems else [])
+
+    def stream_musicxml_to_mp3_sync(
+        self, musicxml_content: str, on_chunk: Any, with_stems: bool = False, chunks: int = 8,
+    ) -> List[StemAudio]:
+        # 合成時間を均等に割り振り、フレーム境界にそろえたチャンクを順に渡す
+        delay = self.latency.sample() / chunks if self.latency is not None else 0.0
+        frames_per_chunk = max(1, len(self.mp3_data) // len(self.SILENT_MP3) // chunks)
+        chunk_size = frames_per_chunk * len(self.SILENT_MP3)
+        for start in range(0, len(self.mp3_data), chunk_size):
+            time.sleep(delay)
+            on_chunk(self.mp3_data[start:start + chunk_size])
+        return self._stems(musicxml_content) if with_stems else []
+
+    def _stems(self, musicxml_content: str) -> List[StemAudio]:
+        return [
+            StemAudio(index=index, part_id=part.part_id, name=part.name, data=self.mp3_data)
+            for index, part in enumerate(list_score_parts(musicxml_content))
+        ]
@@ -0,0 +1,159 @@
+# benchmarks/generation_format.py
+"""
+バッキングトラック生成の出力形式（音符イベント / MusicXML）のトークン数とレイテンシの比較
+
+既定（オフライン）では、同じ伴奏を音符イベント形式で書いたものと、それをローカルで組み立てた
+MusicXML（従来の形式でモデルが出力していた内容に相当）について、プロンプトと出力のトークン数を
+概算し（1トークン ≒ 4文字）、「最初のトークンまでの時間 + 出力トークン数 / 生成速度」で生成時間を見積もります。
+
+--live を指定すると実際の Vertex AI に両方の形式で生成させ、usage_metadata のトークン数と
+応答時間、解析・構造検証の成否を記録します（Vertex AI の認証情報とクォータが必要です）。
+
+使い方 (backend ディレクトリで実行):
+    python benchmarks/generation_format.py [--ttft 1.0] [--tokens-per-second 80]
+    python benchmarks/generation_format.py --live [--runs 3] [--theme "..."]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GCS_UPLOAD_BUCKET", "benchmark-upload")
+os.environ.setdefault("GCS_TRACK_BUCKET", "benchmark-track")
+# --live で同じテーマを繰り返し生成するため、応答キャッシュは使わない
+os.environ.setdefault("LLM_CACHE_BACKEND", "none")
+
+from services.audio_analysis_service import build_generation_messages  # noqa: E402
+from services.musicxml_validator import validate_musicxml  # noqa: E402
+from services.note_events import parse_note_events, render_musicxml  # noqa: E402
+
+FORMATS = ("note_events", "musicxml")
+DEFAULT_THEME = "夜の街を歩くような、落ち着いたジャズ。後半に向けて少しずつ熱を帯びていく。"
+
+# プロンプトの指示どおりの規模（3パート・4小節）の伴奏
+SAMPLE_NOTE_EVENTS = """TEMPO 92
+KEY Dm
+TIME 4/4
+PART P1 5 Rhodes Piano
+PART P2 36 Fretless Bass
+PART P3 drums Drums
+1 P1: @p D3+F3+A3+C4/2 r/8 D3+F3+A3+C4/8 r/4
+1 P2: @mp D2/4 A2/4 C3/4 A2/4
+1 P3: @p kick+ride/4 ride/8 ride/8 snare+ride/4 ride/8 ride/8
+2 P1: G2+B2+F3/2. r/8 G2+B2+F3/8'
+2 P2: G2/4 D3/4 F2/4 B2/8 G2/8
+2 P3: kick+ride/4 ride/8 ride/8 snare+ride/4 ride/8 kick+ride/8
+3 P1: @mp C3+E3+G3+B3/4. C3+E3+G3+B3/8 r/4 E3+G3+B3/8 D3/8
+3 P2: C2/4 G2/4 E2/4 G2/8 B2/8
+3 P3: @mp kick+ride/4 ride/8 ride/8 snare+ride/4 ride/8 snare/16 snare/16
+4 P1: @mf A2+C#3+G3/4> r/8 A2+C#3+G3/8 Bb2+D3+G3/4 A2+C#3+E3+G3/4
+4 P2: A1/4. E2/8 A2/4 C#3/4
+4 P3: kick+crash/4> ride/8 ride/8 snare+ride/8 snare/8 hightom/16 midtom/16 floortom/8
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # benchmarks/fakes.py の _usage_metadata と同じ概算（1トークン ≒ 4文字）
+    return max(1, len(text) // 4)
+
+
+def _prompt_text(generation_format: str, theme: str) -> str:
+    return "\n".join(str(message.content) for message in build_generation_messages(generation_format, theme))
+
+
+def run_offline(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    score = parse_note_events(SAMPLE_NOTE_EVENTS)
+    musicxml = render_musicxml(score)
+    if not validate_musicxml(musicxml).is_valid:
+        raise SystemExit("サンプルの MusicXML が構造検証に失敗しました。")
+    outputs = {
+        "note_events": f"NOTES_START\n{SAMPLE_NOTE_EVENTS}NOTES_END",
+        "musicxml": f"MUSICXML_START\n{musicxml}\nMUSICXML_END",
+    }
+    results = []
+    for generation_format in FORMATS:
+        output_tokens = estimate_tokens(outputs[generation_format])
+        results.append({
+            "format": generation_format,
+            "prompt_tokens": estimate_tokens(_prompt_text(generation_format, args.theme)),
+            "output_tokens": output_tokens,
+            "seconds": args.ttft + output_tokens / args.tokens_per_second,
+        })
+    return results
+
+
+async def _generate_live(generation_format: str, theme: str) -> Dict[str, Any]:
+    from services.audio_analysis_service import get_audio_analyzer
+
+    analyzer = get_audio_analyzer()
+    task = "Note Events Generation" if generation_format == "note_events" else "MusicXML Generation"
+    llm = analyzer._get_llm(task, model_name=analyzer.generator_models[0], for_generation=True)
+    started = time.perf_counter()
+    response = await llm.ainvoke(build_generation_messages(generation_format, theme))
+    elapsed = time.perf_counter() - started
+    usage = getattr(response, "usage_metadata", None) or {}
+    content = str(response.content)
+    try:
+        if generation_format == "note_events":
+            body = content.split("NOTES_START", 1)[1].split("NOTES_END", 1)[0]
+            valid = validate_musicxml(render_musicxml(parse_note_events(body))).is_valid
+        else:
+            body = content.split("MUSICXML_START", 1)[1].split("MUSICXML_END", 1)[0].strip()
+            valid = validate_musicxml(body).is_valid
+    except (IndexError, ValueError):
+        valid = False
+    return {
+        "prompt_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "seconds": elapsed,
+        "valid": valid,
+    }
+
+
+async def run_live(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    for generation_format in FORMATS:
+        runs = [await _generate_live(generation_format, args.theme) for _ in range(args.runs)]
+        results.append({
+            "format": generation_format,
+            "prompt_tokens": statistics.median(run["prompt_tokens"] for run in runs),
+            "output_tokens": statistics.median(run["output_tokens"] for run in runs),
+            "seconds": statistics.median(run["seconds"] for run in runs),
+            "valid": f"{sum(run['valid'] for run in runs)}/{len(runs)}",
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="実際の Vertex AI で計測する")
+    parser.add_argument("--runs", type=int, default=3, help="--live で形式ごとに生成する回数（中央値を表示）")
+    parser.add_argument("--theme", default=DEFAULT_THEME, help="プロンプトに埋め込む「トラックの雰囲気/テーマ」")
+    parser.add_argument("--ttft", type=float, default=1.0, help="オフライン見積もりの最初のトークンまでの時間（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="オフライン見積もりの出力トークンの生成速度")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_live(args)) if args.live else run_offline(args)
+    mode = "live (median)" if args.live else "offline estimate"
+    print(f"{mode}: theme={args.theme!r}")
+    for result in results:
+        valid = f"  valid {result['valid']}" if "valid" in result else ""
+        print(
+            f"{result['format']:>12}: prompt {result['prompt_tokens']:>6.0f} tok  "
+            f"output {result['output_tokens']:>6.0f} tok  {result['seconds']:>6.2f} s{valid}"
+        )
+    baseline, compact = results[1], results[0]
+    if compact["output_tokens"] and compact["seconds"]:
+        print(
+            f"note_events vs musicxml: output tokens x{baseline['output_tokens'] / compact['output_tokens']:.1f} fewer, "
+            f"generation time x{baseline['seconds'] / compact['seconds']:.1f} faster"
+        )
+
+
+if __name__ == "__main__":
+    main()
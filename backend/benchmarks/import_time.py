@@ -0,0 +1,104 @@
+# benchmarks/import_time.py
+"""
+コールドスタート時の import 時間の計測と予算チェック
+
+新しいインタープリタで `python -X importtime -c "import main"` を複数回実行し、
+main の累積 import 時間（最小値）が予算を超えた場合は終了コード 1 で失敗します。
+CI やデプロイ前のチェックに利用できます。重い依存関係（music21, langgraph,
+langchain_google_vertexai, google.cloud.storage など）は初回使用時に読み込む設計のため、
+それらが main の import に混入すると予算超過として検出されます。
+
+使い方 (backend ディレクトリで実行):
+    python benchmarks/import_time.py [--budget-ms 1500] [--runs 5] [--module main]
+予算は環境変数 IMPORT_TIME_BUDGET_MS でも指定できます。
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 初回使用時まで読み込まれてはならないモジュール
+DEFERRED_MODULES = (
+    "music21",
+    "pydub",
+    "numpy",
+    "langgraph",
+    "langchain_google_vertexai",
+    "vertexai",
+    "google.cloud.storage",
+    "google.cloud.logging",
+)
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def run_once(module: str) -> Tuple[int, Dict[str, Tuple[int, int, int]]]:
+    """(module の累積マイクロ秒, {モジュール名: (自身, 累積, 深さ)})"""
+    env = dict(os.environ)
+    env.setdefault("GCS_UPLOAD_BUCKET", "benchmark-upload")
+    env.setdefault("GCS_TRACK_BUCKET", "benchmark-track")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"import {module} に失敗しました (終了コード {proc.returncode})")
+    modules: Dict[str, Tuple[int, int, int]] = {}
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    if module not in modules:
+        raise SystemExit(f"-X importtime の出力に {module} が見つかりませんでした。")
+    return modules[module][1], modules
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_TIME_BUDGET_MS", 1500)))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=10, help="表示する直下の import の件数")
+    args = parser.parse_args()
+
+    totals: List[int] = []
+    modules: Dict[str, Tuple[int, int, int]] = {}
+    for _ in range(args.runs):
+        total_us, modules = run_once(args.module)
+        totals.append(total_us)
+
+    best_ms = min(totals) / 1000
+    median_ms = statistics.median(totals) / 1000
+    print(f"import {args.module}: min {best_ms:.0f} ms, median {median_ms:.0f} ms ({args.runs} runs), budget {args.budget_ms:.0f} ms")
+
+    direct = sorted(
+        ((name, cumulative) for name, (_, cumulative, depth) in modules.items() if depth == 1),
+        key=lambda item: item[1], reverse=True,
+    )
+    print(f"slowest direct imports of {args.module} (last run):")
+    for name, cumulative in direct[: args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    failed = False
+    leaked = [name for name in DEFERRED_MODULES if name in modules]
+    if leaked:
+        print(f"FAIL: 遅延読み込みの対象が import 時に読み込まれています: {', '.join(leaked)}")
+        failed = True
+    if best_ms > args.budget_ms:
+        print(f"FAIL: import 時間が予算を超えています ({best_ms:.0f} ms > {args.budget_ms:.0f} ms)")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+# benchmarks/load_test.py
+"""
+オフラインのエンドツーエンド負荷試験
+
+アプリケーションをプロセス内の uvicorn（専用スレッド・専用イベントループ）で起動し、
+Vertex AI / GCS / 音声合成を benchmarks/fakes.py の代替実装に差し替えたうえで、
+httpx から並行に /api/process（マルチパートアップロード）と /api/chat（SSE / 通常応答）、
+/api/process/batch（online / offline。offline のバッチ予測も代替実装）を送ります。
+ミドルウェア・ワークフロー・レジリエンス層・GCSService は本物のコードを通るため、
+クォータやクラウドへのトラフィックなしにサーバー側のスループットと遅延を比較できます。
+
+シナリオごとに以下を出力します。
+- スループット（成功リクエスト/秒）とステータスコード別の件数
+- レイテンシのパーセンタイル (p50 / p90 / p99 / max)。SSE は最初のイベントまでの時間 (TTFT) も
+  （一括処理は最初の項目の行までの時間。受け付けない項目が所定のエラーで失敗し、他の項目がすべて成功した応答のみ成功と数える）
+- サーバー側イベントループの遅延（10ms 間隔のタイマーの遅れ。p99 / max）
+- ピーク RSS（負荷生成側も同じプロセスのため、その分を含む）
+
+使い方 (backend ディレクトリで実行):
+    python benchmarks/load_test.py [--scenario process chat_sse chat batch_online batch_offline] [--concurrency 16] [--requests 200]
+        [--batch-size 4]
+        [--vertex-latency lognormal:1.0,0.4] [--gcs-latency fixed:0.05] [--synthesis-latency fixed:0.5]
+        [--recordings recordings.json] [--json results.json]
+クライアント単位のレート制限は全リクエストが 127.0.0.1 から届くため既定で無効にします
+（--keep-rate-limit で有効のまま計測）。アドミッション制御は有効のままです。
+アップロードする音声は毎回同じ内容のため、LLM 応答キャッシュも既定で無効にします
+（--keep-llm-cache で LLM_CACHE_BACKEND の設定のまま計測）。
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import wave
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+SCENARIOS = ("process", "chat_sse", "chat", "batch_online", "batch_offline")
+
+CHAT_MUSICXML_BLOB = "generated_musicxml/load-test.musicxml"
+# 一括処理の gcs_uris で参照する音声（GCS_UPLOAD_BUCKET 内）
+BATCH_LIBRARY_BLOB = "library/load-test.wav"
+# 一括処理で毎回含める、受け付けない項目（ファイル名または GCS URI）と期待するエラーコード
+BATCH_REJECTED_FILE = ("rejected.txt", b"not audio", "text/plain")
+BATCH_REJECTED_GCS_URI = "gs://load-test-not-allowed/humming.wav"
+BATCH_REJECTED_ERROR_CODES = {BATCH_REJECTED_FILE[0]: "UNSUPPORTED_MEDIA_TYPE", BATCH_REJECTED_GCS_URI: "FORBIDDEN_ACCESS"}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """最近傍順位法 (services.latency_stats.LatencyWindow と同じ) で pct (0〜100) パーセンタイルを返す。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # /proc がない環境ではプロセス開始以降の最大値で代用する（Linux は KB、macOS はバイト）
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class LoopMonitor:
+    """サーバーのイベントループ上で一定間隔のタイマーを回し、予定時刻からの遅れと RSS を記録する。"""
+
+    def __init__(self, interval_seconds: float = 0.01):
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._lags: List[float] = []
+        self._peak_rss = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._lags = []
+            self._peak_rss = current_rss_bytes()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lags = list(self._lags)
+            peak_rss = max(self._peak_rss, current_rss_bytes())
+        return {
+            "loop_lag_p99_ms": round(percentile(lags, 99) * 1000, 2) if lags else None,
+            "loop_lag_max_ms": round(max(lags) * 1000, 2) if lags else None,
+            "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+        }
+
+    async def run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval_seconds)
+            lag = max(0.0, time.perf_counter() - start - self.interval_seconds)
+            rss = current_rss_bytes()
+            with self._lock:
+                self._lags.append(lag)
+                self._peak_rss = max(self._peak_rss, rss)
+
+
+class ServerThread:
+    """アプリケーションを別スレッドのイベントループで動かす uvicorn サーバー。"""
+
+    def __init__(self, app: Any, monitor: LoopMonitor):
+        import uvicorn
+
+        self.monitor = monitor
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        config = uvicorn.Config(app, lifespan="on", log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._serve()), name="load-test-server", daemon=True)
+
+    async def _serve(self) -> None:
+        monitor_task = asyncio.create_task(self.monitor.run())
+        try:
+            await self.server.serve(sockets=[self.sock])
+        finally:
+            monitor_task.cancel()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout_seconds: float = 30.0) -> None:
+        self.thread.start()
+        deadline = time.monotonic() + timeout_seconds
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("負荷試験用サーバーの起動に失敗しました。")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+def make_wav(duration_seconds: float, sample_rate: int = 16000) -> bytes:
+    """アップロード用の無音モノラルWAV（変換不要な形式のため ffmpeg なしで処理できる）。"""
+    buffer = BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * int(duration_seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def install_fakes(args: argparse.Namespace, storage_root: str) -> Dict[str, Any]:
+    """各 DI ポイントのシングルトンを代替実装に差し替える（main の import 後・サーバー起動前に呼ぶ）。"""
+    from benchmarks.fakes import (
+        BACKING_TRACK_MUSICXML, FakeAudioAnalyzer, FakeAudioSynthesisService, FakeBatchPredictionClient, FakeChatModel,
+        FakeStorageClient, LatencyDistribution, load_recordings,
+    )
+    from config import settings
+    from services import audio_analysis_service, audio_synthesis_service, batch_prediction, gcs_service, vertex_chat_service
+    from services.gcs_disk_cache import GCSDiskCache
+
+    rng = random.Random(args.seed)
+    recordings = load_recordings(args.recordings, args.vertex_latency, rng)
+    storage_client = FakeStorageClient(storage_root, LatencyDistribution.parse(args.gcs_latency, rng) if args.gcs_latency else None)
+
+    # ディスクキャッシュは本物を使う（GCS_DISK_CACHE_ENABLED=true で有効にして比較できる）。前回の実行分が残らないよう一時ディレクトリに置く
+    disk_cache = None
+    if settings.GCS_DISK_CACHE_ENABLED:
+        disk_cache = GCSDiskCache(
+            os.path.join(storage_root, "_disk_cache"),
+            max_bytes=settings.GCS_DISK_CACHE_MAX_MB * 1024 * 1024,
+            mmap_threshold_bytes=settings.GCS_DISK_CACHE_MMAP_THRESHOLD_KB * 1024,
+        )
+    gcs_service._gcs_service_instance = gcs_service.GCSService(storage_client=storage_client, disk_cache=disk_cache)
+    chat_model = FakeChatModel(settings.CHAT_GEMINI_MODEL_NAME, recordings["chat"])
+    vertex_chat_service._vertex_chat_service_instance = vertex_chat_service.VertexChatService(llm_client=chat_model)
+    analyzer = FakeAudioAnalyzer(recordings)
+    audio_analysis_service._audio_analyzer_instance = analyzer
+    audio_synthesis_service._audio_synthesis_service_instance = FakeAudioSynthesisService(
+        LatencyDistribution.parse(args.synthesis_latency, rng) if args.synthesis_latency else None
+    )
+    batch_prediction._batch_prediction_client_instance = FakeBatchPredictionClient(recordings)
+
+    # チャットの musicxml_gcs_url と一括処理の gcs_uris で参照するオブジェクトを用意しておく
+    blob_path = os.path.join(storage_root, settings.GCS_TRACK_BUCKET, CHAT_MUSICXML_BLOB)
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    with open(blob_path, "w", encoding="utf-8") as f:
+        f.write(BACKING_TRACK_MUSICXML)
+    library_path = os.path.join(storage_root, settings.GCS_UPLOAD_BUCKET, BATCH_LIBRARY_BLOB)
+    os.makedirs(os.path.dirname(library_path), exist_ok=True)
+    with open(library_path, "wb") as f:
+        f.write(make_wav(1.0))
+
+    return {"storage_client": storage_client, "disk_cache": disk_cache, "chat_model": chat_model, "analyzer": analyzer}
+
+
+class ScenarioResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.ttfts: List[float] = []
+        self.status_counts: Dict[str, int] = {}
+        self.ok = 0
+
+    def record(self, status: str, latency: float, ok: bool, ttft: Optional[float] = None) -> None:
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if ok:
+            self.ok += 1
+            self.latencies.append(latency)
+            if ttft is not None:
+                self.ttfts.append(ttft)
+
+    def summary(self, elapsed_seconds: float, monitor_snapshot: Dict[str, Any]) -> Dict[str, Any]:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        result = {
+            "scenario": self.name,
+            "requests": sum(self.status_counts.values()),
+            "ok": self.ok,
+            "status_counts": self.status_counts,
+            "elapsed_seconds": round(elapsed_seconds, 2),
+            "throughput_rps": round(self.ok / elapsed_seconds, 2) if elapsed_seconds > 0 else None,
+            "latency_p50_ms": ms(percentile(self.latencies, 50)),
+            "latency_p90_ms": ms(percentile(self.latencies, 90)),
+            "latency_p99_ms": ms(percentile(self.latencies, 99)),
+            "latency_max_ms": ms(max(self.latencies) if self.latencies else None),
+            "latency_mean_ms": ms(statistics.fmean(self.latencies) if self.latencies else None),
+        }
+        if self.ttfts:
+            result["ttft_p50_ms"] = ms(percentile(self.ttfts, 50))
+            result["ttft_p99_ms"] = ms(percentile(self.ttfts, 99))
+        result.update(monitor_snapshot)
+        return result
+
+
+async def _process_request(client: Any, result: ScenarioResult, wav_data: bytes) -> None:
+    start = time.perf_counter()
+    response = await client.post("/api/process", files={"file": ("humming.wav", wav_data, "audio/wav")})
+    result.record(str(response.status_code), time.perf_counter() - start, response.status_code == 200)
+
+
+def _chat_body(musicxml_url: str) -> Dict[str, Any]:
+    return {
+        "messages": [{"role": "user", "content": "サビをもっと盛り上げるにはどうすればいいですか？"}],
+        "humming_theme": "明るく軽快なJ-POP",
+        "musicxml_gcs_url": musicxml_url,
+    }
+
+
+async def _chat_sse_request(client: Any, result: ScenarioResult, musicxml_url: str) -> None:
+    start = time.perf_counter()
+    ttft = None
+    events = 0
+    async with client.stream("POST", "/api/chat", json=_chat_body(musicxml_url), headers={"Accept": "text/event-stream"}) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                events += 1
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                if "[Error]" in line:
+                    result.record("sse_error", time.perf_counter() - start, False)
+                    return
+    ok = response.status_code == 200 and events > 0
+    result.record(str(response.status_code), time.perf_counter() - start, ok, ttft)
+
+
+async def _chat_request(client: Any, result: ScenarioResult, musicxml_url: str) -> None:
+    start = time.perf_counter()
+    response = await client.post("/api/chat", json=_chat_body(musicxml_url))
+    result.record(str(response.status_code), time.perf_counter() - start, response.status_code == 200)
+
+
+async def _batch_request(
+    client: Any, result: ScenarioResult, wav_data: bytes, mode: str, batch_size: int, library_uri: str,
+) -> None:
+    """batch_size 件（アップロード + gcs_uris 1件）の有効な項目と、受け付けない項目2件を1回の一括処理で送る。"""
+    start = time.perf_counter()
+    ttft = None
+    items: Dict[str, Dict[str, Any]] = {}
+    summary: Optional[Dict[str, Any]] = None
+    files = [("files", (f"humming-{index}.wav", wav_data, "audio/wav")) for index in range(batch_size - 1)]
+    files.append(("files", BATCH_REJECTED_FILE))
+    data = {"mode": mode, "gcs_uris": f"{library_uri}\n{BATCH_REJECTED_GCS_URI}"}
+    async with client.stream("POST", "/api/process/batch", data=data, files=files) as response:
+        async for line in response.aiter_lines():
+            if not line.strip() or response.status_code != 200:
+                continue
+            record = json.loads(line)
+            if record["type"] == "item":
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                items[record["source"]] = record
+            elif record["type"] == "summary":
+                summary = record
+    if response.status_code != 200:
+        result.record(str(response.status_code), time.perf_counter() - start, False)
+        return
+
+    def as_expected(source: str, item: Dict[str, Any]) -> bool:
+        if source in BATCH_REJECTED_ERROR_CODES:
+            return item["status"] == "failed" and item["error"]["code"] == BATCH_REJECTED_ERROR_CODES[source]
+        return item["status"] == "succeeded"
+
+    expected_total = batch_size + len(BATCH_REJECTED_ERROR_CODES)
+    ok = (
+        summary is not None and summary["total"] == expected_total and len(items) == expected_total
+        and all(as_expected(source, item) for source, item in items.items())
+    )
+    result.record("200" if ok else "batch_mismatch", time.perf_counter() - start, ok, ttft)
+
+
+async def run_scenario(
+    name: str, base_url: str, concurrency: int, total_requests: int, request_factory: Callable[[Any, ScenarioResult], Any],
+    monitor: LoopMonitor, timeout_seconds: float,
+) -> Dict[str, Any]:
+    import httpx
+
+    result = ScenarioResult(name)
+    remaining = iter(range(total_requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout_seconds, limits=limits) as client:
+
+        async def worker() -> None:
+            for _ in remaining:
+                try:
+                    await request_factory(client, result)
+                except httpx.HTTPError as e:
+                    result.record(type(e).__name__, 0.0, False)
+
+        monitor.reset()
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return result.summary(elapsed, monitor.snapshot())
+
+
+def print_summary(results: List[Dict[str, Any]]) -> None:
+    columns = [
+        ("scenario", "scenario"), ("ok/req", None), ("rps", "throughput_rps"),
+        ("p50 ms", "latency_p50_ms"), ("p90 ms", "latency_p90_ms"), ("p99 ms", "latency_p99_ms"), ("max ms", "latency_max_ms"),
+        ("ttft p50", "ttft_p50_ms"), ("ttft p99", "ttft_p99_ms"),
+        ("lag p99", "loop_lag_p99_ms"), ("lag max", "loop_lag_max_ms"), ("rss MB", "peak_rss_mb"),
+    ]
+    print("  ".join(f"{title:>10}" for title, _ in columns))
+    for result in results:
+        cells = []
+        for title, key in columns:
+            value = f"{result['ok']}/{result['requests']}" if key is None else result.get(key)
+            cells.append(f"{'-' if value is None else value:>10}")
+        print("  ".join(cells))
+    for result in results:
+        errors = {status: count for status, count in result["status_counts"].items() if status != "200"}
+        if errors:
+            print(f"{result['scenario']}: non-200 {errors}")
+
+
+async def run_all(args: argparse.Namespace, server: ServerThread, monitor: LoopMonitor) -> List[Dict[str, Any]]:
+    from config import settings
+
+    wav_data = make_wav(args.upload_seconds)
+    musicxml_url = f"https://storage.googleapis.com/{settings.GCS_TRACK_BUCKET}/{CHAT_MUSICXML_BLOB}"
+    library_uri = f"gs://{settings.GCS_UPLOAD_BUCKET}/{BATCH_LIBRARY_BLOB}"
+    factories = {
+        "process": lambda client, result: _process_request(client, result, wav_data),
+        "chat_sse": lambda client, result: _chat_sse_request(client, result, musicxml_url),
+        "chat": lambda client, result: _chat_request(client, result, musicxml_url),
+        "batch_online": lambda client, result: _batch_request(client, result, wav_data, "online", args.batch_size, library_uri),
+        "batch_offline": lambda client, result: _batch_request(client, result, wav_data, "offline", args.batch_size, library_uri),
+    }
+    # ウォームアップ（ワークフローのコンパイル等）が終わるまでは計測を始めない
+    import httpx
+    async with httpx.AsyncClient(base_url=server.base_url) as client:
+        while (await client.get("/ready")).status_code != 200:
+            await asyncio.sleep(0.1)
+
+    results = []
+    for name in args.scenario:
+        print(f"scenario '{name}': concurrency={args.concurrency}, requests={args.requests} ...", flush=True)
+        results.append(await run_scenario(
+            name, server.base_url, args.concurrency, args.requests, factories[name], monitor, args.timeout,
+        ))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100, help="シナリオごとのリクエスト数")
+    parser.add_argument("--vertex-latency", default=None, help="全タスクの Vertex AI レイテンシ分布を上書き (例: lognormal:1.0,0.4)")
+    parser.add_argument("--gcs-latency", default="lognormal:0.08,0.5", help="GCS 操作1回あたりのレイテンシ分布")
+    parser.add_argument("--synthesis-latency", default="lognormal:1.5,0.3", help="音声合成1回あたりのレイテンシ分布")
+    parser.add_argument("--recordings", default=None, help="記録済み応答の JSON ファイル (形式は benchmarks/fakes.py の DEFAULT_RECORDINGS)")
+    parser.add_argument("--batch-size", type=int, default=4, help="一括処理1回あたりの有効な項目数（受け付けない項目2件を別に含める）")
+    parser.add_argument("--upload-seconds", type=float, default=5.0, help="アップロードするWAVの長さ（秒）")
+    parser.add_argument("--timeout", type=float, default=300.0, help="1リクエストのクライアント側タイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log-level", default="WARNING", help="アプリケーションのログレベル（既定では負荷生成の妨げにならないよう WARNING）")
+    parser.add_argument("--keep-rate-limit", action="store_true")
+    parser.add_argument("--keep-llm-cache", action="store_true")
+    parser.add_argument("--json", dest="json_path", default=None, help="結果を JSON で書き出すパス")
+    args = parser.parse_args()
+
+    # 設定は main の import 時に読み込まれるため、先に環境変数を整える
+    os.environ.setdefault("GCS_UPLOAD_BUCKET", "load-test-upload")
+    os.environ.setdefault("GCS_TRACK_BUCKET", "load-test-track")
+    os.environ["LOG_LEVEL"] = args.log_level
+    if not args.keep_rate_limit:
+        os.environ["RATE_LIMIT_ENABLED"] = "false"
+    if not args.keep_llm_cache:
+        os.environ["LLM_CACHE_BACKEND"] = "none"
+    if args.batch_size < 1:
+        parser.error("--batch-size は1以上を指定してください。")
+
+    from main import app
+
+    with tempfile.TemporaryDirectory(prefix="load-test-gcs-") as storage_root:
+        fakes = install_fakes(args, storage_root)
+        monitor = LoopMonitor()
+        server = ServerThread(app, monitor)
+        server.start()
+        try:
+            results = asyncio.run(run_all(args, server, monitor))
+        finally:
+            server.stop()
+
+    print_summary(results)
+    storage_client = fakes["storage_client"]
+    print(f"fake GCS: operations={storage_client.operations}, bytes={storage_client.bytes_transferred}")
+    if fakes["disk_cache"] is not None:
+        print(f"GCS disk cache: {fakes['disk_cache'].stats()}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# benchmarks/logging_throughput.py
+"""
+JSONロギングのスループット計測
+
+変更前の JsonFormatter (レコードごとに標準属性を計算し、stdlib json で直列化し、
+呼び出し元スレッドで同期的に書き込む) と、現在の logging_config の構成
+(属性集合の事前計算 + orjson + QueueHandler/QueueListener) を比較します。
+出力先は os.devnull です。
+
+使い方 (backend ディレクトリで実行):
+    python benchmarks/logging_throughput.py [--records 20000]
+"""
+
+import argparse
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GCS_UPLOAD_BUCKET", "benchmark-upload")
+os.environ.setdefault("GCS_TRACK_BUCKET", "benchmark-track")
+
+from logging_config import JsonFormatter, NonBlockingQueueHandler  # noqa: E402
+
+
+class LegacyJsonFormatter(logging.Formatter):
+    """変更前の実装 (比較用)。"""
+
+    def format(self, record: logging.LogRecord):
+        log_entry = {
+            "timestamp": self.formatTime(record, self.datefmt),
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "correlation_id": getattr(record, 'correlation_id', None),
+            "service_name": getattr(record, 'service_name', None),
+            "logging.googleapis.com/labels": {
+                "correlation_id": getattr(record, 'correlation_id', None),
+            } if getattr(record, 'correlation_id', None) else {},
+            "logging.googleapis.com/sourceLocation": {
+                "file": record.pathname,
+                "line": record.lineno,
+                "function": record.funcName,
+            } if record.pathname else {},
+        }
+        standard_attrs = set(logging.LogRecord('', '', '', '', '', '', '', '').__dict__.keys())
+        standard_attrs.update(['correlation_id', 'service_name', 'message', 'asctime'])
+        extra_attrs = {k: v for k, v in record.__dict__.items() if k not in standard_attrs}
+        if extra_attrs:
+            log_entry["extra_data"] = extra_attrs
+        return json.dumps(log_entry, default=str)
+
+
+def _sample_extra() -> dict:
+    # ホットパスで記録される程度の大きさの extra (解析結果やリクエストパラメータ)
+    return {
+        "workflow_run_id": "0f8c2a4e-6a0b-4f6e-9c1d-3b7e2d9a1c55",
+        "task": "MusicXML Analysis",
+        "vertex_model": "gemini-2.5-flash-lite",
+        "duration_seconds": 3.21,
+        "parsed_output": {
+            "key": "C major",
+            "bpm": 120,
+            "chords": ["C", "Am", "F", "G"] * 16,
+            "genre": "Pop",
+            "sections": [{"name": f"section-{i}", "measures": list(range(8))} for i in range(8)],
+        },
+        "request_params": {"filename": "humming.webm", "content_type": "audio/webm", "size": 1234567},
+    }
+
+
+def _make_logger(name: str, handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def bench_formatter(formatter: logging.Formatter, records: int) -> float:
+    extra = _sample_extra()
+    record = logging.getLogRecordFactory()("bench", logging.INFO, __file__, 1, "Request finished: %s", ("POST /api/process",), None)
+    record.__dict__.update(extra)
+    start = time.perf_counter()
+    for _ in range(records):
+        formatter.format(record)
+    return records / (time.perf_counter() - start)
+
+
+def bench_pipeline(handler: logging.Handler, records: int, listener: logging.handlers.QueueListener = None) -> tuple:
+    """(呼び出し元から見た records/sec, 出力完了までの records/sec)"""
+    logger = _make_logger(f"bench.{id(handler)}", handler)
+    extra = _sample_extra()
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info("Request finished: %s %d", "POST /api/process", i, extra=extra)
+    caller_elapsed = time.perf_counter() - start
+    if listener is not None:
+        listener.stop()  # キューが空になるまで待つ
+    total_elapsed = time.perf_counter() - start
+    return records / caller_elapsed, records / total_elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"records={args.records}")
+    print(f"formatter (legacy json):   {bench_formatter(LegacyJsonFormatter(), args.records):>10.0f} records/sec")
+    print(f"formatter (orjson):        {bench_formatter(JsonFormatter(), args.records):>10.0f} records/sec")
+
+    with open(os.devnull, "w") as devnull:
+        sync_handler = logging.StreamHandler(devnull)
+        sync_handler.setFormatter(LegacyJsonFormatter())
+        caller_rate, total_rate = bench_pipeline(sync_handler, args.records)
+        print(f"pipeline (legacy, sync):   {caller_rate:>10.0f} records/sec on caller, {total_rate:>10.0f} records/sec written")
+
+        stream_handler = logging.StreamHandler(devnull)
+        stream_handler.setFormatter(JsonFormatter())
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        listener.start()
+        caller_rate, total_rate = bench_pipeline(NonBlockingQueueHandler(log_queue), args.records, listener)
+        print(f"pipeline (orjson, queue):  {caller_rate:>10.0f} records/sec on caller, {total_rate:>10.0f} records/sec written")
+
+
+if __name__ == "__main__":
+    main()
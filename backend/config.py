@@ -1,3 +1,5 @@
+from typing import Dict, List, Literal, Optional
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -26,12 +28,213 @@ class Settings(BaseSettings):
     # GENERATOR_GEMINI_MODEL_NAME: str = Field("gemini-2.5-pro", description="使用するGeminiモデル名 (Vertex AI)") # Example updated to a more specific one
     GENERATOR_GEMINI_MODEL_NAME: str = Field("gemini-2.5-flash-lite-preview-06-17", description="使用するGeminiモデル名 (Vertex AI)") # Example updated to a more specific one
     CHAT_GEMINI_MODEL_NAME: str = Field("gemini-2.5-flash-lite-preview-06-17", description="使用するGeminiモデル名 (Vertex AI)") # Example updated to a more specific one
+    # モデルカスケード: 先頭から試し、抽出・検証失敗やタイムアウト時のみ次のモデルへ。空の場合は上記の単一モデルを使用
+    ANALYZER_GEMINI_MODEL_CASCADE: List[str] = Field(default_factory=list, description="解析タスクで試すモデルの順序付きリスト (JSON配列)")
+    GENERATOR_GEMINI_MODEL_CASCADE: List[str] = Field(default_factory=list, description="MusicXML生成タスクで試すモデルの順序付きリスト (JSON配列)")
+    CHAT_GEMINI_MODEL_CASCADE: List[str] = Field(default_factory=list, description="チャットで試すモデルの順序付きリスト (JSON配列)")
     VERTEX_AI_TIMEOUT_SECONDS: int = Field(120, description="Vertex AI API呼び出しのタイムアウト秒数")
+    # Vertex AI レジリエンス設定 (適応的タイムアウト・リトライ予算・サーキットブレーカー)
+    VERTEX_RETRY_MAX_ATTEMPTS: int = Field(3, description="一時的エラー時のVertex AI呼び出しの最大試行回数（初回を含む）")
+    VERTEX_RETRY_BASE_DELAY_SECONDS: float = Field(0.5, description="リトライのバックオフ基準秒数（フルジッター付き指数バックオフ）")
+    VERTEX_RETRY_MAX_DELAY_SECONDS: float = Field(8.0, description="リトライのバックオフ上限秒数")
+    VERTEX_RETRY_BUDGET_RATIO: float = Field(0.2, description="リクエスト1件あたりに積み立てるリトライ予算（リトライ数/リクエスト数の上限）")
+    VERTEX_RETRY_BUDGET_MAX_TOKENS: float = Field(10.0, description="リトライ予算の最大保持量")
+    VERTEX_ADAPTIVE_TIMEOUT_PERCENTILE: float = Field(0.99, description="適応的タイムアウトの算出に用いる観測レイテンシのパーセンタイル")
+    VERTEX_ADAPTIVE_TIMEOUT_MULTIPLIER: float = Field(2.0, description="観測パーセンタイルに掛けてタイムアウトとする倍率")
+    VERTEX_ADAPTIVE_TIMEOUT_MIN_SECONDS: float = Field(10.0, description="適応的タイムアウトの下限秒数（上限は VERTEX_AI_TIMEOUT_SECONDS）")
+    VERTEX_ADAPTIVE_TIMEOUT_MIN_SAMPLES: int = Field(20, description="適応的タイムアウトを有効にするために必要な最小サンプル数")
+    VERTEX_CIRCUIT_FAILURE_THRESHOLD: int = Field(5, description="サーキットブレーカーを開く連続失敗回数（モデル・ロケーション単位）")
+    VERTEX_CIRCUIT_RESET_SECONDS: float = Field(30.0, description="サーキットブレーカーを開いてから試行を再開するまでの秒数")
+
+    # リクエストヘッジング設定 (AudioAnalyzer の Vertex AI 呼び出し)
+    VERTEX_HEDGING_ENABLED: bool = Field(False, description="応答が遅いVertex AI呼び出しに対して同一リクエストを追加送信するか")
+    VERTEX_HEDGING_PERCENTILE: float = Field(0.95, description="ヘッジ送信までの待ち時間として用いる直近レイテンシのパーセンタイル (0.0〜1.0)")
+    VERTEX_HEDGING_MIN_SAMPLES: int = Field(20, description="パーセンタイルを学習値として使うために必要な最小サンプル数")
+    VERTEX_HEDGING_DEFAULT_DELAY_SECONDS: Optional[float] = Field(None, description="サンプル不足時のヘッジ待ち時間（秒）。未設定の場合は学習完了までヘッジしない")
+    VERTEX_HEDGING_MAX_EXTRA_LOAD_RATIO: float = Field(0.1, description="タスクごとのヘッジによる追加リクエスト数の上限（全リクエスト数に対する比率）")
+    MUSICXML_MAX_GENERATION_ATTEMPTS: int = Field(2, description="生成MusicXMLが構造検証・修復で救済できない場合に再生成を含めて試行する最大回数")
+    MUSICXML_GENERATION_FORMAT: Literal["note_events", "musicxml"] = Field(
+        "note_events",
+        description=(
+            "バッキングトラック生成でモデルに出力させる形式。note_events はコンパクトなノートイベント形式を出力させ、"
+            "MusicXML はローカルで組み立てる（出力トークンが少なく高速）。musicxml はモデルに MusicXML を直接書かせる"
+        ),
+    )
+
+    # LLM 応答キャッシュ設定 (AudioAnalyzer の Vertex AI 呼び出し)
+    LLM_CACHE_BACKEND: Literal["none", "memory", "disk", "sqlite"] = Field(
+        "memory",
+        description=(
+            "同じモデル・temperature・プロンプト・メディアに対する応答を再利用するキャッシュの保存先。"
+            "none は無効、memory はプロセス内、disk はローカルディスク、sqlite は同じホストのプロセス間で共有するSQLiteファイル"
+        ),
+    )
+    LLM_CACHE_TTL_SECONDS: float = Field(7 * 24 * 3600.0, description="キャッシュした応答の有効期間（秒）")
+    LLM_CACHE_MAX_MB: int = Field(64, description="キャッシュの合計サイズ上限（MB単位）。超えた分は最後に参照されたのが古いものから削除")
+    LLM_CACHE_DIR: str = Field("/tmp/sessionmuse-llm-cache", description="LLM_CACHE_BACKEND=disk の場合の保存先ディレクトリ")
+    LLM_CACHE_SQLITE_PATH: str = Field("/tmp/sessionmuse-llm-cache.sqlite3", description="LLM_CACHE_BACKEND=sqlite の場合のデータベースファイル")
+    LLM_CACHE_BYPASS_TASKS: List[str] = Field(
+        default_factory=lambda: ["Note Events Generation", "MusicXML Generation"],
+        description=(
+            "キャッシュを使わないタスク（タスク説明の先頭一致、JSON配列）。既定ではバッキングトラック生成"
+            "（GENERATION_TEMPERATURE での創作的な生成）を除外し、同じ音声・テーマからも毎回異なるトラックを生成する。"
+            "生成もキャッシュする場合は [] を指定する"
+        ),
+    )
+
+    # ワークフローのチェックポイント設定 (/api/process/{workflow_run_id}/resume での再開)
+    WORKFLOW_CHECKPOINT_BACKEND: Literal["none", "sqlite", "file"] = Field(
+        "sqlite",
+        description=(
+            "ワークフローの状態をノードごとに保存する先。none は保存せず再開できない。sqlite は同じホストのプロセス間で共有するSQLiteファイル、"
+            "file は workflow_run_id ごとのファイル（複数インスタンスで再開する場合は共有ボリュームに置く）"
+        ),
+    )
+    WORKFLOW_CHECKPOINT_SQLITE_PATH: str = Field(
+        "/tmp/sessionmuse-workflow-checkpoints.sqlite3", description="WORKFLOW_CHECKPOINT_BACKEND=sqlite の場合のデータベースファイル"
+    )
+    WORKFLOW_CHECKPOINT_DIR: str = Field(
+        "/tmp/sessionmuse-workflow-checkpoints", description="WORKFLOW_CHECKPOINT_BACKEND=file の場合の保存先ディレクトリ"
+    )
+    WORKFLOW_CHECKPOINT_RETENTION_SECONDS: float = Field(
+        24 * 3600.0, description="最後の保存からこの秒数を過ぎたワークフローのチェックポイントを削除する（再開できる期間）"
+    )
+
+    # アドミッション制御設定 (優先度クラスごとの同時実行数・待ち行列)
+    ADMISSION_CONTROL_ENABLED: bool = Field(True, description="アドミッション制御を有効にするか")
+    ADMISSION_PROCESS_MAX_CONCURRENCY: int = Field(4, description="/api/process の同時実行数の上限 (CPU・LLM負荷が高い処理)")
+    ADMISSION_PROCESS_MAX_QUEUE: int = Field(8, description="/api/process の待ち行列の上限。超過分は429で即時拒否")
+    ADMISSION_PROCESS_QUEUE_TIMEOUT_SECONDS: float = Field(30.0, description="/api/process の待ち行列での最大待機秒数。超過すると429")
+    ADMISSION_CHAT_MAX_CONCURRENCY: int = Field(32, description="/api/chat の同時実行数の上限 (対話的な処理)")
+    ADMISSION_CHAT_MAX_QUEUE: int = Field(64, description="/api/chat の待ち行列の上限。超過分は429で即時拒否")
+    ADMISSION_CHAT_QUEUE_TIMEOUT_SECONDS: float = Field(5.0, description="/api/chat の待ち行列での最大待機秒数。超過すると429")
+
+    # クライアント単位のレート制限設定 (トークンバケット)
+    RATE_LIMIT_ENABLED: bool = Field(True, description="クライアント単位のレート制限を有効にするか")
+    RATE_LIMIT_BUCKET_CAPACITY: float = Field(60.0, description="クライアントごとのトークンバケットの容量（バースト許容量）")
+    RATE_LIMIT_REFILL_PER_SECOND: float = Field(0.5, description="トークンバケットに1秒あたり補充されるトークン数")
+    RATE_LIMIT_ROUTE_COSTS: Dict[str, float] = Field(
+        default_factory=lambda: {"/api/process": 20.0, "/api/process/batch": 1.0, "/api/chat": 1.0},
+        description=(
+            "ルート（パスのプレフィックス、最長一致）ごとの1リクエストあたりのコスト (JSONオブジェクト)。未指定のルートは制限しない。"
+            "/api/process/batch はリクエスト自体のコストで、各項目は別に /api/process のコストを払う"
+        ),
+    )
+    RATE_LIMIT_API_KEY_HEADER: str = Field("X-API-Key", description="クライアントの識別に優先して用いるAPIキーのヘッダー名")
+    RATE_LIMIT_API_KEYS: List[str] = Field(
+        default_factory=list,
+        description="クライアントの識別に用いることを許可するAPIキー (JSON配列)。一覧にないキーは無視し、転送元IPで識別する",
+    )
+    RATE_LIMIT_TRUSTED_PROXY_HOPS: int = Field(
+        1,
+        description=(
+            "X-Forwarded-For に追記する信頼できるプロキシの段数。右からこの番目の値をクライアントIPとして扱う"
+            "（Cloud Run 直下は1、外部ロードバランサ経由は2）。0 の場合は X-Forwarded-For を使わず接続元アドレスを使う"
+        ),
+    )
+    RATE_LIMIT_BACKEND: Literal["memory", "redis"] = Field("memory", description="バケット状態の保持先。複数インスタンス構成では redis")
+    RATE_LIMIT_REDIS_URL: Optional[str] = Field(None, description="RATE_LIMIT_BACKEND=redis の場合の接続URL。例: redis://localhost:6379/0")
+    RATE_LIMIT_MAX_TRACKED_CLIENTS: int = Field(10000, description="プロセス内バックエンドで保持するクライアント数の上限")
+
+    # OpenTelemetry トレーシング設定
+    TRACING_ENABLED: bool = Field(False, description="OpenTelemetryのスパンを記録・エクスポートするか")
+    TRACING_EXPORTER: Literal["file", "console"] = Field("file", description="スパンのエクスポート先。file はJSON Linesでローカルファイルに追記")
+    TRACING_FILE_PATH: str = Field("traces.jsonl", description="TRACING_EXPORTER=file の場合の出力ファイルパス")
+    TRACING_SAMPLE_RATIO: float = Field(1.0, description="親スパンがない場合のサンプリング率 (0.0〜1.0)")
+
+    # GCS 読み出しのローカルディスクキャッシュ設定
+    GCS_DISK_CACHE_ENABLED: bool = Field(
+        False,
+        description="GCSから読み出したオブジェクトをローカルディスクにキャッシュするか。"
+                    "Cloud Run の /tmp はメモリ上にあり、キャッシュは最大 GCS_DISK_CACHE_MAX_MB だけインスタンスのメモリ上限を使うため既定は無効",
+    )
+    GCS_DISK_CACHE_DIR: str = Field("/tmp/sessionmuse-gcs-cache", description="キャッシュの保存先ディレクトリ。Cloud Run の /tmp はメモリ上にあるため上限に注意")
+    GCS_DISK_CACHE_MAX_MB: int = Field(
+        64,
+        description="キャッシュの合計サイズ上限（MB単位）。超えた分は最後に参照されたのが古いものから削除。"
+                    "/tmp がメモリ上にある環境ではこの分だけメモリを使うため、インスタンスのメモリ上限（--memory）より十分小さくする",
+    )
+    GCS_DISK_CACHE_MMAP_THRESHOLD_KB: int = Field(1024, description="この大きさ以上のキャッシュ済みオブジェクトはメモリマップで読み出す（KB単位）")
+
+    # 音声合成・配信設定
+    PROCESS_SYNTHESIS_MODE: Literal["inline", "background", "deferred"] = Field(
+        "inline",
+        description=(
+            "/api/process での full レンディション（44.1kHz ステレオ MP3）の合成。inline は合成・保存を終えてから応答し、"
+            "background は応答後にバックグラウンドで合成する。deferred は stream_url へのリクエスト時に合成しながら配信する。"
+            "background / deferred では応答の generated_mp3_url が空になるため、renditions / stream_url を読むクライアントのみで使う。"
+            "リクエストの synthesis_mode で上書きできる"
+        ),
+    )
+    PROCESS_RENDITIONS: Optional[str] = Field(
+        None,
+        description="/api/process で生成するレンディション（カンマ区切り: preview, full）。リクエストの renditions で上書きできる。"
+                    "未設定の場合、full を inline で合成するときは full のみ（プレビューを先に返せず応答が遅れるだけのため）、"
+                    "background・deferred のときは preview,full",
+    )
+    SYNTHESIS_PREVIEW_FORMAT: Literal["opus", "mp3"] = Field("opus", description="プレビューの形式（モノラル）。リクエストの preview_format で上書きできる")
+    SYNTHESIS_PREVIEW_SAMPLE_RATE: int = Field(24000, description="プレビューの合成・出力サンプリングレート (Hz)。Opus は 8000/12000/16000/24000/48000 のいずれか")
+    SYNTHESIS_PREVIEW_BITRATE_KBPS: int = Field(48, description="プレビューのビットレート (kbps)")
+    SYNTHESIS_PARALLEL_PARTS: bool = Field(True, description="パート（score-part）ごとに FluidSynth を並列に実行し、PCM をミックスするか")
+    SYNTHESIS_MAX_PARALLEL_PARTS: int = Field(8, description="並列合成するパート数の上限。超える場合は1プロセスでまとめて合成する（ステムを要求された場合を除く）")
+    PROCESS_STEMS_ENABLED: bool = Field(False, description="/api/process でパートごとのステムを保存するか。リクエストの stems で上書きできる")
+    SYNTHESIS_STEM_BITRATE_KBPS: int = Field(128, description="ステム (MP3) のビットレート (kbps)")
+    TRACK_STREAM_MAX_CONCURRENT_SYNTHESES: int = Field(2, description="/api/tracks/{id}/stream で同時に実行するストリーミング合成の上限（CPUコア数に合わせる）")
+
+    # 音声変換設定
+    AUDIO_CONVERSION_NORMALIZE_DBFS: Optional[float] = Field(
+        None, description="アップロード音声の変換時に RMS をこの値 (dBFS) に正規化する（ピークは -1dBFS まで）。未設定の場合は正規化しない"
+    )
+
+    # ジョブキュー・ワーカー設定
+    JOB_QUEUE_BACKEND: Literal["inline", "sqlite", "redis"] = Field(
+        "inline",
+        description=(
+            "音声変換・音声合成の実行先。inline はAPIプロセス内で実行する。sqlite / redis はジョブキューに投入し、"
+            "worker.py（レンダリング・変換ワーカー）が実行した結果をGCS経由で受け取る"
+        ),
+    )
+    JOB_QUEUE_SQLITE_PATH: str = Field("/tmp/sessionmuse-jobs.sqlite3", description="JOB_QUEUE_BACKEND=sqlite の場合のデータベースファイル。APIとワーカーで同じファイルを参照する")
+    JOB_QUEUE_REDIS_URL: Optional[str] = Field(None, description="JOB_QUEUE_BACKEND=redis の場合の接続URL。例: redis://localhost:6379/1")
+    JOB_QUEUE_WAIT_TIMEOUT_SECONDS: float = Field(300.0, description="APIがジョブの完了を待つ上限（秒）")
+    JOB_QUEUE_LEASE_SECONDS: float = Field(60.0, description="ワーカーが取得したジョブのリース期間（秒）。実行中は延長し、ワーカーが落ちて切れた場合は別のワーカーが再実行する")
+    JOB_QUEUE_MAX_ATTEMPTS: int = Field(3, description="リース切れによる再実行を含めた、1ジョブの最大実行回数")
+    JOB_QUEUE_RETENTION_SECONDS: float = Field(3600.0, description="完了・失敗したジョブの記録を残す期間（秒）")
+    WORKER_CONCURRENCY: int = Field(2, description="ワーカー1プロセスで同時に実行するジョブ数（CPUコア数に合わせる）")
+    WORKER_JOB_KINDS: str = Field("convert,render", description="ワーカーが実行するジョブの種類（カンマ区切り: convert, render）")
+
+    # 一括処理 (/api/process/batch) 設定
+    BATCH_MAX_ITEMS: int = Field(500, description="/api/process/batch の1リクエストで受け付けるファイル・GCS URI の最大件数")
+    BATCH_DEFAULT_CONCURRENCY: int = Field(4, description="/api/process/batch で同時に処理する件数の既定値")
+    BATCH_MAX_CONCURRENCY: int = Field(8, description="/api/process/batch のリクエストで指定できる同時処理数の上限")
+    BATCH_MAX_REQUEST_BODY_MB: int = Field(
+        256,
+        description=(
+            "/api/process/batch のリクエストボディの最大サイズ（MB単位、複数ファイルの合計）。アップロードされたファイルは /tmp に展開され、"
+            "Cloud Run ではインスタンスのメモリを使うため、メモリ上限より十分小さくする。大きな一括処理は gcs_uris で指定する"
+        ),
+    )
+    BATCH_ALLOWED_GCS_BUCKETS: List[str] = Field(
+        default_factory=list,
+        description="/api/process/batch で gcs_uris として読み込みを許可するバケット (JSON配列)。GCS_UPLOAD_BUCKET は常に許可する",
+    )
+    BATCH_PREDICTION_LOCATION: str = Field("us-central1", description="オフラインモードで Vertex AI バッチ予測ジョブを実行するリージョン")
+    BATCH_PREDICTION_POLL_INTERVAL_SECONDS: float = Field(30.0, description="バッチ予測ジョブの状態を確認する間隔（秒）")
+    BATCH_PREDICTION_TIMEOUT_SECONDS: float = Field(3 * 3600.0, description="バッチ予測ジョブ1件の完了を待つ最大秒数")
+    BATCH_PROGRESS_INTERVAL_SECONDS: float = Field(15.0, description="オフラインモードで結果が出るまでの間、進捗行を送る間隔（秒）。接続の維持も兼ねる")
+
+    # 起動時ウォームアップ設定
+    WARMUP_ENABLED: bool = Field(True, description="起動時にワークフローのコンパイル・クライアント生成・合成の初回実行を済ませてから /ready を200にするか")
+    WARMUP_SYNTHESIS_DRY_RUN: bool = Field(True, description="ウォームアップで小さなスコアを MP3 まで合成するか。無効の場合は music21 のパースのみ")
+    WARMUP_STRICT: bool = Field(True, description="ウォームアップの手順が1つでも失敗した場合に /ready を503のままにするか（スタートアッププローブが失敗し、インスタンスは置き換えられる）")
 
     # アプリケーション設定
     LOG_LEVEL: str = Field("INFO", description="アプリケーションログのレベル (INFO, DEBUGなど)")
+    LOG_QUEUE_ENABLED: bool = Field(True, description="ログの整形と出力を専用スレッド (QueueListener) で行い、リクエスト処理をブロックしないようにするか")
     # SIGNED_URL_EXPIRATION_SECONDS は現在使用されていないため削除されました。
     MAX_FILE_SIZE_MB: int = Field(100, description="アップロードファイルの最大サイズ（MB単位）")
+    MULTIPART_OVERHEAD_ALLOWANCE_KB: int = Field(64, description="/api/process の本文サイズ上限に加える、マルチパートの境界・ヘッダー分の余裕（KB単位）")
+    MAX_CHAT_REQUEST_BODY_KB: int = Field(1024, description="/api/chat のリクエストボディの最大サイズ（KB単位）")
     PORT_LOCAL_DEV: int = Field(8000, description="ローカルUvicorn開発サーバー用ポート")
 
 
@@ -1,8 +1,11 @@
 # exceptions.py
 
-from typing import Optional
+from typing import Dict, Optional
 from models import ErrorCode # Ensure relative import if models.py is in the same directory level
 
+# 失敗したワークフローを POST /api/process/{workflow_run_id}/resume で再開できる場合に、エラー応答に付けるヘッダー
+WORKFLOW_RUN_ID_HEADER = "X-Workflow-Run-Id"
+
 class AppException(Exception):
     status_code: int = 500
     error_code: ErrorCode = ErrorCode.INTERNAL_SERVER_ERROR
@@ -15,6 +18,7 @@ class AppException(Exception):
         detail: Optional[str] = None,
         error_code: Optional[ErrorCode] = None,
         status_code: Optional[int] = None,
+        headers: Optional[Dict[str, str]] = None,
     ):
         final_message = message if message is not None else self.__class__.message
         super().__init__(final_message)
@@ -23,6 +27,7 @@ class AppException(Exception):
         self.detail = detail if detail is not None else self.__class__.detail
         self.error_code = error_code if error_code is not None else self.__class__.error_code
         self.status_code = status_code if status_code is not None else self.__class__.status_code
+        self.headers = headers # レスポンスに付与するHTTPヘッダー (例: Retry-After)
 
 
 class InvalidRequestDataException(AppException):
@@ -75,11 +80,21 @@ class ForbiddenAccessException(AppException):
     error_code = ErrorCode.FORBIDDEN_ACCESS
     message = "このリソースへのアクセス権がありません。"
 
+class NotFoundException(AppException):
+    status_code = 404
+    error_code = ErrorCode.NOT_FOUND
+    message = "指定されたリソースが見つかりません。"
+
 class RateLimitExceededException(AppException):
     status_code = 429
     error_code = ErrorCode.RATE_LIMIT_EXCEEDED
     message = "レート制限を超過しました。後でもう一度お試しください。"
 
+    def __init__(self, message: Optional[str] = None, detail: Optional[str] = None, retry_after_seconds: Optional[int] = None):
+        headers = {"Retry-After": str(retry_after_seconds)} if retry_after_seconds is not None else None
+        super().__init__(message=message, detail=detail, headers=headers)
+        self.retry_after_seconds = retry_after_seconds
+
 class AudioConversionException(AppException):
     status_code = 422
     error_code = ErrorCode.INVALID_REQUEST
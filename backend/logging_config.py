@@ -1,12 +1,15 @@
 # logging_config.py
 
+import atexit
 import logging
+import logging.handlers
+import queue
 import sys
 import os
-import json # JSONフォーマッタ用
-from typing import Optional
+from typing import List, Optional
+
+import orjson # JSONフォーマッタ用 (stdlib json より高速)
 
-from google.cloud.logging.handlers import CloudLoggingHandler, setup_logging # CloudLoggingHandlerは直接API用なので注意
 from asgi_correlation_id import correlation_id
 
 from config import settings
@@ -21,6 +24,15 @@ def record_factory(*args, **kwargs):
 
 logging.setLogRecordFactory(record_factory)
 
+# LogRecord が標準で持つ属性。これら以外を extra として出力する（レコードごとに計算しない）
+STANDARD_RECORD_ATTRS = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__.keys()) | {
+    'correlation_id', 'service_name', 'message', 'asctime',
+}
+
+def _json_default(value):
+    # orjson が直接扱えない型 (例外オブジェクト、Pydanticモデル等) は文字列化する
+    return str(value)
+
 class JsonFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord):
         log_entry = {
@@ -44,13 +56,56 @@ class JsonFormatter(logging.Formatter):
         if record.stack_info:
             log_entry["stack_trace"] = self.formatStack(record.stack_info)
         
-        standard_attrs = set(logging.LogRecord('', '', '', '', '', '', '', '').__dict__.keys())
-        standard_attrs.update(['correlation_id', 'service_name', 'message', 'asctime'])
-        extra_attrs = {k: v for k, v in record.__dict__.items() if k not in standard_attrs}
+        extra_attrs = {k: v for k, v in record.__dict__.items() if k not in STANDARD_RECORD_ATTRS}
         if extra_attrs:
             log_entry["extra_data"] = extra_attrs
-            
-        return json.dumps(log_entry, default=str)
+
+        return orjson.dumps(log_entry, default=_json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    呼び出し元スレッドではメッセージと extra の値の確定のみ行い、整形とI/Oは QueueListener のスレッドに任せる。
+    標準の QueueHandler.prepare() はここで整形・例外の文字列化まで行うため、それを避ける。
+    同一プロセス内のキューなので exc_info などはそのまま渡せる。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 引数をこの時点の値で確定させる（後から変更されるオブジェクトの影響を受けないように）
+        record.msg = record.getMessage()
+        record.args = None
+        # extra の dict や list（request_params など）は参照のまま渡すと整形までに呼び出し元で変更されうるため、
+        # この時点で JSON にしておく（JsonFormatter は orjson.Fragment をそのまま埋め込む）
+        for key, value in record.__dict__.items():
+            if key not in STANDARD_RECORD_ATTRS and isinstance(value, (dict, list, tuple)):
+                record.__dict__[key] = orjson.Fragment(
+                    orjson.dumps(value, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+                )
+        return record
+
+
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+def _stop_queue_listener() -> None:
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop() # キューに残ったレコードを出力してから停止する
+        _queue_listener = None
+
+atexit.register(_stop_queue_listener)
+
+def _install_handlers(handlers: List[logging.Handler], use_queue: bool) -> None:
+    global _queue_listener
+    _stop_queue_listener()
+    root_logger = logging.getLogger()
+    if not use_queue:
+        for handler in handlers:
+            root_logger.addHandler(handler)
+        return
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root_logger.addHandler(NonBlockingQueueHandler(log_queue))
+    _queue_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _queue_listener.start()
 
 def setup_app_logging(log_level_str: str = settings.LOG_LEVEL):
     level = getattr(logging, log_level_str.upper(), logging.INFO)
@@ -66,7 +121,7 @@ def setup_app_logging(log_level_str: str = settings.LOG_LEVEL):
         formatter = JsonFormatter()
         json_handler.setFormatter(formatter)
         json_handler.setLevel(level)
-        logging.getLogger().addHandler(json_handler)
+        _install_handlers([json_handler], settings.LOG_QUEUE_ENABLED)
         logging.info(f"GCP環境用にJSONロギングを設定しました。ログレベル: {log_level_str}")
     else:
         console_handler = logging.StreamHandler(sys.stdout)
@@ -76,7 +131,7 @@ def setup_app_logging(log_level_str: str = settings.LOG_LEVEL):
         formatter = logging.Formatter(formatter_str)
         console_handler.setFormatter(formatter)
         console_handler.setLevel(level)
-        logging.getLogger().addHandler(console_handler)
+        _install_handlers([console_handler], settings.LOG_QUEUE_ENABLED)
         logging.info(f"ローカル環境用にコンソールロギングを設定しました。ログレベル: {log_level_str}")
 
     logging.getLogger("uvicorn.access").setLevel(logging.WARNING if level > logging.INFO else logging.INFO)
@@ -1,34 +1,80 @@
 # main.py
 
+import asyncio
 import logging
 import os # PORT_LOCAL_DEV用
+from contextlib import asynccontextmanager
 from uuid import uuid4
 
 from fastapi import FastAPI, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from asgi_correlation_id import CorrelationIdMiddleware, correlation_id
+from asgi_correlation_id import CorrelationIdMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST
 
 from config import settings
 from logging_config import setup_app_logging
+from metrics import record_error, render_latest
+from tracing import setup_tracing
 from models import ErrorCode, ErrorDetail, ErrorResponse
-from exceptions import AppException
-from routers import process_api, chat_api
+from exceptions import WORKFLOW_RUN_ID_HEADER, AppException
+from routers import process_api, chat_api, tracks_api
+from middleware.admission_control import AdmissionControlMiddleware, get_admission_controller
+from middleware.rate_limit import RateLimitMiddleware
+from middleware.body_size_limit import BodySizeLimitMiddleware
+from middleware.error_responses import app_exception_response
+from middleware.metrics import PrometheusMiddleware
+from middleware.tracing import TracingMiddleware
+from middleware.request_logging import RequestLoggingMiddleware
+from services.llm_usage import get_llm_usage_stats
+from services.llm_cache import get_llm_response_cache
+from services.warmup import get_warmup_state
 
 # --- 1. ロギング初期化 ---
 setup_app_logging(settings.LOG_LEVEL)
 logger = logging.getLogger(__name__)
+setup_tracing()
 
 # --- 2. FastAPIアプリケーションインスタンス作成 ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ウォームアップはバックグラウンドで行い、起動（/health の応答）自体は遅らせない。完了までは /ready が503を返す
+    warmup_state = get_warmup_state()
+    warmup_task = None
+    if settings.WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(warmup_state.run())
+    else:
+        warmup_state.mark_ready()
+    yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        try:
+            await warmup_task
+        except asyncio.CancelledError:
+            pass
+
 app = FastAPI(
     title="SessionMUSE Backend API",
     description="API for SessionMUSE, providing audio processing and AI chat functionalities.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # --- 3. ミドルウェア追加 ---
+# 後から追加したミドルウェアほど外側で実行される。
+# 3.0. アドミッション制御 (CORSの内側に置き、429応答にもCORSヘッダーが付くようにする)
+if settings.ADMISSION_CONTROL_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
+
+# 3.0.1. クライアント単位のレート制限 (アドミッション制御より外側で、待ち行列に入る前に判定する)
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
+
+# 3.0.2. リクエストボディのサイズ制限 (受信しながら判定し、上限超過時は本文の展開前に413を返す)
+app.add_middleware(BodySizeLimitMiddleware)
+
 # 3.1. CORS ミドルウェア (Flutter側からのリクエスト許可用)
 app.add_middleware(
     CORSMiddleware,
@@ -36,49 +82,25 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[WORKFLOW_RUN_ID_HEADER],  # ブラウザのクライアントが失敗した処理を再開できるように
 )
 
-# 3.2. Correlation ID ミドルウェア (リクエスト追跡用)
+# 3.2. リクエストロギングミドルウェア (詳細なリクエスト/レスポンスログ用)
+# Correlation ID の内側に置き、リクエストIDがログに付与されるようにする (応答ヘッダーへの反映は Correlation ID 側で行う)
+app.add_middleware(RequestLoggingMiddleware)
+
+# 3.3. Correlation ID ミドルウェア (リクエスト追跡用)
 app.add_middleware(
     CorrelationIdMiddleware,
     header_name='X-Request-ID',
     generator=lambda: uuid4().hex,
 )
 
-# 3.3. カスタムロギングミドルウェア (詳細なリクエスト/レスポンスログ用)
-@app.middleware("http")
-async def log_requests_middleware(request: Request, call_next):
-    request_id = correlation_id.get()
-
-    log_payload_request = {
-        "client_host": request.client.host if request.client else "unknown",
-        "client_port": request.client.port if request.client else "unknown",
-        "http_method": request.method,
-        "http_path": request.url.path,
-        "http_query_params": str(request.query_params),
-        "user_agent": request.headers.get("user-agent", "unknown"),
-        "gcp_trace_context": request.headers.get("X-Cloud-Trace-Context"),
-    }
-    logger.info(
-        f"Request received: {request.method} {request.url.path}",
-        extra=log_payload_request
-    )
-
-    response = await call_next(request)
-
-    log_payload_response = {
-        "http_status_code": response.status_code,
-    }
-    full_log_payload = {**log_payload_request, **log_payload_response}
-    logger.info(
-        f"Request finished: {request.method} {request.url.path} - Status: {response.status_code}",
-        extra=full_log_payload
-    )
-
-    if request_id:
-        response.headers["X-Request-ID"] = request_id
+# 3.4. Prometheus メトリクス (最も外側で、429応答やストリーミングの送出完了までを計測する)
+app.add_middleware(PrometheusMiddleware)
 
-    return response
+# 3.5. OpenTelemetry サーバースパン (受信した traceparent / X-Cloud-Trace-Context を親として引き継ぐ)
+app.add_middleware(TracingMiddleware)
 
 
 # --- 4. 例外ハンドラ登録 ---
@@ -97,6 +119,7 @@ async def request_validation_exception_handler(request: Request, exc: RequestVal
         }
     )
     error_detail_for_client = str(error_details_for_log)
+    record_error(ErrorCode.INVALID_REQUEST.value)
     return JSONResponse(
         status_code=status.HTTP_400_BAD_REQUEST,
         content=jsonable_encoder(ErrorResponse(
@@ -122,16 +145,7 @@ async def app_exception_handler(request: Request, exc: AppException):
             "client_host": request.client.host if request.client else "unknown",
         }
     )
-    return JSONResponse(
-        status_code=exc.status_code,
-        content=jsonable_encoder(ErrorResponse(
-            error=ErrorDetail(
-                code=exc.error_code,
-                message=exc.message,
-                detail=exc.detail
-            )
-        ))
-    )
+    return app_exception_response(exc)
 
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
@@ -144,6 +158,7 @@ async def generic_exception_handler(request: Request, exc: Exception):
             "client_host": request.client.host if request.client else "unknown",
         }
     )
+    record_error(ErrorCode.INTERNAL_SERVER_ERROR.value)
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content=jsonable_encoder(ErrorResponse(
@@ -158,7 +173,8 @@ async def generic_exception_handler(request: Request, exc: Exception):
 # --- 5. APIルーター登録 ---
 app.include_router(process_api.router)
 app.include_router(chat_api.router)
-logger.info("API routers registered: process_api, chat_api.")
+app.include_router(tracks_api.router)
+logger.info("API routers registered: process_api, chat_api, tracks_api.")
 
 
 # --- 基本的なルートとヘルスチェックエンドポイント ---
@@ -172,6 +188,34 @@ async def health_check():
     logger.debug("Health check '/health' accessed.")
     return {"status": "healthy", "version": app.version, "log_level": settings.LOG_LEVEL}
 
+@app.get("/ready", tags=["Utilities"], summary="Readiness Check Endpoint")
+async def readiness_check():
+    """ウォームアップ完了後にのみ200を返す（起動プローブ・ロードバランサー向け）。/health は生存確認のみ。"""
+    warmup_state = get_warmup_state()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if warmup_state.is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": warmup_state.is_ready, "version": app.version, "warmup": warmup_state.snapshot()},
+    )
+
+@app.get("/admission", tags=["Utilities"], summary="Admission Control Status")
+async def admission_status():
+    """優先度クラスごとの同時実行数・待ち行列の深さ（オートスケーラー向け）。"""
+    return {"enabled": settings.ADMISSION_CONTROL_ENABLED, "pools": get_admission_controller().stats()}
+
+@app.get("/llm-usage", tags=["Utilities"], summary="LLM Token Usage and Latency")
+async def llm_usage_status():
+    """
+    タスク・モデルごとの Vertex AI 呼び出し数・トークン数（入力/出力/キャッシュ/推論）・TTFT と所要時間のパーセンタイル。
+    LLM 応答キャッシュが有効な場合は、タスクごとのヒット数・ミス数と使用量も返す（キャッシュから返した応答は tasks に含まれない）。
+    """
+    cache = get_llm_response_cache()
+    return {"tasks": get_llm_usage_stats().snapshot(), "response_cache": cache.stats() if cache is not None else None}
+
+@app.get("/metrics", tags=["Utilities"], summary="Prometheus Metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus のテキスト形式でメトリクスを返す。"""
+    return Response(content=render_latest(), media_type=CONTENT_TYPE_LATEST)
+
 
 # --- 6. ローカル開発用Uvicornランナー ---
 if __name__ == "__main__":
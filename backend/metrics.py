@@ -0,0 +1,227 @@
+# metrics.py
+"""
+Prometheus メトリクス
+
+各処理段階のレイテンシ（ヒストグラム）、ErrorCode ごとのエラー数、処理中リクエスト数などを
+/metrics で公開します。記録は prometheus_client のロックフリーに近い軽量な更新のみで、
+全リクエストで常時計測できるコストに抑えています。
+アドミッション制御・ヘッジング・モデルカスケード・レジリエンス層の統計は、
+スクレイプ時に各コンポーネントから読み出します。
+"""
+
+import sys
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from tracing import tracer
+
+# 数ミリ秒のGCS操作から数分のLLM生成までを1つのバケット列で扱う
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_DURATION = Histogram(
+    "sessionmuse_stage_duration_seconds",
+    "処理段階ごとの所要時間",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "sessionmuse_http_request_duration_seconds",
+    "HTTPリクエストの所要時間（レスポンス送出完了まで）",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "sessionmuse_http_requests_in_flight",
+    "処理中のHTTPリクエスト数",
+)
+CHAT_TTFT = Histogram(
+    "sessionmuse_chat_time_to_first_token_seconds",
+    "チャットのストリーミング応答で最初のトークンを送出するまでの時間",
+    buckets=STAGE_BUCKETS,
+)
+CHAT_TOTAL = Histogram(
+    "sessionmuse_chat_duration_seconds",
+    "チャット応答全体の所要時間",
+    ["mode"],
+    buckets=STAGE_BUCKETS,
+)
+LLM_CALLS = Counter(
+    "sessionmuse_llm_calls_total",
+    "Vertex AI 呼び出し数（タスク・モデル別）",
+    ["task", "model", "mode"],
+)
+LLM_TOKENS = Counter(
+    "sessionmuse_llm_tokens_total",
+    "Vertex AI 呼び出しのトークン数 (type: input / output / cached / reasoning)",
+    ["task", "model", "type"],
+)
+LLM_TTFT = Histogram(
+    "sessionmuse_llm_time_to_first_token_seconds",
+    "Vertex AI 呼び出しで最初のトークンを受信するまでの時間（非ストリーミングは応答全体の受信まで）",
+    ["task", "model"],
+    buckets=STAGE_BUCKETS,
+)
+ERRORS = Counter(
+    "sessionmuse_errors_total",
+    "クライアントに返したエラー応答数 (ErrorCode別)",
+    ["code"],
+)
+
+
+def observe_stage(stage: str, duration_seconds: float) -> None:
+    STAGE_DURATION.labels(stage).observe(duration_seconds)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """with ブロックの所要時間を stage として記録する（例外時も記録）。同名の子スパンも作成する。"""
+    start = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(stage):
+            yield
+    finally:
+        STAGE_DURATION.labels(stage).observe(time.perf_counter() - start)
+
+
+def record_error(code: str) -> None:
+    ERRORS.labels(code).inc()
+
+
+class _ComponentStatsCollector(Collector):
+    """各コンポーネントが保持している統計をスクレイプ時に Prometheus 形式へ変換する。"""
+
+    def describe(self):
+        # 登録時に collect() が呼ばれないようにする（読み込み途中のモジュールを参照しないため）
+        return []
+
+    def collect(self):
+        yield from self._admission_metrics()
+        yield from self._rate_limit_metrics()
+        yield from self._resilience_metrics()
+        yield from self._cascade_metrics()
+        yield from self._hedging_metrics()
+        yield from self._gcs_cache_metrics()
+        yield from self._llm_cache_metrics()
+
+    @staticmethod
+    def _loaded(module_name: str):
+        # まだ読み込まれていないコンポーネントは計測対象外（スクレイプで初期化しない）
+        return sys.modules.get(module_name)
+
+    def _admission_metrics(self):
+        module = self._loaded("middleware.admission_control")
+        if module is None or module._admission_controller_instance is None:
+            return
+        in_flight = GaugeMetricFamily("sessionmuse_admission_in_flight", "アドミッションプールで処理中のリクエスト数", labels=["pool"])
+        queue_depth = GaugeMetricFamily("sessionmuse_admission_queue_depth", "アドミッションプールの待ち行列の深さ", labels=["pool"])
+        rejected = CounterMetricFamily("sessionmuse_admission_rejected", "アドミッション制御で拒否したリクエスト数", labels=["pool", "reason"])
+        for name, stats in module._admission_controller_instance.stats().items():
+            in_flight.add_metric([name], stats["in_flight"])
+            queue_depth.add_metric([name], stats["queue_depth"])
+            rejected.add_metric([name, "queue_full"], stats["rejected_queue_full"])
+            rejected.add_metric([name, "queue_timeout"], stats["rejected_queue_timeout"])
+        yield in_flight
+        yield queue_depth
+        yield rejected
+
+    def _rate_limit_metrics(self):
+        module = self._loaded("middleware.rate_limit")
+        if module is None or module._rate_limiter_instance is None:
+            return
+        stats = module._rate_limiter_instance.stats()
+        decisions = CounterMetricFamily("sessionmuse_rate_limit_decisions", "クライアント単位のレート制限の判定数", labels=["result"])
+        decisions.add_metric(["allowed"], stats["allowed_total"])
+        decisions.add_metric(["rejected"], stats["rejected_total"])
+        yield decisions
+
+    def _resilience_metrics(self):
+        module = self._loaded("services.vertex_resilience")
+        if module is None or module._vertex_resilience_instance is None:
+            return
+        stats = module._vertex_resilience_instance.stats()
+        yield GaugeMetricFamily("sessionmuse_vertex_retry_budget_tokens", "Vertex AIリトライ予算の残量", value=stats["retry_budget_tokens"])
+        yield CounterMetricFamily("sessionmuse_vertex_retries", "Vertex AI呼び出しのリトライ数", value=stats["retries"])
+        yield CounterMetricFamily("sessionmuse_vertex_retry_budget_exhausted", "リトライ予算枯渇によりリトライしなかった回数", value=stats["retry_budget_exhausted"])
+        breaker_open = GaugeMetricFamily("sessionmuse_vertex_circuit_open", "サーキットブレーカーが閉じていない (1) か", labels=["circuit"])
+        for name, breaker in stats["circuit_breakers"].items():
+            breaker_open.add_metric([name], 0 if breaker["state"] == "closed" else 1)
+        yield breaker_open
+        deadlines = GaugeMetricFamily("sessionmuse_vertex_deadline_seconds", "タスクごとの現在の適応的タイムアウト", labels=["task"])
+        for task, deadline in stats["deadlines_seconds"].items():
+            deadlines.add_metric([task], deadline)
+        yield deadlines
+
+    def _cascade_metrics(self):
+        module = self._loaded("services.model_cascade")
+        if module is None or module._model_cascade_stats_instance is None:
+            return
+        attempts = CounterMetricFamily("sessionmuse_model_cascade_attempts", "モデルカスケードの試行数", labels=["task", "model", "result"])
+        escalations = CounterMetricFamily("sessionmuse_model_cascade_escalations", "次のモデルへのエスカレーション数", labels=["task", "model"])
+        for task, models in module._model_cascade_stats_instance.snapshot().items():
+            for model_name, stats in models.items():
+                attempts.add_metric([task, model_name, "success"], stats["successes"])
+                attempts.add_metric([task, model_name, "failure"], stats["attempts"] - stats["successes"])
+                escalations.add_metric([task, model_name], stats["escalations"])
+        yield attempts
+        yield escalations
+
+    def _hedging_metrics(self):
+        module = self._loaded("services.audio_analysis_service")
+        analyzer = module._audio_analyzer_instance if module is not None else None
+        if analyzer is None:
+            return
+        sent = CounterMetricFamily("sessionmuse_hedge_requests_sent", "送信したヘッジリクエスト数", labels=["task"])
+        wins = CounterMetricFamily("sessionmuse_hedge_wins", "ヘッジ側が採用された回数", labels=["task"])
+        saved = CounterMetricFamily("sessionmuse_hedge_latency_saved_seconds", "ヘッジにより短縮されたと推定される時間", labels=["task"])
+        for task, stats in analyzer.hedging_stats().items():
+            sent.add_metric([task], stats["hedges_sent"])
+            wins.add_metric([task], stats["hedge_wins"])
+            saved.add_metric([task], stats["latency_saved_seconds"])
+        yield sent
+        yield wins
+        yield saved
+
+    def _gcs_cache_metrics(self):
+        module = self._loaded("services.gcs_service")
+        service = module._gcs_service_instance if module is not None else None
+        if service is None or service.disk_cache is None:
+            return
+        stats = service.disk_cache.stats()
+        lookups = CounterMetricFamily("sessionmuse_gcs_cache_lookups", "GCSディスクキャッシュの参照数", labels=["result"])
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        yield CounterMetricFamily("sessionmuse_gcs_cache_evictions", "容量上限によりGCSディスクキャッシュから削除したオブジェクト数", value=stats["evictions"])
+        yield GaugeMetricFamily("sessionmuse_gcs_cache_bytes", "GCSディスクキャッシュの使用バイト数", value=stats["bytes"])
+        yield GaugeMetricFamily("sessionmuse_gcs_cache_entries", "GCSディスクキャッシュのオブジェクト数", value=stats["entries"])
+
+    def _llm_cache_metrics(self):
+        module = self._loaded("services.llm_cache")
+        cache = module._llm_response_cache_instance if module is not None else None
+        if cache is None:
+            return
+        stats = cache.stats()
+        lookups = CounterMetricFamily("sessionmuse_llm_cache_lookups", "LLM応答キャッシュの参照数", labels=["task", "result"])
+        invalidations = CounterMetricFamily("sessionmuse_llm_cache_invalidations", "検証に失敗したため削除したキャッシュ済み応答の数", labels=["task"])
+        for task, task_stats in stats["tasks"].items():
+            lookups.add_metric([task, "hit"], task_stats["hits"])
+            lookups.add_metric([task, "miss"], task_stats["misses"])
+            invalidations.add_metric([task], task_stats["invalidations"])
+        yield lookups
+        yield invalidations
+        yield CounterMetricFamily("sessionmuse_llm_cache_evictions", "容量上限によりLLM応答キャッシュから削除した応答の数", value=stats["evictions"])
+        yield GaugeMetricFamily("sessionmuse_llm_cache_bytes", "LLM応答キャッシュの使用バイト数", value=stats["bytes"])
+        yield GaugeMetricFamily("sessionmuse_llm_cache_entries", "LLM応答キャッシュの応答数", value=stats["entries"])
+
+
+REGISTRY.register(_ComponentStatsCollector())
+
+
+def render_latest() -> bytes:
+    return generate_latest(REGISTRY)
+
@@ -0,0 +1,199 @@
+# middleware/admission_control.py
+"""
+アドミッション制御
+
+重い処理パイプライン (/api/process) と対話的なチャット (/api/chat) に別々の
+同時実行プールと待ち行列の上限を設け、負荷が上限を超えた場合は
+RATE_LIMIT_EXCEEDED (429, Retry-After付き) で即座に負荷を切り捨てます。
+ストリーミング応答の送出が終わるまでスロットを保持するため、ASGIミドルウェアとして実装しています。
+一括処理 (/api/process/batch) はリクエスト単位ではなく、項目ごとに process プールのスロットを確保します。
+"""
+
+import asyncio
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+from exceptions import RateLimitExceededException
+from middleware.error_responses import app_exception_response
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionPool:
+    """1つの優先度クラスに対応する同時実行プールと待ち行列。"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout_seconds: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted_total = 0
+        self.rejected_queue_full = 0
+        self.rejected_queue_timeout = 0
+        self._avg_service_seconds: Optional[float] = None
+
+    def _record_service_time(self, duration_seconds: float) -> None:
+        # 指数移動平均で平均処理時間を推定し、Retry-After の算出に使う
+        if self._avg_service_seconds is None:
+            self._avg_service_seconds = duration_seconds
+        else:
+            self._avg_service_seconds = 0.8 * self._avg_service_seconds + 0.2 * duration_seconds
+
+    def retry_after_seconds(self) -> int:
+        average = self._avg_service_seconds or 1.0
+        estimate = average * (self.queued + 1) / self.max_concurrency
+        return int(min(60, max(1, math.ceil(estimate))))
+
+    def _reject(self, reason: str) -> RateLimitExceededException:
+        return RateLimitExceededException(
+            message="サーバーが混雑しています。しばらく待ってから再試行してください。",
+            detail=f"pool={self.name}, reason={reason}, in_flight={self.in_flight}, queued={self.queued}",
+            retry_after_seconds=self.retry_after_seconds(),
+        )
+
+    async def acquire(self) -> None:
+        """スロットを確保する。待ち行列が満杯、または待機期限を超えた場合は RateLimitExceededException。"""
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise self._reject("queue_full")
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout_seconds)
+        except asyncio.TimeoutError:
+            self.rejected_queue_timeout += 1
+            raise self._reject("queue_timeout")
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.admitted_total += 1
+
+    def release(self, service_seconds: float) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+        self._record_service_time(service_seconds)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    @asynccontextmanager
+    async def batch_slot(self) -> AsyncIterator[None]:
+        """
+        一括処理の1項目分のスロット。応答済みのリクエストの中で順番を待つため、待ち行列の上限・待機期限は適用せず、
+        待ち行列の長さにも数えない（対話的なリクエストの受け付けには影響しない）。
+        """
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        self.admitted_total += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "admitted_total": self.admitted_total,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_queue_timeout": self.rejected_queue_timeout,
+        }
+
+
+class AdmissionController:
+    """パスのプレフィックスから優先度クラス（プール）を選ぶ。"""
+
+    def __init__(self):
+        self.pools: Dict[str, AdmissionPool] = {
+            "process": AdmissionPool(
+                "process",
+                max_concurrency=settings.ADMISSION_PROCESS_MAX_CONCURRENCY,
+                max_queue=settings.ADMISSION_PROCESS_MAX_QUEUE,
+                queue_timeout_seconds=settings.ADMISSION_PROCESS_QUEUE_TIMEOUT_SECONDS,
+            ),
+            "chat": AdmissionPool(
+                "chat",
+                max_concurrency=settings.ADMISSION_CHAT_MAX_CONCURRENCY,
+                max_queue=settings.ADMISSION_CHAT_MAX_QUEUE,
+                queue_timeout_seconds=settings.ADMISSION_CHAT_QUEUE_TIMEOUT_SECONDS,
+            ),
+        }
+        # None はリクエスト単位ではスロットを確保しないルート。一括処理は項目ごとに batch_slot() で確保する
+        # （リクエストがスロットを保持したまま項目がスロットを待つと、同時の一括処理だけでプールが埋まり進まなくなるため）
+        self.route_pools: Dict[str, Optional[str]] = {
+            "/api/process": "process",
+            "/api/process/batch": None,
+            "/api/chat": "chat",
+        }
+
+    def pool_for_path(self, path: str) -> Optional[AdmissionPool]:
+        """最も長く一致したプレフィックスのプール。"""
+        best_prefix = ""
+        pool_name = None
+        for prefix, name in self.route_pools.items():
+            if (path == prefix or path.startswith(prefix + "/")) and len(prefix) > len(best_prefix):
+                best_prefix, pool_name = prefix, name
+        return self.pools[pool_name] if pool_name is not None else None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app: ASGIApp, controller: Optional["AdmissionController"] = None):
+        self.app = app
+        self.controller = controller or get_admission_controller()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        pool = self.controller.pool_for_path(scope.get("path", ""))
+        if pool is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await pool.acquire()
+        except RateLimitExceededException as exc:
+            logger.warning(
+                f"アドミッション制御により負荷を切り捨てました: {scope.get('method')} {scope.get('path')}",
+                extra={"error_code": exc.error_code.value, "error_detail": exc.detail, "admission_pool": pool.name,
+                       "retry_after_seconds": exc.retry_after_seconds},
+            )
+            await app_exception_response(exc)(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            pool.release(time.monotonic() - start)
+
+
+# プロセス内で共有するコントローラ
+_admission_controller_instance: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    global _admission_controller_instance
+    if _admission_controller_instance is None:
+        _admission_controller_instance = AdmissionController()
+    return _admission_controller_instance
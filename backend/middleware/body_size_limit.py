@@ -0,0 +1,109 @@
+# middleware/body_size_limit.py
+"""
+リクエストボディのサイズ制限
+
+ルートごとの上限を、本文を受信しながら適用するASGIミドルウェアです。
+Content-Length がある場合は本文を1バイトも読まずに拒否し、ない場合（chunked 等）は
+受信したバイト数を数えて上限を超えた時点で受信を打ち切ります。
+Starlette がマルチパートを SpooledTemporaryFile に展開し終える前に FILE_TOO_LARGE (413) を返すため、
+拒否するリクエストに帯域やメモリ・/tmp を消費しません。
+"""
+
+import logging
+from typing import Dict, Optional
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+from exceptions import FileTooLargeException
+from middleware.error_responses import app_exception_response
+
+logger = logging.getLogger(__name__)
+
+
+def default_route_limits() -> Dict[str, int]:
+    """ルート（パスのプレフィックス）ごとの本文サイズ上限（バイト）。"""
+    return {
+        # 前方一致のため、/api/process より先に判定させる
+        "/api/process/batch": settings.BATCH_MAX_REQUEST_BODY_MB * 1024 * 1024,
+        # マルチパートの境界やヘッダー分の余裕を加える
+        "/api/process": settings.MAX_FILE_SIZE_MB * 1024 * 1024 + settings.MULTIPART_OVERHEAD_ALLOWANCE_KB * 1024,
+        "/api/chat": settings.MAX_CHAT_REQUEST_BODY_KB * 1024,
+    }
+
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app: ASGIApp, route_limits: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.route_limits = route_limits if route_limits is not None else default_route_limits()
+
+    def limit_for_path(self, path: str) -> Optional[int]:
+        for prefix, limit in self.route_limits.items():
+            if path == prefix or path.startswith(prefix + "/"):
+                return limit
+        return None
+
+    def _too_large(self, limit: int, received: Optional[int] = None) -> FileTooLargeException:
+        if received is None:
+            detail = f"limit_bytes={limit}"
+        else:
+            detail = f"limit_bytes={limit}, received_bytes>={received}"
+        return FileTooLargeException(message=f"リクエストボディが上限 ({limit / (1024 * 1024):.1f}MB) を超えています。", detail=detail)
+
+    async def _reject(self, exc: FileTooLargeException, scope: Scope, receive: Receive, send: Send) -> None:
+        logger.warning(
+            f"リクエストボディのサイズ上限を超えたため拒否しました: {scope.get('method')} {scope.get('path')}",
+            extra={"error_code": exc.error_code.value, "error_detail": exc.detail},
+        )
+        response = app_exception_response(exc)
+        # 残りの本文を受信せずに接続を閉じるよう、クライアントに伝える
+        response.headers["Connection"] = "close"
+        await response(scope, receive, send)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.limit_for_path(scope.get("path", ""))
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(self._too_large(limit), scope, receive, send)
+            return
+
+        received = 0
+        exceeded: Optional[FileTooLargeException] = None
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            if exceeded is not None:
+                raise exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = self._too_large(limit, received)
+                    raise exceeded
+            return message
+
+        async def guarded_send(message: Message) -> None:
+            nonlocal response_started
+            if exceeded is not None and not response_started:
+                # 上限超過後にアプリが返すエラー応答（本文解析失敗の400など）は破棄し、413 に差し替える
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if exceeded is None or response_started:
+                raise
+        if exceeded is not None and not response_started:
+            await self._reject(exceeded, scope, receive, send)
@@ -0,0 +1,27 @@
+# middleware/error_responses.py
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from exceptions import AppException
+from metrics import record_error
+from models import ErrorDetail, ErrorResponse
+
+
+def app_exception_response(exc: AppException) -> JSONResponse:
+    """
+    AppException を共通のエラーエンベロープ (models.ErrorResponse) に変換する。
+    例外ハンドラに到達する前に応答するASGIミドルウェアからも利用する。
+    """
+    record_error(exc.error_code.value)
+    return JSONResponse(
+        status_code=exc.status_code,
+        content=jsonable_encoder(ErrorResponse(
+            error=ErrorDetail(
+                code=exc.error_code,
+                message=exc.message,
+                detail=exc.detail
+            )
+        )),
+        headers=exc.headers,
+    )
@@ -0,0 +1,250 @@
+# middleware/rate_limit.py
+"""
+クライアント単位のレート制限
+
+クライアント（許可されたAPIキー、なければ転送元IP）ごとにトークンバケットを持ち、
+ルートごとに設定されたコスト分のトークンを消費します。/api/process のような
+重い処理はチャット1ターンより大きなコストを払うため、単一クライアントが
+Vertex AI のクォータを使い切ることを防ぎます。一括処理 (/api/process/batch) は
+項目ごとに /api/process 1回分のコストを払い、トークンが貯まるまで項目の処理を待ちます。
+
+バケットの状態は既定ではプロセス内に保持し、複数インスタンス構成では
+Redis を共有バックエンドとして利用できます（redis パッケージが必要）。
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from config import settings
+from exceptions import RateLimitExceededException
+from middleware.error_responses import app_exception_response
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryBucketBackend:
+    """プロセス内のトークンバケット。保持するクライアント数は max_clients までで、古いものから破棄する。"""
+
+    def __init__(self, max_clients: int = 10000):
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float) -> Tuple[bool, float]:
+        """
+        cost 分のトークンを消費する。
+        :return: (許可されたか, 拒否時に必要なトークンが貯まるまでの秒数)
+        """
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / refill_per_second if refill_per_second > 0 else math.inf
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "memory", "tracked_clients": len(self._buckets)}
+
+
+# 補充と消費を1回の往復でアトミックに行う
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+if refill > 0 then
+  redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill) + 1)
+end
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketBackend:
+    """複数インスタンスで共有するトークンバケット。Redis に到達できない場合は許可する（フェイルオープン）。"""
+
+    def __init__(self, url: str, key_prefix: str = "sessionmuse:ratelimit:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis には redis パッケージが必要です。") from e
+        self._client = redis_asyncio.from_url(url)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+        self.key_prefix = key_prefix
+        self.errors = 0
+
+    async def consume(self, key: str, cost: float, capacity: float, refill_per_second: float) -> Tuple[bool, float]:
+        try:
+            allowed, tokens = await self._script(
+                keys=[self.key_prefix + key],
+                args=[capacity, refill_per_second, cost, time.time()],
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"レート制限バックエンド (Redis) でエラーが発生したため、リクエストを許可します: {type(e).__name__}")
+            return True, 0.0
+        if int(allowed) == 1:
+            return True, 0.0
+        tokens = float(tokens)
+        return False, (cost - tokens) / refill_per_second if refill_per_second > 0 else math.inf
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "redis", "errors": self.errors}
+
+
+class RateLimiter:
+    """クライアントの識別とルートごとのコストの解決、バケットの消費を行う。"""
+
+    def __init__(self, backend: Optional[Any] = None):
+        self.capacity = settings.RATE_LIMIT_BUCKET_CAPACITY
+        self.refill_per_second = settings.RATE_LIMIT_REFILL_PER_SECOND
+        self.route_costs = dict(settings.RATE_LIMIT_ROUTE_COSTS)
+        self.api_key_header = settings.RATE_LIMIT_API_KEY_HEADER
+        # 許可されたAPIキーはハッシュで保持し、ログ・統計に生のキーが出ないようにする
+        self.api_key_hashes = {self._hash_api_key(api_key) for api_key in settings.RATE_LIMIT_API_KEYS}
+        self.trusted_proxy_hops = max(0, settings.RATE_LIMIT_TRUSTED_PROXY_HOPS)
+        self.backend = backend or self._create_backend()
+        self.allowed_total = 0
+        self.rejected_total = 0
+
+    @staticmethod
+    def _create_backend() -> Any:
+        if settings.RATE_LIMIT_BACKEND == "redis":
+            if not settings.RATE_LIMIT_REDIS_URL:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis の場合は RATE_LIMIT_REDIS_URL を設定してください。")
+            return RedisBucketBackend(settings.RATE_LIMIT_REDIS_URL)
+        return InMemoryBucketBackend(max_clients=settings.RATE_LIMIT_MAX_TRACKED_CLIENTS)
+
+    def cost_for(self, method: str, path: str) -> float:
+        """最も長く一致したルートのコスト。一致しなければ 0（制限しない）。"""
+        if method == "OPTIONS":
+            return 0.0
+        best_prefix = ""
+        cost = 0.0
+        for prefix, route_cost in self.route_costs.items():
+            if (path == prefix or path.startswith(prefix.rstrip("/") + "/")) and len(prefix) > len(best_prefix):
+                best_prefix, cost = prefix, route_cost
+        return cost
+
+    @staticmethod
+    def _hash_api_key(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+
+    def client_key(self, scope: Scope) -> str:
+        """
+        許可されたAPIキーがあればそのハッシュ、なければ転送元IPをキーにする。
+        X-Forwarded-For の左側はクライアントが自由に書けるため、信頼できるプロキシが追記した右から
+        RATE_LIMIT_TRUSTED_PROXY_HOPS 番目の値を使う。値が足りない場合は接続元アドレスを使う。
+        """
+        headers = Headers(scope=scope)
+        api_key = headers.get(self.api_key_header)
+        if api_key:
+            key_hash = self._hash_api_key(api_key)
+            if key_hash in self.api_key_hashes:
+                return "key:" + key_hash
+        if self.trusted_proxy_hops > 0:
+            forwarded_for = [hop.strip() for hop in ",".join(headers.getlist("x-forwarded-for")).split(",") if hop.strip()]
+            if len(forwarded_for) >= self.trusted_proxy_hops:
+                return "ip:" + forwarded_for[-self.trusted_proxy_hops]
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    async def check(self, scope: Scope) -> None:
+        """トークンが足りなければ RateLimitExceededException を送出する。"""
+        cost = self.cost_for(scope.get("method", ""), scope.get("path", ""))
+        if cost <= 0:
+            return
+        key = self.client_key(scope)
+        allowed, wait_seconds = await self.backend.consume(key, cost, self.capacity, self.refill_per_second)
+        if allowed:
+            self.allowed_total += 1
+            return
+        self.rejected_total += 1
+        if cost > self.capacity or not math.isfinite(wait_seconds):
+            detail = f"cost={cost:g} can never be satisfied (capacity={self.capacity:g}, refill_per_second={self.refill_per_second:g})"
+            retry_after = None
+        else:
+            detail = f"cost={cost:g}, capacity={self.capacity:g}, refill_per_second={self.refill_per_second:g}"
+            retry_after = int(max(1, math.ceil(wait_seconds)))
+        raise RateLimitExceededException(detail=detail, retry_after_seconds=retry_after)
+
+    async def wait_for_tokens(self, key: str, cost: float) -> None:
+        """
+        cost 分のトークンが貯まるまで待ってから消費する（一括処理の項目用）。
+        容量を超えるなど満たせないコストの場合は RateLimitExceededException を送出する。
+        """
+        while True:
+            allowed, wait_seconds = await self.backend.consume(key, cost, self.capacity, self.refill_per_second)
+            if allowed:
+                self.allowed_total += 1
+                return
+            if cost > self.capacity or not math.isfinite(wait_seconds):
+                self.rejected_total += 1
+                raise RateLimitExceededException(
+                    detail=f"cost={cost:g} can never be satisfied (capacity={self.capacity:g}, refill_per_second={self.refill_per_second:g})"
+                )
+            await asyncio.sleep(wait_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "refill_per_second": self.refill_per_second,
+            "route_costs": self.route_costs,
+            "allowed_total": self.allowed_total,
+            "rejected_total": self.rejected_total,
+            **self.backend.stats(),
+        }
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp, limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = limiter or get_rate_limiter()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.limiter.check(scope)
+        except RateLimitExceededException as exc:
+            logger.warning(
+                f"クライアントのレート制限を超過しました: {scope.get('method')} {scope.get('path')}",
+                extra={"error_code": exc.error_code.value, "error_detail": exc.detail,
+                       "retry_after_seconds": exc.retry_after_seconds},
+            )
+            await app_exception_response(exc)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# プロセス内で共有するリミッター
+_rate_limiter_instance: Optional[RateLimiter] = None
+
+def get_rate_limiter() -> RateLimiter:
+    global _rate_limiter_instance
+    if _rate_limiter_instance is None:
+        _rate_limiter_instance = RateLimiter()
+    return _rate_limiter_instance
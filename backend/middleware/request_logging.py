@@ -0,0 +1,77 @@
+# middleware/request_logging.py
+"""
+リクエスト/レスポンスの詳細ログを出力するASGIミドルウェア。
+
+BaseHTTPMiddleware (@app.middleware("http")) は応答本文を内部のキューとタスク経由で
+中継するため、SSE のようなストリーミング応答ではチャンクごとにオーバーヘッドが生じます。
+このミドルウェアは send をラップするだけで本文をそのまま通過させ、
+最初のバイトまでの時間 (TTFB)・全体の所要時間・応答バイト数を記録します。
+リクエスト内で Vertex AI を呼び出した場合は、タスクごとのトークン使用量と TTFT を llm_usage として併記します。
+X-Request-ID の応答ヘッダーへの反映は外側の CorrelationIdMiddleware が行います。
+"""
+
+import logging
+import time
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from services.llm_usage import request_usage_scope, summarize_calls
+
+logger = logging.getLogger(__name__)
+
+
+class RequestLoggingMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        client = scope.get("client")
+        method = scope.get("method", "")
+        path = scope.get("path", "")
+        log_payload_request = {
+            "client_host": client[0] if client else "unknown",
+            "client_port": client[1] if client else "unknown",
+            "http_method": method,
+            "http_path": path,
+            "http_query_params": scope.get("query_string", b"").decode("latin-1"),
+            "user_agent": headers.get("user-agent", "unknown"),
+            "gcp_trace_context": headers.get("X-Cloud-Trace-Context"),
+        }
+        logger.info(f"Request received: {method} {path}", extra=log_payload_request)
+
+        start = time.perf_counter()
+        status_code = 500
+        ttfb_seconds = None
+        response_bytes = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, ttfb_seconds, response_bytes
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                ttfb_seconds = time.perf_counter() - start
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        with request_usage_scope() as llm_calls:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                duration_seconds = time.perf_counter() - start
+                logger.info(
+                    f"Request finished: {method} {path} - Status: {status_code}",
+                    extra={
+                        **log_payload_request,
+                        "http_status_code": status_code,
+                        "ttfb_seconds": round(ttfb_seconds, 4) if ttfb_seconds is not None else None,
+                        "duration_seconds": round(duration_seconds, 4),
+                        "response_bytes": response_bytes,
+                        "llm_usage": summarize_calls(llm_calls),
+                    },
+                )
@@ -0,0 +1,53 @@
+# middleware/tracing.py
+"""
+リクエストごとのサーバースパンを作成するASGIミドルウェア。
+受信ヘッダー (traceparent / X-Cloud-Trace-Context) から親コンテキストを取り込み、
+ストリーミング応答の送出完了までをスパンに含めます。
+"""
+
+from opentelemetry import context, propagate
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from tracing import tracer
+
+
+class TracingMiddleware:
+    def __init__(self, app: ASGIApp, excluded_paths: tuple = ("/metrics",)):
+        self.app = app
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope.get("path") in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        parent = propagate.extract(Headers(scope=scope))
+        method = scope.get("method", "")
+        path = scope.get("path", "")
+        token = context.attach(parent)
+        try:
+            with tracer.start_as_current_span(
+                f"{method} {path}",
+                kind=SpanKind.SERVER,
+                attributes={"http.request.method": method, "url.path": path},
+            ) as span:
+
+                async def send_wrapper(message: Message) -> None:
+                    if message["type"] == "http.response.start":
+                        status_code = message["status"]
+                        span.set_attribute("http.response.status_code", status_code)
+                        if status_code >= 500:
+                            span.set_status(Status(StatusCode.ERROR))
+                    await send(message)
+
+                await self.app(scope, receive, send_wrapper)
+
+                # ルーティング後にテンプレートが判明したらスパン名をそろえる（系列のばらつきを防ぐ）
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.route", route)
+        finally:
+            context.detach(token)
@@ -20,6 +20,7 @@ class ErrorCode(str, Enum):
     AUTHENTICATION_REQUIRED = "AUTHENTICATION_REQUIRED"
     FORBIDDEN_ACCESS = "FORBIDDEN_ACCESS"
     RATE_LIMIT_EXCEEDED = "RATE_LIMIT_EXCEEDED"
+    NOT_FOUND = "NOT_FOUND"
 
 
 class ErrorDetail(BaseModel):
@@ -43,6 +44,32 @@ class MusicAnalysisFeatures(BaseModel):
     genre: str = Field(..., description="楽曲のジャンル。例: 'J-POP', 'Rock'")
 
 
+class RenditionInfo(BaseModel):
+    name: Literal["preview", "full"] = Field(..., description="レンディション名。preview は低品質で先に合成され、full は 44.1kHz ステレオの MP3")
+    format: Literal["opus", "mp3"] = Field(..., description="音声形式")
+    content_type: str = Field(..., description="Content-Type", example="audio/ogg")
+    sample_rate: int = Field(..., description="サンプリングレート (Hz)", example=24000)
+    channels: int = Field(..., description="チャンネル数", example=1)
+    bitrate_kbps: int = Field(..., description="ビットレート (kbps)", example=48)
+    status: Literal["ready", "pending"] = Field(
+        ..., description="ready は url から取得可能。pending は合成中または未合成（full は stream_url から合成しながら再生できる）"
+    )
+    url: Optional[HttpUrl] = Field(None, description="公開URL（status が ready の場合のみ）")
+
+
+class StemInfo(BaseModel):
+    index: int = Field(..., description="score-part の順番（0始まり）")
+    part_id: Optional[str] = Field(None, description="MusicXML の score-part の id", example="P1")
+    name: str = Field(..., description="パート名", example="Bass")
+    content_type: str = Field(..., description="Content-Type", example="audio/mpeg")
+    status: Literal["ready", "pending"] = Field(
+        ..., description="ready は url から取得可能。pending は full レンディションとともに合成中（完了は status_url で確認する）"
+    )
+    url: Optional[HttpUrl] = Field(
+        None, description="公開URL（保存先は固定のため pending でも返し、合成の完了後に取得できる）。全ステムは同じ長さで、足し合わせると full と同じミックスになる"
+    )
+
+
 class ProcessResponse(BaseModel):
     humming_theme: str = Field(..., description="口ずさみ音声から解析されたトラックの雰囲気/テーマ", example="明るくエネルギッシュなJ-POP")
     analysis: Optional[MusicAnalysisFeatures] = Field(None, description="MusicXMLから解析された音楽的特徴")
@@ -51,8 +78,67 @@ class ProcessResponse(BaseModel):
         None, description="アップロードされたオリジナル音声ファイルの公開URL"
     )
     generated_mp3_url: Optional[HttpUrl] = Field(
-        None, description="生成されたMP3ファイルの公開URL"
+        None, description="生成されたMP3ファイル（full レンディション）の公開URL。応答時点で合成済みの場合のみ"
+    )
+    track_id: Optional[str] = Field(None, description="生成されたトラックのID")
+    stream_url: Optional[str] = Field(
+        None, description="合成しながら再生できるMP3ストリームのパス。合成済みの場合は保存済みファイルへリダイレクトされる",
+        example="/api/tracks/0b7c9a8e-5f0e-4a51-9d7b-2f3c1e6a4d10/stream",
+    )
+    renditions: List[RenditionInfo] = Field(
+        default_factory=list, description="生成された（または生成中の）レンディション。preview, full の順"
+    )
+    stems: List[StemInfo] = Field(
+        default_factory=list, description="パートごとのステム（要求された場合のみ）。クライアント側で楽器ごとのミュート・ソロに使う"
+    )
+    status_url: Optional[str] = Field(
+        None, description="full レンディションとステムの合成状況を返すパス。pending の場合はこれで完了を確認する",
+        example="/api/tracks/0b7c9a8e-5f0e-4a51-9d7b-2f3c1e6a4d10",
     )
+    workflow_run_id: Optional[str] = Field(
+        None, description="ワークフローの実行ID。POST /api/process/{workflow_run_id}/resume で同じ結果を再取得できる（チェックポイントが有効な場合）"
+    )
+
+
+class TrackStatusResponse(BaseModel):
+    """GET /api/tracks/{track_id} の応答。full の合成が終わるとステムもすべて保存済みになる。"""
+    track_id: str = Field(..., description="トラックのID")
+    generated_mp3_url: Optional[HttpUrl] = Field(None, description="full レンディションの公開URL（合成済みの場合のみ）")
+    renditions: List[RenditionInfo] = Field(default_factory=list, description="full レンディションの状況")
+    stems: List[StemInfo] = Field(
+        default_factory=list, description="保存済みのステム。full が ready の時点で、要求されたステムはすべて含まれる"
+    )
+
+
+class BatchItemResult(BaseModel):
+    """/api/process/batch の NDJSON 応答の1行（1件分の結果）。完了した順に送られる。"""
+    type: Literal["item"] = "item"
+    index: int = Field(..., description="リクエスト内での順番（files の後に gcs_uris が続く）")
+    source: str = Field(..., description="ファイル名または GCS URI")
+    status: Literal["succeeded", "failed"]
+    result: Optional[ProcessResponse] = Field(None, description="/api/process と同じ形式の結果（status が succeeded の場合のみ）")
+    error: Optional[ErrorDetail] = Field(None, description="エラー（status が failed の場合のみ）")
+    workflow_run_id: Optional[str] = Field(
+        None, description="失敗した項目を POST /api/process/{workflow_run_id}/resume で再開するための実行ID（再開できる場合のみ）"
+    )
+
+
+class BatchProgress(BaseModel):
+    """/api/process/batch の NDJSON 応答の1行（オフラインモードの進捗）。"""
+    type: Literal["progress"] = "progress"
+    stage: str = Field(..., description="実行中の段階", example="humming_analysis")
+    items: int = Field(..., description="その段階で処理中の件数")
+    elapsed_seconds: float = Field(..., description="バッチの処理開始からの経過秒数")
+
+
+class BatchSummary(BaseModel):
+    """/api/process/batch の NDJSON 応答の最終行。"""
+    type: Literal["summary"] = "summary"
+    mode: Literal["online", "offline"]
+    total: int
+    succeeded: int
+    failed: int
+    duration_seconds: float
 
 
 class ChatMessage(BaseModel):
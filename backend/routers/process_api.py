@@ -1,14 +1,37 @@
 # routers/process_api.py
 
+import asyncio
+import io
 import uuid
 import logging
 import os
-from fastapi import APIRouter, UploadFile, File, Depends
-from typing import Annotated, Optional
+import re
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from fastapi import APIRouter, UploadFile, File, Form, Depends, Request
+from fastapi.responses import StreamingResponse
+from typing import TYPE_CHECKING, Annotated, Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
-from models import ProcessResponse
+from models import (
+    BatchItemResult,
+    BatchProgress,
+    BatchSummary,
+    ErrorDetail,
+    MusicAnalysisFeatures,
+    ProcessResponse,
+    RenditionInfo,
+    StemInfo,
+)
 from config import settings
+from metrics import observe_stage, record_error, stage_timer
+from middleware.admission_control import get_admission_controller
+from middleware.rate_limit import get_rate_limiter
 from exceptions import (
+    WORKFLOW_RUN_ID_HEADER,
+    AppException,
+    ForbiddenAccessException,
+    InvalidRequestDataException,
     UnsupportedMediaTypeException,
     FileTooLargeException,
     InternalServerErrorException,
@@ -16,10 +39,26 @@ from exceptions import (
     AnalysisFailedException, # Keep for direct raise if workflow contract violated
     GenerationFailedException # Keep for direct raise if workflow contract violated
 )
-from services.audio_analysis_service import run_audio_analysis_workflow, AudioAnalysisWorkflowState
 from services.gcs_service import GCSService, get_gcs_service
 from services.audio_conversion_service import AudioConversionService, AudioConversionError
 from services.audio_synthesis_service import AudioSynthesisService, get_audio_synthesis_service
+from services.renditions import (
+    FULL_RENDITION,
+    PREVIEW_FORMATS,
+    SYNTHESIS_MODES,
+    generated_musicxml_blob_name,
+    parse_rendition_names,
+    preview_rendition,
+    stem_rendition,
+)
+from services.job_queue import get_job_queue
+from services.jobs import JOB_KIND_CONVERT, convert_job_payload, run_convert_job, run_job
+from services.track_publishing import TrackPublishOptions, publish_full, publish_preview, store_generated_musicxml
+from routers.tracks_api import rendition_info, track_status_path, track_stream_path
+
+if TYPE_CHECKING:
+    from services.audio_analysis_service import AudioAnalysisWorkflowState
+    from services.job_queue import JobQueue
 
 logger = logging.getLogger(__name__)
 
@@ -38,167 +77,635 @@ SUPPORTED_AUDIO_MIME_TYPES = [
     "audio/webm",  # WebM
 ]
 
+
+def _parse_process_options(
+    renditions: Optional[str], preview_format: Optional[str], stems: Optional[bool], synthesis_mode: Optional[str] = None,
+) -> TrackPublishOptions:
+    if synthesis_mode is not None and synthesis_mode not in SYNTHESIS_MODES:
+        raise InvalidRequestDataException(
+            message=f"不正な合成方法です: {synthesis_mode}。指定できる値: {', '.join(SYNTHESIS_MODES)}"
+        )
+    rendition_names = parse_rendition_names(renditions, synthesis_mode)
+    if preview_format is not None and preview_format not in PREVIEW_FORMATS:
+        raise InvalidRequestDataException(
+            message=f"不正なプレビュー形式です: {preview_format}。指定できる値: {', '.join(PREVIEW_FORMATS)}"
+        )
+    with_stems = settings.PROCESS_STEMS_ENABLED if stems is None else stems
+    if with_stems and "full" not in rendition_names:
+        raise InvalidRequestDataException(message="ステムを保存するには full レンディションを指定してください。")
+    return TrackPublishOptions(
+        rendition_names=rendition_names, preview_format=preview_format, with_stems=with_stems, synthesis_mode=synthesis_mode,
+    )
+
+
+def _validate_upload(file: UploadFile) -> None:
+    if file.content_type not in SUPPORTED_AUDIO_MIME_TYPES:
+        raise UnsupportedMediaTypeException(f"サポートされていないファイルタイプです: {file.content_type}。サポートされているタイプ: {', '.join(SUPPORTED_AUDIO_MIME_TYPES)}")
+
+    actual_file_size = file.size
+    if actual_file_size is None: # Should ideally not happen with UploadFile
+        logger.warning("UploadFile.size is None, which is unexpected.")
+        raise InternalServerErrorException(message="ファイルサイズを決定できませんでした。")
+
+    max_size_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    if actual_file_size > max_size_bytes:
+        raise FileTooLargeException(f"ファイルサイズが{settings.MAX_FILE_SIZE_MB}MBを超えています。")
+
+
+# Determine file extension based on MIME type
+FILE_EXTENSIONS_BY_CONTENT_TYPE = {
+    "audio/mpeg": ".mp3",
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/mp4": ".m4a",
+    "audio/x-m4a": ".m4a",
+    "audio/aac": ".aac",
+    "audio/webm": ".webm",
+}
+# gcs_uris で指定された音声の形式は拡張子から判断する
+CONTENT_TYPES_BY_FILE_EXTENSION = {
+    ".mp3": "audio/mpeg",
+    ".wav": "audio/wav",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+    ".webm": "audio/webm",
+}
+
+
+def _file_extension_for_content_type(content_type: Optional[str]) -> str:
+    extension = FILE_EXTENSIONS_BY_CONTENT_TYPE.get(content_type)
+    if extension is None:
+        # This case should ideally be caught by the SUPPORTED_AUDIO_MIME_TYPES check,
+        # but as a fallback, use a generic extension.
+        logger.warning(f"予期しないコンテントタイプ '{content_type}' のための拡張子を決定できません。'.dat' を使用します。")
+        return ".dat"
+    return extension
+
+
+async def _store_original_audio(file_id: str, file: UploadFile, gcs_service: GCSService, job_queue: Optional["JobQueue"]) -> str:
+    """アップロードされた音声を（必要ならWAVに変換して）original/ に保存し、GCS URI を返す。"""
+    original_file_extension = _file_extension_for_content_type(file.content_type)
+
+    # 音声形式変換（WebM/AACをWAVに変換）
+    processed_file_obj = file
+    processed_content_type = file.content_type
+    processed_extension = original_file_extension
+
+    if AudioConversionService.needs_conversion(file.content_type) and job_queue is not None:
+        logger.info(f"音声変換をワーカーに依頼します: {file.content_type}")
+        incoming_file_uri = await gcs_service.upload_file_obj_to_gcs(
+            file_obj=file, bucket_name=settings.GCS_UPLOAD_BUCKET,
+            destination_blob_name=f"incoming/{file_id}{original_file_extension}", content_type=file.content_type
+        )
+        processed_extension = ".wav"
+        conversion = await run_job(job_queue, JOB_KIND_CONVERT, convert_job_payload(
+            incoming_file_uri,
+            AudioConversionService.get_source_format_from_mime_type(file.content_type),
+            f"original/{file_id}{processed_extension}",
+        ))
+        logger.info(f"音声変換完了: {file.content_type} -> audio/wav")
+        return conversion["uri"]
+    elif AudioConversionService.needs_conversion(file.content_type):
+        try:
+            logger.info(f"音声変換が必要です: {file.content_type}")
+
+            # ファイルデータを読み取り
+            file_data = await file.read()
+
+            # 音声変換実行
+            source_format = AudioConversionService.get_source_format_from_mime_type(file.content_type)
+            with stage_timer("audio_conversion"):
+                wav_data = AudioConversionService.convert_to_wav(file_data, source_format)
+
+            # 変換されたWAVデータで新しいUploadFileオブジェクトを作成
+            wav_io = io.BytesIO(wav_data)
+            processed_file_obj = UploadFile(
+                file=wav_io,
+                filename=f"{file_id}.wav",
+                headers={"content-type": "audio/wav"}
+            )
+            processed_content_type = "audio/wav"
+            processed_extension = ".wav"
+
+            logger.info(f"音声変換完了: {file.content_type} -> {processed_content_type}")
+
+        except AudioConversionError as e:
+            logger.error(f"音声変換エラー: {e}")
+            raise AudioConversionException(f"音声ファイルの変換に失敗しました: {str(e)}")
+        except Exception as e:
+            logger.error(f"予期しない音声変換エラー: {e}")
+            raise AudioConversionException(f"音声変換中にエラーが発生しました: {str(e)}")
+
+    # 変換後のファイルをGCSにアップロード
+    # GCSService is expected to raise GCSUploadErrorException on failure.
+    return await gcs_service.upload_file_obj_to_gcs(
+        file_obj=processed_file_obj, bucket_name=settings.GCS_UPLOAD_BUCKET,
+        destination_blob_name=f"original/{file_id}{processed_extension}", content_type=processed_content_type
+    )
+
+
+def _workflow_outputs(workflow_final_state: "AudioAnalysisWorkflowState") -> Tuple[str, str, Optional[MusicAnalysisFeatures]]:
+    # ワークフローから「トラックの雰囲気/テーマ」、MusicXMLデータ、音楽的特徴を取得します。
+    humming_theme = workflow_final_state.get("humming_theme")
+    generated_musicxml_data = workflow_final_state.get("generated_musicxml_data")
+    music_analysis_features = workflow_final_state.get("music_analysis_features")
+
+    # 必須データの存在確認
+    if not humming_theme:
+        logger.error("AIワークフローからトラックの雰囲気/テーマが欠落しています。")
+        raise AnalysisFailedException(detail="AIワークフローからトラックの雰囲気/テーマが欠落しています。")
+
+    if not generated_musicxml_data:
+        logger.error("AIワークフローから生成されたMusicXMLデータが欠落しています。")
+        raise GenerationFailedException(detail="AIワークフローから生成されたMusicXMLデータが欠落しています。")
+
+    # music_analysis_features はオプションなので、存在しなくてもエラーにはしない
+    if not music_analysis_features:
+        logger.warning("MusicXMLの音楽的特徴は解析されませんでした。レスポンスには含まれません。")
+    return humming_theme, generated_musicxml_data, music_analysis_features
+
+
+def _process_response(
+    file_id: str,
+    gcs_original_file_uri: str,
+    humming_theme: str,
+    music_analysis_features: Optional[MusicAnalysisFeatures],
+    options: TrackPublishOptions,
+    preview: Optional[Dict[str, Any]],
+    full: Optional[Dict[str, Any]],
+    gcs_service: GCSService,
+    workflow_run_id: Optional[str] = None,
+) -> ProcessResponse:
+    """保存・合成の各段階の結果 (services.track_publishing) から応答を組み立てる。"""
+    renditions: List[RenditionInfo] = []
+    stem_infos: List[StemInfo] = []
+    public_mp3_url = None
+    if preview is not None:
+        renditions.append(rendition_info(
+            preview_rendition(options.preview_format), "ready",
+            gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, preview["blob_name"]),
+        ))
+    if full is not None:
+        if full["status"] == "ready":
+            public_mp3_url = gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, full["blob_name"])
+        renditions.append(rendition_info(FULL_RENDITION, full["status"], public_mp3_url))
+        stem_spec = stem_rendition(FULL_RENDITION)
+        stem_infos.extend(
+            StemInfo(
+                index=stem["index"], part_id=stem["part_id"], name=stem["name"], content_type=stem_spec.content_type,
+                status=full["status"],
+                url=gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, stem["blob_name"]) if stem["blob_name"] else None,
+            )
+            for stem in full["stems"]
+        )
+
+    # 各ファイルの公開URLを取得
+    public_original_audio_url = gcs_service.get_gcs_public_url(*gcs_service.parse_gcs_url(gcs_original_file_uri))
+    public_musicxml_url = gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, generated_musicxml_blob_name(file_id))
+
+    return ProcessResponse(
+        humming_theme=humming_theme,
+        analysis=music_analysis_features, # 解析結果（存在しない場合はNone）
+        backing_track_url=public_musicxml_url,
+        original_file_url=public_original_audio_url,
+        generated_mp3_url=public_mp3_url,
+        track_id=file_id,
+        stream_url=track_stream_path(file_id),
+        status_url=track_status_path(file_id),
+        renditions=renditions,
+        stems=stem_infos,
+        workflow_run_id=workflow_run_id,
+    )
+
+
+def _workflow_response(workflow_final_state: "AudioAnalysisWorkflowState", gcs_service: GCSService) -> ProcessResponse:
+    """合成・保存まで完了したワークフローの状態から応答を組み立てる。"""
+    humming_theme, _, music_analysis_features = _workflow_outputs(workflow_final_state)
+    if not workflow_final_state.get("publish_options"):
+        raise InvalidRequestDataException(message="このワークフローはトラックの合成・保存を含まないため、結果を返せません。")
+    return _process_response(
+        workflow_final_state["file_id"], workflow_final_state["gcs_file_path"], humming_theme, music_analysis_features,
+        TrackPublishOptions(**workflow_final_state["publish_options"]),
+        workflow_final_state.get("preview_rendition"), workflow_final_state.get("full_rendition"),
+        gcs_service, workflow_run_id=workflow_final_state["workflow_run_id"],
+    )
+
+
+async def _publish_track(
+    file_id: str,
+    gcs_original_file_uri: str,
+    humming_theme: str,
+    generated_musicxml_data: str,
+    music_analysis_features: Optional[MusicAnalysisFeatures],
+    options: TrackPublishOptions,
+    gcs_service: GCSService,
+    audio_synthesis_service: AudioSynthesisService,
+    job_queue: Optional["JobQueue"],
+) -> ProcessResponse:
+    """
+    生成されたMusicXMLを保存し、要求されたレンディションを合成（または合成を予約）して応答を組み立てる。
+    ワークフローを通らないオフラインの一括処理用で、ワークフローの合成・保存のノードと同じ段階を順に実行する。
+    """
+    gcs_musicxml_uri = await store_generated_musicxml(file_id, generated_musicxml_data, gcs_service)
+    preview = full = None
+    if "preview" in options.rendition_names:
+        # 軽いプレビューを先に合成し、すぐに試聴できるようにする
+        preview = await publish_preview(
+            file_id, gcs_musicxml_uri, generated_musicxml_data, options.preview_format, gcs_service, audio_synthesis_service, job_queue,
+        )
+    if "full" in options.rendition_names:
+        full = await publish_full(
+            file_id, gcs_musicxml_uri, generated_musicxml_data, options.with_stems, gcs_service, audio_synthesis_service, job_queue,
+            options.synthesis_mode,
+        )
+    return _process_response(
+        file_id, gcs_original_file_uri, humming_theme, music_analysis_features, options, preview, full, gcs_service,
+    )
+
+
 @router.post("/process", response_model=ProcessResponse)
 async def process_audio_file(
     file: Annotated[UploadFile, File(description="処理する音声ファイル (MP3, WAV, M4A, AAC, WebM)。")],
+    renditions: Annotated[Optional[str], Form(description="生成するレンディション（カンマ区切り: preview, full）。未指定の場合はサーバーの設定値（未設定なら inline では full のみ、それ以外は preview,full）")] = None,
+    preview_format: Annotated[Optional[str], Form(description=f"プレビューの形式 ({', '.join(PREVIEW_FORMATS)})。未指定の場合はサーバーの設定値")] = None,
+    stems: Annotated[Optional[bool], Form(description="full レンディションと同時にパートごとのステムを保存するか。未指定の場合はサーバーの設定値")] = None,
+    synthesis_mode: Annotated[Optional[str], Form(description=f"full レンディションの合成方法 ({', '.join(SYNTHESIS_MODES)})。background / deferred では応答時点の generated_mp3_url は空。未指定の場合はサーバーの設定値")] = None,
     gcs_service: GCSService = Depends(get_gcs_service),
-    audio_synthesis_service: AudioSynthesisService = Depends(get_audio_synthesis_service)
 ):
+    """
+    口ずさみ音声を解析してバッキングトラックを生成し、MusicXML の保存と要求されたレンディションの合成まで行う。
+    合成・保存などで失敗した場合、エラー応答の X-Workflow-Run-Id ヘッダーの値で POST /api/process/{workflow_run_id}/resume から再開できる。
+    """
     # local_temp_file_path was unused and has been removed.
     try:
+        validation_start = time.perf_counter()
         logger.info(f"ファイルアップロードリクエスト受信: {file.filename}, Content-Type: {file.content_type}")
-        if file.content_type not in SUPPORTED_AUDIO_MIME_TYPES:
-            raise UnsupportedMediaTypeException(f"サポートされていないファイルタイプです: {file.content_type}。サポートされているタイプ: {', '.join(SUPPORTED_AUDIO_MIME_TYPES)}")
-
-        actual_file_size = file.size
-        if actual_file_size is None: # Should ideally not happen with UploadFile
-            logger.warning("UploadFile.size is None, which is unexpected.")
-            raise InternalServerErrorException(message="ファイルサイズを決定できませんでした。")
-
-        max_size_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
-        if actual_file_size > max_size_bytes:
-            raise FileTooLargeException(f"ファイルサイズが{settings.MAX_FILE_SIZE_MB}MBを超えています。")
+        _validate_upload(file)
+        options = _parse_process_options(renditions, preview_format, stems, synthesis_mode)
 
+        observe_stage("upload_validation", time.perf_counter() - validation_start)
         logger.info(f"ファイル '{file.filename}' は初期検証を通過しました。")
 
         file_id = str(uuid.uuid4())
         logger.info(f"処理用の一意なIDを生成しました: {file_id}")
 
-        # Determine file extension based on MIME type
-        content_type = file.content_type
-        if content_type == "audio/mpeg":
-            original_file_extension = ".mp3"
-        elif content_type in ["audio/wav", "audio/x-wav"]:
-            original_file_extension = ".wav"
-        elif content_type in ["audio/mp4", "audio/x-m4a"]:
-            original_file_extension = ".m4a"
-        elif content_type == "audio/aac":
-            original_file_extension = ".aac"
-        elif content_type == "audio/webm":
-            original_file_extension = ".webm"
-        else:
-            # This case should ideally be caught by the SUPPORTED_AUDIO_MIME_TYPES check,
-            # but as a fallback, use a generic extension.
-            logger.warning(f"予期しないコンテントタイプ '{content_type}' のための拡張子を決定できません。'.dat' を使用します。")
-            original_file_extension = ".dat"
-
-        # 音声形式変換（WebM/AACをWAVに変換）
-        processed_file_obj = file
-        processed_content_type = file.content_type
-        processed_extension = original_file_extension
-
-        if AudioConversionService.needs_conversion(file.content_type):
-            try:
-                logger.info(f"音声変換が必要です: {file.content_type}")
+        # JOB_QUEUE_BACKEND が sqlite / redis の場合、変換・合成はワーカーで行い、結果は GCS 経由で受け取る
+        job_queue = get_job_queue()
+        gcs_original_file_uri = await _store_original_audio(file_id, file, gcs_service, job_queue)
 
-                # ファイルデータを読み取り
-                file_data = await file.read()
+        # audio_analysis_service.run_audio_analysis_workflow は AnalysisFailedException または
+        # GenerationFailedException を失敗時に送出することが期待されます。
+        # MusicXMLの保存とレンディションの合成もワークフローの段階として実行し、失敗した段階から再開できるようにする。
+        # LangGraph / Vertex AI SDK を含むため、初回のリクエスト時に読み込む（コールドスタート短縮）
+        from services.audio_analysis_service import run_audio_analysis_workflow
+        workflow_final_state: "AudioAnalysisWorkflowState" = await run_audio_analysis_workflow(
+            gcs_file_path=gcs_original_file_uri, file_id=file_id, publish_options=options,
+        )
+        response = _workflow_response(workflow_final_state, gcs_service)
+        logger.info(f"ファイル {file_id} の処理に成功しました。レスポンスを返します。")
+        return response
+    finally:
+        # Ensure file is closed, even if an error occurs
+        logger.info(f"ファイルのリクエスト処理を終了: {file.filename if file else 'N/A'}")
+        if file and hasattr(file, 'close') and callable(file.close):
+             try:
+                 await file.close() # Important for UploadFile
+                 logger.debug(f"UploadFileをクローズしました: {file.filename}")
+             except Exception as e_close:
+                 logger.warning(f"UploadFile {file.filename} のクローズ中にエラー: {e_close}", exc_info=True)
 
-                # 音声変換実行
-                source_format = AudioConversionService.get_source_format_from_mime_type(file.content_type)
-                wav_data = AudioConversionService.convert_to_wav(file_data, source_format)
 
-                # 変換されたWAVデータで新しいUploadFileオブジェクトを作成
-                import io
-                from fastapi import UploadFile
+@router.post("/process/{workflow_run_id}/resume", response_model=ProcessResponse)
+async def resume_process(workflow_run_id: str, gcs_service: GCSService = Depends(get_gcs_service)):
+    """
+    失敗した /api/process のワークフローを、チェックポイントから失敗した段階以降だけ再実行する。
+    完了済みの解析・生成・合成はやり直さない。完了済みのワークフローを指定した場合は保存済みの結果を返す。
+    """
+    from services.audio_analysis_service import resume_audio_analysis_workflow
+    logger.info(f"ワークフローの再開リクエスト受信: {workflow_run_id}")
+    workflow_final_state: "AudioAnalysisWorkflowState" = await resume_audio_analysis_workflow(workflow_run_id)
+    response = _workflow_response(workflow_final_state, gcs_service)
+    logger.info(f"ワークフロー {workflow_run_id} の再開に成功しました。レスポンスを返します。")
+    return response
 
-                wav_io = io.BytesIO(wav_data)
-                processed_file_obj = UploadFile(
-                    file=wav_io,
-                    filename=f"{file_id}.wav",
-                    headers={"content-type": "audio/wav"}
-                )
-                processed_content_type = "audio/wav"
-                processed_extension = ".wav"
 
-                logger.info(f"音声変換完了: {file.content_type} -> {processed_content_type}")
+# --- 一括処理 (/api/process/batch) ---
 
-            except AudioConversionError as e:
-                logger.error(f"音声変換エラー: {e}")
-                raise AudioConversionException(f"音声ファイルの変換に失敗しました: {str(e)}")
-            except Exception as e:
-                logger.error(f"予期しない音声変換エラー: {e}")
-                raise AudioConversionException(f"音声変換中にエラーが発生しました: {str(e)}")
+BATCH_MODES = ("online", "offline")
 
-        # 変換後のファイルをGCSにアップロード
-        gcs_blob_name_original = f"original/{file_id}{processed_extension}"
 
-        # GCSService is expected to raise GCSUploadErrorException on failure.
-        gcs_original_file_uri = await gcs_service.upload_file_obj_to_gcs(
-            file_obj=processed_file_obj, bucket_name=settings.GCS_UPLOAD_BUCKET,
-            destination_blob_name=gcs_blob_name_original, content_type=processed_content_type
-        )
-        # If gcs_original_file_uri is None here, it means upload_file_obj_to_gcs contract is violated (should return str or raise)
-        # This should not happen if the service is implemented correctly.
-        # For robustness, a check can be added, but it implies a bug in the service.
+@dataclass
+class _BatchItem:
+    index: int
+    source: str # ファイル名または GCS URI
+    content_type: Optional[str]
+    file_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    received_uri: Optional[str] = None # 受信した音声の GCS URI（変換が必要な場合は変換前）
+    error: Optional[AppException] = None
 
-        # audio_analysis_service.run_audio_analysis_workflow is expected to raise
-        # audio_analysis_service.run_audio_analysis_workflow は AnalysisFailedException または
-        # GenerationFailedException を失敗時に送出することが期待されます。
-        workflow_final_state: AudioAnalysisWorkflowState = await run_audio_analysis_workflow(
-            gcs_file_path=gcs_original_file_uri
+
+@dataclass
+class _BatchThrottle:
+    """
+    一括処理の各項目に、/api/process 1回分のレート制限のコストとアドミッション制御の process プールのスロットを課す。
+    リクエスト自体はミドルウェアでは1件分として扱われないため、項目ごとにここで制限する。
+    """
+    client_key: str
+
+    async def charge(self) -> None:
+        """クライアントのトークンバケットから1項目分のコストを消費する。足りない場合は貯まるまで待つ。"""
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        limiter = get_rate_limiter()
+        cost = limiter.cost_for("POST", "/api/process")
+        if cost > 0:
+            await limiter.wait_for_tokens(self.client_key, cost)
+
+    def slot(self) -> AsyncContextManager[None]:
+        if not settings.ADMISSION_CONTROL_ENABLED:
+            return nullcontext()
+        return get_admission_controller().pools["process"].batch_slot()
+
+
+def _split_gcs_uris(gcs_uris: Optional[str]) -> List[str]:
+    if not gcs_uris:
+        return []
+    return [uri.strip() for uri in re.split(r"[,\n]", gcs_uris) if uri.strip()]
+
+
+def _content_type_for_gcs_uri(gcs_uri: str, gcs_service: GCSService) -> str:
+    """許可されたバケット内の対応形式の音声かを確認し、拡張子から判断した Content-Type を返す。"""
+    try:
+        bucket_name, blob_name = gcs_service.parse_gcs_url(gcs_uri)
+    except ValueError:
+        raise InvalidRequestDataException(message=f"不正なGCS URIです: {gcs_uri}")
+    if bucket_name not in {settings.GCS_UPLOAD_BUCKET, *settings.BATCH_ALLOWED_GCS_BUCKETS}:
+        raise ForbiddenAccessException(message=f"バケット '{bucket_name}' の音声は読み込めません。")
+    content_type = CONTENT_TYPES_BY_FILE_EXTENSION.get(os.path.splitext(blob_name.lower())[1])
+    if content_type is None:
+        raise UnsupportedMediaTypeException(
+            f"サポートされていないファイル形式です: {gcs_uri}。サポートされている拡張子: {', '.join(CONTENT_TYPES_BY_FILE_EXTENSION)}"
         )
+    return content_type
+
 
-        # ワークフローから「トラックの雰囲気/テーマ」、MusicXMLデータ、音楽的特徴を取得します。
-        humming_theme = workflow_final_state.get("humming_theme")
-        generated_musicxml_data = workflow_final_state.get("generated_musicxml_data")
-        music_analysis_features = workflow_final_state.get("music_analysis_features")
-
-        # 必須データの存在確認
-        if not humming_theme:
-            logger.error("AIワークフローからトラックの雰囲気/テーマが欠落しています。")
-            raise AnalysisFailedException(detail="AIワークフローからトラックの雰囲気/テーマが欠落しています。")
-
-        if not generated_musicxml_data:
-            logger.error("AIワークフローから生成されたMusicXMLデータが欠落しています。")
-            raise GenerationFailedException(detail="AIワークフローから生成されたMusicXMLデータが欠落しています。")
-
-        # music_analysis_features はオプションなので、存在しなくてもエラーにはしない
-        if not music_analysis_features:
-            logger.warning("MusicXMLの音楽的特徴は解析されませんでした。レスポンスには含まれません。")
-
-        # MusicXMLデータをGCSにアップロード
-        gcs_blob_name_musicxml = f"generated_musicxml/{file_id}.musicxml"
-        await gcs_service.upload_data_to_gcs(
-            data=generated_musicxml_data,
-            bucket_name=settings.GCS_TRACK_BUCKET,
-            destination_blob_name=gcs_blob_name_musicxml,
-            content_type="application/vnd.recordare.musicxml+xml"
+async def _receive_batch_upload(item: _BatchItem, file: UploadFile, gcs_service: GCSService) -> None:
+    """アップロードされた音声をそのまま GCS に保存する（変換は項目の処理時に行う）。"""
+    prefix = "incoming" if AudioConversionService.needs_conversion(file.content_type) else "original"
+    try:
+        item.received_uri = await gcs_service.upload_file_obj_to_gcs(
+            file_obj=file, bucket_name=settings.GCS_UPLOAD_BUCKET,
+            destination_blob_name=f"{prefix}/{item.file_id}{_file_extension_for_content_type(file.content_type)}",
         )
+    except AppException as e:
+        item.error = e
+
+
+async def _original_audio_for_batch_item(item: _BatchItem, job_queue: Optional["JobQueue"]) -> str:
+    """WAV 以外は original/ に WAV として変換し、解析に使う音声の GCS URI を返す。"""
+    if not AudioConversionService.needs_conversion(item.content_type):
+        return item.received_uri
+    payload = convert_job_payload(
+        item.received_uri,
+        AudioConversionService.get_source_format_from_mime_type(item.content_type),
+        f"original/{item.file_id}.wav",
+    )
+    conversion = await run_job(job_queue, JOB_KIND_CONVERT, payload) if job_queue is not None else await run_convert_job(payload)
+    return conversion["uri"]
+
+
+def _as_app_exception(item: _BatchItem, error: Exception) -> AppException:
+    if isinstance(error, AppException):
+        return error
+    logger.error(f"バッチの項目 {item.index} ({item.source}) の処理中に予期せぬエラーが発生しました: {error}", exc_info=error)
+    return InternalServerErrorException(message="項目の処理中に予期せぬエラーが発生しました。", detail=type(error).__name__)
+
 
-        # MusicXMLからMP3への変換
-        logger.info(f"MusicXMLからMP3への変換を開始します。ファイルID: {file_id}")
-        generated_mp3_data = await audio_synthesis_service.synthesize_musicxml_to_mp3(generated_musicxml_data)
-        logger.info(f"MusicXMLからMP3への変換が完了しました。ファイルID: {file_id}")
-
-        # 生成されたMP3データをGCSにアップロード
-        gcs_blob_name_mp3 = f"generated_mp3/{file_id}.mp3"
-        await gcs_service.upload_data_to_gcs(
-            data=generated_mp3_data,
-            bucket_name=settings.GCS_TRACK_BUCKET,
-            destination_blob_name=gcs_blob_name_mp3,
-            content_type="audio/mpeg"
+def _item_result(item: _BatchItem, result: Optional[ProcessResponse] = None) -> BatchItemResult:
+    if item.error is not None:
+        record_error(item.error.error_code.value)
+        return BatchItemResult(
+            index=item.index, source=item.source, status="failed",
+            error=ErrorDetail(code=item.error.error_code, message=item.error.message, detail=item.error.detail),
+            workflow_run_id=(item.error.headers or {}).get(WORKFLOW_RUN_ID_HEADER),
         )
+    return BatchItemResult(index=item.index, source=item.source, status="succeeded", result=result)
 
-        # 各ファイルの公開URLを取得
-        public_original_audio_url = gcs_service.get_gcs_public_url(settings.GCS_UPLOAD_BUCKET, gcs_blob_name_original)
-        public_musicxml_url = gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, gcs_blob_name_musicxml)
-        public_mp3_url = gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, gcs_blob_name_mp3)
 
-        logger.info(f"ファイル {file_id} の処理に成功しました。レスポンスを返します。")
-        return ProcessResponse(
-            humming_theme=humming_theme,
-            analysis=music_analysis_features, # 解析結果（存在しない場合はNone）
-            backing_track_url=public_musicxml_url,
-            original_file_url=public_original_audio_url,
-            generated_mp3_url=public_mp3_url
+async def _run_bounded(
+    items: List[_BatchItem], concurrency: int, process: Callable[[_BatchItem], Awaitable[BatchItemResult]],
+    throttle: _BatchThrottle, charge: bool = True,
+) -> AsyncIterator[BatchItemResult]:
+    """
+    最大 concurrency 件ずつ process を実行し、完了した順に結果を返す。中断された場合は残りをキャンセルする。
+    各項目は process プールのスロットを確保してから実行する。charge の場合は先にレート制限のコストを払う。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item: _BatchItem) -> BatchItemResult:
+        async with semaphore:
+            try:
+                if charge:
+                    await throttle.charge()
+                async with throttle.slot():
+                    return await process(item)
+            except Exception as e:
+                item.error = _as_app_exception(item, e)
+                return _item_result(item)
+
+    tasks = [asyncio.create_task(run(item)) for item in items]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _online_batch_results(
+    items: List[_BatchItem], concurrency: int, options: TrackPublishOptions, throttle: _BatchThrottle,
+    gcs_service: GCSService, job_queue: Optional["JobQueue"],
+) -> AsyncIterator[BatchItemResult]:
+    """各項目を /api/process と同じワークフローで処理する。クライアント・キャッシュ・ワーカーはすべての項目で共有する。"""
+    from services.audio_analysis_service import run_audio_analysis_workflow
+
+    async def process(item: _BatchItem) -> BatchItemResult:
+        gcs_original_file_uri = await _original_audio_for_batch_item(item, job_queue)
+        workflow_final_state = await run_audio_analysis_workflow(
+            gcs_file_path=gcs_original_file_uri, file_id=item.file_id, publish_options=options,
         )
+        return _item_result(item, _workflow_response(workflow_final_state, gcs_service))
+
+    async for result in _run_bounded(items, concurrency, process, throttle):
+        yield result
+
+
+async def _offline_batch_results(
+    items: List[_BatchItem], concurrency: int, options: TrackPublishOptions, throttle: _BatchThrottle, start: float,
+    gcs_service: GCSService, audio_synthesis_service: AudioSynthesisService, job_queue: Optional["JobQueue"],
+) -> AsyncIterator[Union[BatchItemResult, BatchProgress]]:
+    """
+    解析・生成を Vertex AI のバッチ予測で全件まとめて行い、完了後に各項目の保存・合成を行う。
+    結果が出るまでの間は BATCH_PROGRESS_INTERVAL_SECONDS ごとに進捗行を送る（接続の維持も兼ねる）。
+    """
+    from services.batch_prediction import OfflineItem, get_batch_prediction_client, new_batch_id, run_offline_workflow
+
+    originals: Dict[int, str] = {}
+
+    async def convert(item: _BatchItem) -> BatchItemResult:
+        originals[item.index] = await _original_audio_for_batch_item(item, job_queue)
+        return _item_result(item)
+
+    async for result in _run_bounded(items, concurrency, convert, throttle):
+        if result.status == "failed":
+            yield result
+
+    items = [item for item in items if item.error is None]
+    progress = {"stage": "submit", "items": len(items)}
+    # WAV 以外は変換済みのため、解析に渡す音声はすべて WAV
+    offline_items = [OfflineItem(gcs_uri=originals[item.index], mime_type="audio/wav") for item in items]
+    batch_id = new_batch_id()
+
+    def on_stage(stage: str, count: int) -> None:
+        progress.update(stage=stage, items=count)
+
+    workflow = asyncio.create_task(run_offline_workflow(offline_items, get_batch_prediction_client(), batch_id, on_stage))
+    try:
+        while not workflow.done():
+            await asyncio.wait({workflow}, timeout=settings.BATCH_PROGRESS_INTERVAL_SECONDS)
+            if not workflow.done():
+                yield BatchProgress(elapsed_seconds=round(time.perf_counter() - start, 3), **progress)
     finally:
-        # Ensure file is closed, even if an error occurs
-        logger.info(f"ファイルのリクエスト処理を終了: {file.filename if file else 'N/A'}")
-        if file and hasattr(file, 'close') and callable(file.close):
-             try:
-                 await file.close() # Important for UploadFile
-                 logger.debug(f"UploadFileをクローズしました: {file.filename}")
-             except Exception as e_close:
-                 logger.warning(f"UploadFile {file.filename} のクローズ中にエラー: {e_close}", exc_info=True)
+        workflow.cancel()
+    error = workflow.exception()
+    if error is not None:
+        logger.error(f"バッチ予測による解析・生成中に予期せぬエラーが発生しました ({batch_id}): {error}", exc_info=error)
+        for offline_item in offline_items:
+            offline_item.error = offline_item.error or InternalServerErrorException(
+                message="バッチ予測による解析・生成中に予期せぬエラーが発生しました。", detail=type(error).__name__
+            )
+    logger.info(f"バッチ予測による解析・生成が完了しました: {batch_id}")
+
+    offline_by_index = {item.index: offline_item for item, offline_item in zip(items, offline_items)}
+
+    async def publish(item: _BatchItem) -> BatchItemResult:
+        offline_item = offline_by_index[item.index]
+        if offline_item.error is not None:
+            item.error = offline_item.error
+            return _item_result(item)
+        result = await _publish_track(
+            item.file_id, offline_item.gcs_uri, offline_item.humming_theme, offline_item.generated_musicxml_data,
+            offline_item.music_analysis_features, options, gcs_service, audio_synthesis_service, job_queue,
+        )
+        return _item_result(item, result)
+
+    # レート制限のコストは変換時に払っている
+    async for result in _run_bounded(items, concurrency, publish, throttle, charge=False):
+        yield result
+
+
+async def _batch_response_lines(
+    mode: str, items: List[_BatchItem], concurrency: int, options: TrackPublishOptions, throttle: _BatchThrottle,
+    gcs_service: GCSService, audio_synthesis_service: AudioSynthesisService,
+) -> AsyncIterator[str]:
+    start = time.perf_counter()
+    counts = {"succeeded": 0, "failed": 0}
+    job_queue = get_job_queue()
+
+    # 受け付けなかった項目は先に返す
+    for item in items:
+        if item.error is not None:
+            counts["failed"] += 1
+            yield _item_result(item).model_dump_json(exclude_none=True) + "\n"
+    valid_items = [item for item in items if item.error is None]
+
+    if mode == "offline":
+        results = _offline_batch_results(valid_items, concurrency, options, throttle, start, gcs_service, audio_synthesis_service, job_queue)
+    else:
+        results = _online_batch_results(valid_items, concurrency, options, throttle, gcs_service, job_queue)
+    async for line in results:
+        if isinstance(line, BatchItemResult):
+            counts[line.status] += 1
+        yield line.model_dump_json(exclude_none=True) + "\n"
+
+    duration = time.perf_counter() - start
+    observe_stage(f"process_batch_{mode}", duration)
+    logger.info(f"一括処理が完了しました ({mode}): 成功 {counts['succeeded']} 件, 失敗 {counts['failed']} 件, {duration:.1f}秒")
+    yield BatchSummary(
+        mode=mode, total=len(items), succeeded=counts["succeeded"], failed=counts["failed"], duration_seconds=round(duration, 3),
+    ).model_dump_json() + "\n"
+
+
+@router.post(
+    "/process/batch",
+    response_class=StreamingResponse,
+    responses={200: {
+        "content": {"application/x-ndjson": {}},
+        "description": "1行1件の NDJSON。type が item の行（完了順）と progress の行（offline のみ）の後に、summary の行が1つ続く",
+    }},
+)
+async def process_audio_batch(
+    request: Request,
+    files: Annotated[List[UploadFile], File(description="処理する音声ファイル（複数指定可）。")] = [],
+    gcs_uris: Annotated[Optional[str], Form(description="処理する音声の GCS URI（改行またはカンマ区切り）。許可されたバケットのみ")] = None,
+    renditions: Annotated[Optional[str], Form(description="生成するレンディション（カンマ区切り: preview, full）。未指定の場合はサーバーの設定値（未設定なら inline では full のみ、それ以外は preview,full）")] = None,
+    preview_format: Annotated[Optional[str], Form(description=f"プレビューの形式 ({', '.join(PREVIEW_FORMATS)})。未指定の場合はサーバーの設定値")] = None,
+    stems: Annotated[Optional[bool], Form(description="full レンディションと同時にパートごとのステムを保存するか。未指定の場合はサーバーの設定値")] = None,
+    synthesis_mode: Annotated[Optional[str], Form(description=f"full レンディションの合成方法 ({', '.join(SYNTHESIS_MODES)})。background / deferred では応答時点の generated_mp3_url は空。未指定の場合はサーバーの設定値")] = None,
+    concurrency: Annotated[Optional[int], Form(description="同時に処理する件数。未指定の場合はサーバーの設定値")] = None,
+    mode: Annotated[str, Form(description="online: 1件ずつ Vertex AI を呼び出す。offline: Vertex AI のバッチ予測でまとめて処理する（低コスト・数分〜数時間）")] = "online",
+    gcs_service: GCSService = Depends(get_gcs_service),
+    audio_synthesis_service: AudioSynthesisService = Depends(get_audio_synthesis_service)
+):
+    """
+    複数の口ずさみ音声を1リクエストで処理し、各項目の結果・エラーを NDJSON で完了した順に返す。
+    1件の失敗でバッチ全体は失敗せず、その項目の行に /api/process と同じ形式のエラーが入る。
+    各項目は /api/process 1回分のレート制限のコストを払い、アドミッション制御の process プールのスロットを使って処理する。
+    """
+    options = _parse_process_options(renditions, preview_format, stems, synthesis_mode)
+    if mode not in BATCH_MODES:
+        raise InvalidRequestDataException(message=f"不正なモードです: {mode}。指定できる値: {', '.join(BATCH_MODES)}")
+    uris = _split_gcs_uris(gcs_uris)
+    if not files and not uris:
+        raise InvalidRequestDataException(message="files または gcs_uris を指定してください。")
+    if len(files) + len(uris) > settings.BATCH_MAX_ITEMS:
+        raise InvalidRequestDataException(message=f"1回のリクエストで処理できるのは{settings.BATCH_MAX_ITEMS}件までです。")
+    concurrency = settings.BATCH_DEFAULT_CONCURRENCY if concurrency is None else concurrency
+    if not 1 <= concurrency <= settings.BATCH_MAX_CONCURRENCY:
+        raise InvalidRequestDataException(message=f"concurrency は1から{settings.BATCH_MAX_CONCURRENCY}の範囲で指定してください。")
+
+    items: List[_BatchItem] = []
+    for file in files:
+        item = _BatchItem(index=len(items), source=file.filename or f"file-{len(items)}", content_type=file.content_type)
+        try:
+            _validate_upload(file)
+        except AppException as e:
+            item.error = e
+        items.append(item)
+    for uri in uris:
+        item = _BatchItem(index=len(items), source=uri, content_type=None)
+        try:
+            item.content_type = _content_type_for_gcs_uri(uri, gcs_service)
+            item.received_uri = uri
+        except AppException as e:
+            item.error = e
+        items.append(item)
+    logger.info(f"一括処理リクエスト受信 ({mode}): ファイル {len(files)} 件, GCS URI {len(uris)} 件, 同時処理数 {concurrency}")
+
+    # フォームのファイルはエンドポイントから戻ると閉じられるため、応答のストリーミングを始める前に GCS に保存する
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def receive(item: _BatchItem, file: UploadFile) -> None:
+        async with semaphore:
+            await _receive_batch_upload(item, file, gcs_service)
+
+    with stage_timer("process_batch_receive"):
+        await asyncio.gather(*(receive(item, file) for item, file in zip(items, files) if item.error is None))
+
+    return StreamingResponse(
+        _batch_response_lines(
+            mode, items, concurrency, options, _BatchThrottle(get_rate_limiter().client_key(request.scope)),
+            gcs_service, audio_synthesis_service,
+        ),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,163 @@
+# routers/tracks_api.py
+
+import asyncio
+import logging
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import RedirectResponse, StreamingResponse
+
+from config import settings
+from exceptions import AppException, AudioSynthesisException, NotFoundException
+from models import RenditionInfo, StemInfo, TrackStatusResponse
+from services.audio_synthesis_service import AudioSynthesisService, get_audio_synthesis_service
+from services.gcs_service import GCSService, get_gcs_service
+from services.job_queue import get_job_queue
+from services.jobs import JOB_KIND_RENDER, render_job_dedup_key, render_job_payload, run_job
+from services.renditions import (
+    FULL_RENDITION,
+    RenditionSpec,
+    generated_mp3_blob_name,
+    generated_musicxml_blob_name,
+    list_score_parts,
+    stem_blob_name,
+    stem_rendition,
+)
+from services.track_streaming import get_track_stream_registry
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/api",
+    tags=["Tracks"],
+)
+
+
+def track_stream_path(track_id: str) -> str:
+    return f"{router.prefix}/tracks/{track_id}/stream"
+
+
+def track_status_path(track_id: str) -> str:
+    return f"{router.prefix}/tracks/{track_id}"
+
+
+def rendition_info(spec: RenditionSpec, status: str, url: Optional[str] = None) -> RenditionInfo:
+    return RenditionInfo(
+        name=spec.name,
+        format=spec.format,
+        content_type=spec.content_type,
+        sample_rate=spec.sample_rate,
+        channels=spec.channels,
+        bitrate_kbps=spec.bitrate_kbps,
+        status=status,
+        url=url,
+    )
+
+
+def _parse_track_id(track_id: str) -> str:
+    try:
+        return str(uuid.UUID(track_id))
+    except ValueError:
+        raise NotFoundException(message="指定されたトラックが見つかりません。", detail=f"track_id={track_id}")
+
+
+@router.get("/tracks/{track_id}", response_model=TrackStatusResponse)
+async def get_track_status(
+    track_id: str,
+    gcs_service: GCSService = Depends(get_gcs_service),
+):
+    """
+    full レンディションとステムの合成状況を返す。/api/process が pending で応答した場合に、完了の確認に使う。
+    ステムは MP3 より先に保存されるため、full が ready なら要求されたステムはすべて stems に含まれる。
+    """
+    track_id = _parse_track_id(track_id)
+    musicxml_blob_name = generated_musicxml_blob_name(track_id)
+    if not await gcs_service.blob_exists(settings.GCS_TRACK_BUCKET, musicxml_blob_name):
+        raise NotFoundException(message="指定されたトラックが見つかりません。", detail=f"track_id={track_id}")
+
+    stem_spec = stem_rendition(FULL_RENDITION)
+    mp3_blob_name = generated_mp3_blob_name(track_id)
+    full_ready, stem_blob_names = await asyncio.gather(
+        gcs_service.blob_exists(settings.GCS_TRACK_BUCKET, mp3_blob_name),
+        gcs_service.list_blob_names(settings.GCS_TRACK_BUCKET, f"generated_stems/{track_id}/"),
+    )
+    stems = []
+    if stem_blob_names:
+        # パート名は MusicXML の part-list から取る（ステムのパスは score-part の順番）
+        musicxml_content = await gcs_service.download_file_as_string_from_gcs(f"gs://{settings.GCS_TRACK_BUCKET}/{musicxml_blob_name}")
+        stored = set(stem_blob_names)
+        for index, part in enumerate(list_score_parts(musicxml_content)):
+            stem_blob = stem_blob_name(track_id, index, stem_spec)
+            if stem_blob in stored:
+                stems.append(StemInfo(
+                    index=index, part_id=part.part_id, name=part.name, content_type=stem_spec.content_type,
+                    status="ready", url=gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, stem_blob),
+                ))
+
+    mp3_url = gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, mp3_blob_name) if full_ready else None
+    return TrackStatusResponse(
+        track_id=track_id,
+        generated_mp3_url=mp3_url,
+        renditions=[rendition_info(FULL_RENDITION, "ready" if full_ready else "pending", mp3_url)],
+        stems=stems,
+    )
+
+
+@router.get(
+    "/tracks/{track_id}/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"audio/mpeg": {}}}, 307: {"description": "合成済み（ジョブキュー使用時は合成の完了後）の場合は保存済みMP3へリダイレクト"}},
+)
+async def stream_track(
+    track_id: str,
+    gcs_service: GCSService = Depends(get_gcs_service),
+    audio_synthesis_service: AudioSynthesisService = Depends(get_audio_synthesis_service),
+):
+    """
+    トラックのMP3を合成しながら配信する（chunked transfer, audio/mpeg）。
+    合成中のトラックには途中から参加でき、先頭から受信する。保存済みの場合は GCS のオブジェクトへリダイレクトする。
+    ジョブキュー (JOB_QUEUE_BACKEND) がある場合は API プロセスでは合成せず、実行中のレンダリングジョブ
+    （なければ新たに投入したジョブ）の完了を待ってから保存済みMP3へリダイレクトする。
+    """
+    track_id = _parse_track_id(track_id)
+
+    registry = get_track_stream_registry()
+    stream = registry.get(track_id)
+    if stream is None:
+        mp3_blob_name = generated_mp3_blob_name(track_id)
+        if await gcs_service.blob_exists(settings.GCS_TRACK_BUCKET, mp3_blob_name):
+            logger.info(f"トラック {track_id} は合成済みのため、保存済みMP3へリダイレクトします。")
+            return RedirectResponse(gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, mp3_blob_name), status_code=307)
+
+        musicxml_blob_name = generated_musicxml_blob_name(track_id)
+        if not await gcs_service.blob_exists(settings.GCS_TRACK_BUCKET, musicxml_blob_name):
+            raise NotFoundException(message="指定されたトラックが見つかりません。", detail=f"track_id={track_id}")
+        musicxml_gcs_uri = f"gs://{settings.GCS_TRACK_BUCKET}/{musicxml_blob_name}"
+        job_queue = get_job_queue()
+        if job_queue is not None:
+            # background で投入済みのジョブがあればそれに合流し、同じMP3を重ねて合成しない
+            logger.info(f"トラック {track_id} の合成をワーカーで待ちます。")
+            rendered = await run_job(
+                job_queue, JOB_KIND_RENDER, render_job_payload(track_id, musicxml_gcs_uri, FULL_RENDITION),
+                dedup_key=render_job_dedup_key(track_id, FULL_RENDITION),
+            )
+            return RedirectResponse(gcs_service.get_gcs_public_url(settings.GCS_TRACK_BUCKET, rendered["blob_name"]), status_code=307)
+
+        musicxml_content = await gcs_service.download_file_as_string_from_gcs(musicxml_gcs_uri)
+        # 上の await の間に別のリクエストが合成を始めていれば、そちらに合流する
+        stream = registry.start(track_id, musicxml_content, audio_synthesis_service, gcs_service)
+        logger.info(f"トラック {track_id} のストリーミング合成を開始しました。")
+
+    await stream.wait_started()
+    if stream.error is not None and not stream.chunks:
+        # 1バイトも送れないまま失敗した場合は通常のエラー応答にする
+        if isinstance(stream.error, AppException):
+            raise stream.error
+        raise AudioSynthesisException(detail=str(stream.error))
+
+    return StreamingResponse(
+        stream.iter_chunks(),
+        media_type="audio/mpeg",
+        headers={"Cache-Control": "no-store", "Accept-Ranges": "none"},
+    )
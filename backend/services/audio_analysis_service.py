@@ -4,23 +4,61 @@ import re
 import time
 import uuid
 import os # os.path.splitext を使用するために追加
-from typing import TypedDict, List, Dict, Any, Optional, Union
+from dataclasses import asdict
+from typing import TYPE_CHECKING, TypedDict, List, Dict, Any, Optional, Tuple, Union
 
-from langgraph.graph import StateGraph, END
+from opentelemetry import trace
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessageChunk # BaseMessageChunk はストリーミングで利用
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.exceptions import OutputParserException # 構造化出力のエラー処理に利用
-from langchain_google_vertexai import ChatVertexAI, HarmCategory, HarmBlockThreshold
 
 # models から MusicAnalysisFeatures と ErrorCode をインポート
 from models import MusicAnalysisFeatures, ErrorCode
-from exceptions import AnalysisFailedException, GenerationFailedException, VertexAIAPIErrorException
+from exceptions import (
+    WORKFLOW_RUN_ID_HEADER,
+    AnalysisFailedException,
+    AppException,
+    GenerationFailedException,
+    InternalServerErrorException,
+    InvalidRequestDataException,
+    NotFoundException,
+    VertexAIAPIErrorException,
+)
 from config import settings
+from metrics import observe_stage
+from tracing import set_token_usage, traced
 from services import prompts
 from services.correct_musicxml import correct_common_musicxml_errors
+from services.musicxml_validator import validate_musicxml, repair_musicxml
+from services.note_events import NoteEventsError, parse_note_events, render_musicxml
+from services.request_hedging import RequestHedger
+from services.vertex_resilience import get_vertex_resilience
+from services.model_cascade import resolve_model_cascade, run_model_cascade, get_model_cascade_stats
+from services.llm_usage import LLMCallUsage, record_llm_call
+from services.llm_cache import (
+    CACHE_KEY_METADATA,
+    decode_response,
+    encode_response,
+    get_llm_response_cache,
+    invalidate_cached_response,
+    response_cache_key,
+)
+from services.audio_synthesis_service import get_audio_synthesis_service
+from services.gcs_service import get_gcs_service
+from services.job_queue import get_job_queue
+from services.track_publishing import TrackPublishOptions, publish_full, publish_preview, store_generated_musicxml
+
+if TYPE_CHECKING:
+    # langgraph / langchain_google_vertexai は読み込みが重いため、実行時は初回使用時に読み込む（コールドスタート短縮）
+    from langchain_google_vertexai import ChatVertexAI
+    from langgraph.graph import StateGraph
 
 logger = logging.getLogger(__name__)
 
+# 解析と生成で温度を調整（LLM応答キャッシュのキーにも含める）
+ANALYSIS_TEMPERATURE = 0.3
+GENERATION_TEMPERATURE = 0.7
+
 # AudioAnalysisWorkflowState を新しい仕様に合わせて変更
 class AudioAnalysisWorkflowState(TypedDict):
     gcs_file_path: str # 入力音声ファイルのGCSパス
@@ -34,6 +72,12 @@ class AudioAnalysisWorkflowState(TypedDict):
     analysis_handled: Optional[bool] # 解析エラーが処理されたかどうかのフラグ
     generation_handled: Optional[bool] # 生成エラーが処理されたかどうかのフラグ
     entry_point_completed: Optional[bool] # エントリーポイントが完了したかどうかのフラグ
+    # 以下は合成・保存の段階（publish_options を指定した実行のみ）で使う
+    file_id: Optional[str] # トラックID（保存先の blob 名に使う）
+    publish_options: Optional[Dict[str, Any]] # TrackPublishOptions の内容
+    musicxml_gcs_uri: Optional[str] # 保存した MusicXML の GCS URI
+    preview_rendition: Optional[Dict[str, Any]] # publish_preview の結果
+    full_rendition: Optional[Dict[str, Any]] # publish_full の結果
 
 class AudioAnalyzer:
     def __init__(self, location: str = settings.VERTEX_AI_LOCATION, model_name: str = settings.ANALYZER_GEMINI_MODEL_NAME, timeout: int = settings.VERTEX_AI_TIMEOUT_SECONDS):
@@ -41,22 +85,120 @@ class AudioAnalyzer:
         # self.model_name はメソッド呼び出し時に指定するため、ここでは初期化不要かもしれないが、互換性のため残す
         self.default_model_name = model_name
         self.timeout = timeout
+        from langchain_google_vertexai import HarmBlockThreshold, HarmCategory
         self.safety_settings = {
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
             HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
         }
+        self.hedging_enabled = settings.VERTEX_HEDGING_ENABLED
+        self._hedgers: Dict[str, RequestHedger] = {}
+        self.analyzer_models = resolve_model_cascade(settings.ANALYZER_GEMINI_MODEL_CASCADE, model_name)
+        self.generator_models = resolve_model_cascade(settings.GENERATOR_GEMINI_MODEL_CASCADE, settings.GENERATOR_GEMINI_MODEL_NAME)
+
+    def model_cascade_stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """タスク・モデルごとの成功率とレイテンシを返す（カスケード順序の調整用）。"""
+        return get_model_cascade_stats().snapshot()
+
+    def _get_hedger(self, task_description: str) -> RequestHedger:
+        hedger = self._hedgers.get(task_description)
+        if hedger is None:
+            hedger = RequestHedger(
+                name=task_description,
+                percentile=settings.VERTEX_HEDGING_PERCENTILE,
+                min_samples=settings.VERTEX_HEDGING_MIN_SAMPLES,
+                default_delay_seconds=settings.VERTEX_HEDGING_DEFAULT_DELAY_SECONDS,
+                max_extra_load_ratio=settings.VERTEX_HEDGING_MAX_EXTRA_LOAD_RATIO,
+            )
+            self._hedgers[task_description] = hedger
+        return hedger
+
+    def hedging_stats(self) -> Dict[str, Dict[str, Any]]:
+        """タスクごとのヘッジ率・推定短縮時間などの統計を返す。"""
+        return {task: hedger.stats() for task, hedger in self._hedgers.items()}
+
+    async def _invoke_llm(
+        self,
+        llm: Any,
+        messages: List[Union[SystemMessage, HumanMessage, AIMessage]],
+        task_description: str,
+        model_name: Optional[str] = None,
+        structured: bool = False,
+        temperature: Optional[float] = None,
+        output_schema: Optional[type] = None,
+    ) -> Tuple[Any, bool, LLMCallUsage]:
+        """
+        LLMを呼び出す。共有のレジリエンス層（適応的タイムアウト・リトライ・サーキットブレーカー）を通し、
+        ヘッジングが有効な場合は各試行を RequestHedger 経由で実行する。
+        テキスト応答は最初のトークンまでの時間を計測するためストリーミングで受信して結合する。
+        構造化出力 (structured) は with_structured_output(..., include_raw=True) の生応答から使用量を記録し、パース結果を返す。
+        temperature を指定した呼び出しは LLM 応答キャッシュを参照・保存する（構造化出力は output_schema も必要）。
+        キャッシュから返した応答は Vertex AI を呼び出していないため、使用量として記録しない。
+        :return: (応答, ヘッジ側の応答が採用されたか, トークン使用量)
+        """
+        resolved_model_name = model_name or getattr(llm, "model_name", None) or self.default_model_name
+        cache = get_llm_response_cache() if temperature is not None else None
+        cache_key: Optional[str] = None
+        if cache is not None and cache.enabled_for(task_description) and (output_schema is not None or not structured):
+            cache_key = await response_cache_key(resolved_model_name, temperature, messages, output_schema if structured else None)
+        if cache_key is not None:
+            cached = await cache.get(task_description, cache_key)
+            if cached is not None:
+                logger.info(f"LLM応答キャッシュの応答を使用します ({task_description}, Model: {resolved_model_name})")
+                return decode_response(cached, cache_key, output_schema), False, LLMCallUsage(task=task_description, model=resolved_model_name)
+
+        async def timed_call() -> Tuple[Any, Optional[float], float]:
+            start = time.perf_counter()
+            if structured:
+                return await llm.ainvoke(messages), None, time.perf_counter() - start
+            response: Optional[BaseMessageChunk] = None
+            ttft: Optional[float] = None
+            async for chunk in llm.astream(messages):
+                if ttft is None and chunk.content:
+                    ttft = time.perf_counter() - start
+                # チャンクの usage_metadata は差分のため、加算すると応答全体の使用量になる
+                response = chunk if response is None else response + chunk
+            return response if response is not None else AIMessage(content=""), ttft, time.perf_counter() - start
+
+        async def attempt() -> Tuple[Any, bool, LLMCallUsage]:
+            if not self.hedging_enabled:
+                (resp, ttft, duration), hedge_won = await timed_call(), False
+            else:
+                (resp, ttft, duration), hedge_won = await self._get_hedger(task_description).run(timed_call)
+            raw = resp["raw"] if structured else resp
+            # レジリエンス層が作成した Vertex AI 呼び出しのスパンにトークン数を付与する
+            span = trace.get_current_span()
+            set_token_usage(span, raw)
+            span.set_attribute("vertex.hedge_won", hedge_won)
+            usage = record_llm_call(task_description, resolved_model_name, raw, duration, ttft_seconds=ttft, streaming=not structured)
+            if structured:
+                if resp.get("parsing_error") is not None:
+                    raise resp["parsing_error"]
+                resp = resp["parsed"]
+            return resp, hedge_won, usage
+
+        response, hedge_won, usage = await get_vertex_resilience().call(resolved_model_name, self.location, task_description, attempt)
+        if cache_key is not None:
+            encoded = encode_response(response)
+            if encoded is not None:
+                await cache.put(task_description, cache_key, encoded)
+                if not structured:
+                    # 後段の検証で不正と分かった場合に invalidate_cached_response で削除できるようにする
+                    response.response_metadata[CACHE_KEY_METADATA] = cache_key
+        return response, hedge_won, usage
 
     # _get_llm メソッドを、モデル名を引数で受け取れるように変更
-    def _get_llm(self, task_description: str, model_name: str, for_generation: bool = False) -> ChatVertexAI:
+    def _get_llm(self, task_description: str, model_name: str, for_generation: bool = False) -> "ChatVertexAI":
+        from langchain_google_vertexai import ChatVertexAI
         try:
-            temperature = 0.7 if for_generation else 0.3 # 解析と生成で温度を調整
+            temperature = GENERATION_TEMPERATURE if for_generation else ANALYSIS_TEMPERATURE
             llm = ChatVertexAI(
                 location=self.location,
                 model_name=model_name, # 引数で受け取ったモデル名を使用
                 temperature=temperature,
                 request_timeout=self.timeout,
+                max_retries=1, # リトライは vertex_resilience のリトライ予算内で行う
                 safety_settings=self.safety_settings,
             )
             logger.info(f"'{task_description}'用ChatVertexAIをモデル'{model_name}', Location: {self.location})で初期化しました。")
@@ -83,29 +225,41 @@ class AudioAnalyzer:
     # _call_vertex_api メソッドを、構造化出力に対応できるように再修正
     async def _call_vertex_api(
         self,
-        llm: ChatVertexAI, # 通常のLLMか、.with_structured_output()でラップされたLLM
+        llm: "ChatVertexAI", # 通常のLLMか、.with_structured_output()でラップされたLLM
         messages: List[Union[SystemMessage, HumanMessage, AIMessage]],
         task_description: str,
         request_params: Dict[str, Any], # ログ記録用
         workflow_run_id: Optional[str] = None,
         is_structured_output: bool = False, # 呼び出し元が構造化出力かを明示
         output_schema: Optional[Any] = None, # ログ記録のためにスキーマ情報を受け取る
-        pre_parsed_response: Optional[Union[AIMessage, BaseModel]] = None # 既にパース済みのレスポンスを受け取る
+        pre_parsed_response: Optional[Union[AIMessage, BaseModel]] = None, # 既にパース済みのレスポンスを受け取る
+        pre_parsed_usage: Optional[LLMCallUsage] = None, # パース済みレスポンスのトークン使用量（ログ記録用）
+        temperature: Optional[float] = None # 指定した場合は LLM 応答キャッシュを使う
     ) -> Union[AIMessage, BaseModel]: # AIMessage または Pydanticモデルを返す
+        from langchain_google_vertexai import ChatVertexAI # _get_llm で読み込み済み
         api_call_start_time = time.time()
+        hedge_won = False
+        usage = pre_parsed_usage
         try:
             if pre_parsed_response:
                 response_data = pre_parsed_response
             else:
-                response_data = await llm.ainvoke(messages)
+                response_data, hedge_won, usage = await self._invoke_llm(llm, messages, task_description, temperature=temperature)
             api_call_duration = time.time() - api_call_start_time
 
             log_extra = {
                 "target_service": "VertexAI",
                 "task": task_description, "duration_seconds": api_call_duration,
                 "request_params": request_params, "workflow_run_id": workflow_run_id,
-                "is_structured_output": is_structured_output
+                "is_structured_output": is_structured_output,
+                "hedge_won": hedge_won,
             }
+            if usage is not None:
+                log_extra.update({
+                    "input_tokens": usage.input_tokens, "output_tokens": usage.output_tokens,
+                    "cached_tokens": usage.cached_tokens, "reasoning_tokens": usage.reasoning_tokens,
+                    "ttft_seconds": round(usage.ttft_seconds, 3) if usage.ttft_seconds is not None else None,
+                })
             if isinstance(llm, ChatVertexAI):
                 log_extra["vertex_model"] = llm.model_name
             else:
@@ -134,19 +288,18 @@ class AudioAnalyzer:
             return response_data
         except Exception as e:
             api_call_duration = time.time() - api_call_start_time
-            logger.error(
-                f"Vertex AI API呼び出し失敗 ({task_description})", exc_info=True,
-                extra={
-                    "target_service": "VertexAI",
-                    "task": task_description, "duration_seconds": api_call_duration,
-                    "request_params": request_params, "workflow_run_id": workflow_run_id,
-                    "error_type": type(e).__name__,
-                }
-            )
+            # log_extra は成功時にしか作られないため、失敗時のログ項目はここで組み立てる
+            error_extra = {
+                "target_service": "VertexAI",
+                "task": task_description, "duration_seconds": api_call_duration,
+                "request_params": request_params, "workflow_run_id": workflow_run_id,
+                "error_type": type(e).__name__,
+            }
             if isinstance(llm, ChatVertexAI):
-                log_extra["vertex_model"] = llm.model_name
+                error_extra["vertex_model"] = llm.model_name
             else:
-                log_extra["vertex_model"] = "StructuredOutputLLM (model_name not directly available)"
+                error_extra["vertex_model"] = "StructuredOutputLLM (model_name not directly available)"
+            logger.error(f"Vertex AI API呼び出し失敗 ({task_description})", exc_info=True, extra=error_extra)
 
             if "blocked" in str(e).lower() or "safety filter" in str(e).lower():
                 raise VertexAIAPIErrorException(message=f"{task_description}リクエストが安全フィルターでブロックされた可能性があります (Vertex AI)。", detail=str(e), error_code=ErrorCode.VERTEX_AI_API_ERROR)
@@ -161,13 +314,21 @@ class AudioAnalyzer:
     async def analyze_musicxml(self, musicxml_data: str, workflow_run_id: Optional[str]) -> MusicAnalysisFeatures:
         """
         MusicXMLデータを解析し、構造化された音楽的特徴を取得する。
+        解析用モデルのカスケードを先頭から試す。
         """
         task = "MusicXML Analysis (音楽的特徴の抽出)"
+        return await run_model_cascade(
+            task, self.analyzer_models,
+            lambda model_name: self._analyze_musicxml_with_model(musicxml_data, workflow_run_id, task, model_name),
+            workflow_run_id=workflow_run_id,
+        )
+
+    async def _analyze_musicxml_with_model(self, musicxml_data: str, workflow_run_id: Optional[str], task: str, model_name: str) -> MusicAnalysisFeatures:
         # MusicXML解析は比較的創造性が不要なため、temperatureを低めに設定
-        llm = self._get_llm(task, model_name=settings.ANALYZER_GEMINI_MODEL_NAME, for_generation=False)
+        llm = self._get_llm(task, model_name=model_name, for_generation=False)
 
         # 構造化出力を使用するLLMを準備
-        structured_llm = llm.with_structured_output(MusicAnalysisFeatures)
+        structured_llm = llm.with_structured_output(MusicAnalysisFeatures, include_raw=True) # 生応答からトークン使用量を記録する
 
         messages = [
             SystemMessage(content=prompts.ANALYZE_MUSICXML_PROMPT),
@@ -175,8 +336,11 @@ class AudioAnalyzer:
         ]
 
         try:
-            # structured_llm を直接呼び出す
-            raw_response = await structured_llm.ainvoke(messages)
+            # structured_llm を直接呼び出す（ヘッジング有効時は RequestHedger 経由）
+            raw_response, _, usage = await self._invoke_llm(
+                structured_llm, messages, task, model_name=model_name, structured=True,
+                temperature=ANALYSIS_TEMPERATURE, output_schema=MusicAnalysisFeatures,
+            )
 
             # 明示的な型チェックを追加
             if not isinstance(raw_response, MusicAnalysisFeatures):
@@ -195,7 +359,8 @@ class AudioAnalyzer:
                 workflow_run_id,
                 is_structured_output=True, # フラグを立てる
                 output_schema=MusicAnalysisFeatures, # スキーマを渡す
-                pre_parsed_response=response_features # 既にパース済みのレスポンスを渡す
+                pre_parsed_response=response_features, # 既にパース済みのレスポンスを渡す
+                pre_parsed_usage=usage
             )
             logger.info(f"MusicXML解析成功。Features: {response_features.dict()}")
             return response_features
@@ -212,9 +377,17 @@ class AudioAnalyzer:
     async def analyze_humming_audio(self, gcs_file_path: str, workflow_run_id: Optional[str]) -> str:
         """
         口ずさみ音声を解析し、「トラックの雰囲気/テーマ」を取得する。
+        解析用モデルのカスケードを先頭から試す。
         """
         task = "Humming Audio Analysis (トラック雰囲気/テーマ取得)"
-        llm = self._get_llm(task, model_name=settings.ANALYZER_GEMINI_MODEL_NAME, for_generation=False)
+        return await run_model_cascade(
+            task, self.analyzer_models,
+            lambda model_name: self._analyze_humming_audio_with_model(gcs_file_path, workflow_run_id, task, model_name),
+            workflow_run_id=workflow_run_id,
+        )
+
+    async def _analyze_humming_audio_with_model(self, gcs_file_path: str, workflow_run_id: Optional[str], task: str, model_name: str) -> str:
+        llm = self._get_llm(task, model_name=model_name, for_generation=False)
         mime_type = self._get_mime_type_from_gcs_path(gcs_file_path)
 
         # プロンプトは services.prompts から取得
@@ -230,7 +403,8 @@ class AudioAnalyzer:
         ]
         try:
             response_ai_message = await self._call_vertex_api(
-                llm, messages, task, {"gcs_file_path": gcs_file_path, "mime_type": mime_type}, workflow_run_id
+                llm, messages, task, {"gcs_file_path": gcs_file_path, "mime_type": mime_type}, workflow_run_id,
+                temperature=ANALYSIS_TEMPERATURE
             )
             # 応答はテキスト形式を期待
             if not isinstance(response_ai_message, AIMessage):
@@ -255,43 +429,41 @@ class AudioAnalyzer:
     async def generate_musicxml_from_theme(self, gcs_file_path: str, humming_theme: str, workflow_run_id: Optional[str]) -> str:
         """
         口ずさみ音声と「トラックの雰囲気/テーマ」からMusicXMLを生成する。
+        生成結果は構造検証にかけ、修復で救済できない場合は生成用モデルのカスケードに沿って
+        次のモデル（最後のモデル以降は同じモデル）で再生成する。
         """
         task = "MusicXML Generation (バッキングトラック生成)"
-        llm = self._get_llm(task, model_name=settings.GENERATOR_GEMINI_MODEL_NAME, for_generation=True)
-        mime_type = self._get_mime_type_from_gcs_path(gcs_file_path)
+        max_attempts = max(1, settings.MUSICXML_MAX_GENERATION_ATTEMPTS, len(self.generator_models))
+        attempt_models = [self.generator_models[min(i, len(self.generator_models) - 1)] for i in range(max_attempts)]
 
-        # プロンプトテンプレートにテーマを埋め込む
-        prompt_text = prompts.MUSICXML_GENERATION_PROMPT_TEMPLATE.format(humming_theme=humming_theme)
-        messages = [
-            SystemMessage(content=prompts.MUSICXML_GENERATION_SYSTEM_PROMPT),
-            HumanMessage(content=prompt_text)
-        ]
+        async def attempt(model_name: str) -> str:
+            return await self._generate_musicxml_once(gcs_file_path, humming_theme, workflow_run_id, model_name)
+
+        return await run_model_cascade(task, attempt_models, attempt, workflow_run_id=workflow_run_id)
+
+    async def _generate_musicxml_once(self, gcs_file_path: str, humming_theme: str, workflow_run_id: Optional[str], model_name: str) -> str:
+        """
+        Vertex AIを1回呼び出して、構造検証・修復済みのMusicXMLを返す。
+        settings.MUSICXML_GENERATION_FORMAT が "note_events" の場合は音符イベントを生成させてローカルでMusicXMLを組み立てる。
+        """
+        generation_format = settings.MUSICXML_GENERATION_FORMAT
+        task = GENERATION_TASKS[generation_format]
+        llm = self._get_llm(task, model_name=model_name, for_generation=True)
+        messages = build_generation_messages(generation_format, humming_theme)
         try:
             response_ai_message: AIMessage = await self._call_vertex_api(
-                llm, messages, task, {"gcs_file_path": gcs_file_path, "humming_theme": humming_theme}, workflow_run_id
+                llm, messages, task, {"gcs_file_path": gcs_file_path, "humming_theme": humming_theme}, workflow_run_id,
+                temperature=GENERATION_TEMPERATURE
             )
-            content = response_ai_message.content
-            # MusicXMLの抽出ロジック (既存のものを流用・調整)
-            match = re.search(r"MUSICXML_START\s*([\s\S]+?)\s*MUSICXML_END", content, re.DOTALL)
-            if match:
-                musicxml_text = match.group(1).strip()
-                if not musicxml_text:
-                    logger.error(f"[{task}] 抽出されたMusicXMLデータが空です。")
-                    raise GenerationFailedException(message="抽出されたMusicXMLデータが空です (Vertex AI)。", detail="LLM response contained MUSICXML_START/END tags but no content.")
-                # 簡単なXML形式のチェック (必須ではないが、より堅牢にするなら)
-                if not (musicxml_text.startswith("<?xml") and musicxml_text.endswith("</score-partwise>")):
-                    logger.warning(f"[{task}] 生成されたMusicXMLが期待される形式と異なる可能性があります: {musicxml_text[:100]}...{musicxml_text[-100:]}")
-                logger.info(f"MusicXML生成成功。データ長: {len(musicxml_text)}")
-                correct_musicxml_text = correct_common_musicxml_errors(musicxml_text)
-                if len(correct_musicxml_text) != len(musicxml_text):
-                    logger.info(f"MusicXML修正。データ長: {len(correct_musicxml_text)}")
-                    musicxml_text = correct_musicxml_text
-                return musicxml_text
-            if "CANNOT_GENERATE_MUSICXML" in content.upper(): # AIが明示的に生成不可と伝えた場合
-                 logger.warning(f"[{task}] Vertex AI がMusicXMLデータを生成できないと報告しました。応答: {content[:200]}")
-                 raise GenerationFailedException(message="Vertex AI がMusicXMLデータを生成できないと報告しました。", detail=content)
-            logger.warning(f"[{task}] LLM応答のMusicXMLにMUSICXML_START/ENDタグが含まれていませんでした。コンテント: {content[:200]}...")
-            raise GenerationFailedException(message="Vertex AI が期待する形式でMusicXMLデータを返しませんでした (タグ欠落)。", detail=f"Response (start): {str(content)[:200]}")
+            try:
+                musicxml_text = musicxml_from_generation_output(response_ai_message.content, generation_format, workflow_run_id)
+                return validate_and_repair_musicxml(musicxml_text, workflow_run_id)
+            except GenerationFailedException:
+                # 再試行で同じ不正な応答がキャッシュから返らないようにする
+                await invalidate_cached_response(task, response_ai_message)
+                raise
+        except GenerationFailedException:
+            raise
         except VertexAIAPIErrorException as e:
             logger.error(f"[{task}] Vertex AI APIエラー: {e.message}", exc_info=True)
             raise GenerationFailedException(message=f"MusicXML生成中にAPIエラーが発生しました: {e.message}", detail=e.detail)
@@ -299,7 +471,109 @@ class AudioAnalyzer:
             logger.error(f"[{task}] 予期せぬエラー: {e}", exc_info=True)
             raise GenerationFailedException(message=f"MusicXML生成中に予期せぬエラーが発生しました: {str(e)}")
 
-audio_analyzer = AudioAnalyzer()
+
+GENERATION_TASKS = {
+    "note_events": "Note Events Generation (バッキングトラック生成)",
+    "musicxml": "MusicXML Generation (バッキングトラック生成)",
+}
+
+
+def build_generation_messages(generation_format: str, humming_theme: str) -> List[Union[SystemMessage, HumanMessage]]:
+    """バッキングトラック生成のプロンプトを形式 ("note_events" / "musicxml") ごとに組み立てる。"""
+    if generation_format == "note_events":
+        system_prompt, template = prompts.NOTE_EVENTS_GENERATION_SYSTEM_PROMPT, prompts.NOTE_EVENTS_GENERATION_PROMPT_TEMPLATE
+    else:
+        system_prompt, template = prompts.MUSICXML_GENERATION_SYSTEM_PROMPT, prompts.MUSICXML_GENERATION_PROMPT_TEMPLATE
+    # プロンプトテンプレートにテーマを埋め込む
+    return [
+        SystemMessage(content=system_prompt),
+        HumanMessage(content=template.format(humming_theme=humming_theme)),
+    ]
+
+
+def musicxml_from_generation_output(content: str, generation_format: str, workflow_run_id: Optional[str] = None) -> str:
+    """
+    生成モデルの応答テキストからMusicXMLを取り出す（バッチ予測の応答にも使う）。
+    note_events 形式は音符イベントを解析してMusicXMLを組み立て、musicxml 形式は抽出したMusicXMLの既知の誤りを修正する。
+    期待する形式でない場合は GenerationFailedException を送出する。
+    """
+    task = GENERATION_TASKS[generation_format]
+    if generation_format == "note_events":
+        match = re.search(r"NOTES_START\s*([\s\S]+?)\s*NOTES_END", content)
+        if match is None:
+            if "CANNOT_GENERATE" in content.upper():
+                logger.warning(f"[{task}] Vertex AI が音符イベントを生成できないと報告しました。応答: {content[:200]}")
+                raise GenerationFailedException(message="Vertex AI がバッキングトラックを生成できないと報告しました。", detail=content)
+            logger.warning(f"[{task}] LLM応答にNOTES_START/ENDタグが含まれていませんでした。コンテント: {content[:200]}...")
+            raise GenerationFailedException(message="Vertex AI が期待する形式で音符イベントを返しませんでした (タグ欠落)。", detail=f"Response (start): {str(content)[:200]}")
+        try:
+            score = parse_note_events(match.group(1))
+        except NoteEventsError as e:
+            # 文法の誤りはモデルの出力の問題のため、カスケードに沿って再生成させる
+            logger.warning(f"[{task}] 音符イベントの解析に失敗しました: {e}")
+            raise GenerationFailedException(message="生成された音符イベントを解析できませんでした。", detail=str(e))
+        if score.warnings:
+            logger.info(f"[{task}] 音符イベントを補正しました: {'; '.join(score.warnings)}", extra={"workflow_run_id": workflow_run_id})
+        musicxml_text = render_musicxml(score)
+        logger.info(f"音符イベント生成成功。パート数: {len(score.parts)}, 小節数: {score.measure_count}, データ長: {len(match.group(1))} -> MusicXML {len(musicxml_text)}")
+        return musicxml_text
+
+    # MusicXMLの抽出ロジック (既存のものを流用・調整)
+    match = re.search(r"MUSICXML_START\s*([\s\S]+?)\s*MUSICXML_END", content, re.DOTALL)
+    if match:
+        musicxml_text = match.group(1).strip()
+        if not musicxml_text:
+            logger.error(f"[{task}] 抽出されたMusicXMLデータが空です。")
+            raise GenerationFailedException(message="抽出されたMusicXMLデータが空です (Vertex AI)。", detail="LLM response contained MUSICXML_START/END tags but no content.")
+        # 簡単なXML形式のチェック (必須ではないが、より堅牢にするなら)
+        if not (musicxml_text.startswith("<?xml") and musicxml_text.endswith("</score-partwise>")):
+            logger.warning(f"[{task}] 生成されたMusicXMLが期待される形式と異なる可能性があります: {musicxml_text[:100]}...{musicxml_text[-100:]}")
+        logger.info(f"MusicXML生成成功。データ長: {len(musicxml_text)}")
+        correct_musicxml_text = correct_common_musicxml_errors(musicxml_text)
+        if len(correct_musicxml_text) != len(musicxml_text):
+            logger.info(f"MusicXML修正。データ長: {len(correct_musicxml_text)}")
+            musicxml_text = correct_musicxml_text
+        return musicxml_text
+    if "CANNOT_GENERATE_MUSICXML" in content.upper(): # AIが明示的に生成不可と伝えた場合
+        logger.warning(f"[{task}] Vertex AI がMusicXMLデータを生成できないと報告しました。応答: {content[:200]}")
+        raise GenerationFailedException(message="Vertex AI がMusicXMLデータを生成できないと報告しました。", detail=content)
+    logger.warning(f"[{task}] LLM応答のMusicXMLにMUSICXML_START/ENDタグが含まれていませんでした。コンテント: {content[:200]}...")
+    raise GenerationFailedException(message="Vertex AI が期待する形式でMusicXMLデータを返しませんでした (タグ欠落)。", detail=f"Response (start): {str(content)[:200]}")
+
+
+def validate_and_repair_musicxml(musicxml_text: str, workflow_run_id: Optional[str] = None) -> str:
+    """
+    MusicXMLを構造検証し、修復可能な問題はその場で修復する。
+    修復できない場合は GenerationFailedException を送出する。
+    """
+    validation = validate_musicxml(musicxml_text)
+    log_extra = {
+        "workflow_run_id": workflow_run_id,
+        "validation_issues": [issue.to_dict() for issue in validation.issues],
+    }
+    if validation.is_valid:
+        logger.info(f"MusicXML構造検証成功。警告数: {len(validation.issues)}", extra=log_extra)
+        return musicxml_text
+
+    if validation.is_repairable:
+        repaired_text = repair_musicxml(musicxml_text, validation)
+        revalidation = validate_musicxml(repaired_text)
+        if revalidation.is_valid:
+            logger.info(f"MusicXMLの構造エラーを修復しました: {validation.summary()}", extra=log_extra)
+            return repaired_text
+        validation = revalidation
+
+    logger.warning(f"MusicXML構造検証失敗: {validation.summary()}", extra=log_extra)
+    raise GenerationFailedException(message="生成されたMusicXMLが構造検証に失敗しました。", detail=validation.summary())
+
+# 依存性注入のための関数（初回使用時に生成する）
+_audio_analyzer_instance: Optional[AudioAnalyzer] = None
+
+def get_audio_analyzer() -> AudioAnalyzer:
+    global _audio_analyzer_instance
+    if _audio_analyzer_instance is None:
+        _audio_analyzer_instance = AudioAnalyzer()
+    return _audio_analyzer_instance
 
 # 既存の estimate_key, estimate_bpm, estimate_chords, estimate_genre は削除
 
@@ -312,19 +586,21 @@ async def node_log_event(state: AudioAnalysisWorkflowState, event_name: str, is_
     if not is_start and "start_time" in extra_info:
         duration = time.time() - extra_info.pop("start_time")
         extra_info["duration_seconds"] = round(duration, 2)
+        observe_stage(f"workflow_node:{event_name}", duration)
         message += f". Duration: {extra_info['duration_seconds']:.2f}s"
     logger.log(log_level, message, extra=extra_info)
 
 # execute_analysis_node は汎用性が低くなったため、各ノードで直接呼び出す形式に変更。削除。
 
 # 新しいノード: node_analyze_humming_audio
+@traced("workflow_node analyze_humming_audio")
 async def node_analyze_humming_audio(state: AudioAnalysisWorkflowState) -> Dict[str, Any]:
     node_name = "analyze_humming_audio"
     start_time = time.time()
     await node_log_event(state, node_name, is_start=True, data={"start_time": start_time, "gcs_file_path": state["gcs_file_path"]})
     output: Dict[str, Any] = {}
     try:
-        theme = await audio_analyzer.analyze_humming_audio(state["gcs_file_path"], state.get("workflow_run_id"))
+        theme = await get_audio_analyzer().analyze_humming_audio(state["gcs_file_path"], state.get("workflow_run_id"))
         output["humming_theme"] = theme
     except Exception as e:
         error_message = f"{node_name} 失敗: {str(e)}"
@@ -336,6 +612,7 @@ async def node_analyze_humming_audio(state: AudioAnalysisWorkflowState) -> Dict[
     return output
 
 # 新しいノード: analyze_musicxml_node
+@traced("workflow_node analyze_musicxml")
 async def analyze_musicxml_node(state: AudioAnalysisWorkflowState) -> Dict[str, Any]:
     node_name = "analyze_musicxml_node"
     start_time = time.time()
@@ -351,7 +628,7 @@ async def analyze_musicxml_node(state: AudioAnalysisWorkflowState) -> Dict[str,
         logger.warning(error_msg, extra={"workflow_run_id": state.get("workflow_run_id")})
     else:
         try:
-            features = await audio_analyzer.analyze_musicxml(
+            features = await get_audio_analyzer().analyze_musicxml(
                 musicxml_data=musicxml_data,
                 workflow_run_id=state.get("workflow_run_id")
             )
@@ -370,6 +647,7 @@ async def analyze_musicxml_node(state: AudioAnalysisWorkflowState) -> Dict[str,
 # 今回は node_analyze_humming_audio が成功すれば final_analysis_result が作成されるため、集約は不要。削除。
 
 # 新しいノード: node_generate_musicxml (旧 node_generate_backing_track を改修)
+@traced("workflow_node generate_musicxml")
 async def node_generate_musicxml(state: AudioAnalysisWorkflowState) -> Dict[str, Any]:
     node_name = "generate_musicxml"
     start_time = time.time()
@@ -387,7 +665,7 @@ async def node_generate_musicxml(state: AudioAnalysisWorkflowState) -> Dict[str,
         try:
             # humming_theme と gcs_file_path がNoneでないことを保証 (mypyのため)
             if humming_theme and gcs_file_path:
-                 output["generated_musicxml_data"] = await audio_analyzer.generate_musicxml_from_theme(
+                 output["generated_musicxml_data"] = await get_audio_analyzer().generate_musicxml_from_theme(
                     gcs_file_path=gcs_file_path,
                     humming_theme=humming_theme,
                     workflow_run_id=state.get("workflow_run_id")
@@ -404,7 +682,63 @@ async def node_generate_musicxml(state: AudioAnalysisWorkflowState) -> Dict[str,
     await node_log_event(state, node_name, is_start=False, data={"start_time": start_time, "generation_error_present": bool(output.get("musicxml_generation_error"))})
     return output
 
-def build_workflow() -> StateGraph:
+# --- 合成・保存の段階（publish_options を指定した実行のみ） ---
+# 失敗は状態に記録せず PublishStageError として送出する。チェックポイントは失敗したノードの直前で止まり、
+# 再開時には完了済みの段階（と Vertex AI を呼ぶ解析・生成）をやり直さずにそのノードから実行する。
+
+class PublishStageError(Exception):
+    """合成・保存の段階の失敗。元の例外を LangGraph の外へ伝えるために包む。"""
+
+    def __init__(self, stage: str, original: Exception):
+        super().__init__(f"{stage}: {original}")
+        self.stage = stage
+        self.original = original
+
+
+async def _run_publish_stage(state: AudioAnalysisWorkflowState, node_name: str, stage: Any) -> Dict[str, Any]:
+    start_time = time.time()
+    await node_log_event(state, node_name, is_start=True, data={"start_time": start_time, "file_id": state.get("file_id")})
+    try:
+        output = await stage()
+    except Exception as e:
+        logger.error(f"{node_name} 失敗: {e}", exc_info=True, extra={"workflow_run_id": state.get("workflow_run_id")})
+        raise PublishStageError(node_name, e) from e
+    await node_log_event(state, node_name, is_start=False, data={"start_time": start_time})
+    return output
+
+
+@traced("workflow_node store_musicxml")
+async def node_store_musicxml(state: AudioAnalysisWorkflowState) -> Dict[str, Any]:
+    async def stage() -> Dict[str, Any]:
+        uri = await store_generated_musicxml(state["file_id"], state["generated_musicxml_data"], get_gcs_service())
+        return {"musicxml_gcs_uri": uri}
+    return await _run_publish_stage(state, "store_musicxml", stage)
+
+
+@traced("workflow_node render_preview")
+async def node_render_preview(state: AudioAnalysisWorkflowState) -> Dict[str, Any]:
+    async def stage() -> Dict[str, Any]:
+        preview = await publish_preview(
+            state["file_id"], state["musicxml_gcs_uri"], state["generated_musicxml_data"], state["publish_options"]["preview_format"],
+            get_gcs_service(), get_audio_synthesis_service(), get_job_queue(),
+        )
+        return {"preview_rendition": preview}
+    return await _run_publish_stage(state, "render_preview", stage)
+
+
+@traced("workflow_node render_full")
+async def node_render_full(state: AudioAnalysisWorkflowState) -> Dict[str, Any]:
+    async def stage() -> Dict[str, Any]:
+        full = await publish_full(
+            state["file_id"], state["musicxml_gcs_uri"], state["generated_musicxml_data"], state["publish_options"]["with_stems"],
+            get_gcs_service(), get_audio_synthesis_service(), get_job_queue(), state["publish_options"].get("synthesis_mode"),
+        )
+        return {"full_rendition": full}
+    return await _run_publish_stage(state, "render_full", stage)
+
+
+def build_workflow(checkpointer: Optional[Any] = None) -> "StateGraph":
+    from langgraph.graph import StateGraph, END
     workflow = StateGraph(AudioAnalysisWorkflowState)
 
     # ノードの定義
@@ -445,25 +779,85 @@ def build_workflow() -> StateGraph:
     )
     workflow.add_edge("handle_musicxml_generation_error_node", END) # 生成エラー時は終了
 
+    # 合成・保存の段階のノード
+    workflow.add_node("store_musicxml_node", node_store_musicxml)
+    workflow.add_node("render_preview_node", node_render_preview)
+    workflow.add_node("render_full_node", node_render_full)
+
+    def route_publish(state: AudioAnalysisWorkflowState) -> str:
+        # 要求された段階のうち、まだ結果のないものへ MusicXML の保存, preview, full の順に進む
+        options = state.get("publish_options")
+        if not options:
+            return END
+        if not state.get("musicxml_gcs_uri"):
+            return "store_musicxml_node"
+        if "preview" in options["rendition_names"] and not state.get("preview_rendition"):
+            return "render_preview_node"
+        if "full" in options["rendition_names"] and not state.get("full_rendition"):
+            return "render_full_node"
+        return END
+
+    publish_routes = {name: name for name in ("store_musicxml_node", "render_preview_node", "render_full_node")}
+    publish_routes[END] = END
+
     # MusicXML解析ノードからの条件分岐
     workflow.add_conditional_edges(
         "analyze_musicxml_node",
-        lambda state: "handle_music_analysis_error_node" if state.get("music_analysis_error") or not state.get("music_analysis_features") else END,
+        lambda state: "handle_music_analysis_error_node" if state.get("music_analysis_error") or not state.get("music_analysis_features") else route_publish(state),
         {
-            END: END, # 成功時は終了
+            **publish_routes, # 成功時は合成・保存へ（指定がなければ終了）
             "handle_music_analysis_error_node": "handle_music_analysis_error_node"
         }
     )
-    workflow.add_edge("handle_music_analysis_error_node", END) # 解析エラー時は終了
-
-    return workflow.compile()
-
-app_graph = build_workflow()
-
-async def run_audio_analysis_workflow(gcs_file_path: str) -> AudioAnalysisWorkflowState:
+    # MusicXML解析の失敗は致命的ではないため、解析結果なしで合成・保存へ進む
+    workflow.add_conditional_edges("handle_music_analysis_error_node", route_publish, publish_routes)
+    for node_name in ("store_musicxml_node", "render_preview_node", "render_full_node"):
+        workflow.add_conditional_edges(node_name, route_publish, publish_routes)
+
+    return workflow.compile(checkpointer=checkpointer)
+
+# コンパイル済みワークフロー（初回実行時にコンパイルする）
+_app_graph_instance: Optional[Any] = None
+
+def get_app_graph() -> Any:
+    global _app_graph_instance
+    if _app_graph_instance is None:
+        from services.workflow_checkpoints import get_workflow_checkpointer
+        _app_graph_instance = build_workflow(checkpointer=get_workflow_checkpointer())
+    return _app_graph_instance
+
+
+def __getattr__(name: str) -> Any:
+    # 旧来のモジュール属性 audio_analyzer / app_graph への参照を遅延生成で維持する
+    if name == "audio_analyzer":
+        return get_audio_analyzer()
+    if name == "app_graph":
+        return get_app_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _workflow_config(workflow_run_id: str) -> Dict[str, Any]:
+    # thread_id はチェックポイントの保存単位。合成・保存のノードが増えたため recursion_limit も増やす
+    return {"recursion_limit": 20, "configurable": {"workflow_run_id": workflow_run_id, "thread_id": workflow_run_id}}
+
+
+def _resumable(exc: AppException, workflow_run_id: str) -> AppException:
+    """チェックポイントが有効な場合、再開に使う workflow_run_id をエラー応答のヘッダーに付ける。"""
+    if get_app_graph().checkpointer is not None:
+        exc.headers = {**(exc.headers or {}), WORKFLOW_RUN_ID_HEADER: workflow_run_id}
+    return exc
+
+
+@traced("audio_analysis_workflow")
+async def run_audio_analysis_workflow(
+    gcs_file_path: str, file_id: Optional[str] = None, publish_options: Optional[TrackPublishOptions] = None,
+) -> AudioAnalysisWorkflowState:
+    """
+    口ずさみ解析・MusicXML生成・MusicXML解析を実行する。publish_options を指定した場合は続けて、
+    file_id のトラックとして MusicXML の保存とレンディションの合成を行う。
+    チェックポイントが有効な場合、失敗した実行は resume_audio_analysis_workflow で再開できる。
+    """
     workflow_run_id = uuid.uuid4().hex
     logger.info(f"新しい音声解析・MusicXML生成ワークフロー開始 ({gcs_file_path})", extra={"workflow_run_id": workflow_run_id, "gcs_file_path": gcs_file_path})
-    start_time_overall = time.time()
 
     initial_state = AudioAnalysisWorkflowState(
         gcs_file_path=gcs_file_path,
@@ -476,13 +870,80 @@ async def run_audio_analysis_workflow(gcs_file_path: str) -> AudioAnalysisWorkfl
         music_analysis_error=None,
         analysis_handled=None,
         generation_handled=None,
-        entry_point_completed=None
+        entry_point_completed=None,
+        file_id=file_id,
+        publish_options=asdict(publish_options) if publish_options is not None else None,
+        musicxml_gcs_uri=None,
+        preview_rendition=None,
+        full_rendition=None,
     )
-    final_state: AudioAnalysisWorkflowState = initial_state.copy()
+    return await _invoke_workflow(initial_state, initial_state)
+
+
+# workflow_run_id ごとの実行中の再開。同時に届いた再開リクエストは新たに実行せず、同じ再開の結果を待つ
+_resumes_in_flight: Dict[str, "asyncio.Task[AudioAnalysisWorkflowState]"] = {}
+
+
+@traced("audio_analysis_workflow_resume")
+async def resume_audio_analysis_workflow(workflow_run_id: str) -> AudioAnalysisWorkflowState:
+    """
+    チェックポイントから実行を再開する。
+    - 途中で失敗した（またはプロセスが停止した）実行: 最後に完了したノードの続きから実行する
+    - 口ずさみ解析・MusicXML生成の失敗で終了した実行: 失敗したノードから実行し直す
+    - 完了済みの実行: 保存済みの結果を返す（応答を受け取れなかったクライアントの再試行）
+    同じ workflow_run_id の再開が実行中の場合はそれに合流する（合成の重複やチェックポイントの競合書き込みを防ぐ）。
+    """
+    task = _resumes_in_flight.get(workflow_run_id)
+    if task is None:
+        task = asyncio.create_task(_resume_workflow(workflow_run_id))
+        _resumes_in_flight[workflow_run_id] = task
+
+        def forget(done: "asyncio.Task[AudioAnalysisWorkflowState]") -> None:
+            _resumes_in_flight.pop(workflow_run_id, None)
+            # 待っていたリクエストがすべて切断された場合も、例外を取得済みにしておく
+            if not done.cancelled():
+                done.exception()
+
+        task.add_done_callback(forget)
+    else:
+        logger.info("同じワークフローの再開が実行中のため、その結果を待ちます。", extra={"workflow_run_id": workflow_run_id})
+    # 1つのリクエストが切断されても、合流している他のリクエストのために再開は続ける
+    return await asyncio.shield(task)
+
+
+async def _resume_workflow(workflow_run_id: str) -> AudioAnalysisWorkflowState:
+    graph = get_app_graph()
+    if graph.checkpointer is None:
+        raise InvalidRequestDataException(message="ワークフローのチェックポイントが無効なため、再開できません。")
+    config = _workflow_config(workflow_run_id)
+    snapshot = await graph.aget_state(config)
+    if not snapshot.values:
+        raise NotFoundException(message=f"ワークフロー {workflow_run_id} のチェックポイントが見つかりません（保存期間を過ぎた可能性があります）。")
+    state: AudioAnalysisWorkflowState = snapshot.values
+    log_extra = {"workflow_run_id": workflow_run_id, "gcs_file_path": state.get("gcs_file_path"), "next_nodes": list(snapshot.next)}
+
+    if not snapshot.next:
+        # エラー処理ノードで終了した実行は、エラーを消した状態を失敗したノードの直前のノードの出力として書き込み、そこから分岐し直す
+        if state.get("humming_analysis_error"):
+            await graph.aupdate_state(config, {"humming_analysis_error": None, "analysis_handled": None}, as_node="entry_point")
+        elif state.get("musicxml_generation_error"):
+            await graph.aupdate_state(config, {"musicxml_generation_error": None, "generation_handled": None}, as_node="analyze_humming_node")
+        else:
+            logger.info("完了済みのワークフローのため、保存済みの結果を返します。", extra=log_extra)
+            return _validated_workflow_state(state, log_extra)
+    logger.info(f"ワークフローを再開します ({state.get('gcs_file_path')})", extra=log_extra)
+    return await _invoke_workflow(None, state)
+
+
+async def _invoke_workflow(graph_input: Optional[AudioAnalysisWorkflowState], state: AudioAnalysisWorkflowState) -> AudioAnalysisWorkflowState:
+    """ワークフローを実行（graph_input が None の場合はチェックポイントから再開）し、結果を検証して返す。"""
+    workflow_run_id = state["workflow_run_id"]
+    gcs_file_path = state["gcs_file_path"]
+    start_time_overall = time.time()
+    final_state: AudioAnalysisWorkflowState = state.copy()
 
     try:
-        config = {"recursion_limit": 15, "configurable": {"workflow_run_id": workflow_run_id}} # ノードが増えたため制限を少し増やす
-        invoked_result = await app_graph.ainvoke(initial_state, config=config)
+        invoked_result = await get_app_graph().ainvoke(graph_input, config=_workflow_config(workflow_run_id))
 
         if isinstance(invoked_result, dict):
             for key, value in invoked_result.items():
@@ -495,6 +956,13 @@ async def run_audio_analysis_workflow(gcs_file_path: str) -> AudioAnalysisWorkfl
             # このケースでは、エラー情報を final_state に追加
             final_state["humming_analysis_error"] = (final_state.get("humming_analysis_error") or "") + " | ワークフロー呼び出しが予期しない型を返しました。"
 
+    except PublishStageError as e:
+        # 解析・生成は完了しているため、合成・保存のエラーをそのまま返す（再開すればその段階から実行できる）
+        observe_stage("workflow_total", time.time() - start_time_overall)
+        error = e.original if isinstance(e.original, AppException) else InternalServerErrorException(
+            message="トラックの合成・保存中に予期せぬエラーが発生しました。", detail=type(e.original).__name__
+        )
+        raise _resumable(error, workflow_run_id) from e.original
     except Exception as e:
         logger.error(f"LangGraphワークフロー実行中の致命的エラー ({gcs_file_path}): {e}", exc_info=True, extra={"workflow_run_id": workflow_run_id})
         error_addon = f" | ワークフロー実行フレームワークエラー: {type(e).__name__}: {e}"
@@ -506,8 +974,16 @@ async def run_audio_analysis_workflow(gcs_file_path: str) -> AudioAnalysisWorkfl
 
 
     duration = time.time() - start_time_overall
+    observe_stage("workflow_total", duration)
+    log_extra = {"workflow_run_id": workflow_run_id, "gcs_file_path": gcs_file_path, "duration_seconds": round(duration, 2)}
+    return _validated_workflow_state(final_state, log_extra)
+
+
+def _validated_workflow_state(final_state: AudioAnalysisWorkflowState, log_extra: Dict[str, Any]) -> AudioAnalysisWorkflowState:
+    """必須の結果（テーマ・MusicXML）が欠けている場合は例外を送出する。"""
+    workflow_run_id = final_state["workflow_run_id"]
     log_extra = {
-        "workflow_run_id": workflow_run_id, "gcs_file_path": gcs_file_path, "duration_seconds": round(duration, 2),
+        **log_extra,
         "humming_theme_present": bool(final_state.get("humming_theme")),
         "musicxml_data_present": bool(final_state.get("generated_musicxml_data")),
         "music_features_present": bool(final_state.get("music_analysis_features")),
@@ -524,18 +1000,18 @@ async def run_audio_analysis_workflow(gcs_file_path: str) -> AudioAnalysisWorkfl
     if not humming_theme:
         detail = str(final_state.get('humming_analysis_error', "ワークフローは口ずさみ解析結果を生成せずに終了しました。"))
         logger.error(f"口ずさみ解析失敗（結果欠落）: {detail}", extra=log_extra)
-        raise AnalysisFailedException(message="口ずさみ音声解析が正常に完了しませんでした（結果欠落）。", detail=detail)
+        raise _resumable(AnalysisFailedException(message="口ずさみ音声解析が正常に完了しませんでした（結果欠落）。", detail=detail), workflow_run_id)
 
     # generated_musicxml_data がない場合は GenerationFailedException
     if not generated_musicxml_data_val:
         detail = str(final_state.get('musicxml_generation_error', "ワークフローはMusicXMLデータを生成せずに終了しました。"))
         logger.error(f"MusicXML生成失敗（データ欠落またはエラー）: {detail}", extra=log_extra)
-        raise GenerationFailedException(message="MusicXML生成が正常に完了しませんでした。", detail=detail)
+        raise _resumable(GenerationFailedException(message="MusicXML生成が正常に完了しませんでした。", detail=detail), workflow_run_id)
 
     # music_analysis_features がない場合も、今回はエラーとせず警告ログに留める（機能のフォールバック）
     if not final_state.get("music_analysis_features"):
         detail = str(final_state.get('music_analysis_error', "MusicXML解析ステップで特徴を抽出できませんでした。"))
         logger.warning(f"MusicXML解析スキップまたは失敗: {detail}", extra=log_extra)
 
-    logger.info(f"新しいワークフロー ({gcs_file_path}) 正常終了。", extra=log_extra)
+    logger.info(f"新しいワークフロー ({final_state['gcs_file_path']}) 正常終了。", extra=log_extra)
     return final_state
@@ -2,16 +2,19 @@
 音声ファイル変換サービス
 
 WebMやAAC形式の音声ファイルをWAV形式に変換する機能を提供します。
+デコードは ffmpeg で行い、チャンネル変換・リサンプリング・正規化は services.audio_core (NumPy) で行います。
 """
 
-import io
 import logging
-from typing import BinaryIO, Optional
-from pydub import AudioSegment
-from pydub.exceptions import CouldntDecodeError
+import subprocess
+import tempfile
+
+from config import settings
 
 logger = logging.getLogger(__name__)
 
+SUPPORTED_SOURCE_FORMATS = ("webm", "aac", "m4a", "mp4", "mp3")
+
 
 class AudioConversionError(Exception):
     """音声変換エラー"""
@@ -43,67 +46,73 @@ class AudioConversionService:
         Raises:
             AudioConversionError: 変換に失敗した場合
         """
+        # numpy は初回の変換時に読み込む（コールドスタート短縮）
+        from services import audio_core
+
+        source_format = source_format.lower()
+        if source_format not in SUPPORTED_SOURCE_FORMATS:
+            raise AudioConversionError(f"サポートされていない音声形式: {source_format}")
+
         try:
             logger.info(f"音声変換開始: {source_format} -> WAV")
-            
-            # 入力データからAudioSegmentを作成
-            audio_io = io.BytesIO(audio_data)
-            
-            # 形式に応じてAudioSegmentを読み込み
-            if source_format.lower() in ['webm']:
-                # WebM形式 (通常はOpusコーデック)
-                try:
-                    audio = AudioSegment.from_file(audio_io, format="webm")
-                except CouldntDecodeError:
-                    # WebMが読めない場合、OGGとして試行
-                    audio_io.seek(0)
-                    audio = AudioSegment.from_file(audio_io, format="ogg")
-                    
-            elif source_format.lower() in ['aac']:
-                # AAC形式
-                audio = AudioSegment.from_file(audio_io, format="aac")
-                
-            elif source_format.lower() in ['m4a', 'mp4']:
-                # M4A/MP4形式
-                audio = AudioSegment.from_file(audio_io, format="m4a")
-                
-            elif source_format.lower() in ['mp3']:
-                # MP3形式
-                audio = AudioSegment.from_file(audio_io, format="mp3")
-                
-            else:
-                raise AudioConversionError(f"サポートされていない音声形式: {source_format}")
-            
-            logger.info(f"元の音声情報 - チャンネル数: {audio.channels}, サンプルレート: {audio.frame_rate}Hz, 長さ: {len(audio)}ms")
-            
+
+            # デコードのみ ffmpeg で行い、元のチャンネル数・サンプルレートの 16bit PCM WAV を受け取る
+            decoded = AudioConversionService._decode_to_wav(audio_data, source_format)
+            audio = audio_core.read_wav(decoded)  # コピーせずに data チャンクを参照する
+
+            logger.info(f"元の音声情報 - チャンネル数: {audio.channels}, サンプルレート: {audio.sample_rate}Hz, 長さ: {int(audio.duration_seconds * 1000)}ms")
+
             # 出力形式に変換
-            if audio.channels != output_channels:
-                if output_channels == 1:
-                    audio = audio.set_channels(1)  # モノラルに変換
-                else:
-                    audio = audio.set_channels(output_channels)
-                    
-            if audio.frame_rate != output_sample_rate:
-                audio = audio.set_frame_rate(output_sample_rate)
-            
+            audio = audio_core.downmix(audio, output_channels)
+            audio = audio_core.resample(audio, output_sample_rate)
+            if settings.AUDIO_CONVERSION_NORMALIZE_DBFS is not None:
+                audio = audio_core.normalize_loudness(audio, settings.AUDIO_CONVERSION_NORMALIZE_DBFS)
+
             # WAV形式でエクスポート
-            output_io = io.BytesIO()
-            audio.export(output_io, format="wav")
-            wav_data = output_io.getvalue()
-            
+            wav_data = audio_core.write_wav(audio)
+
             logger.info(f"音声変換完了 - 出力サイズ: {len(wav_data)} bytes")
             return wav_data
-            
-        except CouldntDecodeError as e:
+
+        except AudioConversionError:
+            raise
+
+        except audio_core.WavFormatError as e:
             error_msg = f"音声ファイルをデコードできませんでした ({source_format}): {str(e)}"
             logger.error(error_msg)
             raise AudioConversionError(error_msg) from e
-            
+
         except Exception as e:
             error_msg = f"音声変換中にエラーが発生しました ({source_format}): {str(e)}"
             logger.error(error_msg)
             raise AudioConversionError(error_msg) from e
-    
+
+    @staticmethod
+    def _decode_to_wav(audio_data: bytes, source_format: str) -> bytes:
+        """
+        ffmpeg で音声をデコードし、16bit PCM の WAV を返す。
+        MP4/M4A はファイル末尾のメタデータ (moov) を読むためにシークが必要なため、入力は一時ファイル経由で渡す。
+        コンテナは ffmpeg に判定させる（WebM として届いた Ogg もそのまま読める）。
+        """
+        with tempfile.NamedTemporaryFile(suffix=f".{source_format}") as input_file:
+            input_file.write(audio_data)
+            input_file.flush()
+            cmd = [
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin",
+                "-i", input_file.name,
+                "-vn", "-acodec", "pcm_s16le", "-f", "wav", "pipe:1",
+            ]
+            try:
+                process = subprocess.run(cmd, capture_output=True, check=False)
+            except FileNotFoundError as e:
+                raise AudioConversionError("ffmpeg が見つかりません。") from e
+        if process.returncode != 0 or not process.stdout:
+            stderr = process.stderr.decode("utf-8", "replace").strip()
+            error_msg = f"音声ファイルをデコードできませんでした ({source_format}): {stderr[-500:]}"
+            logger.error(error_msg)
+            raise AudioConversionError(error_msg)
+        return process.stdout
+
     @staticmethod
     def needs_conversion(mime_type: str) -> bool:
         """
@@ -131,7 +140,7 @@ class AudioConversionService:
             mime_type: MIMEタイプ
             
         Returns:
-            pydubで使用する形式名
+            変換元の形式名
         """
         mime_to_format = {
             "audio/webm": "webm",
@@ -0,0 +1,301 @@
+# backend/services/audio_core.py
+"""
+NumPy による PCM 処理の共通部品
+
+pydub の AudioSegment は変換のたびに bytes 全体をコピーし、チャンネル変換・リサンプリングは audioop を経由します。
+ここでは int16 / float32 の配列を直接扱います。
+- WAV の読み込みは data チャンクへのゼロコピーのビュー（16bit PCM と 32bit float の場合）
+- モノラルからの複製は broadcast のビューで、コピーしない
+- エンコーダーには連続した int16 のバッファ（memoryview）を渡す
+
+numpy の読み込みはコールドスタートに影響するため、このモジュールは使用箇所で遅延 import すること。
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# ダウンサンプリング時のローパスフィルタのタップ数
+_LOWPASS_TAPS = 63
+# 折り返し成分がこれ以下の周波数に入る場合にローパスをかける
+_AUDIBLE_LIMIT_HZ = 20000
+# 一時配列を小さく保つための処理単位
+_BLOCK_FRAMES = 65536
+
+
+class WavFormatError(ValueError):
+    """WAV として解釈できないデータ"""
+
+
+@dataclass
+class PcmAudio:
+    samples: np.ndarray  # 形状 (frames, channels)。dtype は int16 か float32 (-1.0〜1.0)
+    sample_rate: int
+
+    @property
+    def channels(self) -> int:
+        return self.samples.shape[1]
+
+    @property
+    def frames(self) -> int:
+        return self.samples.shape[0]
+
+    @property
+    def duration_seconds(self) -> float:
+        return self.frames / self.sample_rate
+
+
+def read_wav(data: Buffer) -> PcmAudio:
+    """
+    WAV を読み込む。16bit PCM / 32bit float は入力バッファへの読み取り専用ビューを返す（コピーしない）。
+    パイプ出力の WAV のようにサイズが確定していないヘッダーも受け付ける。
+    """
+    view = memoryview(data).cast("B")
+    if len(view) < 12 or view[:4] != b"RIFF" or view[8:12] != b"WAVE":
+        raise WavFormatError("RIFF/WAVE ヘッダーがありません。")
+    position = 12
+    fmt = None
+    while position + 8 <= len(view):
+        chunk_id = bytes(view[position:position + 4])
+        (size,) = struct.unpack_from("<I", view, position + 4)
+        body = position + 8
+        if chunk_id == b"fmt ":
+            audio_format, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", view, body)
+            if audio_format == _WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                (audio_format,) = struct.unpack_from("<H", view, body + 24)
+            fmt = (audio_format, channels, sample_rate, block_align, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise WavFormatError("fmt チャンクより前に data チャンクがあります。")
+            # サイズ未確定 (0 / 0xFFFFFFFF) や切り詰められたファイルでは、残り全体を data とみなす
+            end = len(view) if size == 0 or body + size > len(view) else body + size
+            audio_format, channels, sample_rate, block_align, bits = fmt
+            usable = (end - body) - (end - body) % block_align
+            samples = _decode_samples(view[body:body + usable], audio_format, bits)
+            return PcmAudio(samples.reshape(-1, channels), sample_rate)
+        position = body + size + (size & 1)
+    raise WavFormatError("data チャンクがありません。")
+
+
+def _decode_samples(view: memoryview, audio_format: int, bits: int) -> np.ndarray:
+    if audio_format == _WAVE_FORMAT_PCM and bits == 16:
+        return np.frombuffer(view, dtype="<i2")
+    if audio_format == _WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        return np.frombuffer(view, dtype="<f4")
+    if audio_format == _WAVE_FORMAT_PCM and bits == 8:
+        return ((np.frombuffer(view, dtype=np.uint8).astype(np.int16) - 128) << 8).astype(np.int16)
+    if audio_format == _WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(view, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        value = (raw[:, 0] << 8) | (raw[:, 1] << 16) | (raw[:, 2] << 24)  # 上位にそろえて符号を保つ
+        return (value.astype(np.float32) * (1.0 / 2147483648.0)).astype(np.float32)
+    if audio_format == _WAVE_FORMAT_PCM and bits == 32:
+        return np.frombuffer(view, dtype="<i4").astype(np.float32) * np.float32(1.0 / 2147483648.0)
+    raise WavFormatError(f"サポートされていない WAV 形式です: format={audio_format}, bits={bits}")
+
+
+def to_float32(samples: np.ndarray) -> np.ndarray:
+    if samples.dtype == np.float32:
+        return samples
+    # astype と乗算を分けると一時配列ができるため、1回の演算で変換する
+    return np.multiply(samples, np.float32(1.0 / 32768.0), dtype=np.float32)
+
+
+def _int16_into(samples: np.ndarray, out: np.ndarray) -> None:
+    """float32 を int16 に変換して out に書き込む。ブロックごとに処理し、信号全体の大きさの一時配列を作らない。"""
+    for start in range(0, samples.shape[0], _BLOCK_FRAMES):
+        block = samples[start:start + _BLOCK_FRAMES] * np.float32(32768.0)
+        np.clip(block, -32768.0, 32767.0, out=block)
+        np.rint(block, out=block)
+        out[start:start + _BLOCK_FRAMES] = block
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    if samples.dtype == np.int16:
+        return samples
+    out = np.empty(samples.shape, dtype=np.int16)
+    _int16_into(samples, out)
+    return out
+
+
+def downmix(audio: PcmAudio, channels: int) -> PcmAudio:
+    """チャンネル数を変える。モノラル化は平均、モノラルからの複製はコピーしないビュー。"""
+    if audio.channels == channels:
+        return audio
+    if channels == 1:
+        # (frames, channels) の軸方向の reduce は遅いため、チャンネルごとに加算する
+        mono = audio.samples[:, 0].astype(np.float32)
+        for channel in range(1, audio.channels):
+            mono += audio.samples[:, channel]
+        scale = 1.0 / audio.channels
+        if audio.samples.dtype == np.int16:
+            scale /= 32768.0
+        mono *= np.float32(scale)
+        return PcmAudio(mono[:, None], audio.sample_rate)
+    if audio.channels == 1:
+        return PcmAudio(np.broadcast_to(audio.samples, (audio.frames, channels)), audio.sample_rate)
+    raise ValueError(f"{audio.channels}ch から {channels}ch への変換はサポートしていません。")
+
+
+def _lowpass(samples: np.ndarray, cutoff: float) -> np.ndarray:
+    """窓関数法 (Blackman) の FIR ローパス。cutoff はサンプリング周波数に対する比 (0〜0.5)。"""
+    n = np.arange(_LOWPASS_TAPS) - (_LOWPASS_TAPS - 1) / 2
+    taps = (2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(_LOWPASS_TAPS)).astype(np.float32)
+    taps /= taps.sum()
+    filtered = np.empty_like(samples)
+    for channel in range(samples.shape[1]):
+        filtered[:, channel] = np.convolve(samples[:, channel], taps, mode="same")
+    return filtered
+
+
+def resample(audio: PcmAudio, sample_rate: int) -> PcmAudio:
+    """
+    サンプリングレートを変える（線形補間。出力は float32）。
+    ダウンサンプリングで折り返し成分が可聴域に入る場合だけ、先にローパスをかける（48kHz → 44.1kHz では不要）。
+    補間はブロック単位で行い、位置・係数の一時配列を小さく保つ。
+    """
+    if audio.sample_rate == sample_rate:
+        return audio
+    samples = to_float32(audio.samples)
+    if sample_rate < audio.sample_rate and sample_rate - audio.sample_rate / 2 < _AUDIBLE_LIMIT_HZ:
+        samples = _lowpass(samples, 0.5 * sample_rate / audio.sample_rate * 0.95)
+    out_frames = int(round(audio.frames * sample_rate / audio.sample_rate))
+    if audio.frames < 2:
+        return PcmAudio(np.repeat(samples[:1], out_frames, axis=0), sample_rate)
+
+    step = audio.sample_rate / sample_rate
+    resampled = np.empty((out_frames, audio.channels), dtype=np.float32)
+    for start in range(0, out_frames, _BLOCK_FRAMES):
+        stop = min(start + _BLOCK_FRAMES, out_frames)
+        positions = np.arange(start, stop, dtype=np.float64) * step
+        index = np.minimum(positions.astype(np.int64), audio.frames - 2)
+        frac = np.minimum(positions - index, 1.0).astype(np.float32)[:, None]
+        left = samples[index]
+        resampled[start:stop] = left + (samples[index + 1] - left) * frac
+    return PcmAudio(resampled, sample_rate)
+
+
+def apply_gain(audio: PcmAudio, gain_db: float) -> PcmAudio:
+    gain = 10.0 ** (gain_db / 20.0)
+    if audio.samples.dtype == np.int16:
+        gain /= 32768.0
+    return PcmAudio(np.multiply(audio.samples, np.float32(gain), dtype=np.float32), audio.sample_rate)
+
+
+def peak_dbfs(audio: PcmAudio) -> float:
+    if not audio.frames:
+        return float("-inf")
+    # abs() の一時配列を作らないよう、最大値と最小値から求める
+    peak = max(float(audio.samples.max()), -float(audio.samples.min()))
+    if audio.samples.dtype == np.int16:
+        peak /= 32768.0
+    return 20.0 * np.log10(peak) if peak > 0 else float("-inf")
+
+
+def rms_dbfs(audio: PcmAudio) -> float:
+    if not audio.frames:
+        return float("-inf")
+    total = 0.0
+    for start in range(0, audio.frames, _BLOCK_FRAMES):
+        block = to_float32(audio.samples[start:start + _BLOCK_FRAMES])
+        total += float(np.vdot(block, block)) if block.flags.c_contiguous else float(np.sum(np.square(block), dtype=np.float64))
+    rms = np.sqrt(total / audio.samples.size)
+    return 20.0 * np.log10(rms) if rms > 0 else float("-inf")
+
+
+def normalize_peak(audio: PcmAudio, target_dbfs: float = -1.0) -> PcmAudio:
+    """ピークが target_dbfs になるようにゲインをかける。無音の場合はそのまま返す。"""
+    current = peak_dbfs(audio)
+    if current == float("-inf"):
+        return audio
+    return apply_gain(audio, target_dbfs - current)
+
+
+def normalize_loudness(audio: PcmAudio, target_dbfs: float = -20.0, peak_ceiling_dbfs: float = -1.0) -> PcmAudio:
+    """RMS が target_dbfs になるようにゲインをかける。ただしピークが peak_ceiling_dbfs を超えない範囲にとどめる。"""
+    current = rms_dbfs(audio)
+    if current == float("-inf"):
+        return audio
+    gain_db = min(target_dbfs - current, peak_ceiling_dbfs - peak_dbfs(audio))
+    return apply_gain(audio, gain_db)
+
+
+def fade(audio: PcmAudio, fade_in_seconds: float = 0.0, fade_out_seconds: float = 0.0) -> PcmAudio:
+    """先頭・末尾に線形のフェードをかける。入力の配列は変更しない。"""
+    samples = audio.samples
+    if samples.dtype == np.float32:
+        samples = samples.copy()
+    else:
+        samples = to_float32(samples)
+    fade_in = min(int(fade_in_seconds * audio.sample_rate), audio.frames)
+    fade_out = min(int(fade_out_seconds * audio.sample_rate), audio.frames)
+    if fade_in:
+        samples[:fade_in] *= np.linspace(0.0, 1.0, fade_in, endpoint=False, dtype=np.float32)[:, None]
+    if fade_out:
+        samples[audio.frames - fade_out:] *= np.linspace(1.0, 0.0, fade_out, dtype=np.float32)[:, None]
+    return PcmAudio(samples, audio.sample_rate)
+
+
+def mix_pcm16(buffers: Sequence[Buffer], channels: int) -> np.ndarray:
+    """
+    s16le のインターリーブ PCM を加算してクリップする。長さが違う場合は短いものを無音として扱う。
+    戻り値は形状 (frames, channels) の int16 配列。
+    """
+    frame_bytes = 2 * channels
+    lengths = [len(buffer) // frame_bytes for buffer in buffers]
+    frames = max(lengths, default=0)
+    accumulator = np.zeros(frames * channels, dtype=np.int32)
+    for buffer, length in zip(buffers, lengths):
+        if length:
+            accumulator[:length * channels] += np.frombuffer(buffer, dtype="<i2", count=length * channels)
+    np.clip(accumulator, -32768, 32767, out=accumulator)
+    return accumulator.astype("<i2").reshape(frames, channels)
+
+
+def mix(tracks: Sequence[PcmAudio], gains_db: Optional[Sequence[float]] = None) -> PcmAudio:
+    """同じサンプリングレート・チャンネル数のトラックを float32 で加算する（クリップは to_int16 で行う）。"""
+    if not tracks:
+        raise ValueError("ミックスするトラックがありません。")
+    sample_rate, channels = tracks[0].sample_rate, tracks[0].channels
+    if any(track.sample_rate != sample_rate or track.channels != channels for track in tracks):
+        raise ValueError("サンプリングレートとチャンネル数をそろえてからミックスしてください。")
+    mixed = np.zeros((max(track.frames for track in tracks), channels), dtype=np.float32)
+    for index, track in enumerate(tracks):
+        samples = to_float32(track.samples)
+        if gains_db is not None and gains_db[index]:
+            samples = samples * np.float32(10.0 ** (gains_db[index] / 20.0))
+        mixed[:track.frames] += samples
+    return PcmAudio(mixed, sample_rate)
+
+
+def pcm16_buffer(audio: PcmAudio) -> memoryview:
+    """エンコーダーに渡す連続した s16le のバッファ。すでに連続した int16 の場合はコピーしない。"""
+    samples = np.ascontiguousarray(to_int16(audio.samples))
+    if samples.dtype.byteorder == ">":
+        samples = samples.byteswap()
+    return memoryview(samples).cast("B")
+
+
+def write_wav(audio: PcmAudio) -> bytes:
+    """16bit PCM の WAV にする。float32 の場合は出力バッファに直接 int16 を書き込む。"""
+    data_size = audio.frames * audio.channels * 2
+    output = bytearray(44 + data_size)
+    struct.pack_into(
+        "<4sI4s4sIHHIIHH4sI", output, 0,
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, _WAVE_FORMAT_PCM, audio.channels, audio.sample_rate,
+        audio.sample_rate * audio.channels * 2, audio.channels * 2, 16,
+        b"data", data_size,
+    )
+    target = np.frombuffer(output, dtype="<i2", offset=44).reshape(audio.frames, audio.channels)
+    if audio.samples.dtype == np.int16:
+        target[:] = audio.samples
+    else:
+        _int16_into(audio.samples, target)
+    return bytes(output)
@@ -2,15 +2,84 @@ import logging
 import os
 import subprocess
 import tempfile
-from typing import Optional
+import threading
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import IO, Callable, List, Optional
 
-from music21 import converter, tempo
-from pydub import AudioSegment
+from fastapi.concurrency import run_in_threadpool
 
+from config import settings
 from exceptions import AudioSynthesisException
+from metrics import stage_timer
+from services.mp3_framing import Mp3FrameSplitter
+from services.note_events import NoteScore, note_score_from_musicxml, render_midi
+from services.renditions import FULL_RENDITION, RenderedAudio, RenditionSpec, StemAudio, list_score_parts, stem_rendition
 
 logger = logging.getLogger(__name__)
 
+STREAM_READ_SIZE = 64 * 1024
+# パートのミックス単位 (s16le ステレオで 4096 フレーム)。パイプのバッファより小さくし、各 FluidSynth が先行して合成できるようにする
+MIX_BLOCK_BYTES = 4096 * 4
+
+
+@dataclass
+class PartMidi:
+    index: int
+    part_id: str
+    name: str
+    midi_path: str
+
+
+class _PcmMixer(threading.Thread):
+    """
+    パートごとの FluidSynth 出力 (s16le ステレオ) をブロック単位で読み、加算・クリップしてエンコーダーの標準入力に書き込む。
+    stem_files を渡した場合は、各パートの PCM をそのまま書き出す。
+    """
+
+    def __init__(self, sources: List[IO[bytes]], sink: IO[bytes], stem_files: Optional[List[IO[bytes]]] = None):
+        super().__init__(name="pcm-mixer", daemon=True)
+        self.sources = sources
+        self.sink = sink
+        self.stem_files = stem_files
+        self.total_bytes = 0
+        self.error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        # numpy は合成時にのみ使うため、ここで読み込む（コールドスタート短縮）
+        from services.audio_core import mix_pcm16
+
+        try:
+            active = list(enumerate(self.sources))
+            while active:
+                blocks = []
+                still_active = []
+                for index, source in active:
+                    data = source.read(MIX_BLOCK_BYTES)  # EOF まではブロックサイズ分そろうまで待つ
+                    if len(data) == MIX_BLOCK_BYTES:
+                        still_active.append((index, source))
+                    usable = len(data) - len(data) % 4  # フレーム単位に切り詰める
+                    if not usable:
+                        continue
+                    blocks.append(memoryview(data)[:usable])
+                    if self.stem_files is not None:
+                        self.stem_files[index].write(blocks[-1])
+                active = still_active
+                if blocks:
+                    mixed = mix_pcm16(blocks, channels=2)
+                    self.sink.write(mixed)
+                    self.total_bytes += mixed.nbytes
+        except BaseException as e:
+            self.error = e
+        finally:
+            for source in self.sources:
+                source.close()
+            try:
+                self.sink.close()
+            except OSError:
+                pass  # エンコーダーが先に終了した場合。終了コードで検出する
+
+
 class AudioSynthesisService:
     def __init__(self):
         # SoundFontのパスを取得
@@ -22,88 +91,282 @@ class AudioSynthesisService:
 
     async def synthesize_musicxml_to_mp3(self, musicxml_content: str) -> bytes:
         """
-        MusicXMLコンテンツをMP3バイト列に変換します。
+        MusicXMLコンテンツを full レンディションのMP3バイト列に変換します。
+        パース・FluidSynth・エンコードはいずれもブロッキング処理のため、スレッドプールで実行します。
         :param musicxml_content: MusicXMLの文字列データ
         :return: 生成されたMP3ファイルのバイト列
         """
-        logger.info("MusicXMLからMP3への合成を開始します。")
-        with tempfile.TemporaryDirectory() as tmpdir:
-            musicxml_path = os.path.join(tmpdir, "input.musicxml")
-            midi_path = os.path.join(tmpdir, "output.mid")
-            wav_path = os.path.join(tmpdir, "output.wav")
-            mp3_path = os.path.join(tmpdir, "output.mp3")
+        rendered = await self.render_rendition(musicxml_content, FULL_RENDITION)
+        return rendered.data
 
-            try:
-                # 1. MusicXMLをファイルに保存
-                with open(musicxml_path, "w", encoding="utf-8") as f:
-                    f.write(musicxml_content)
-                logger.debug(f"MusicXMLを一時ファイルに保存しました: {musicxml_path}")
-
-                # 2. MusicXMLをMIDIに変換 (music21)
-                score = converter.parse(musicxml_path)
-
-                # MusicXMLからパースしたテンポ情報を取得
-                metronome_marks = score.flat.getElementsByClass('MetronomeMark')
-                if metronome_marks:
-                    # 最初のテンポ設定を取得
-                    initial_tempo = metronome_marks[0]
-                    logger.info(f"MusicXMLからBPM: {initial_tempo.number} を検出しました。")
-                    # スコアの先頭(オフセット0)にテンポ情報を挿入して、MIDI書き出し時に反映されるようにする
-                    # 既存のテンポ情報と重複する可能性を避けるため、新しいオブジェクトとして挿入するのが安全
-                    score.insert(0, tempo.MetronomeMark(number=initial_tempo.number))
-                else:
-                    default_bpm = 120
-                    logger.warning(f"MusicXMLにテンポ情報が見つかりませんでした。デフォルトのテンポ({default_bpm})が使用されます。")
-                    score.insert(0, tempo.MetronomeMark(number=default_bpm))
+    async def render_rendition(self, musicxml_content: str, spec: RenditionSpec, with_stems: bool = False) -> RenderedAudio:
+        """
+        MusicXMLを指定したレンディション（サンプリングレート・チャンネル数・形式・ビットレート）で合成します。
+        プレビューのような低品質のレンディションは合成・エンコードとも軽く、full より短時間で完了します。
+        :param musicxml_content: MusicXMLの文字列データ
+        :param spec: 出力するレンディション
+        :param with_stems: パートごとのステムも書き出すか
+        :return: エンコード済みの音声データ（spec.content_type）とステム
+        """
+        return await run_in_threadpool(self._render_sync, musicxml_content, spec, with_stems)
+
+    def _render_sync(self, musicxml_content: str, spec: RenditionSpec, with_stems: bool = False) -> RenderedAudio:
+        chunks: List[bytes] = []
+        stems = self._run_encoder_pipeline(
+            musicxml_content, spec, chunks.append, stage=f"synthesis_render_{spec.name}", with_stems=with_stems,
+        )
+        return RenderedAudio(data=b"".join(chunks), stems=stems)
+
+    def stream_musicxml_to_mp3_sync(
+        self, musicxml_content: str, on_chunk: Callable[[bytes], None], with_stems: bool = False,
+    ) -> List[StemAudio]:
+        """
+        MusicXMLを full レンディションの MP3 に合成しながら、エンコード済みのデータをフレーム境界にそろえて on_chunk に渡す（ブロッキング処理）。
+        with_stems の場合、ステムは合成の完了後にまとめて返す。
+        """
+        splitter = Mp3FrameSplitter()
+
+        def on_data(data: bytes) -> None:
+            frames = splitter.feed(data)
+            if frames:
+                on_chunk(frames)
+
+        stems = self._run_encoder_pipeline(
+            musicxml_content, FULL_RENDITION, on_data, stage="synthesis_stream", with_stems=with_stems,
+        )
+        tail = splitter.flush()
+        if tail:
+            on_chunk(tail)
+        if splitter.skipped_bytes:
+            logger.warning(f"MP3ストリームのフレーム同期外れにより {splitter.skipped_bytes} バイトを読み飛ばしました。")
+        return stems
+
+    def _write_midis(self, musicxml_content: str, tmpdir: str, split_parts: bool) -> List[PartMidi]:
+        """
+        MusicXMLをパースし、テンポ情報を先頭にそろえてMIDIファイルに書き出す。
+        split_parts の場合はパート（score-part）ごとに別のMIDIファイルにする。
+        ノートイベントからレンダリングした MusicXML の場合は、music21 を通さずに直接書き出す。
+        """
+        note_score = note_score_from_musicxml(musicxml_content)
+        if note_score is not None:
+            return self._write_note_event_midis(note_score, tmpdir, split_parts)
+
+        # music21 は読み込みが重いため、初回の合成時に読み込む（コールドスタート短縮）
+        from music21 import converter, stream, tempo
+
+        musicxml_path = os.path.join(tmpdir, "input.musicxml")
+
+        # 1. MusicXMLをファイルに保存
+        with open(musicxml_path, "w", encoding="utf-8") as f:
+            f.write(musicxml_content)
+        logger.debug(f"MusicXMLを一時ファイルに保存しました: {musicxml_path}")
+
+        # 2. MusicXMLをMIDIに変換 (music21)
+        with stage_timer("synthesis_parse"):
+            score = converter.parse(musicxml_path)
 
+        # MusicXMLからパースしたテンポ情報を取得
+        metronome_marks = score.flat.getElementsByClass('MetronomeMark')
+        if metronome_marks:
+            # 最初のテンポ設定を取得
+            bpm = metronome_marks[0].number
+            logger.info(f"MusicXMLからBPM: {bpm} を検出しました。")
+        else:
+            bpm = 120
+            logger.warning(f"MusicXMLにテンポ情報が見つかりませんでした。デフォルトのテンポ({bpm})が使用されます。")
+
+        parts = list(score.parts)
+        with stage_timer("synthesis_midi"):
+            if not split_parts or not parts:
+                # スコアの先頭(オフセット0)にテンポ情報を挿入して、MIDI書き出し時に反映されるようにする
+                # 既存のテンポ情報と重複する可能性を避けるため、新しいオブジェクトとして挿入するのが安全
+                score.insert(0, tempo.MetronomeMark(number=bpm))
+                midi_path = os.path.join(tmpdir, "output.mid")
                 score.write('midi', fp=midi_path)
-                logger.debug(f"MusicXMLからMIDIへの変換が完了しました: {midi_path}")
-
-                # 3. MIDIをWAVに変換 (FluidSynth)
-                # -T wav: 出力形式をWAVに指定
-                # -F <file>: 出力ファイルパスを指定
-                # -r 44100: サンプリングレートを指定
-                # -L warning: FluidSynthのログレベルをwarningに設定
-                fluidsynth_cmd = [
-                    "fluidsynth",
-                    "-ni",  # no-interaction, no-shell
-                    "-a", "file",
-                    "-o", "synth.audio-channels=2",
-                    "-T", "wav",
-                    "-F", wav_path,
-                    "-r", "44100",
-                    # "-L", "warning",
-                    self.soundfont_path,
-                    midi_path,
+                midis = [PartMidi(index=0, part_id="", name="", midi_path=midi_path)]
+            else:
+                # music21 はパートIDを楽器名などに置き換えることがあるため、IDとパート名は part-list の順番で対応付ける
+                score_parts = list_score_parts(musicxml_content)
+                if len(score_parts) != len(parts):
+                    score_parts = []
+                midis = []
+                for index, part in enumerate(parts):
+                    # パートは複数のストリームに属せるため、元のスコアから取り出さずに単独のスコアへ入れる
+                    part_score = stream.Score()
+                    part_score.insert(0, tempo.MetronomeMark(number=bpm))
+                    part_score.insert(0, part)
+                    midi_path = os.path.join(tmpdir, f"part{index}.mid")
+                    part_score.write('midi', fp=midi_path)
+                    if score_parts:
+                        part_id, name = score_parts[index].part_id, score_parts[index].name
+                    else:
+                        part_id = part.id if isinstance(part.id, str) else f"P{index + 1}"
+                        name = part.partName or part_id
+                    midis.append(PartMidi(index=index, part_id=part_id, name=name, midi_path=midi_path))
+        logger.debug(f"MusicXMLからMIDIへの変換が完了しました: {len(midis)} ファイル")
+        return midis
+
+    def _write_note_event_midis(self, note_score: NoteScore, tmpdir: str, split_parts: bool) -> List[PartMidi]:
+        with stage_timer("synthesis_midi"):
+            if not split_parts:
+                midi_path = os.path.join(tmpdir, "output.mid")
+                with open(midi_path, "wb") as f:
+                    f.write(render_midi(note_score))
+                return [PartMidi(index=0, part_id="", name="", midi_path=midi_path)]
+            midis = []
+            for index, part in enumerate(note_score.parts):
+                midi_path = os.path.join(tmpdir, f"part{index}.mid")
+                with open(midi_path, "wb") as f:
+                    f.write(render_midi(note_score, part_ids=[part.part_id]))
+                midis.append(PartMidi(index=index, part_id=part.part_id, name=part.name, midi_path=midi_path))
+        logger.debug(f"ノートイベントからMIDIを書き出しました: {len(midis)} ファイル")
+        return midis
+
+    def _should_split_parts(self, musicxml_content: str, with_stems: bool) -> bool:
+        if with_stems:
+            return True
+        if not settings.SYNTHESIS_PARALLEL_PARTS:
+            return False
+        # パート数は music21 でパースする前に軽量に数える
+        return 2 <= len(list_score_parts(musicxml_content)) <= settings.SYNTHESIS_MAX_PARALLEL_PARTS
+
+    def _fluidsynth_cmd(self, spec: RenditionSpec, midi_path: str) -> List[str]:
+        return [
+            "fluidsynth",
+            "-ni",
+            "-a", "file",
+            "-o", "synth.audio-channels=2",
+            *spec.fluidsynth_options(),
+            "-T", "raw",
+            "-O", "s16",
+            "-F", "-",  # 標準出力に書き出す
+            "-r", str(spec.sample_rate),
+            self.soundfont_path,
+            midi_path,
+        ]
+
+    def _run_encoder_pipeline(
+        self, musicxml_content: str, spec: RenditionSpec, on_data: Callable[[bytes], None], stage: str,
+        with_stems: bool = False,
+    ) -> List[StemAudio]:
+        """
+        FluidSynth の raw PCM 出力を ffmpeg の標準入力につなぎ、エンコーダーの出力を読んだ順に on_data に渡す（ブロッキング処理）。
+        WAV/MP3 の中間ファイルは作らない。
+        複数パートのスコアはパートごとに FluidSynth を起動して別々のコアで合成し、_PcmMixer でミックスしてからエンコードする。
+        """
+        logger.info(f"MusicXMLから {spec.name} レンディション ({spec.format}, {spec.sample_rate}Hz, {spec.channels}ch) の合成を開始します。")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            processes: List[subprocess.Popen] = []
+            try:
+                midis = self._write_midis(musicxml_content, tmpdir, self._should_split_parts(musicxml_content, with_stems))
+                encoder_cmd = [
+                    "ffmpeg", "-hide_banner", "-loglevel", "error",
+                    "-f", "s16le", "-ar", str(spec.sample_rate), "-ac", "2", "-i", "pipe:0",
+                    *spec.encoder_args(),
+                    "pipe:1",
                 ]
-                logger.debug(f"FluidSynthコマンド: {' '.join(fluidsynth_cmd)}")
-                # subprocess.run(fluidsynth_cmd, check=True, capture_output=True)
-                process = subprocess.run(fluidsynth_cmd, capture_output=True, text=True, check=False)
-                logger.debug(f"MIDIからWAVへの変換が完了しました: {wav_path}")
-
-                if process.returncode != 0:
-                    logger.error(f"FluidSynthコマンドの実行に失敗しました。終了コード: {process.returncode}")
-                    logger.error(f"FluidSynth stdout:\n{process.stdout}")
-                    logger.error(f"FluidSynth stderr:\n{process.stderr}") # ★★★ この内容が重要 ★★★
-                    # 元の例外を発生させるか、詳細情報を含めたカスタム例外を発生
-                    raise subprocess.CalledProcessError(process.returncode, process.args, output=process.stdout, stderr=process.stderr)
-
-
-                # 4. WAVをMP3に変換 (pydub)
-                audio = AudioSegment.from_wav(wav_path)
-                # 192kbit/s の品質でMP3にエクスポート
-                audio.export(mp3_path, format="mp3", bitrate="192k")
-                logger.debug(f"WAVからMP3への変換が完了しました: {mp3_path}")
-
-                # 5. MP3ファイルを読み込んでバイト列として返す
-                with open(mp3_path, "rb") as f:
-                    mp3_data = f.read()
-                logger.info("MusicXMLからMP3への合成が成功しました。")
-                return mp3_data
+                mix_parts = len(midis) > 1 or with_stems
+                if mix_parts:
+                    logger.info(f"{len(midis)} パートを並列に合成します。")
+                with ExitStack() as stack:
+                    # 標準エラー出力はパイプだと詰まる可能性があるため、一時ファイルに受ける
+                    def open_log(name: str) -> IO[str]:
+                        return stack.enter_context(open(os.path.join(tmpdir, name), "w+"))
+
+                    logs = []
+                    fluidsynths = []
+                    for midi in midis:
+                        log_file = open_log(f"fluidsynth{midi.index}.log")
+                        fluidsynth = subprocess.Popen(self._fluidsynth_cmd(spec, midi.midi_path), stdout=subprocess.PIPE, stderr=log_file)
+                        processes.append(fluidsynth)
+                        fluidsynths.append(fluidsynth)
+                        logs.append((fluidsynth, log_file))
+
+                    encoder_log = open_log("ffmpeg.log")
+                    mixer: Optional[_PcmMixer] = None
+                    stem_paths = [os.path.join(tmpdir, f"stem{midi.index}.raw") for midi in midis]
+                    if mix_parts:
+                        encoder = subprocess.Popen(encoder_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=encoder_log)
+                        processes.append(encoder)
+                        stem_files = [stack.enter_context(open(path, "wb")) for path in stem_paths] if with_stems else None
+                        mixer = _PcmMixer([p.stdout for p in fluidsynths], encoder.stdin, stem_files)
+                        mixer.start()
+                    else:
+                        encoder = subprocess.Popen(encoder_cmd, stdin=fluidsynths[0].stdout, stdout=subprocess.PIPE, stderr=encoder_log)
+                        processes.append(encoder)
+                        fluidsynths[0].stdout.close()  # ffmpeg が終了したら FluidSynth が SIGPIPE を受け取れるようにする
+                    logs.append((encoder, encoder_log))
 
+                    with stage_timer(stage):
+                        while True:
+                            data = encoder.stdout.read1(STREAM_READ_SIZE)
+                            if not data:
+                                break
+                            on_data(data)
+                    encoder.stdout.close()
+                    if mixer is not None:
+                        mixer.join()
+
+                    for process, log_file in logs:
+                        if process.wait() != 0:
+                            log_file.seek(0)
+                            stderr = log_file.read()
+                            logger.error(f"{process.args[0]} の実行に失敗しました。終了コード: {process.returncode}\n{stderr}")
+                            raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr)
+                    if mixer is not None and mixer.error is not None:
+                        raise mixer.error
+
+                stems: List[StemAudio] = []
+                if with_stems:
+                    stems = self._encode_stems(midis, stem_paths, mixer.total_bytes, stem_rendition(spec), tmpdir)
+                logger.info(f"{spec.name} レンディションの合成が成功しました。")
+                return stems
             except Exception as e:
-                logger.error(f"MusicXMLからMP3への合成中にエラーが発生しました: {e}", exc_info=True)
+                logger.error(f"{spec.name} レンディションの合成中にエラーが発生しました: {e}", exc_info=True)
+                if isinstance(e, AudioSynthesisException):
+                    raise
                 raise AudioSynthesisException(detail=str(e))
+            finally:
+                for process in processes:
+                    if process.poll() is None:
+                        process.kill()
+                        process.wait()
+
+    def _encode_stems(
+        self, midis: List[PartMidi], stem_paths: List[str], total_bytes: int, stem_spec: RenditionSpec, tmpdir: str,
+    ) -> List[StemAudio]:
+        """ミックスと同じ長さまで無音で埋めたうえで、各パートの PCM を並列にエンコードする。"""
+        processes = []
+        try:
+            with stage_timer("synthesis_stems"):
+                for midi, raw_path in zip(midis, stem_paths):
+                    shortfall = total_bytes - os.path.getsize(raw_path)
+                    if shortfall > 0:
+                        with open(raw_path, "ab") as f:
+                            f.write(b"\x00" * shortfall)
+                    output_path = os.path.join(tmpdir, f"stem{midi.index}{stem_spec.extension}")
+                    cmd = [
+                        "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                        "-f", "s16le", "-ar", str(stem_spec.sample_rate), "-ac", "2", "-i", raw_path,
+                        *stem_spec.encoder_args(),
+                        output_path,
+                    ]
+                    processes.append((midi, output_path, subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)))
+
+                stems = []
+                for midi, output_path, process in processes:
+                    _, stderr = process.communicate()
+                    if process.returncode != 0:
+                        raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr.decode("utf-8", "replace"))
+                    with open(output_path, "rb") as f:
+                        stems.append(StemAudio(index=midi.index, part_id=midi.part_id, name=midi.name, data=f.read()))
+            return stems
+        finally:
+            for _, _, process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
 
 # 依存性注入のための関数
 _audio_synthesis_service_instance: Optional[AudioSynthesisService] = None
@@ -0,0 +1,368 @@
+"""
+Vertex AI バッチ予測によるオフライン一括処理
+
+/api/process/batch の mode=offline で使用します。口ずさみ音声の解析・バッキングトラック生成・MusicXML解析の
+3段階を、それぞれ全件分の要求をまとめた1つのバッチ予測ジョブとして順に実行します。
+1件ずつのオンライン呼び出しより料金が安く、オンライン推論のクォータも消費しませんが、
+ジョブの完了まで数分〜数時間かかるため、大量の録音をまとめて事前処理する用途向けです。
+- 各段階はモデルカスケードの先頭のモデルだけで実行し、生成結果が検証に失敗した項目は再生成せずにその項目のエラーとする
+- 1つの段階で失敗した項目は以降の段階の要求に含めない（MusicXML解析の失敗は特徴なしとして扱う）
+
+BatchPredictionClient を差し替えることで Vertex AI なしで動作を確認できます（benchmarks/fakes.py の FakeBatchPredictionClient。
+benchmarks/batch_offline_check.py で項目ごとの結果と失敗の扱いを検証します）。
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+from exceptions import AnalysisFailedException, AppException, ExternalServiceErrorException, GenerationFailedException
+from metrics import stage_timer
+from models import MusicAnalysisFeatures
+from services import prompts
+from services.llm_usage import record_llm_call
+
+if TYPE_CHECKING:
+    from services.gcs_service import GCSService
+
+logger = logging.getLogger(__name__)
+
+# 入力の各行に付けるラベル。出力の行は入力と同じ順序とは限らないため、ラベルで要求と対応付ける
+ITEM_LABEL = "sessionmuse_item"
+TASK_LABEL = "sessionmuse_task"
+
+HUMMING_ANALYSIS_TASK = "humming_analysis"
+GENERATION_TASK = "generation"
+MUSICXML_ANALYSIS_TASK = "musicxml_analysis"
+
+# バッチ予測ジョブの終了状態（google.cloud.aiplatform_v1.types.JobState の名前）
+_SUCCEEDED_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+_FAILED_STATES = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+def labeled_request(request: Dict[str, Any], index: int) -> Dict[str, Any]:
+    """入力の1行。出力の行と要求を対応付けるため、要求の順番を ITEM_LABEL に入れる。"""
+    return {"request": {**request, "labels": {**request.get("labels", {}), ITEM_LABEL: str(index)}}}
+
+
+def responses_from_output_rows(rows: Iterable[Dict[str, Any]], count: int, job_name: str) -> List[Optional[Dict[str, Any]]]:
+    """
+    バッチ予測の出力の行（順不同）を ITEM_LABEL で要求に対応付け、要求と同じ順序の応答の一覧にする。
+    失敗した行（status あり）と、出力に現れなかった要求は None。
+    """
+    responses: List[Optional[Dict[str, Any]]] = [None] * count
+    for row in rows:
+        index = int(row.get("request", {}).get("labels", {}).get(ITEM_LABEL, -1))
+        if not 0 <= index < count:
+            continue
+        if row.get("status"):
+            logger.warning(f"バッチ予測の要求 {index} が失敗しました ({job_name}): {row['status']}")
+            continue
+        responses[index] = row.get("response")
+    return responses
+
+
+class BatchPredictionClient(ABC):
+    """GenerateContentRequest (REST の JSON 形式) の一覧を1つのバッチ予測ジョブとして実行するクライアント。"""
+
+    @abstractmethod
+    async def predict(self, model_name: str, requests: List[Dict[str, Any]], job_name: str) -> List[Optional[Dict[str, Any]]]:
+        """要求と同じ順序で GenerateContentResponse を返す。個別に失敗した要求は None。"""
+
+
+class VertexBatchPredictionClient(BatchPredictionClient):
+    """入力の JSONL を GCS に置いて Vertex AI のバッチ予測ジョブを作成し、完了までポーリングして出力を読み出す。"""
+
+    def __init__(
+        self,
+        gcs_service: "GCSService",
+        location: str = settings.BATCH_PREDICTION_LOCATION,
+        poll_interval_seconds: float = settings.BATCH_PREDICTION_POLL_INTERVAL_SECONDS,
+        timeout_seconds: float = settings.BATCH_PREDICTION_TIMEOUT_SECONDS,
+    ):
+        self.gcs_service = gcs_service
+        self.location = location
+        self.poll_interval_seconds = poll_interval_seconds
+        self.timeout_seconds = timeout_seconds
+
+    async def predict(self, model_name: str, requests: List[Dict[str, Any]], job_name: str) -> List[Optional[Dict[str, Any]]]:
+        bucket_name = settings.GCS_UPLOAD_BUCKET
+        prefix = f"batch/{job_name}"
+        lines = [json.dumps(labeled_request(request, index), ensure_ascii=False) for index, request in enumerate(requests)]
+        input_uri = await self.gcs_service.upload_data_to_gcs(
+            "\n".join(lines), bucket_name, f"{prefix}/input.jsonl", "application/jsonl"
+        )
+
+        # aiplatform は読み込みが重いため、オフライン処理の初回に読み込む
+        from google.cloud import aiplatform
+
+        def create_job() -> "aiplatform.BatchPredictionJob":
+            # vertexai.init はチャット等と共有するグローバル設定のため使わず、リージョンはジョブごとに指定する
+            job = aiplatform.BatchPredictionJob.create(
+                job_display_name=job_name,
+                model_name=f"publishers/google/models/{model_name}",
+                instances_format="jsonl",
+                predictions_format="jsonl",
+                gcs_source=input_uri,
+                gcs_destination_prefix=f"gs://{bucket_name}/{prefix}/output",
+                location=self.location,
+                sync=False,
+            )
+            job.wait_for_resource_creation()
+            return job
+
+        try:
+            job = await run_in_threadpool(create_job)
+        except Exception as e:
+            logger.error(f"バッチ予測ジョブを作成できませんでした ({job_name}): {e}", exc_info=True)
+            raise ExternalServiceErrorException(message="Vertex AI のバッチ予測ジョブを作成できませんでした。", detail=str(e))
+        logger.info(f"バッチ予測ジョブを作成しました: {job.resource_name} (要求数: {len(requests)}, モデル: {model_name})")
+
+        deadline = time.monotonic() + self.timeout_seconds
+        while True:
+            state = (await run_in_threadpool(lambda: job.state)).name
+            if state in _SUCCEEDED_STATES:
+                break
+            if state in _FAILED_STATES:
+                raise ExternalServiceErrorException(
+                    message="Vertex AI のバッチ予測ジョブが失敗しました。", detail=f"{job.resource_name}: {state} {job.error}"
+                )
+            if time.monotonic() >= deadline:
+                await run_in_threadpool(job.cancel)
+                raise ExternalServiceErrorException(
+                    message="Vertex AI のバッチ予測ジョブが制限時間内に完了しませんでした。",
+                    detail=f"{job.resource_name}: timeout_seconds={self.timeout_seconds}",
+                )
+            await asyncio.sleep(self.poll_interval_seconds)
+
+        output_bucket, output_prefix = self.gcs_service.parse_gcs_url(job.output_info.gcs_output_directory + "/")
+        rows = []
+        for blob_name in await self.gcs_service.list_blob_names(output_bucket, output_prefix):
+            if not blob_name.endswith(".jsonl"):
+                continue
+            content = await self.gcs_service.download_file_as_string_from_gcs(f"gs://{output_bucket}/{blob_name}")
+            rows.extend(json.loads(line) for line in content.splitlines() if line.strip())
+        return responses_from_output_rows(rows, len(requests), job_name)
+
+
+def response_text(response: Optional[Dict[str, Any]]) -> Optional[str]:
+    """GenerateContentResponse の最初の候補のテキストを返す（思考部分は除く）。候補がなければ None。"""
+    if not response:
+        return None
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    text = "".join(part.get("text", "") for part in parts if not part.get("thought"))
+    return text or None
+
+
+def _response_schema(model: type) -> Dict[str, Any]:
+    """pydantic モデルの JSON スキーマを Vertex AI の responseSchema（OpenAPI のサブセット）に変換する。"""
+    def convert(schema: Dict[str, Any]) -> Dict[str, Any]:
+        converted: Dict[str, Any] = {"type": schema["type"].upper()}
+        if "description" in schema:
+            converted["description"] = schema["description"]
+        if schema["type"] == "object":
+            converted["properties"] = {name: convert(prop) for name, prop in schema["properties"].items()}
+            converted["required"] = list(schema.get("required", []))
+        elif schema["type"] == "array":
+            converted["items"] = convert(schema["items"])
+        return converted
+    return convert(model.model_json_schema())
+
+
+def _safety_settings() -> List[Dict[str, str]]:
+    from services.audio_analysis_service import get_audio_analyzer
+    return [
+        {"category": category.name, "threshold": threshold.name}
+        for category, threshold in get_audio_analyzer().safety_settings.items()
+    ]
+
+
+def _request(task: str, parts: List[Dict[str, Any]], temperature: float, system_prompt: Optional[str] = None,
+             response_schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    generation_config: Dict[str, Any] = {"temperature": temperature}
+    if response_schema is not None:
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseSchema"] = response_schema
+    request: Dict[str, Any] = {
+        "contents": [{"role": "user", "parts": parts}],
+        "generationConfig": generation_config,
+        "safetySettings": _safety_settings(),
+        "labels": {TASK_LABEL: task},
+    }
+    if system_prompt is not None:
+        request["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+    return request
+
+
+def humming_analysis_request(gcs_uri: str, mime_type: str) -> Dict[str, Any]:
+    # オンラインの解析と同じく、指示と音声を1つのユーザーメッセージで渡す
+    return _request(
+        HUMMING_ANALYSIS_TASK,
+        [{"text": prompts.HUMMING_ANALYSIS_SYSTEM_PROMPT}, {"fileData": {"fileUri": gcs_uri, "mimeType": mime_type}}],
+        temperature=0.3,
+    )
+
+
+def generation_request(humming_theme: str, generation_format: str) -> Dict[str, Any]:
+    from services.audio_analysis_service import build_generation_messages
+    system_message, human_message = build_generation_messages(generation_format, humming_theme)
+    return _request(GENERATION_TASK, [{"text": human_message.content}], temperature=0.7, system_prompt=system_message.content)
+
+
+def musicxml_analysis_request(musicxml_data: str) -> Dict[str, Any]:
+    return _request(
+        MUSICXML_ANALYSIS_TASK, [{"text": musicxml_data}], temperature=0.3,
+        system_prompt=prompts.ANALYZE_MUSICXML_PROMPT, response_schema=_response_schema(MusicAnalysisFeatures),
+    )
+
+
+def _record_usage(task: str, model_name: str, responses: List[Optional[Dict[str, Any]]], duration_seconds: float) -> None:
+    """バッチの応答の usageMetadata を、オンライン呼び出しと同じ集計に「<タスク> [batch]」として記録する。"""
+    for response in responses:
+        if not response:
+            continue
+        usage = response.get("usageMetadata") or {}
+        usage_metadata = {
+            "input_tokens": usage.get("promptTokenCount", 0),
+            "output_tokens": usage.get("candidatesTokenCount", 0),
+            "input_token_details": {"cache_read": usage.get("cachedContentTokenCount", 0)},
+            "output_token_details": {"reasoning": usage.get("thoughtsTokenCount", 0)},
+        }
+        record_llm_call(f"{task} [batch]", model_name, SimpleNamespace(usage_metadata=usage_metadata), duration_seconds)
+
+
+@dataclass
+class OfflineItem:
+    """オフライン処理の1件分の入力と結果。error が設定された項目は以降の段階で処理しない。"""
+
+    gcs_uri: str
+    mime_type: str
+    humming_theme: Optional[str] = None
+    generated_musicxml_data: Optional[str] = None
+    music_analysis_features: Optional[MusicAnalysisFeatures] = None
+    error: Optional[AppException] = None
+
+
+async def _run_stage(
+    client: BatchPredictionClient,
+    task: str,
+    model_name: str,
+    requests: List[Dict[str, Any]],
+    job_name: str,
+) -> List[Optional[Dict[str, Any]]]:
+    start = time.perf_counter()
+    with stage_timer(f"batch_{task}"):
+        responses = await client.predict(model_name, requests, job_name)
+    _record_usage(task, model_name, responses, time.perf_counter() - start)
+    return responses
+
+
+async def run_offline_workflow(
+    items: List[OfflineItem],
+    client: BatchPredictionClient,
+    batch_id: str,
+    on_stage: Optional[Callable[[str, int], None]] = None,
+) -> None:
+    """
+    3段階のバッチ予測を順に実行し、items に結果またはエラーを書き込む。
+    on_stage は各段階の開始時に (段階名, 要求数) で呼ばれる（進捗の通知用）。
+    """
+    from services.audio_analysis_service import (
+        get_audio_analyzer,
+        musicxml_from_generation_output,
+        validate_and_repair_musicxml,
+    )
+    analyzer = get_audio_analyzer()
+    generation_format = settings.MUSICXML_GENERATION_FORMAT
+
+    async def stage(task: str, model_name: str, targets: List[OfflineItem],
+                    build: Callable[[OfflineItem], Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """ジョブ自体が失敗した場合は AppException を送出する。"""
+        if on_stage is not None:
+            on_stage(task, len(targets))
+        if not targets:
+            return []
+        return await _run_stage(client, task, model_name, [build(item) for item in targets], f"{batch_id}-{task}")
+
+    def fail(targets: List[OfflineItem], error: AppException) -> List[Optional[Dict[str, Any]]]:
+        # ジョブ自体の失敗は、その段階の全項目のエラーとする
+        for item in targets:
+            item.error = error
+        return []
+
+    # 1. 口ずさみ音声の解析
+    targets = [item for item in items if item.error is None]
+    try:
+        responses = await stage(HUMMING_ANALYSIS_TASK, analyzer.analyzer_models[0], targets,
+                                lambda item: humming_analysis_request(item.gcs_uri, item.mime_type))
+    except AppException as e:
+        responses = fail(targets, e)
+    for item, response in zip(targets, responses):
+        theme_text = (response_text(response) or "").strip()
+        if not theme_text:
+            item.error = AnalysisFailedException(message="AIが「トラックの雰囲気/テーマ」を返しませんでした (Vertex AI バッチ予測)。")
+        else:
+            item.humming_theme = theme_text
+
+    # 2. バッキングトラックの生成
+    targets = [item for item in items if item.error is None]
+    try:
+        responses = await stage(GENERATION_TASK, analyzer.generator_models[0], targets,
+                                lambda item: generation_request(item.humming_theme, generation_format))
+    except AppException as e:
+        responses = fail(targets, e)
+    for item, response in zip(targets, responses):
+        content = response_text(response)
+        if content is None:
+            item.error = GenerationFailedException(message="Vertex AI がバッキングトラックを返しませんでした (バッチ予測)。")
+            continue
+        try:
+            musicxml_text = musicxml_from_generation_output(content, generation_format, batch_id)
+            item.generated_musicxml_data = validate_and_repair_musicxml(musicxml_text, batch_id)
+        except GenerationFailedException as e:
+            item.error = e
+
+    # 3. MusicXMLの解析（オンラインと同じく、失敗しても項目は音楽的特徴なしで成功とする）
+    targets = [item for item in items if item.error is None]
+    try:
+        responses = await stage(MUSICXML_ANALYSIS_TASK, analyzer.analyzer_models[0], targets,
+                                lambda item: musicxml_analysis_request(item.generated_musicxml_data))
+    except AppException as e:
+        logger.warning(f"MusicXML解析のバッチ予測に失敗しました。音楽的特徴なしで続行します ({batch_id}): {e.message}")
+        responses = []
+    for item, response in zip(targets, responses):
+        content = response_text(response)
+        if content is None:
+            continue
+        try:
+            item.music_analysis_features = MusicAnalysisFeatures.model_validate_json(content)
+        except ValueError as e:
+            logger.warning(f"MusicXML解析のバッチ応答をパースできませんでした ({batch_id}): {e}")
+
+
+def new_batch_id() -> str:
+    # ジョブ名・GCSのプレフィックスに使うため、英小文字・数字・ハイフンのみにする
+    return f"batch-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+_batch_prediction_client_instance: Optional[BatchPredictionClient] = None
+
+
+def get_batch_prediction_client() -> BatchPredictionClient:
+    global _batch_prediction_client_instance
+    if _batch_prediction_client_instance is None:
+        from services.gcs_service import get_gcs_service
+        _batch_prediction_client_instance = VertexBatchPredictionClient(get_gcs_service())
+    return _batch_prediction_client_instance
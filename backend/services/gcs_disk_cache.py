@@ -0,0 +1,162 @@
+# backend/services/gcs_disk_cache.py
+"""
+GCS オブジェクトのローカルディスクキャッシュ
+
+GCSService の読み出しの前段に置く read-through キャッシュです。
+- キーにはオブジェクトの generation を含めるため、上書きされたオブジェクトの古い内容を返すことはない
+- 書き込みは同じディレクトリの一時ファイルに書いてから os.replace するため、読み手が書きかけのファイルを見ることはない
+- 合計バイト数の上限を超えたら、最後に参照された時刻が古いものから削除する (LRU)
+- 大きなオブジェクトはメモリマップして返すため、読み出し時にファイル全体をコピーしない
+
+ファイルI/Oはブロッキング処理のため、呼び出し側（GCSService）でスレッドプールから使用します。
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_TMP_SUFFIX = ".tmp"
+
+
+class GCSDiskCache:
+    def __init__(self, directory: str, max_bytes: int, mmap_threshold_bytes: int = 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap_threshold_bytes = mmap_threshold_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # ファイル名 -> サイズ（先頭ほど古い）
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    @staticmethod
+    def _file_name(bucket_name: str, blob_name: str, generation: Union[int, str]) -> str:
+        return hashlib.sha256(f"{bucket_name}/{blob_name}#{generation}".encode("utf-8")).hexdigest()
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _load_existing(self) -> None:
+        """再起動後もキャッシュを引き継ぐため、既存ファイルを最終更新時刻の古い順に登録する。書きかけの一時ファイルは消す。"""
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(_TMP_SUFFIX):
+                self._unlink_quietly(entry.path)
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict_locked()
+        if found:
+            logger.info(f"GCSディスクキャッシュを読み込みました: {len(self._entries)} 件, {self._total_bytes} bytes", extra={"cache_dir": self.directory})
+
+    @contextmanager
+    def open(self, bucket_name: str, blob_name: str, generation: Union[int, str]) -> Iterator[Optional[Union[bytes, memoryview]]]:
+        """
+        キャッシュ済みの内容を返すコンテキストマネージャー。ない場合は None。
+        mmap_threshold_bytes 以上のオブジェクトは読み取り専用のメモリマップ (memoryview) を返すため、
+        with ブロックの外に持ち出さないこと（必要なら bytes() や str() で変換する）。
+        """
+        file_name = self._file_name(bucket_name, blob_name, generation)
+        with self._lock:
+            known = file_name in self._entries
+            if known:
+                self._entries.move_to_end(file_name)
+        file_obj = None
+        if known:
+            try:
+                file_obj = open(self._path(file_name), "rb")
+            except FileNotFoundError:
+                # 外部から消された場合は索引からも外す
+                with self._lock:
+                    self._total_bytes -= self._entries.pop(file_name, 0)
+        if file_obj is None:
+            with self._lock:
+                self.misses += 1
+            yield None
+            return
+
+        with self._lock:
+            self.hits += 1
+        with file_obj:
+            size = os.fstat(file_obj.fileno()).st_size
+            # 参照時刻を更新し、再起動後の LRU 順序に反映させる
+            try:
+                os.utime(file_obj.fileno())
+            except OSError:
+                pass
+            if size == 0 or size < self.mmap_threshold_bytes:
+                yield file_obj.read()
+                return
+            # 読み出し中に同じキーが削除されても、POSIX ではマップ済みの内容は有効なまま
+            mapped = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+                mapped.close()
+
+    def put(self, bucket_name: str, blob_name: str, generation: Union[int, str], data: Union[bytes, memoryview]) -> bool:
+        """内容を保存する。上限を超える大きさのオブジェクトは保存しない。保存した場合は True。"""
+        size = len(data)
+        if size > self.max_bytes:
+            return False
+        file_name = self._file_name(bucket_name, blob_name, generation)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=_TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._path(file_name))
+        except OSError:
+            self._unlink_quietly(tmp_path)
+            logger.warning(f"GCSディスクキャッシュへの書き込みに失敗しました: gs://{bucket_name}/{blob_name}", exc_info=True)
+            return False
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(file_name, 0)
+            self._entries[file_name] = size
+            self._evict_locked()
+        return True
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            file_name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            self._unlink_quietly(self._path(file_name))
+
+    @staticmethod
+    def _unlink_quietly(path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,20 +1,34 @@
 # backend/services/gcs_service.py
 import logging
 from io import BytesIO
-from typing import Optional
+from typing import TYPE_CHECKING, Callable, List, Optional, TypeVar, Union
 
 from fastapi import UploadFile
 from fastapi.concurrency import run_in_threadpool
-from google.cloud import storage
+from google.api_core import exceptions as google_exceptions
 from google.auth.exceptions import DefaultCredentialsError
 
+from config import settings
 from exceptions import GCSUploadErrorException
+from metrics import stage_timer
+from services.gcs_disk_cache import GCSDiskCache
+
+if TYPE_CHECKING:
+    from google.cloud import storage
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 class GCSService:
-    def __init__(self, storage_client: Optional[storage.Client] = None):
-        self.client = storage_client if storage_client else storage.Client()
+    def __init__(self, storage_client: Optional["storage.Client"] = None, disk_cache: Optional[GCSDiskCache] = None):
+        if storage_client is None:
+            # google.cloud.storage は読み込みが重いため、クライアント生成時に読み込む
+            from google.cloud import storage
+            storage_client = storage.Client()
+        self.client = storage_client
+        # 読み出しの前段に置くローカルディスクキャッシュ (None の場合は常にGCSから読む)
+        self.disk_cache = disk_cache
 
     async def upload_file_obj_to_gcs(
         self, file_obj: UploadFile, bucket_name: str, destination_blob_name: str, content_type: Optional[str] = None
@@ -27,11 +41,12 @@ class GCSService:
             bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(destination_blob_name)
             await file_obj.seek(0)
-            await run_in_threadpool(
-                blob.upload_from_file,
-                file_obj.file,
-                content_type=content_type or file_obj.content_type
-            )
+            with stage_timer("gcs_upload_file"):
+                await run_in_threadpool(
+                    blob.upload_from_file,
+                    file_obj.file,
+                    content_type=content_type or file_obj.content_type
+                )
             gcs_uri = f"gs://{bucket_name}/{destination_blob_name}"
             logger.info(f"Successfully uploaded file object '{file_obj.filename}' to GCS: {gcs_uri}")
             return gcs_uri
@@ -64,11 +79,15 @@ class GCSService:
             bucket = self.client.bucket(bucket_name)
             blob = bucket.blob(destination_blob_name)
             file_like_object = BytesIO(data_bytes)
-            await run_in_threadpool(
-                blob.upload_from_file,
-                file_like_object,
-                content_type=content_type
-            )
+            with stage_timer("gcs_upload_data"):
+                await run_in_threadpool(
+                    blob.upload_from_file,
+                    file_like_object,
+                    content_type=content_type
+                )
+            # 直後にチャット等で読み返される生成物のため、アップロード結果の generation でキャッシュにも書き込む
+            if self.disk_cache is not None and blob.generation is not None:
+                await run_in_threadpool(self.disk_cache.put, bucket_name, destination_blob_name, blob.generation, data_bytes)
             gcs_uri = f"gs://{bucket_name}/{destination_blob_name}"
             logger.info(f"Successfully uploaded data to GCS: {gcs_uri} (Content-Type: {content_type})")
             return gcs_uri
@@ -79,6 +98,52 @@ class GCSService:
             logger.error(f"GCS upload error for data to '{destination_blob_name}': {e}", exc_info=True)
             raise GCSUploadErrorException(message="Failed to upload data to GCS.")
 
+    async def blob_exists(self, bucket_name: str, blob_name: str) -> bool:
+        """オブジェクトが存在するかをメタデータの取得で確認する。"""
+        try:
+            bucket = self.client.bucket(bucket_name)
+            blob = await run_in_threadpool(bucket.get_blob, blob_name)
+            return blob is not None
+        except DefaultCredentialsError as e:
+            logger.error(f"GCS authentication error while checking '{blob_name}': {e}", exc_info=True)
+            raise GCSUploadErrorException(message="GCS authentication/configuration error.")
+        except Exception as e:
+            logger.error(f"GCS metadata lookup error for '{blob_name}': {e}", exc_info=True)
+            raise GCSUploadErrorException(message=f"Failed to look up GCS object: gs://{bucket_name}/{blob_name}.")
+
+    async def object_fingerprint(self, gcs_url: str) -> str:
+        """
+        オブジェクトの内容を識別する値をメタデータから返す（内容はダウンロードしない）。
+        MD5、ない場合（コンポジットオブジェクト）は CRC32C、どちらもない場合はパスと generation。
+        """
+        try:
+            bucket_name, blob_name = self.parse_gcs_url(gcs_url)
+            blob = await run_in_threadpool(self.client.bucket(bucket_name).get_blob, blob_name)
+        except ValueError:
+            raise GCSUploadErrorException(message=f"Invalid GCS URL format: {gcs_url}.")
+        except Exception as e:
+            logger.error(f"GCS metadata lookup error for '{gcs_url}': {e}", exc_info=True)
+            raise GCSUploadErrorException(message=f"Failed to look up GCS object: {gcs_url}.")
+        if blob is None:
+            raise GCSUploadErrorException(message=f"GCS object does not exist: {gcs_url}.")
+        if blob.md5_hash:
+            return f"md5:{blob.md5_hash}"
+        if blob.crc32c:
+            return f"crc32c:{blob.crc32c}"
+        return f"{bucket_name}/{blob_name}#{blob.generation}"
+
+    async def list_blob_names(self, bucket_name: str, prefix: str) -> List[str]:
+        """prefix で始まるオブジェクト名の一覧を返す。"""
+        try:
+            blobs = await run_in_threadpool(lambda: list(self.client.list_blobs(bucket_name, prefix=prefix)))
+            return [blob.name for blob in blobs]
+        except DefaultCredentialsError as e:
+            logger.error(f"GCS authentication error while listing '{prefix}': {e}", exc_info=True)
+            raise GCSUploadErrorException(message="GCS authentication/configuration error.")
+        except Exception as e:
+            logger.error(f"GCS list error for 'gs://{bucket_name}/{prefix}': {e}", exc_info=True)
+            raise GCSUploadErrorException(message=f"Failed to list GCS objects: gs://{bucket_name}/{prefix}.")
+
     def get_gcs_public_url(self, bucket_name: str, blob_name: str) -> str:
         """
         Generates the public URL for a GCS object.
@@ -86,7 +151,7 @@ class GCSService:
         """
         return f"https://storage.googleapis.com/{bucket_name}/{blob_name}"
 
-    def _parse_gcs_url(self, gcs_url: str) -> tuple[str, str]:
+    def parse_gcs_url(self, gcs_url: str) -> tuple[str, str]:
         """
         Parses a GCS URL (gs://bucket/object or https://storage.googleapis.com/bucket/object)
         and returns (bucket_name, blob_name).
@@ -102,28 +167,55 @@ class GCSService:
                 return parts[0], parts[1]
         raise ValueError(f"Invalid GCS URL format: {gcs_url}")
 
+    def _read_through(self, bucket_name: str, blob_name: str, transform: Callable[[Union[bytes, memoryview]], T]) -> T:
+        """
+        オブジェクトを読み出して transform に渡す（ブロッキング処理。スレッドプールから呼ぶ）。
+        ディスクキャッシュがある場合は、メタデータで現在の generation を確認してからキャッシュを参照し、
+        ない場合はその generation を指定してダウンロードしてキャッシュに保存する。
+        """
+        bucket = self.client.bucket(bucket_name)
+        if self.disk_cache is None:
+            return transform(bucket.blob(blob_name).download_as_bytes())
+
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            raise google_exceptions.NotFound(f"gs://{bucket_name}/{blob_name} does not exist.")
+        with self.disk_cache.open(bucket_name, blob_name, blob.generation) as cached:
+            if cached is not None:
+                logger.debug(f"GCS disk cache hit: gs://{bucket_name}/{blob_name}#{blob.generation}")
+                return transform(cached)
+        # 確認後に上書きされた場合は 412 となり、古い generation の内容を別の generation として保存することはない
+        data = blob.download_as_bytes(if_generation_match=blob.generation)
+        self.disk_cache.put(bucket_name, blob_name, blob.generation, data)
+        return transform(data)
+
     async def download_file_as_string_from_gcs(self, gcs_url: str, encoding: str = "utf-8") -> str:
         """
         Downloads a file from GCS given its GCS URL and returns its content as a string.
         """
+        return await self._download(gcs_url, lambda data: str(data, encoding))
+
+    async def download_bytes_from_gcs(self, gcs_url: str) -> bytes:
+        """GCS のオブジェクトをバイト列として読み出す（ワーカーがジョブの入力を受け取る際に使用）。"""
+        return await self._download(gcs_url, bytes)
+
+    async def _download(self, gcs_url: str, transform: Callable[[Union[bytes, memoryview]], T]) -> T:
         try:
-            bucket_name, blob_name = self._parse_gcs_url(gcs_url)
-            bucket = self.client.bucket(bucket_name)
-            blob = bucket.blob(blob_name)
+            bucket_name, blob_name = self.parse_gcs_url(gcs_url)
 
             logger.info(f"Attempting to download GCS object: gs://{bucket_name}/{blob_name}")
 
             # Use run_in_threadpool for the blocking GCS download call
-            file_bytes = await run_in_threadpool(blob.download_as_bytes)
+            with stage_timer("gcs_download"):
+                content = await run_in_threadpool(self._read_through, bucket_name, blob_name, transform)
 
-            content = file_bytes.decode(encoding)
-            logger.info(f"Successfully downloaded and decoded GCS object: gs://{bucket_name}/{blob_name}")
+            logger.info(f"Successfully downloaded GCS object: gs://{bucket_name}/{blob_name}")
             return content
         except DefaultCredentialsError as e:
             logger.error(f"GCS authentication error while downloading '{gcs_url}': {e}", exc_info=True)
             # Consider a more specific exception, e.g., GCSDownloadErrorException
             raise GCSUploadErrorException(message=f"GCS authentication/configuration error during download from {gcs_url}.")
-        except ValueError as e: # From _parse_gcs_url
+        except ValueError as e: # From parse_gcs_url
             logger.error(f"Invalid GCS URL format for download: {gcs_url} - {e}", exc_info=True)
             raise GCSUploadErrorException(message=f"Invalid GCS URL format: {gcs_url}.") # Or a more specific client error
         except Exception as e:
@@ -133,9 +225,27 @@ class GCSService:
             # Or re-raise specific Google Cloud exceptions if the caller should handle them.
             raise GCSUploadErrorException(message=f"Failed to download file from GCS: {gcs_url}. Error: {type(e).__name__}")
 
+def create_disk_cache() -> Optional[GCSDiskCache]:
+    if not settings.GCS_DISK_CACHE_ENABLED:
+        return None
+    try:
+        return GCSDiskCache(
+            settings.GCS_DISK_CACHE_DIR,
+            max_bytes=settings.GCS_DISK_CACHE_MAX_MB * 1024 * 1024,
+            mmap_threshold_bytes=settings.GCS_DISK_CACHE_MMAP_THRESHOLD_KB * 1024,
+        )
+    except OSError as e:
+        # キャッシュが使えなくても GCS からの読み出しは継続できる
+        logger.warning(f"GCSディスクキャッシュを初期化できませんでした ({settings.GCS_DISK_CACHE_DIR}): {e}")
+        return None
+
 
 # Helper function to get an instance of the service, potentially with dependency injection in mind for FastAPI
+_gcs_service_instance: Optional[GCSService] = None
+
 def get_gcs_service() -> GCSService:
-    # In a FastAPI context, you might initialize this with settings or manage its lifecycle.
-    # For now, a simple instantiation.
-    return GCSService()
+    # storage.Client の生成（認証情報の解決・HTTPセッション作成）はリクエストごとに行わず、プロセス内で共有する
+    global _gcs_service_instance
+    if _gcs_service_instance is None:
+        _gcs_service_instance = GCSService(disk_cache=create_disk_cache())
+    return _gcs_service_instance
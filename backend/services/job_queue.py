@@ -0,0 +1,539 @@
+# backend/services/job_queue.py
+"""
+音声変換・音声合成のジョブキュー
+
+CPU を使う変換・合成を API プロセスから切り離し、worker.py（レンダリング・変換ワーカー）で実行するためのキューです。
+ジョブの入力と出力は GCS に置き、キューにはそのパスと小さな JSON だけを載せます。
+API とワーカーは別々の台数・インスタンスサイズでスケールできます。
+
+バックエンド (JOB_QUEUE_BACKEND):
+- sqlite: ローカルの SQLite ファイル。同じホスト（または共有ボリューム）上の API とワーカーで使う開発・小規模向け
+- redis: Redis または互換サービス。複数インスタンス構成向け（redis パッケージが必要）
+
+ワーカーが取得したジョブにはリースが付き、実行中は延長されます。ワーカーが落ちてリースが切れたジョブは、
+JOB_QUEUE_MAX_ATTEMPTS 回まで別のワーカーが再実行します。
+投入時に dedup_key を指定すると、同じキーの未完了のジョブがあればそれを返し、新たには投入しません
+（同じ出力を書き込むジョブの重複を防ぐ）。
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+TERMINAL_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# リース切れの再実行が上限に達したジョブに記録するエラー（services.jobs のエラー形式に合わせる）
+LEASE_EXPIRED_ERROR = {
+    "error_code": "EXTERNAL_SERVICE_ERROR",
+    "message": "レンダリング・変換ワーカーがジョブの実行中に応答しなくなりました。",
+    "detail": None,
+    "status_code": 503,
+}
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: Dict[str, Any]
+    status: str = JOB_QUEUED
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[Dict[str, Any]] = None  # error_code, message, detail, status_code
+    attempts: int = 0
+    created_at: float = 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+
+class JobQueue(ABC):
+    """ジョブの投入（API）と取得・完了報告（ワーカー）、完了待ち（API）を行う。"""
+
+    def __init__(
+        self,
+        lease_seconds: float = settings.JOB_QUEUE_LEASE_SECONDS,
+        max_attempts: int = settings.JOB_QUEUE_MAX_ATTEMPTS,
+        retention_seconds: float = settings.JOB_QUEUE_RETENTION_SECONDS,
+        poll_interval: float = 0.2,
+    ):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+
+    @abstractmethod
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> Job:
+        """ジョブを投入する。dedup_key が同じ未完了（queued / running）のジョブがあれば、投入せずにそれを返す。"""
+
+    @abstractmethod
+    async def claim(self, kinds: Sequence[str], worker_id: str, timeout: float) -> Optional[Job]:
+        """kinds のいずれかのジョブを投入順に1件取得し、実行中にする。timeout 秒待ってもなければ None。"""
+
+    @abstractmethod
+    async def extend_lease(self, job_id: str, worker_id: str) -> bool:
+        """リースを延長する。リースが切れて他のワーカーに渡っていた場合は False。"""
+
+    @abstractmethod
+    async def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def fail(self, job_id: str, worker_id: str, error: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    async def wait(self, job_id: str, timeout: float) -> Job:
+        """ジョブが完了（成功・失敗）するまで待つ。timeout 秒を超えた場合は asyncio.TimeoutError。"""
+
+    @abstractmethod
+    async def stats(self) -> Dict[str, Any]:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    SQLite のテーブルをキューとして使う。取得は1つの UPDATE ... RETURNING で行うため、
+    複数のワーカープロセスが同じジョブを取得することはない。完了待ち・取得待ちはポーリング。
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        dedup_key TEXT,
+        worker_id TEXT,
+        lease_until REAL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, kind, created_at);
+    """
+
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._last_cleanup = 0.0
+        conn = self._connect()
+        conn.executescript(self._SCHEMA)
+        if "dedup_key" not in {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}:
+            # dedup_key を追加する前に作られたデータベース。API とワーカーが同時に追加した場合は先の追加を使う
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN dedup_key TEXT")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_dedup_key ON jobs (dedup_key, status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # 接続はスレッドごとに作り、スレッドプールのスレッドで使い回す
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # API とワーカーの読み書きが互いを待たないよう WAL にする
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            status=row["status"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=json.loads(row["error"]) if row["error"] else None,
+            attempts=row["attempts"],
+            created_at=row["created_at"],
+        )
+
+    def _enqueue_sync(self, kind: str, payload: Dict[str, Any], dedup_key: Optional[str]) -> Job:
+        conn = self._connect()
+        now = time.time()
+        job = Job(id=str(uuid.uuid4()), kind=kind, payload=payload, created_at=now)
+        # 未完了のジョブの確認と投入の間に他のプロセスが投入しないよう、書き込みロックを取ってから確認する
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedup_key is not None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE dedup_key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1",
+                    (dedup_key, JOB_QUEUED, JOB_RUNNING),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return self._row_to_job(row)
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, status, dedup_key, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, kind, json.dumps(payload), JOB_QUEUED, dedup_key, now, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job
+
+    def _claim_sync(self, kinds: Sequence[str], worker_id: str) -> Optional[Job]:
+        conn = self._connect()
+        now = time.time()
+        # リース切れのまま再実行の上限に達したジョブは失敗にする
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND lease_until < ? AND attempts >= ?",
+            (JOB_FAILED, json.dumps(LEASE_EXPIRED_ERROR), now, JOB_RUNNING, now, self.max_attempts),
+        )
+        placeholders = ", ".join("?" for _ in kinds)
+        row = conn.execute(
+            f"""
+            UPDATE jobs SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE kind IN ({placeholders}) AND (status = ? OR (status = ? AND lease_until < ?))
+                ORDER BY created_at LIMIT 1
+            )
+            RETURNING *
+            """,
+            (JOB_RUNNING, worker_id, now + self.lease_seconds, now, *kinds, JOB_QUEUED, JOB_RUNNING, now),
+        ).fetchone()
+        if now - self._last_cleanup > 60.0:
+            self._last_cleanup = now
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JOB_SUCCEEDED, JOB_FAILED, now - self.retention_seconds),
+            )
+        return self._row_to_job(row) if row is not None else None
+
+    def _extend_lease_sync(self, job_id: str, worker_id: str) -> bool:
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            (now + self.lease_seconds, now, job_id, worker_id, JOB_RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def _finish_sync(self, job_id: str, worker_id: str, status: str, column: str, value: Dict[str, Any]) -> bool:
+        cursor = self._connect().execute(
+            f"UPDATE jobs SET status = ?, {column} = ?, lease_until = NULL, updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+            (status, json.dumps(value), time.time(), job_id, worker_id, JOB_RUNNING),
+        )
+        return cursor.rowcount == 1
+
+    def _get_sync(self, job_id: str) -> Optional[Job]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def _stats_sync(self) -> Dict[str, Any]:
+        rows = self._connect().execute("SELECT kind, status, COUNT(*) AS n FROM jobs GROUP BY kind, status").fetchall()
+        counts: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            counts.setdefault(row["kind"], {})[row["status"]] = row["n"]
+        return {"backend": "sqlite", "jobs": counts}
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> Job:
+        return await run_in_threadpool(self._enqueue_sync, kind, payload, dedup_key)
+
+    async def claim(self, kinds: Sequence[str], worker_id: str, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await run_in_threadpool(self._claim_sync, kinds, worker_id)
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    async def extend_lease(self, job_id: str, worker_id: str) -> bool:
+        return await run_in_threadpool(self._extend_lease_sync, job_id, worker_id)
+
+    async def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> None:
+        if not await run_in_threadpool(self._finish_sync, job_id, worker_id, JOB_SUCCEEDED, "result", result):
+            logger.warning(f"ジョブ {job_id} はリースが切れて他のワーカーに渡ったため、完了を記録しません。")
+
+    async def fail(self, job_id: str, worker_id: str, error: Dict[str, Any]) -> None:
+        if not await run_in_threadpool(self._finish_sync, job_id, worker_id, JOB_FAILED, "error", error):
+            logger.warning(f"ジョブ {job_id} はリースが切れて他のワーカーに渡ったため、失敗を記録しません。")
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await run_in_threadpool(self._get_sync, job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Job:
+        deadline = time.monotonic() + timeout
+        # 短いジョブの完了をすぐに拾えるよう、最初は短い間隔で確認する
+        interval = 0.02
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job.done:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"job {job_id} did not finish within {timeout}s")
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, self.poll_interval)
+
+    async def stats(self) -> Dict[str, Any]:
+        return await run_in_threadpool(self._stats_sync)
+
+    async def close(self) -> None:
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+# リース切れのジョブの回収と、キューからの取り出しを1回の往復でアトミックに行う
+# KEYS[1]: リースの sorted set, KEYS[2..]: 種類ごとのキュー
+# ARGV: now, lease_until, worker_id, max_attempts, key_prefix, retention_seconds, lease_expired_error
+_REDIS_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local prefix = ARGV[5]
+local retention = tonumber(ARGV[6])
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)) do
+  redis.call('ZREM', KEYS[1], job_id)
+  local job_key = prefix .. 'job:' .. job_id
+  local state = redis.call('HMGET', job_key, 'kind', 'attempts')
+  if state[1] then
+    if tonumber(state[2]) >= tonumber(ARGV[4]) then
+      redis.call('HSET', job_key, 'status', 'failed', 'error', ARGV[7])
+      redis.call('EXPIRE', job_key, retention)
+      redis.call('RPUSH', prefix .. 'done:' .. job_id, '1')
+      redis.call('EXPIRE', prefix .. 'done:' .. job_id, retention)
+    else
+      redis.call('HSET', job_key, 'status', 'queued')
+      redis.call('RPUSH', prefix .. 'queue:' .. state[1], job_id)
+    end
+  end
+end
+for i = 2, #KEYS do
+  local job_id = redis.call('RPOP', KEYS[i])
+  if job_id then
+    local job_key = prefix .. 'job:' .. job_id
+    redis.call('HSET', job_key, 'status', 'running', 'worker_id', ARGV[3])
+    redis.call('HINCRBY', job_key, 'attempts', 1)
+    redis.call('ZADD', KEYS[1], ARGV[2], job_id)
+    return job_id
+  end
+end
+return false
+"""
+
+# 同じ dedup_key の未完了のジョブの確認と投入を1回の往復でアトミックに行う
+# KEYS[1]: dedup_key が指すジョブID, KEYS[2]: 新しいジョブのハッシュ, KEYS[3]: 種類ごとのキュー
+# ARGV: job_id, kind, payload, created_at, key_prefix, retention_seconds
+_REDIS_ENQUEUE_DEDUP_SCRIPT = """
+local existing = redis.call('GET', KEYS[1])
+if existing then
+  local status = redis.call('HGET', ARGV[5] .. 'job:' .. existing, 'status')
+  if status == 'queued' or status == 'running' then
+    return existing
+  end
+end
+redis.call('HSET', KEYS[2], 'kind', ARGV[2], 'payload', ARGV[3], 'status', 'queued', 'attempts', 0, 'created_at', ARGV[4])
+redis.call('LPUSH', KEYS[3], ARGV[1])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[6])
+return ARGV[1]
+"""
+
+# KEYS[1]: リースの sorted set, KEYS[2]: ジョブのハッシュ
+# ARGV: job_id, worker_id, lease_until
+_REDIS_EXTEND_LEASE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[2], 'status', 'worker_id')
+if state[1] ~= 'running' or state[2] ~= ARGV[2] then
+  return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+# KEYS[1]: リースの sorted set, KEYS[2]: ジョブのハッシュ, KEYS[3]: 完了通知のリスト
+# ARGV: job_id, worker_id, status, field, value, retention_seconds
+_REDIS_FINISH_SCRIPT = """
+local state = redis.call('HMGET', KEYS[2], 'status', 'worker_id')
+if state[1] ~= 'running' or state[2] ~= ARGV[2] then
+  return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], 'status', ARGV[3], ARGV[4], ARGV[5])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+redis.call('RPUSH', KEYS[3], '1')
+redis.call('EXPIRE', KEYS[3], ARGV[6])
+return 1
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Redis のリスト（種類ごとのキュー）とハッシュ（ジョブの状態）、リースの sorted set で構成するキュー。
+    状態の遷移は Lua スクリプトで行う。完了待ちは完了通知のリストに対する BLPOP。
+    """
+
+    def __init__(self, url: str, key_prefix: str = "sessionmuse:jobs:", **kwargs: Any):
+        super().__init__(**kwargs)
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("JOB_QUEUE_BACKEND=redis には redis パッケージが必要です。") from e
+        self._client = redis_asyncio.from_url(url, decode_responses=True)
+        self._claim_script = self._client.register_script(_REDIS_CLAIM_SCRIPT)
+        self._enqueue_dedup_script = self._client.register_script(_REDIS_ENQUEUE_DEDUP_SCRIPT)
+        self._extend_lease_script = self._client.register_script(_REDIS_EXTEND_LEASE_SCRIPT)
+        self._finish_script = self._client.register_script(_REDIS_FINISH_SCRIPT)
+        self.key_prefix = key_prefix
+
+    def _key(self, *parts: str) -> str:
+        return self.key_prefix + ":".join(parts)
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> Job:
+        job = Job(id=str(uuid.uuid4()), kind=kind, payload=payload, created_at=time.time())
+        if dedup_key is not None:
+            job_id = await self._enqueue_dedup_script(
+                keys=[self._key("dedup", dedup_key), self._key("job", job.id), self._key("queue", kind)],
+                args=[job.id, kind, json.dumps(payload), job.created_at, self.key_prefix, int(self.retention_seconds)],
+            )
+            if job_id != job.id:
+                return await self.get(job_id) or job
+            return job
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key("job", job.id), mapping={
+                "kind": kind,
+                "payload": json.dumps(payload),
+                "status": JOB_QUEUED,
+                "attempts": 0,
+                "created_at": job.created_at,
+            })
+            pipe.lpush(self._key("queue", kind), job.id)
+            await pipe.execute()
+        return job
+
+    async def claim(self, kinds: Sequence[str], worker_id: str, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            job_id = await self._claim_script(
+                keys=[self._key("leases"), *(self._key("queue", kind) for kind in kinds)],
+                args=[
+                    now, now + self.lease_seconds, worker_id, self.max_attempts,
+                    self.key_prefix, int(self.retention_seconds), json.dumps(LEASE_EXPIRED_ERROR),
+                ],
+            )
+            if job_id:
+                return await self.get(job_id)
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    async def extend_lease(self, job_id: str, worker_id: str) -> bool:
+        extended = await self._extend_lease_script(
+            keys=[self._key("leases"), self._key("job", job_id)],
+            args=[job_id, worker_id, time.time() + self.lease_seconds],
+        )
+        return int(extended) == 1
+
+    async def _finish(self, job_id: str, worker_id: str, status: str, field: str, value: Dict[str, Any]) -> bool:
+        finished = await self._finish_script(
+            keys=[self._key("leases"), self._key("job", job_id), self._key("done", job_id)],
+            args=[job_id, worker_id, status, field, json.dumps(value), int(self.retention_seconds)],
+        )
+        return int(finished) == 1
+
+    async def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> None:
+        if not await self._finish(job_id, worker_id, JOB_SUCCEEDED, "result", result):
+            logger.warning(f"ジョブ {job_id} はリースが切れて他のワーカーに渡ったため、完了を記録しません。")
+
+    async def fail(self, job_id: str, worker_id: str, error: Dict[str, Any]) -> None:
+        if not await self._finish(job_id, worker_id, JOB_FAILED, "error", error):
+            logger.warning(f"ジョブ {job_id} はリースが切れて他のワーカーに渡ったため、失敗を記録しません。")
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        fields = await self._client.hgetall(self._key("job", job_id))
+        if not fields:
+            return None
+        return Job(
+            id=job_id,
+            kind=fields["kind"],
+            payload=json.loads(fields["payload"]),
+            status=fields["status"],
+            result=json.loads(fields["result"]) if fields.get("result") else None,
+            error=json.loads(fields["error"]) if fields.get("error") else None,
+            attempts=int(fields.get("attempts", 0)),
+            created_at=float(fields.get("created_at", 0.0)),
+        )
+
+    async def wait(self, job_id: str, timeout: float) -> Job:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job.done:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError(f"job {job_id} did not finish within {timeout}s")
+            # 同じジョブを複数のリクエストが待つ場合、通知を受け取れるのは1つだけなので、短い間隔で状態も確認する
+            await self._client.blpop([self._key("done", job_id)], timeout=min(remaining, 1.0))
+
+    async def stats(self) -> Dict[str, Any]:
+        queued: Dict[str, int] = {}
+        async for key in self._client.scan_iter(match=self._key("queue", "*")):
+            queued[key[len(self._key("queue", "")):]] = await self._client.llen(key)
+        return {"backend": "redis", "queued": queued, "running": await self._client.zcard(self._key("leases"))}
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_job_queue() -> JobQueue:
+    if settings.JOB_QUEUE_BACKEND == "redis":
+        if not settings.JOB_QUEUE_REDIS_URL:
+            raise RuntimeError("JOB_QUEUE_BACKEND=redis の場合は JOB_QUEUE_REDIS_URL を設定してください。")
+        return RedisJobQueue(settings.JOB_QUEUE_REDIS_URL)
+    if settings.JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueue(settings.JOB_QUEUE_SQLITE_PATH)
+    raise RuntimeError(f"JOB_QUEUE_BACKEND={settings.JOB_QUEUE_BACKEND} ではジョブキューを使用しません。")
+
+
+_job_queue_instance: Optional[JobQueue] = None
+
+def get_job_queue() -> Optional[JobQueue]:
+    """JOB_QUEUE_BACKEND=inline の場合は None（変換・合成は API プロセス内で実行する）。"""
+    global _job_queue_instance
+    if settings.JOB_QUEUE_BACKEND == "inline":
+        return None
+    if _job_queue_instance is None:
+        _job_queue_instance = create_job_queue()
+    return _job_queue_instance
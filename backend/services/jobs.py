@@ -0,0 +1,170 @@
+# backend/services/jobs.py
+"""
+ジョブキューで実行するジョブの定義
+
+API とワーカーの間で受け渡すのは GCS 上のパスと小さな JSON だけで、音声データはキューに載せません。
+- convert: アップロードされた音声 (GCS) を WAV に変換して original/ に保存する
+- render: 保存済みの MusicXML (GCS) からレンディション（とステム）を合成して保存する
+
+ジョブ内で発生した AppException はエラーコード・ステータスごと記録し、API 側で同じ内容の例外として送出します。
+"""
+
+import asyncio
+import logging
+from dataclasses import asdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+from exceptions import AppException, AudioConversionException, ExternalServiceErrorException
+from metrics import stage_timer
+from models import ErrorCode
+from services.job_queue import JOB_FAILED, Job, JobQueue
+from services.renditions import RenditionSpec, rendition_blob_name, stem_blob_name, stem_rendition
+
+logger = logging.getLogger(__name__)
+
+JOB_KIND_CONVERT = "convert"
+JOB_KIND_RENDER = "render"
+JOB_KINDS = (JOB_KIND_CONVERT, JOB_KIND_RENDER)
+
+
+def convert_job_payload(source_uri: str, source_format: str, destination_blob_name: str) -> Dict[str, Any]:
+    return {
+        "source_uri": source_uri,
+        "source_format": source_format,
+        "bucket": settings.GCS_UPLOAD_BUCKET,
+        "destination_blob_name": destination_blob_name,
+    }
+
+
+def render_job_payload(track_id: str, musicxml_uri: str, spec: RenditionSpec, with_stems: bool = False) -> Dict[str, Any]:
+    return {
+        "track_id": track_id,
+        "musicxml_uri": musicxml_uri,
+        "rendition": asdict(spec),
+        "with_stems": with_stems,
+    }
+
+
+def render_job_dedup_key(track_id: str, spec: RenditionSpec) -> str:
+    """同じレンディションの保存先に書き込むレンダリングジョブを1つにまとめるためのキー。"""
+    return f"{JOB_KIND_RENDER}:{rendition_blob_name(track_id, spec)}"
+
+
+async def run_convert_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """アップロードされた音声を WAV に変換して保存する。結果は保存先の GCS URI。"""
+    from services.audio_conversion_service import AudioConversionError, AudioConversionService
+    from services.gcs_service import get_gcs_service
+
+    gcs_service = get_gcs_service()
+    audio_data = await gcs_service.download_bytes_from_gcs(payload["source_uri"])
+    try:
+        with stage_timer("audio_conversion"):
+            wav_data = await run_in_threadpool(AudioConversionService.convert_to_wav, audio_data, payload["source_format"])
+    except AudioConversionError as e:
+        raise AudioConversionException(f"音声ファイルの変換に失敗しました: {str(e)}")
+    uri = await gcs_service.upload_data_to_gcs(
+        data=wav_data,
+        bucket_name=payload["bucket"],
+        destination_blob_name=payload["destination_blob_name"],
+        content_type="audio/wav",
+    )
+    return {"uri": uri}
+
+
+async def run_render_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """MusicXML からレンディションを合成して保存する。結果は保存先の blob 名（ステムを含む）。"""
+    from services.audio_synthesis_service import get_audio_synthesis_service
+    from services.gcs_service import get_gcs_service
+
+    gcs_service = get_gcs_service()
+    spec = RenditionSpec(**payload["rendition"])
+    track_id = payload["track_id"]
+    musicxml_content = await gcs_service.download_file_as_string_from_gcs(payload["musicxml_uri"])
+    rendered = await get_audio_synthesis_service().render_rendition(musicxml_content, spec, with_stems=payload["with_stems"])
+
+    # ステムを先に保存する（ミックスが保存済みなら、ステムもすべて保存済みとみなせるようにする）
+    stem_spec = stem_rendition(spec)
+    stems = []
+    for stem in rendered.stems:
+        stem_blob = stem_blob_name(track_id, stem.index, stem_spec)
+        await gcs_service.upload_data_to_gcs(
+            data=stem.data,
+            bucket_name=settings.GCS_TRACK_BUCKET,
+            destination_blob_name=stem_blob,
+            content_type=stem_spec.content_type,
+        )
+        stems.append({"index": stem.index, "part_id": stem.part_id, "name": stem.name, "blob_name": stem_blob})
+    blob_name = rendition_blob_name(track_id, spec)
+    await gcs_service.upload_data_to_gcs(
+        data=rendered.data,
+        bucket_name=settings.GCS_TRACK_BUCKET,
+        destination_blob_name=blob_name,
+        content_type=spec.content_type,
+    )
+    return {"blob_name": blob_name, "stems": stems}
+
+
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = {
+    JOB_KIND_CONVERT: run_convert_job,
+    JOB_KIND_RENDER: run_render_job,
+}
+
+
+async def execute_job(job: Job) -> Dict[str, Any]:
+    handler = JOB_HANDLERS.get(job.kind)
+    if handler is None:
+        raise ValueError(f"未知のジョブの種類です: {job.kind}")
+    return await handler(job.payload)
+
+
+def job_error_payload(error: Exception) -> Dict[str, Any]:
+    """ジョブの失敗をキューに記録する形式に変換する。"""
+    if isinstance(error, AppException):
+        return {
+            "error_code": error.error_code.value,
+            "message": error.message,
+            "detail": error.detail,
+            "status_code": error.status_code,
+        }
+    return {
+        "error_code": ErrorCode.INTERNAL_SERVER_ERROR.value,
+        "message": "ジョブの実行中に予期しないエラーが発生しました。",
+        "detail": f"{type(error).__name__}: {error}",
+        "status_code": 500,
+    }
+
+
+def exception_from_job_error(error: Dict[str, Any]) -> AppException:
+    try:
+        error_code = ErrorCode(error.get("error_code"))
+    except ValueError:
+        error_code = ErrorCode.INTERNAL_SERVER_ERROR
+    return AppException(
+        message=error.get("message"),
+        detail=error.get("detail"),
+        error_code=error_code,
+        status_code=error.get("status_code", 500),
+    )
+
+
+async def run_job(queue: JobQueue, kind: str, payload: Dict[str, Any], dedup_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    ジョブを投入して完了を待ち、結果を返す。失敗した場合はワーカー側の例外を送出する。
+    dedup_key が同じ未完了のジョブがあれば、新たに投入せずにその完了を待つ。
+    """
+    job = await queue.enqueue(kind, payload, dedup_key=dedup_key)
+    logger.info(f"ジョブを投入しました: {kind} (job_id={job.id})")
+    try:
+        with stage_timer(f"job_{kind}"):
+            job = await queue.wait(job.id, settings.JOB_QUEUE_WAIT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise ExternalServiceErrorException(
+            message="レンダリング・変換ワーカーの処理が時間内に完了しませんでした。",
+            detail=f"kind={kind}, job_id={job.id}",
+        )
+    if job.status == JOB_FAILED:
+        raise exception_from_job_error(job.error or {})
+    return job.result or {}
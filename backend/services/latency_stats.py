@@ -0,0 +1,38 @@
+"""
+レイテンシ統計ユーティリティ
+
+直近の呼び出し時間をスライディングウィンドウで保持し、パーセンタイルを求めます。
+リクエストのヘッジングやタイムアウトの調整など、観測値に基づく判断に利用します。
+"""
+
+import math
+from collections import deque
+from typing import Deque, List, Optional
+
+
+class LatencyWindow:
+    """直近 max_samples 件の所要時間（秒）を保持するウィンドウ。"""
+
+    def __init__(self, max_samples: int = 200):
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+
+    def record(self, duration_seconds: float) -> None:
+        self._samples.append(duration_seconds)
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        q (0.0〜1.0) パーセンタイルを返す。サンプルがない場合は None。
+        最近傍順位法で計算する。
+        """
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        rank = max(1, math.ceil(q * len(ordered)))
+        return ordered[min(rank, len(ordered)) - 1]
+
+    def samples_above(self, threshold_seconds: float) -> List[float]:
+        return [s for s in self._samples if s > threshold_seconds]
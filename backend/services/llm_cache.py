@@ -0,0 +1,462 @@
+# backend/services/llm_cache.py
+"""
+LLM 応答キャッシュ
+
+AudioAnalyzer の Vertex AI 呼び出し（口ずさみ解析・バッキングトラック生成・MusicXML解析）の応答を、
+(モデル, temperature, プロンプトのハッシュ, メディアのハッシュ) をキーとして保存します。
+同じ音声の解析・同じMusicXMLの解析・ベンチマークや再実行での同一リクエストには Vertex AI を呼ばずに応答します。
+メディア（口ずさみ音声）は GCS のメタデータの MD5（ない場合は CRC32C）で識別するため、
+同じ音声を別のパスにアップロードし直した場合もキャッシュが使われます。
+
+バックエンド (LLM_CACHE_BACKEND):
+- memory: プロセス内。再起動で消える
+- disk: ローカルディスクのファイル。再起動後も引き継ぐ
+- sqlite: SQLite ファイル。同じホスト（または共有ボリューム）上の API・ワーカープロセスで共有する
+
+いずれも LLM_CACHE_TTL_SECONDS を過ぎた応答は使わず、LLM_CACHE_MAX_MB を超えたら最後に参照されたのが古いものから削除します。
+LLM_CACHE_BYPASS_TASKS に一致するタスクはキャッシュを参照・保存しません。既定ではバッキングトラック生成が該当し、
+同じ口ずさみ音声をアップロードし直しても毎回異なるトラックを生成します。
+保存した応答が後段の検証で不正と分かった場合、呼び出し側は invalidate で削除します（同じ不正な応答を返し続けないため）。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+from exceptions import AppException
+
+logger = logging.getLogger(__name__)
+
+# 応答の response_metadata に保存する、キャッシュのキー（invalidate 用）とヒットしたかどうか
+CACHE_KEY_METADATA = "llm_cache_key"
+CACHE_HIT_METADATA = "llm_cache_hit"
+
+# キーの形式を変えた場合に古いエントリを使わないようにするためのバージョン
+_KEY_VERSION = 1
+_TMP_SUFFIX = ".tmp"
+
+
+class LLMResponseCache(ABC):
+    """応答（JSON にできる dict）をキーで保存する。タスクごとのヒット数・ミス数を数える。"""
+
+    backend_name = "none"
+
+    def __init__(self, ttl_seconds: float, max_bytes: int, bypass_tasks: Sequence[str] = ()):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.bypass_tasks = tuple(bypass_tasks)
+        self._stats_lock = threading.Lock()
+        self._task_stats: Dict[str, Dict[str, int]] = {}
+        self.evictions = 0
+
+    def enabled_for(self, task_description: str) -> bool:
+        return not any(task_description.startswith(prefix) for prefix in self.bypass_tasks)
+
+    def _count(self, task_description: str, result: str) -> None:
+        with self._stats_lock:
+            stats = self._task_stats.setdefault(task_description, {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0})
+            stats[result] += 1
+
+    async def get(self, task_description: str, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._get(key, time.time())
+        self._count(task_description, "hits" if raw is not None else "misses")
+        return json.loads(raw) if raw is not None else None
+
+    async def put(self, task_description: str, key: str, value: Dict[str, Any]) -> None:
+        raw = json.dumps(value, ensure_ascii=False)
+        if len(raw.encode("utf-8")) > self.max_bytes:
+            return
+        await self._put(key, raw, time.time() + self.ttl_seconds)
+        self._count(task_description, "stores")
+
+    async def invalidate(self, task_description: str, key: str) -> None:
+        await self._delete(key)
+        self._count(task_description, "invalidations")
+
+    @abstractmethod
+    async def _get(self, key: str, now: float) -> Optional[str]:
+        """期限内の値を返す（参照時刻も更新する）。ない場合・期限切れの場合は None。"""
+
+    @abstractmethod
+    async def _put(self, key: str, raw: str, expires_at: float) -> None:
+        ...
+
+    @abstractmethod
+    async def _delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def _storage_stats(self) -> Dict[str, Any]:
+        """entries と bytes。"""
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            tasks = {task: dict(stats) for task, stats in self._task_stats.items()}
+        return {
+            "backend": self.backend_name,
+            **self._storage_stats(),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "tasks": tasks,
+        }
+
+
+class MemoryLLMResponseCache(LLMResponseCache):
+    """プロセス内の LRU。操作は短いためイベントループ上で直接行う。"""
+
+    backend_name = "memory"
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()  # key -> (期限, 値, サイズ)（先頭ほど古い）
+        self._total_bytes = 0
+
+    async def _get(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, raw, _ = entry
+        if expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return raw
+
+    async def _put(self, key: str, raw: str, expires_at: float) -> None:
+        self._remove(key)
+        size = len(raw.encode("utf-8"))
+        self._entries[key] = (expires_at, raw, size)
+        self._total_bytes += size
+        while self._total_bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def _delete(self, key: str) -> None:
+        self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "bytes": self._total_bytes}
+
+
+class DiskLLMResponseCache(LLMResponseCache):
+    """
+    1応答を1ファイル（期限と値の JSON）として保存する。索引（サイズと LRU 順序）はメモリに持ち、
+    起動時に既存ファイルの最終更新時刻から復元する。書き込みは一時ファイルからの os.replace。
+    """
+
+    backend_name = "disk"
+
+    def __init__(self, directory: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # ファイル名 -> サイズ（先頭ほど古い）
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _load_existing(self) -> None:
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(_TMP_SUFFIX):
+                self._unlink_quietly(entry.path)
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, entry.name, stat.st_size))
+        with self._lock:
+            for _, name, size in sorted(found):
+                self._entries[name] = size
+                self._total_bytes += size
+            self._evict_locked()
+
+    def _get_sync(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            # 参照時刻を更新し、再起動後の LRU 順序に反映させる
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            self._delete_sync(key)
+            return None
+        if stored["expires_at"] <= now:
+            self._delete_sync(key)
+            return None
+        return stored["value"]
+
+    def _put_sync(self, key: str, raw: str, expires_at: float) -> None:
+        data = json.dumps({"expires_at": expires_at, "value": raw}, ensure_ascii=False).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=_TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            self._unlink_quietly(tmp_path)
+            logger.warning(f"LLM応答キャッシュへの書き込みに失敗しました: {key}", exc_info=True)
+            return
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict_locked()
+
+    def _delete_sync(self, key: str) -> None:
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+        self._unlink_quietly(self._path(key))
+
+    def _evict_locked(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            self._unlink_quietly(self._path(key))
+
+    @staticmethod
+    def _unlink_quietly(path: str) -> None:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    async def _get(self, key: str, now: float) -> Optional[str]:
+        return await run_in_threadpool(self._get_sync, key, now)
+
+    async def _put(self, key: str, raw: str, expires_at: float) -> None:
+        await run_in_threadpool(self._put_sync, key, raw, expires_at)
+
+    async def _delete(self, key: str) -> None:
+        await run_in_threadpool(self._delete_sync, key)
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._total_bytes}
+
+
+class SQLiteLLMResponseCache(LLMResponseCache):
+    """1つのテーブルに保存する。サイズ上限の判定・削除は保存時に行う。"""
+
+    backend_name = "sqlite"
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS llm_responses (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS llm_responses_by_access ON llm_responses (accessed_at);
+    """
+
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connect().executescript(self._SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 接続はスレッドごとに作り、スレッドプールのスレッドで使い回す
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _get_sync(self, key: str, now: float) -> Optional[str]:
+        conn = self._connect()
+        row = conn.execute(
+            "UPDATE llm_responses SET accessed_at = ? WHERE key = ? AND expires_at > ? RETURNING value", (now, key, now)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _put_sync(self, key: str, raw: str, expires_at: float) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, raw, len(raw.encode("utf-8")), expires_at, now),
+            )
+            conn.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (now,))
+            (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+            if total > self.max_bytes:
+                # 参照が古い順に、超過分がなくなるまで削除する
+                evicted = []
+                for old_key, size in conn.execute("SELECT key, size FROM llm_responses ORDER BY accessed_at"):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    total -= size
+                conn.executemany("DELETE FROM llm_responses WHERE key = ?", evicted)
+                self.evictions += len(evicted)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _delete_sync(self, key: str) -> None:
+        self._connect().execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+
+    async def _get(self, key: str, now: float) -> Optional[str]:
+        return await run_in_threadpool(self._get_sync, key, now)
+
+    async def _put(self, key: str, raw: str, expires_at: float) -> None:
+        await run_in_threadpool(self._put_sync, key, raw, expires_at)
+
+    async def _delete(self, key: str) -> None:
+        await run_in_threadpool(self._delete_sync, key)
+
+    def _storage_stats(self) -> Dict[str, Any]:
+        entries, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+        return {"entries": entries, "bytes": total}
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+def _message_parts(messages: Sequence[Any]) -> Tuple[List[Any], List[str]]:
+    """メッセージを (種類, テキスト) の列とメディアの GCS URI の一覧に分ける。"""
+    prompt: List[Any] = []
+    media_uris: List[str] = []
+    for message in messages:
+        content = message.content if isinstance(message.content, list) else [message.content]
+        texts = []
+        for part in content:
+            if isinstance(part, str):
+                texts.append(part)
+            elif part.get("type") == "media":
+                media_uris.append(part["file_uri"])
+                texts.append({"media": len(media_uris) - 1, "mime_type": part.get("mime_type")})
+            else:
+                texts.append(part.get("text", ""))
+        prompt.append([message.type, texts])
+    return prompt, media_uris
+
+
+async def response_cache_key(
+    model_name: str,
+    temperature: float,
+    messages: Sequence[Any],
+    output_schema: Optional[type] = None,
+) -> Optional[str]:
+    """
+    キャッシュのキーを作る。メディアの内容を識別できない場合（GCSのメタデータを取得できない等）は None（キャッシュしない）。
+    構造化出力はスキーマ名もキーに含める。
+    """
+    prompt, media_uris = _message_parts(messages)
+    media_hashes = []
+    if media_uris:
+        from services.gcs_service import get_gcs_service
+        gcs_service = get_gcs_service()
+        for uri in media_uris:
+            try:
+                media_hashes.append(await gcs_service.object_fingerprint(uri))
+            except AppException as e:
+                logger.warning(f"メディアを識別できないため、LLM応答をキャッシュしません: {uri} ({e.message})")
+                return None
+    prompt_hash = hashlib.sha256(json.dumps(prompt, ensure_ascii=False).encode("utf-8")).hexdigest()
+    material = json.dumps({
+        "version": _KEY_VERSION,
+        "model": model_name,
+        "temperature": temperature,
+        "prompt": prompt_hash,
+        "media": media_hashes,
+        "schema": output_schema.__name__ if output_schema is not None else None,
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def encode_response(response: Any) -> Optional[Dict[str, Any]]:
+    """保存する形に変換する。テキストが空の応答など、再利用すべきでない応答は None。"""
+    from langchain_core.messages import BaseMessage
+    # BaseMessage も pydantic モデルのため、構造化出力より先に判定する
+    if isinstance(response, BaseMessage):
+        content = response.content
+        return {"content": content} if isinstance(content, str) and content.strip() else None
+    if hasattr(response, "model_dump"):
+        return {"parsed": response.model_dump()}
+    return None
+
+
+def decode_response(cached: Dict[str, Any], key: str, output_schema: Optional[type] = None) -> Any:
+    """encode_response の逆変換。テキスト応答は invalidate できるよう response_metadata にキーを入れた AIMessage にする。"""
+    if "parsed" in cached:
+        return output_schema(**cached["parsed"])
+    from langchain_core.messages import AIMessage
+    return AIMessage(content=cached["content"], response_metadata={CACHE_KEY_METADATA: key, CACHE_HIT_METADATA: True})
+
+
+async def invalidate_cached_response(task_description: str, response: Any) -> None:
+    """後段の検証で不正と分かった応答をキャッシュから削除する（キャッシュを経由していない応答では何もしない）。"""
+    cache = get_llm_response_cache()
+    key = (getattr(response, "response_metadata", None) or {}).get(CACHE_KEY_METADATA)
+    if cache is not None and key:
+        await cache.invalidate(task_description, key)
+        logger.info(f"不正な応答をLLM応答キャッシュから削除しました ({task_description})")
+
+
+def create_llm_response_cache() -> Optional[LLMResponseCache]:
+    options = {
+        "ttl_seconds": settings.LLM_CACHE_TTL_SECONDS,
+        "max_bytes": settings.LLM_CACHE_MAX_MB * 1024 * 1024,
+        "bypass_tasks": settings.LLM_CACHE_BYPASS_TASKS,
+    }
+    try:
+        if settings.LLM_CACHE_BACKEND == "memory":
+            return MemoryLLMResponseCache(**options)
+        if settings.LLM_CACHE_BACKEND == "disk":
+            return DiskLLMResponseCache(settings.LLM_CACHE_DIR, **options)
+        if settings.LLM_CACHE_BACKEND == "sqlite":
+            return SQLiteLLMResponseCache(settings.LLM_CACHE_SQLITE_PATH, **options)
+    except (OSError, sqlite3.Error) as e:
+        # キャッシュが使えなくても Vertex AI の呼び出しは継続できる
+        logger.warning(f"LLM応答キャッシュを初期化できませんでした ({settings.LLM_CACHE_BACKEND}): {e}")
+    return None
+
+
+_llm_response_cache_instance: Optional[LLMResponseCache] = None
+_llm_response_cache_initialized = False
+
+
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    """LLM_CACHE_BACKEND=none または初期化に失敗した場合は None。"""
+    global _llm_response_cache_instance, _llm_response_cache_initialized
+    if not _llm_response_cache_initialized:
+        _llm_response_cache_instance = create_llm_response_cache()
+        _llm_response_cache_initialized = True
+    return _llm_response_cache_instance
@@ -0,0 +1,202 @@
+"""
+LLM 呼び出しのトークン使用量と最初のトークンまでの時間 (TTFT)
+
+AudioAnalyzer（解析・生成）と VertexChatService のすべての Vertex AI 呼び出しについて、
+usage_metadata の入力・出力・キャッシュ・推論トークン数と TTFT・所要時間を記録します。
+- (タスク, モデル) ごとにプロセス内で集計し、/llm-usage と Prometheus メトリクスで公開する
+- リクエスト単位の集計は RequestLoggingMiddleware が「Request finished」ログに llm_usage として出力する
+
+ストリーミングしない呼び出し（構造化出力・非ストリーミングのチャット）は応答全体が届いた時点を
+最初のトークンとみなし、TTFT = 所要時間として記録します。
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from opentelemetry import trace
+
+from metrics import LLM_CALLS, LLM_TOKENS, LLM_TTFT
+from services.latency_stats import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+TOKEN_TYPES = ("input", "output", "cached", "reasoning")
+
+
+@dataclass
+class LLMCallUsage:
+    """1回の LLM 呼び出しの使用量。"""
+
+    task: str
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    reasoning_tokens: int = 0
+    ttft_seconds: Optional[float] = None
+    duration_seconds: float = 0.0
+    streaming: bool = False
+
+    def tokens(self) -> Dict[str, int]:
+        return {
+            "input": self.input_tokens,
+            "output": self.output_tokens,
+            "cached": self.cached_tokens,
+            "reasoning": self.reasoning_tokens,
+        }
+
+
+def usage_tokens(response: Any) -> Dict[str, int]:
+    """
+    LangChain の応答 (AIMessage / AIMessageChunk) の usage_metadata からトークン数を取り出す。
+    キャッシュ済み入力は input_token_details.cache_read、推論（思考）トークンは output_token_details.reasoning。
+    """
+    usage: Optional[Dict[str, Any]] = getattr(response, "usage_metadata", None)
+    if not usage:
+        return {token_type: 0 for token_type in TOKEN_TYPES}
+    input_details = usage.get("input_token_details") or {}
+    output_details = usage.get("output_token_details") or {}
+    return {
+        "input": int(usage.get("input_tokens") or 0),
+        "output": int(usage.get("output_tokens") or 0),
+        "cached": int(input_details.get("cache_read") or 0),
+        "reasoning": int(output_details.get("reasoning") or 0),
+    }
+
+
+@dataclass
+class _UsageStats:
+    calls: int = 0
+    tokens: Dict[str, int] = field(default_factory=lambda: {token_type: 0 for token_type in TOKEN_TYPES})
+    ttft: LatencyWindow = field(default_factory=LatencyWindow)
+    duration: LatencyWindow = field(default_factory=LatencyWindow)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            **{f"{token_type}_tokens": count for token_type, count in self.tokens.items()},
+            "output_tokens_per_call": (self.tokens["output"] / self.calls) if self.calls else None,
+            "ttft_p50_seconds": self.ttft.percentile(0.5),
+            "ttft_p95_seconds": self.ttft.percentile(0.95),
+            "duration_p50_seconds": self.duration.percentile(0.5),
+            "duration_p95_seconds": self.duration.percentile(0.95),
+        }
+
+
+class LLMUsageStats:
+    """(タスク, モデル) ごとの呼び出し数・トークン数の累計と、直近の TTFT・所要時間。"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], _UsageStats] = {}
+
+    def record(self, usage: LLMCallUsage) -> None:
+        stats = self._stats.setdefault((usage.task, usage.model), _UsageStats())
+        stats.calls += 1
+        for token_type, count in usage.tokens().items():
+            stats.tokens[token_type] += count
+        if usage.ttft_seconds is not None:
+            stats.ttft.record(usage.ttft_seconds)
+        stats.duration.record(usage.duration_seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (task, model_name), stats in self._stats.items():
+            result.setdefault(task, {})[model_name] = stats.snapshot()
+        return result
+
+
+# リクエスト内で行われた呼び出しの記録先（request_usage_scope の内側でのみ設定される）
+_request_calls: ContextVar[Optional[List[LLMCallUsage]]] = ContextVar("llm_request_calls", default=None)
+
+
+@contextmanager
+def request_usage_scope() -> Iterator[List[LLMCallUsage]]:
+    """
+    with ブロック内（そこから作成したタスク・スレッドを含む）の LLM 呼び出しを収集する。
+    リストはコンテキストのコピー間で共有されるため、ヘッジや並列ノードの呼び出しも集まる。
+    """
+    calls: List[LLMCallUsage] = []
+    token = _request_calls.set(calls)
+    try:
+        yield calls
+    finally:
+        _request_calls.reset(token)
+
+
+def summarize_calls(calls: List[LLMCallUsage]) -> Optional[Dict[str, Any]]:
+    """リクエスト内の呼び出しをタスクごとに集計する（構造化ログ用）。呼び出しがなければ None。"""
+    if not calls:
+        return None
+    by_task: Dict[str, Dict[str, Any]] = {}
+    for call in calls:
+        entry = by_task.setdefault(call.task, {"calls": 0, "models": [], "ttft_seconds": [], "duration_seconds": 0.0,
+                                              **{f"{token_type}_tokens": 0 for token_type in TOKEN_TYPES}})
+        entry["calls"] += 1
+        if call.model not in entry["models"]:
+            entry["models"].append(call.model)
+        if call.ttft_seconds is not None:
+            entry["ttft_seconds"].append(round(call.ttft_seconds, 3))
+        entry["duration_seconds"] = round(entry["duration_seconds"] + call.duration_seconds, 3)
+        for token_type, count in call.tokens().items():
+            entry[f"{token_type}_tokens"] += count
+    return {
+        "calls": len(calls),
+        **{f"{token_type}_tokens": sum(call.tokens()[token_type] for call in calls) for token_type in TOKEN_TYPES},
+        "tasks": by_task,
+    }
+
+
+def record_llm_call(
+    task: str,
+    model: str,
+    response: Any,
+    duration_seconds: float,
+    ttft_seconds: Optional[float] = None,
+    streaming: bool = False,
+) -> LLMCallUsage:
+    """
+    1回の呼び出しの使用量をプロセス内の集計・Prometheus・カレントスパン・リクエスト単位の集計に記録する。
+    ttft_seconds を省略した場合（ストリーミングしない呼び出し）は所要時間を TTFT とする。
+    """
+    tokens = usage_tokens(response)
+    usage = LLMCallUsage(
+        task=task,
+        model=model,
+        input_tokens=tokens["input"],
+        output_tokens=tokens["output"],
+        cached_tokens=tokens["cached"],
+        reasoning_tokens=tokens["reasoning"],
+        ttft_seconds=ttft_seconds if ttft_seconds is not None else duration_seconds,
+        duration_seconds=duration_seconds,
+        streaming=streaming,
+    )
+    get_llm_usage_stats().record(usage)
+    LLM_CALLS.labels(task, model, "streaming" if streaming else "non_streaming").inc()
+    for token_type, count in tokens.items():
+        if count:
+            LLM_TOKENS.labels(task, model, token_type).inc(count)
+    LLM_TTFT.labels(task, model).observe(usage.ttft_seconds)
+
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.set_attribute("gen_ai.usage.cached_tokens", usage.cached_tokens)
+        span.set_attribute("gen_ai.usage.reasoning_tokens", usage.reasoning_tokens)
+        span.set_attribute("gen_ai.response.time_to_first_token", usage.ttft_seconds)
+
+    calls = _request_calls.get()
+    if calls is not None:
+        calls.append(usage)
+    return usage
+
+
+_llm_usage_stats_instance: Optional[LLMUsageStats] = None
+
+
+def get_llm_usage_stats() -> LLMUsageStats:
+    global _llm_usage_stats_instance
+    if _llm_usage_stats_instance is None:
+        _llm_usage_stats_instance = LLMUsageStats()
+    return _llm_usage_stats_instance
@@ -0,0 +1,131 @@
+"""
+モデルカスケード
+
+タスクごとに設定された順序付きモデルリストを先頭（安価・高速なモデル）から試し、
+出力の抽出・検証の失敗やタイムアウトの場合にのみ次のモデルへエスカレーションします。
+カスケード順序をデータに基づいて調整できるよう、モデルごとの成功率とレイテンシを記録します。
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from langchain_core.exceptions import OutputParserException
+
+from exceptions import GenerationFailedException
+from services.latency_stats import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+ESCALATION_EXCEPTIONS: Tuple[type, ...] = (GenerationFailedException, OutputParserException, asyncio.TimeoutError)
+
+
+def should_escalate(exc: BaseException) -> bool:
+    """
+    例外、またはその原因チェーン（__cause__ / __context__）にエスカレーション対象が含まれるか。
+    サービス層では下位の例外を AppException に包み直すため、チェーンを辿って判定する。
+    """
+    seen = set()
+    current: Optional[BaseException] = exc
+    while current is not None and id(current) not in seen:
+        if isinstance(current, ESCALATION_EXCEPTIONS):
+            return True
+        seen.add(id(current))
+        current = current.__cause__ or current.__context__
+    return False
+
+
+def resolve_model_cascade(cascade: Iterable[str], default_model: str) -> List[str]:
+    """設定されたカスケードを重複を除いて返す。未設定なら既定モデルのみ。"""
+    models: List[str] = []
+    for model in cascade:
+        if model and model not in models:
+            models.append(model)
+    return models or [default_model]
+
+
+@dataclass
+class _ModelStats:
+    attempts: int = 0
+    successes: int = 0
+    escalations: int = 0
+    latency: LatencyWindow = field(default_factory=LatencyWindow)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "successes": self.successes,
+            "escalations": self.escalations,
+            "success_rate": (self.successes / self.attempts) if self.attempts else None,
+            "latency_p50_seconds": self.latency.percentile(0.5),
+            "latency_p95_seconds": self.latency.percentile(0.95),
+        }
+
+
+class ModelCascadeStats:
+    """(タスク, モデル) ごとの試行結果とレイテンシ。"""
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str], _ModelStats] = {}
+
+    def record(self, task: str, model_name: str, success: bool, duration_seconds: float, escalated: bool = False) -> None:
+        stats = self._stats.setdefault((task, model_name), _ModelStats())
+        stats.attempts += 1
+        if success:
+            stats.successes += 1
+        if escalated:
+            stats.escalations += 1
+        stats.latency.record(duration_seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (task, model_name), stats in self._stats.items():
+            result.setdefault(task, {})[model_name] = stats.snapshot()
+        return result
+
+
+async def run_model_cascade(
+    task: str,
+    models: List[str],
+    attempt: Callable[[str], Awaitable[T]],
+    stats: Optional[ModelCascadeStats] = None,
+    workflow_run_id: Optional[str] = None,
+) -> T:
+    """
+    models を順に attempt(model_name) で試す。エスカレーション対象外の例外や
+    最後のモデルでの失敗はそのまま送出する。
+    """
+    stats = stats or get_model_cascade_stats()
+    for index, model_name in enumerate(models):
+        start = time.monotonic()
+        try:
+            result = await attempt(model_name)
+        except Exception as e:
+            duration = time.monotonic() - start
+            escalate = index < len(models) - 1 and should_escalate(e)
+            stats.record(task, model_name, success=False, duration_seconds=duration, escalated=escalate)
+            if not escalate:
+                raise
+            logger.warning(
+                f"モデル '{model_name}' での{task}に失敗したため、'{models[index + 1]}' にエスカレーションします: {type(e).__name__}",
+                extra={"workflow_run_id": workflow_run_id, "task": task, "vertex_model": model_name,
+                       "next_model": models[index + 1], "duration_seconds": round(duration, 3)},
+            )
+            continue
+        stats.record(task, model_name, success=True, duration_seconds=time.monotonic() - start)
+        return result
+    raise ValueError("モデルカスケードが空です。")
+
+
+# プロセス内で共有する統計
+_model_cascade_stats_instance: Optional[ModelCascadeStats] = None
+
+def get_model_cascade_stats() -> ModelCascadeStats:
+    global _model_cascade_stats_instance
+    if _model_cascade_stats_instance is None:
+        _model_cascade_stats_instance = ModelCascadeStats()
+    return _model_cascade_stats_instance
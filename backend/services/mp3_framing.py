@@ -0,0 +1,115 @@
+# backend/services/mp3_framing.py
+"""
+MP3 (MPEG audio) のフレーム境界の検出
+
+エンコーダーの出力をパイプから読むと、読み出し単位はフレームの途中で切れます。
+ストリーミング配信ではチャンクをフレーム境界にそろえて送ることで、
+どのチャンクで再生を始めても（途中から参加したクライアントでも）デコーダーが同期できるようにします。
+"""
+
+from typing import Optional
+
+# ビットレート (kbps)。[MPEG-1 か][レイヤー] -> インデックス 0〜15
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448, 0),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384, 0),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256, 0),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160, 0),
+}
+# サンプリングレート (Hz)。バージョンのビット値 -> インデックス 0〜2
+_SAMPLE_RATES = {
+    0b11: (44100, 48000, 32000),  # MPEG-1
+    0b10: (22050, 24000, 16000),  # MPEG-2
+    0b00: (11025, 12000, 8000),   # MPEG-2.5
+}
+_LAYERS = {0b11: 1, 0b10: 2, 0b01: 3}
+
+HEADER_SIZE = 4
+
+
+def mp3_frame_length(header: bytes) -> Optional[int]:
+    """4バイトのフレームヘッダーからフレーム長（バイト）を返す。ヘッダーとして不正な場合は None。"""
+    if len(header) < HEADER_SIZE or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0b11
+    layer = _LAYERS.get((header[1] >> 1) & 0b11)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0b11
+    padding = (header[2] >> 1) & 0b1
+    if version_bits not in _SAMPLE_RATES or layer is None or sample_rate_index == 3:
+        return None
+    is_mpeg1 = version_bits == 0b11
+    bitrate = _BITRATES[(is_mpeg1, layer)][bitrate_index] * 1000
+    if bitrate == 0:
+        return None  # フリーフォーマット・不正値はフレーム長を決められない
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and not is_mpeg1:
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+def _id3v2_length(data: bytes) -> Optional[int]:
+    """先頭が ID3v2 タグならタグ全体の長さを返す（ヘッダーが揃っていない場合は None）。"""
+    if len(data) < 10:
+        return None
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)  # syncsafe integer
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class Mp3FrameSplitter:
+    """
+    任意の位置で切れたバイト列を受け取り、完結したフレームだけを返す。
+    先頭の ID3v2 タグはそのまま通し、同期が外れた箇所は次の同期ワードまで読み飛ばす。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._started = False
+        self.skipped_bytes = 0
+
+    def feed(self, data: bytes) -> bytes:
+        self._buffer.extend(data)
+        output = bytearray()
+        position = 0
+        buffer = self._buffer
+        if not self._started:
+            if len(buffer) < 10 and buffer[:3] == b"ID3"[:len(buffer)]:
+                return b""
+            if buffer[:3] == b"ID3":
+                tag_length = _id3v2_length(bytes(buffer[:10]))
+                if tag_length is None or len(buffer) < tag_length:
+                    return b""
+                output += buffer[:tag_length]
+                position = tag_length
+            self._started = True
+
+        while len(buffer) - position >= HEADER_SIZE:
+            frame_length = mp3_frame_length(bytes(buffer[position:position + HEADER_SIZE]))
+            if frame_length is None:
+                next_sync = buffer.find(b"\xff", position + 1)
+                skip_to = next_sync if next_sync != -1 else len(buffer)
+                self.skipped_bytes += skip_to - position
+                position = skip_to
+                continue
+            if len(buffer) - position < frame_length:
+                break
+            output += buffer[position:position + frame_length]
+            position += frame_length
+        del buffer[:position]
+        return bytes(output)
+
+    def flush(self) -> bytes:
+        """ストリーム終端で残ったバイト列を処理する。末尾の ID3v1 タグは返し、不完全なフレームは捨てる。"""
+        remainder = bytes(self._buffer)
+        self._buffer.clear()
+        if remainder.startswith(b"TAG"):
+            return remainder
+        self.skipped_bytes += len(remainder)
+        return b""
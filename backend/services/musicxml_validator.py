@@ -0,0 +1,426 @@
+"""
+MusicXML構造検証サービス
+
+AIが生成したMusicXMLを、合成（music21/FluidSynth）やGCSアップロードなどの
+高コストな後続処理の前に検証・修復する機能を提供します。
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MUSICXML_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 4.0 Partwise//EN" '
+    '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+)
+
+# MusicXML 4.0 の一般的な要素（合成に使うものと、表示・記譜のみのもの）。
+# ここにない要素は整形式であれば警告として報告するだけで、書き換えない
+ALLOWED_ELEMENTS: Set[str] = {
+    # スコアのヘッダー・レイアウト
+    "score-partwise", "work", "work-number", "work-title", "movement-number", "movement-title",
+    "identification", "creator", "rights", "encoding", "software", "encoding-date", "encoder",
+    "encoding-description", "supports", "source", "miscellaneous", "miscellaneous-field",
+    "defaults", "scaling", "millimeters", "tenths", "page-layout", "page-height", "page-width",
+    "page-margins", "left-margin", "right-margin", "top-margin", "bottom-margin", "system-layout",
+    "system-margins", "system-distance", "top-system-distance", "staff-layout", "staff-distance",
+    "appearance", "line-width", "note-size", "distance", "music-font", "word-font", "lyric-font",
+    "lyric-language", "credit", "credit-type", "credit-words", "credit-symbol", "print",
+    "measure-numbering", "system-dividers", "left-divider", "right-divider",
+    # スコア・パート構造
+    "part-list", "part-group", "group-name", "group-name-display", "group-abbreviation",
+    "group-abbreviation-display", "group-symbol", "group-barline", "group-time",
+    "score-part", "part-name", "part-name-display", "part-abbreviation", "part-abbreviation-display",
+    "display-text", "accidental-text", "score-instrument", "instrument-name", "instrument-abbreviation",
+    "instrument-sound", "solo", "ensemble", "virtual-instrument", "virtual-library", "virtual-name",
+    "midi-device", "midi-instrument", "midi-channel", "midi-name", "midi-bank", "midi-program",
+    "midi-unpitched", "volume", "pan", "elevation", "part", "measure",
+    # 属性
+    "attributes", "divisions", "key", "fifths", "mode", "cancel", "key-step", "key-alter",
+    "key-accidental", "key-octave", "time", "beats", "beat-type", "senza-misura", "interchangeable",
+    "time-relation", "clef", "sign", "line", "clef-octave-change", "staves", "part-symbol",
+    "instruments", "transpose", "diatonic", "chromatic", "octave-change", "double",
+    "staff-details", "staff-type", "staff-lines", "staff-tuning", "tuning-step", "tuning-alter",
+    "tuning-octave", "capo", "staff-size", "measure-style", "multiple-rest", "measure-repeat",
+    "beat-repeat", "slash", "slash-type", "slash-dot", "directive",
+    # 音符
+    "note", "pitch", "step", "alter", "octave", "unpitched", "display-step", "display-octave",
+    "rest", "chord", "grace", "cue", "duration", "tie", "instrument", "voice", "type", "dot",
+    "accidental", "time-modification", "actual-notes", "normal-notes", "normal-type", "normal-dot",
+    "stem", "notehead", "notehead-text", "staff", "beam", "play", "ipa", "mute", "semi-pitched",
+    "other-play", "backup", "forward",
+    # 歌詞
+    "lyric", "syllabic", "text", "elision", "extend", "laughing", "humming", "end-line", "end-paragraph",
+    # 記譜
+    "notations", "tied", "slur", "tuplet", "tuplet-actual", "tuplet-normal", "tuplet-number",
+    "tuplet-type", "tuplet-dot", "glissando", "slide", "ornaments", "trill-mark", "turn",
+    "delayed-turn", "inverted-turn", "delayed-inverted-turn", "vertical-turn", "shake", "wavy-line",
+    "mordent", "inverted-mordent", "schleifer", "tremolo", "other-ornament", "accidental-mark",
+    "technical", "up-bow", "down-bow", "harmonic", "natural", "artificial", "base-pitch",
+    "touching-pitch", "sounding-pitch", "open-string", "thumb-position", "fingering", "pluck",
+    "double-tongue", "triple-tongue", "stopped", "snap-pizzicato", "fret", "string", "hammer-on",
+    "pull-off", "bend", "bend-alter", "pre-bend", "release", "with-bar", "tap", "heel", "toe",
+    "fingernails", "hole", "hole-type", "hole-closed", "hole-shape", "arrow", "arrow-direction",
+    "arrow-style", "handbell", "open", "half-muted", "harmon-mute", "harmon-closed", "golpe",
+    "other-technical", "articulations", "accent", "strong-accent", "staccato", "tenuto",
+    "detached-legato", "staccatissimo", "spiccato", "scoop", "plop", "doit", "falloff",
+    "breath-mark", "caesura", "stress", "unstress", "soft-accent", "other-articulation",
+    "fermata", "arpeggiate", "non-arpeggiate", "other-notation",
+    # 強弱
+    "dynamics", "p", "pp", "ppp", "pppp", "ppppp", "pppppp", "f", "ff", "fff", "ffff", "fffff",
+    "ffffff", "mp", "mf", "sf", "sfp", "sfpp", "fp", "rf", "rfz", "sfz", "sffz", "fz", "n", "pf",
+    "sfzp", "other-dynamics",
+    # 方向指示・テンポ
+    "direction", "direction-type", "rehearsal", "segno", "coda", "words", "symbol", "wedge",
+    "dashes", "bracket", "pedal", "metronome", "beat-unit", "beat-unit-dot", "beat-unit-tied",
+    "per-minute", "metronome-arrows", "metronome-note", "metronome-type", "metronome-dot",
+    "metronome-beam", "metronome-tied", "metronome-tuplet", "metronome-relation", "octave-shift",
+    "harp-pedals", "pedal-tuning", "pedal-step", "pedal-alter", "damp", "damp-all", "eyeglasses",
+    "string-mute", "scordatura", "accord", "image", "principal-voice", "percussion",
+    "accordion-registration", "accordion-high", "accordion-middle", "accordion-low",
+    "staff-divide", "other-direction", "offset", "sound", "swing", "straight", "first", "second",
+    "swing-type", "swing-style", "listening", "sync", "other-listening", "listen", "assess", "wait",
+    "other-listen", "grouping", "feature",
+    # コードネーム・数字付き低音
+    "harmony", "root", "root-step", "root-alter", "numeral", "numeral-root", "numeral-alter",
+    "numeral-key", "numeral-fifths", "numeral-mode", "function", "kind", "inversion", "bass",
+    "bass-separator", "bass-step", "bass-alter", "degree", "degree-value", "degree-alter",
+    "degree-type", "frame", "frame-strings", "frame-frets", "first-fret", "frame-note", "barre",
+    "figured-bass", "figure", "prefix", "figure-number", "suffix",
+    # 小節線・反復
+    "barline", "bar-style", "repeat", "ending",
+    # その他
+    "footnote", "level", "link", "bookmark",
+}
+
+
+class IssueCode:
+    MALFORMED_XML = "MALFORMED_XML"
+    UNEXPECTED_ROOT = "UNEXPECTED_ROOT"
+    MISSING_PART_LIST = "MISSING_PART_LIST"
+    NO_PARTS = "NO_PARTS"
+    DUPLICATE_PART_ID = "DUPLICATE_PART_ID"
+    PART_WITHOUT_SCORE_PART = "PART_WITHOUT_SCORE_PART"
+    SCORE_PART_WITHOUT_PART = "SCORE_PART_WITHOUT_PART"
+    MISSING_DIVISIONS = "MISSING_DIVISIONS"
+    MEASURE_OVERFULL = "MEASURE_OVERFULL"
+    MEASURE_UNDERFULL = "MEASURE_UNDERFULL"
+    UNSUPPORTED_ELEMENT = "UNSUPPORTED_ELEMENT"
+
+
+# 局所的な修復で対処できる問題
+REPAIRABLE_CODES: Set[str] = {
+    IssueCode.PART_WITHOUT_SCORE_PART,
+    IssueCode.SCORE_PART_WITHOUT_PART,
+    IssueCode.MEASURE_OVERFULL,
+}
+
+
+@dataclass
+class MusicXMLValidationIssue:
+    code: str
+    message: str
+    severity: str = "error"  # "error" または "warning"
+    part_id: Optional[str] = None
+    measure_number: Optional[str] = None
+    element: Optional[str] = None
+
+    @property
+    def repairable(self) -> bool:
+        return self.code in REPAIRABLE_CODES
+
+    def to_dict(self) -> Dict[str, Optional[str]]:
+        return {
+            "code": self.code, "message": self.message, "severity": self.severity,
+            "part_id": self.part_id, "measure_number": self.measure_number, "element": self.element,
+        }
+
+
+@dataclass
+class MusicXMLValidationResult:
+    issues: List[MusicXMLValidationIssue] = field(default_factory=list)
+
+    @property
+    def errors(self) -> List[MusicXMLValidationIssue]:
+        return [issue for issue in self.issues if issue.severity == "error"]
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    @property
+    def is_repairable(self) -> bool:
+        """エラーがすべて局所的な修復で対処可能か"""
+        return bool(self.errors) and all(issue.repairable for issue in self.errors)
+
+    def summary(self, limit: int = 5) -> str:
+        parts = [
+            f"{issue.code}(part={issue.part_id}, measure={issue.measure_number}): {issue.message}"
+            for issue in self.errors[:limit]
+        ]
+        if len(self.errors) > limit:
+            parts.append(f"... 他{len(self.errors) - limit}件")
+        return "; ".join(parts)
+
+
+@dataclass
+class _PartTimeState:
+    """パートごとの拍子・分解能の状態。小節をまたいで引き継がれる。"""
+    divisions: Optional[int] = None
+    beats: Optional[int] = None
+    beat_type: Optional[int] = None
+
+    def measure_capacity(self) -> Optional[int]:
+        if not self.divisions or not self.beats or not self.beat_type:
+            return None
+        return self.divisions * self.beats * 4 // self.beat_type
+
+
+def _int_text(elem: Optional[ET.Element]) -> Optional[int]:
+    if elem is None or elem.text is None:
+        return None
+    try:
+        return int(float(elem.text.strip()))
+    except ValueError:
+        return None
+
+
+def _parse_beats(text: Optional[str]) -> Optional[int]:
+    """'3+2' のような複合拍子も合計値として扱う"""
+    if not text:
+        return None
+    try:
+        return sum(int(piece) for piece in text.strip().split("+"))
+    except ValueError:
+        return None
+
+
+def _apply_attributes(attributes: ET.Element, state: _PartTimeState) -> None:
+    divisions = _int_text(attributes.find("divisions"))
+    if divisions:
+        state.divisions = divisions
+    time_elem = attributes.find("time")
+    if time_elem is not None and time_elem.find("senza-misura") is None:
+        beats = _parse_beats(time_elem.findtext("beats"))
+        beat_type = _int_text(time_elem.find("beat-type"))
+        if beats and beat_type:
+            state.beats, state.beat_type = beats, beat_type
+
+
+def _note_duration(note: ET.Element) -> int:
+    if note.find("grace") is not None:
+        return 0
+    return _int_text(note.find("duration")) or 0
+
+
+def _walk_measure(measure: ET.Element, state: _PartTimeState) -> Tuple[int, bool]:
+    """
+    小節内の要素を順に辿り、最大到達位置（divisions単位）を返す。
+    :return: (到達位置, divisions未定義のまま音符が現れたか)
+    """
+    position = 0
+    extent = 0
+    last_note_start = 0
+    missing_divisions = False
+    for child in measure:
+        if child.tag == "attributes":
+            _apply_attributes(child, state)
+        elif child.tag == "note":
+            if state.divisions is None:
+                missing_divisions = True
+            duration = _note_duration(child)
+            if child.find("chord") is not None:
+                extent = max(extent, last_note_start + duration)
+                continue
+            last_note_start = position
+            position += duration
+        elif child.tag == "backup":
+            position = max(0, position - (_int_text(child.find("duration")) or 0))
+        elif child.tag == "forward":
+            position += _int_text(child.find("duration")) or 0
+        extent = max(extent, position)
+    return extent, missing_divisions
+
+
+def validate_musicxml(xml_content: str, chunk_size: int = 64 * 1024) -> MusicXMLValidationResult:
+    """
+    MusicXMLをストリーミング（プル型パーサ）で1パス検証する。
+    小節の処理が終わるたびに要素を解放するため、ツリー全体は保持しない。
+    """
+    result = MusicXMLValidationResult()
+    parser = ET.XMLPullParser(events=("start", "end"))
+    score_part_ids: List[str] = []
+    part_ids: List[str] = []
+    part_list_seen = False
+    unsupported_seen: Set[str] = set()
+    current_part_id: Optional[str] = None
+    part_states: Dict[str, _PartTimeState] = {}
+    root_checked = False
+
+    def handle_events(events: Iterable[Tuple[str, ET.Element]]) -> None:
+        nonlocal part_list_seen, current_part_id, root_checked
+        for event, elem in events:
+            tag = elem.tag
+            if event == "start":
+                if not root_checked:
+                    root_checked = True
+                    if tag != "score-partwise":
+                        result.issues.append(MusicXMLValidationIssue(
+                            IssueCode.UNEXPECTED_ROOT, f"ルート要素が score-partwise ではありません: <{tag}>", element=tag,
+                        ))
+                if tag not in ALLOWED_ELEMENTS and tag not in unsupported_seen:
+                    unsupported_seen.add(tag)
+                    result.issues.append(MusicXMLValidationIssue(
+                        IssueCode.UNSUPPORTED_ELEMENT, f"未知の要素 <{tag}> が含まれています（そのまま残します）。",
+                        severity="warning", part_id=current_part_id, element=tag,
+                    ))
+                if tag == "part":
+                    current_part_id = elem.get("id")
+                    part_ids.append(current_part_id or "")
+                    part_states.setdefault(current_part_id or "", _PartTimeState())
+                continue
+
+            # event == "end"
+            if tag == "score-part":
+                score_part_ids.append(elem.get("id") or "")
+            elif tag == "part-list":
+                part_list_seen = True
+                elem.clear()
+            elif tag == "measure" and current_part_id is not None:
+                state = part_states[current_part_id]
+                extent, missing_divisions = _walk_measure(elem, state)
+                measure_number = elem.get("number")
+                if missing_divisions:
+                    result.issues.append(MusicXMLValidationIssue(
+                        IssueCode.MISSING_DIVISIONS, "<divisions> が定義される前に音符が現れました。",
+                        part_id=current_part_id, measure_number=measure_number,
+                    ))
+                capacity = state.measure_capacity()
+                if capacity is not None:
+                    if extent > capacity:
+                        result.issues.append(MusicXMLValidationIssue(
+                            IssueCode.MEASURE_OVERFULL,
+                            f"小節の長さ {extent} が拍子から求まる長さ {capacity} を超えています。",
+                            part_id=current_part_id, measure_number=measure_number,
+                        ))
+                    elif extent < capacity and elem.get("implicit") != "yes":
+                        result.issues.append(MusicXMLValidationIssue(
+                            IssueCode.MEASURE_UNDERFULL,
+                            f"小節の長さ {extent} が拍子から求まる長さ {capacity} に足りません。",
+                            severity="warning", part_id=current_part_id, measure_number=measure_number,
+                        ))
+                elem.clear()
+            elif tag == "part":
+                current_part_id = None
+                elem.clear()
+
+    try:
+        for offset in range(0, len(xml_content), chunk_size):
+            parser.feed(xml_content[offset:offset + chunk_size])
+            handle_events(parser.read_events())
+        parser.close()
+        handle_events(parser.read_events())
+    except ET.ParseError as e:
+        result.issues.append(MusicXMLValidationIssue(IssueCode.MALFORMED_XML, f"XMLが整形式ではありません: {e}"))
+        return result
+
+    if not part_list_seen:
+        result.issues.append(MusicXMLValidationIssue(IssueCode.MISSING_PART_LIST, "<part-list> がありません。"))
+
+    for ids, label in ((score_part_ids, "score-part"), (part_ids, "part")):
+        duplicates = sorted({pid for pid in ids if ids.count(pid) > 1})
+        for pid in duplicates:
+            result.issues.append(MusicXMLValidationIssue(
+                IssueCode.DUPLICATE_PART_ID, f"<{label}> のIDが重複しています: {pid}", part_id=pid,
+            ))
+    for pid in part_ids:
+        if pid not in score_part_ids:
+            result.issues.append(MusicXMLValidationIssue(
+                IssueCode.PART_WITHOUT_SCORE_PART, f"<part id=\"{pid}\"> に対応する <score-part> がありません。", part_id=pid,
+            ))
+    for pid in score_part_ids:
+        if pid not in part_ids:
+            result.issues.append(MusicXMLValidationIssue(
+                IssueCode.SCORE_PART_WITHOUT_PART, f"<score-part id=\"{pid}\"> に対応する <part> がありません。", part_id=pid,
+            ))
+    if not part_ids:
+        result.issues.append(MusicXMLValidationIssue(IssueCode.NO_PARTS, "<part> が1つもありません。"))
+    return result
+
+
+def _reconcile_part_ids(root: ET.Element) -> None:
+    part_list = root.find("part-list")
+    if part_list is None:
+        return
+    score_parts = part_list.findall("score-part")
+    parts = root.findall("part")
+    part_ids = {p.get("id") for p in parts}
+    score_part_ids = {sp.get("id") for sp in score_parts}
+    orphan_parts = [p for p in parts if p.get("id") not in score_part_ids]
+    unused_score_parts = [sp for sp in score_parts if sp.get("id") not in part_ids]
+
+    # 件数が一致する場合は、出現順でIDを対応付ける（AIがIDだけを書き間違えたケース）
+    if orphan_parts and len(orphan_parts) == len(unused_score_parts):
+        for part, score_part in zip(orphan_parts, unused_score_parts):
+            part.set("id", score_part.get("id") or "")
+        return
+    for score_part in unused_score_parts:
+        part_list.remove(score_part)
+    for part in orphan_parts:
+        new_score_part = ET.SubElement(part_list, "score-part", {"id": part.get("id") or ""})
+        ET.SubElement(new_score_part, "part-name").text = part.get("id") or "Part"
+
+
+def _clip_overfull_measures(root: ET.Element) -> None:
+    for part in root.findall("part"):
+        state = _PartTimeState()
+        for measure in part.findall("measure"):
+            position = 0
+            last_note_start = 0
+            for child in list(measure):
+                if child.tag == "attributes":
+                    _apply_attributes(child, state)
+                    continue
+                capacity = state.measure_capacity()
+                if child.tag == "backup":
+                    position = max(0, position - (_int_text(child.find("duration")) or 0))
+                    continue
+                if child.tag == "forward":
+                    position += _int_text(child.find("duration")) or 0
+                    if capacity is not None and position > capacity:
+                        measure.remove(child)
+                        position = capacity
+                    continue
+                if child.tag != "note" or capacity is None:
+                    continue
+                is_chord = child.find("chord") is not None
+                start = last_note_start if is_chord else position
+                duration = _note_duration(child)
+                if start >= capacity and duration > 0:
+                    measure.remove(child)
+                    continue
+                if start + duration > capacity:
+                    child.find("duration").text = str(capacity - start)  # type: ignore[union-attr]
+                    duration = capacity - start
+                if not is_chord:
+                    last_note_start = start
+                    position = start + duration
+
+
+def repair_musicxml(xml_content: str, validation: MusicXMLValidationResult) -> str:
+    """
+    検証結果に含まれる修復可能な問題だけを対象に、MusicXMLを局所的に修復する。
+    整形式でないXMLは対象外（呼び出し元で再生成すること）。
+    """
+    codes = {issue.code for issue in validation.errors}
+    root = ET.fromstring(xml_content)
+    if codes & {IssueCode.PART_WITHOUT_SCORE_PART, IssueCode.SCORE_PART_WITHOUT_PART}:
+        _reconcile_part_ids(root)
+    if IssueCode.MEASURE_OVERFULL in codes:
+        _clip_overfull_measures(root)
+    ET.indent(root, space="  ")
+    return MUSICXML_HEADER + ET.tostring(root, encoding="unicode")
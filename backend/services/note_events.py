@@ -0,0 +1,557 @@
+# backend/services/note_events.py
+"""
+バッキングトラック生成用のコンパクトなノートイベント形式と、MusicXML / MIDI への決定的なレンダラー
+
+LLM に MusicXML を直接書かせると、出力トークンの大半が part-list・midi-device・冗長な <note> 要素などの
+定型部分に費やされ、生成のレイテンシが長くなります。そこで LLM には以下の行指向の形式で音符だけを出力させ、
+MusicXML（と MIDI）はこのモジュールで組み立てます。レンダラーの出力は常に同じ構造になるため、
+correct_musicxml による AI 特有の誤りの修正は不要です。
+
+    TEMPO 96
+    KEY Am
+    TIME 4/4
+    PART P1 5 Rhodes Piano
+    PART P2 36 Fretless Bass
+    PART P3 drums Drums
+    1 P1: @mp A3+C4+E4/2 G3+B3+D4/2
+    1 P2: A2/4. E2/8 A2/4 r/4
+    1 P3: kick+hat/8 hat/8 snare+hat/8 hat/8 kick+hat/8 kick/8 snare+hat/4
+
+- ヘッダー: TEMPO（BPM）、KEY（主音 + 短調は m。例: C, F#m, Bb）、TIME（拍子）、PART（ID・GM プログラム番号 1〜128 または drums・パート名）
+- 小節行: "<小節番号> <パートID>: <イベント...>"。書かれていない小節は全休符になる
+- イベント: 音高（C4, F#3, Bb2。和音は + でつなぐ）/ 長さ（1, 2, 4, 8, 16, 32。付点は "."、3連符は "t"）
+  - 休符は r/4 のように書く。ドラムの音高は DRUM_KEYS の名前か GM のキー番号
+  - 末尾の ' はスタッカート、> はアクセント。@mf のような強弱記号は以降の音符に適用される
+- 小節の長さが拍子と合わない場合は、不足分を休符で埋め、はみ出した音符を切り捨てる（warnings に記録）
+
+レンダリングした MusicXML には正規化したノートイベントをコメントとして埋め込みます。音声合成では
+note_score_from_musicxml で取り出し、music21 を通さずに MIDI を書き出します（music21 はパート名から楽器を
+推測して GM プログラムを上書きし、ドラムの音色も区別しないため）。
+"""
+
+import re
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+from services.musicxml_validator import MUSICXML_HEADER
+
+# 4分音符あたりの分解能。32分音符 (6) と3連符 (2/3倍) が整数になるように選ぶ
+DIVISIONS = 48
+MIDI_TICKS_PER_QUARTER = 480
+
+NOTE_TYPES: Dict[int, str] = {1: "whole", 2: "half", 4: "quarter", 8: "eighth", 16: "16th", 32: "32nd"}
+DYNAMICS_VELOCITY: Dict[str, int] = {"ppp": 16, "pp": 33, "p": 49, "mp": 64, "mf": 80, "f": 96, "ff": 112, "fff": 127}
+DEFAULT_VELOCITY = DYNAMICS_VELOCITY["mf"]
+
+# GM パーカッションのキー番号と、譜面上の表示位置 (step, octave)
+DRUM_KEYS: Dict[str, int] = {
+    "kick": 36, "kick2": 35, "snare": 38, "rim": 37, "clap": 39, "snare2": 40,
+    "hat": 42, "pedalhat": 44, "openhat": 46, "crash": 49, "ride": 51, "ridebell": 53, "splash": 55, "china": 52,
+    "floortom": 41, "lowtom": 45, "midtom": 47, "hightom": 50,
+    "tambourine": 54, "cowbell": 56, "bongohigh": 60, "bongolow": 61,
+    "congamute": 62, "congahigh": 63, "congalow": 64, "timbalehigh": 65, "timbalelow": 66,
+    "cabasa": 69, "shaker": 70, "claves": 75, "woodblockhigh": 76, "woodblocklow": 77, "triangle": 81,
+}
+_DRUM_DISPLAY: Dict[int, Tuple[str, int]] = {
+    35: ("E", 4), 36: ("F", 4), 37: ("C", 5), 38: ("C", 5), 39: ("C", 5), 40: ("C", 5),
+    41: ("A", 4), 42: ("G", 5), 44: ("D", 4), 45: ("B", 4), 46: ("G", 5), 47: ("D", 5), 49: ("A", 5),
+    50: ("E", 5), 51: ("F", 5), 52: ("A", 5), 53: ("F", 5), 55: ("A", 5),
+}
+_DRUM_NAMES_BY_KEY = {key: name for name, key in DRUM_KEYS.items()}
+
+_STEP_SEMITONES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+_MAJOR_FIFTHS = {"C": 0, "G": 1, "D": 2, "A": 3, "E": 4, "B": 5, "F#": 6, "C#": 7,
+                 "F": -1, "Bb": -2, "Eb": -3, "Ab": -4, "Db": -5, "Gb": -6, "Cb": -7}
+_MINOR_FIFTHS = {"A": 0, "E": 1, "B": 2, "F#": 3, "C#": 4, "G#": 5, "D#": 6, "A#": 7,
+                 "D": -1, "G": -2, "C": -3, "F": -4, "Bb": -5, "Eb": -6, "Ab": -7}
+
+_PITCH_RE = re.compile(r"^([A-G])(#{1,2}|b{1,2})?(-?\d)$")
+_EVENT_RE = re.compile(r"^(?P<pitches>[^/\s]+)/(?P<value>1|2|4|8|16|32)(?P<dot>\.)?(?P<triplet>t)?(?P<marks>['>]*)$")
+_MEASURE_RE = re.compile(r"^(\d+)\s+([A-Za-z][\w-]*)\s*:\s*(.*)$")
+_SOURCE_COMMENT_RE = re.compile(r"<!-- sessionmuse:note-events\n(.*?)\n-->", re.DOTALL)
+
+
+class NoteEventsError(ValueError):
+    """ノートイベント形式として解釈できない入力。line は1始まりの行番号。"""
+
+    def __init__(self, message: str, line: Optional[int] = None):
+        super().__init__(f"{line}行目: {message}" if line is not None else message)
+        self.line = line
+
+
+@dataclass(frozen=True)
+class Pitch:
+    step: str
+    alter: int
+    octave: int
+    midi: int  # ドラムの場合は GM のキー番号（step / octave は譜面上の表示位置）
+
+
+@dataclass(frozen=True)
+class NoteEvent:
+    pitches: Tuple[Pitch, ...]  # 空の場合は休符
+    duration: int  # DIVISIONS 単位
+    note_type: str
+    dotted: bool = False
+    triplet: bool = False
+    dynamic: Optional[str] = None  # この音符から適用する強弱記号
+    staccato: bool = False
+    accent: bool = False
+
+    @property
+    def is_rest(self) -> bool:
+        return not self.pitches
+
+
+@dataclass
+class PartSpec:
+    part_id: str
+    name: str
+    program: Optional[int]  # GM プログラム番号 (1〜128)。ドラムの場合は None
+
+    @property
+    def is_drums(self) -> bool:
+        return self.program is None
+
+
+@dataclass
+class NoteScore:
+    tempo: float
+    key_fifths: int
+    key_mode: str  # "major" / "minor"
+    beats: int
+    beat_type: int
+    parts: List[PartSpec]
+    measures: Dict[str, List[List[NoteEvent]]]  # パートID -> 小節ごとのイベント（長さは拍子に合わせ済み）
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def measure_count(self) -> int:
+        return max((len(measures) for measures in self.measures.values()), default=0)
+
+    @property
+    def measure_duration(self) -> int:
+        return self.beats * DIVISIONS * 4 // self.beat_type
+
+
+def _duration(value: int, dotted: bool, triplet: bool) -> int:
+    duration = DIVISIONS * 4 // value
+    if dotted:
+        duration = duration * 3 // 2
+    if triplet:
+        duration = duration * 2 // 3
+    return duration
+
+
+# 休符で埋める際に使う長さ（長い順）。3連符は通常の音価で埋められない端数のためだけに使う
+_FILL_VALUES: List[Tuple[int, int, bool, bool]] = sorted(
+    ((_duration(value, dotted, False), value, dotted, False) for value in NOTE_TYPES for dotted in (False, True) if value != 32 or not dotted),
+    reverse=True,
+) + sorted(((_duration(value, False, True), value, False, True) for value in NOTE_TYPES), reverse=True)
+
+
+def _rests(duration: int) -> List[NoteEvent]:
+    rests = []
+    for length, value, dotted, triplet in _FILL_VALUES:
+        while duration >= length:
+            rests.append(NoteEvent(pitches=(), duration=length, note_type=NOTE_TYPES[value], dotted=dotted, triplet=triplet))
+            duration -= length
+    return rests
+
+
+def _parse_pitch(token: str, drums: bool, line: int) -> Pitch:
+    if drums:
+        key = DRUM_KEYS.get(token.lower())
+        if key is None and token.isdigit():
+            key = int(token)
+        if key is None or not 27 <= key <= 87:
+            raise NoteEventsError(f"ドラムの音色として解釈できません: {token}", line)
+        step, octave = _DRUM_DISPLAY.get(key, ("C", 5))
+        return Pitch(step=step, alter=0, octave=octave, midi=key)
+    match = _PITCH_RE.match(token)
+    if match is None:
+        raise NoteEventsError(f"音高として解釈できません: {token}", line)
+    step, accidental, octave = match.group(1), match.group(2) or "", int(match.group(3))
+    alter = len(accidental) if accidental.startswith("#") else -len(accidental)
+    midi = (octave + 1) * 12 + _STEP_SEMITONES[step] + alter
+    if not 0 <= midi <= 127:
+        raise NoteEventsError(f"音域外の音高です: {token}", line)
+    return Pitch(step=step, alter=alter, octave=octave, midi=midi)
+
+
+def _parse_events(text: str, part: PartSpec, line: int) -> List[NoteEvent]:
+    events = []
+    dynamic = None
+    for token in text.split():
+        if token.startswith("@"):
+            dynamic = token[1:].lower()
+            if dynamic not in DYNAMICS_VELOCITY:
+                raise NoteEventsError(f"未対応の強弱記号です: {token}", line)
+            continue
+        match = _EVENT_RE.match(token)
+        if match is None:
+            raise NoteEventsError(f"イベントとして解釈できません: {token}", line)
+        value = int(match.group("value"))
+        dotted, triplet = bool(match.group("dot")), bool(match.group("triplet"))
+        if value == 32 and dotted:
+            raise NoteEventsError(f"付点32分音符は使用できません: {token}", line)
+        raw_pitches = match.group("pitches")
+        pitches = () if raw_pitches.lower() == "r" else tuple(
+            _parse_pitch(p, part.is_drums, line) for p in raw_pitches.split("+")
+        )
+        marks = match.group("marks")
+        events.append(NoteEvent(
+            pitches=pitches,
+            duration=_duration(value, dotted, triplet),
+            note_type=NOTE_TYPES[value],
+            dotted=dotted,
+            triplet=triplet,
+            dynamic=dynamic if pitches else None,
+            staccato="'" in marks,
+            accent=">" in marks,
+        ))
+        if pitches:
+            dynamic = None
+    return events
+
+
+def _fit_measure(events: List[NoteEvent], measure_duration: int) -> Tuple[List[NoteEvent], Optional[str]]:
+    """小節の長さを拍子に合わせる。はみ出した音符は切り捨て、不足分は休符で埋める。"""
+    fitted = []
+    position = 0
+    for event in events:
+        if position + event.duration > measure_duration:
+            break
+        fitted.append(event)
+        position += event.duration
+    total = sum(event.duration for event in events)
+    fitted.extend(_rests(measure_duration - position))
+    if total == measure_duration:
+        return fitted, None
+    return fitted, f"小節の長さ {total}/{measure_duration} を拍子に合わせました"
+
+
+def parse_note_events(text: str) -> NoteScore:
+    """ノートイベント形式のテキストを解釈する。構文の誤りは NoteEventsError。"""
+    tempo = 120.0
+    key_fifths, key_mode = 0, "major"
+    beats, beat_type = 4, 4
+    parts: Dict[str, PartSpec] = {}
+    raw_measures: Dict[str, Dict[int, Tuple[int, List[NoteEvent]]]] = {}
+
+    for line_number, raw_line in enumerate(text.splitlines(), start=1):
+        line = raw_line.strip()
+        # "#" はシャープにも使うため、行頭の "#" のみをコメントとして扱う
+        if not line or line.startswith("#"):
+            continue
+        keyword, _, rest = line.partition(" ")
+        keyword = keyword.upper()
+        rest = rest.strip()
+        if keyword == "TEMPO":
+            try:
+                tempo = float(rest)
+            except ValueError:
+                raise NoteEventsError(f"テンポとして解釈できません: {rest}", line_number)
+            if not 20 <= tempo <= 400:
+                raise NoteEventsError(f"テンポが範囲外です: {rest}", line_number)
+        elif keyword == "KEY":
+            minor = rest.endswith("m")
+            tonic = rest[:-1] if minor else rest
+            table = _MINOR_FIFTHS if minor else _MAJOR_FIFTHS
+            if tonic not in table:
+                raise NoteEventsError(f"調として解釈できません: {rest}", line_number)
+            key_fifths, key_mode = table[tonic], "minor" if minor else "major"
+        elif keyword == "TIME":
+            match = re.match(r"^(\d+)\s*/\s*(1|2|4|8|16)$", rest)
+            if match is None or not 1 <= int(match.group(1)) <= 16:
+                raise NoteEventsError(f"拍子として解釈できません: {rest}", line_number)
+            beats, beat_type = int(match.group(1)), int(match.group(2))
+        elif keyword == "PART":
+            fields = rest.split(None, 2)
+            if len(fields) < 2:
+                raise NoteEventsError(f"PART には ID とプログラム番号（または drums）が必要です: {rest}", line_number)
+            part_id, instrument = fields[0], fields[1].lower()
+            if instrument == "drums":
+                program = None
+            elif instrument.isdigit() and 1 <= int(instrument) <= 128:
+                program = int(instrument)
+            else:
+                raise NoteEventsError(f"GM プログラム番号 (1〜128) または drums を指定してください: {fields[1]}", line_number)
+            if part_id in parts:
+                raise NoteEventsError(f"パートIDが重複しています: {part_id}", line_number)
+            parts[part_id] = PartSpec(part_id=part_id, name=fields[2].strip() if len(fields) > 2 else part_id, program=program)
+            raw_measures[part_id] = {}
+        else:
+            match = _MEASURE_RE.match(line)
+            if match is None:
+                raise NoteEventsError(f"解釈できない行です: {line[:80]}", line_number)
+            number, part_id, events_text = int(match.group(1)), match.group(2), match.group(3)
+            part = parts.get(part_id)
+            if part is None:
+                raise NoteEventsError(f"PART で宣言されていないパートです: {part_id}", line_number)
+            if number < 1 or number > 256:
+                raise NoteEventsError(f"小節番号が範囲外です: {number}", line_number)
+            if number in raw_measures[part_id]:
+                raise NoteEventsError(f"{part_id} の {number} 小節目が重複しています", line_number)
+            raw_measures[part_id][number] = (line_number, _parse_events(events_text, part, line_number))
+
+    if not parts:
+        raise NoteEventsError("PART が1つもありません。")
+    measure_count = max((max(measures) for measures in raw_measures.values() if measures), default=0)
+    if measure_count == 0:
+        raise NoteEventsError("小節が1つもありません。")
+
+    score = NoteScore(
+        tempo=tempo, key_fifths=key_fifths, key_mode=key_mode, beats=beats, beat_type=beat_type,
+        parts=list(parts.values()), measures={},
+    )
+    for part_id, measures in raw_measures.items():
+        fitted_measures = []
+        for number in range(1, measure_count + 1):
+            line_number, events = measures.get(number, (None, []))
+            fitted, warning = _fit_measure(events, score.measure_duration)
+            if warning and events:
+                score.warnings.append(f"{line_number}行目 ({part_id} {number}小節目): {warning}")
+            fitted_measures.append(fitted)
+        score.measures[part_id] = fitted_measures
+    return score
+
+
+def _format_pitch(pitch: Pitch, drums: bool) -> str:
+    if drums:
+        return _DRUM_NAMES_BY_KEY.get(pitch.midi, str(pitch.midi))
+    accidental = "#" * pitch.alter if pitch.alter > 0 else "b" * -pitch.alter
+    return f"{pitch.step}{accidental}{pitch.octave}"
+
+
+def _format_event(event: NoteEvent, part: PartSpec) -> str:
+    value = next(v for v, name in NOTE_TYPES.items() if name == event.note_type)
+    pitches = "+".join(_format_pitch(p, part.is_drums) for p in event.pitches) or "r"
+    token = f"{pitches}/{value}{'.' if event.dotted else ''}{'t' if event.triplet else ''}"
+    token += ("'" if event.staccato else "") + (">" if event.accent else "")
+    return f"@{event.dynamic} {token}" if event.dynamic else token
+
+
+def format_note_events(score: NoteScore) -> str:
+    """NoteScore を正規化したノートイベント形式で書き出す（parse_note_events で同じ NoteScore に戻る）。"""
+    key_names = _MINOR_FIFTHS if score.key_mode == "minor" else _MAJOR_FIFTHS
+    tonic = next(name for name, fifths in key_names.items() if fifths == score.key_fifths)
+    lines = [
+        f"TEMPO {score.tempo:g}",
+        f"KEY {tonic}{'m' if score.key_mode == 'minor' else ''}",
+        f"TIME {score.beats}/{score.beat_type}",
+    ]
+    lines.extend(f"PART {part.part_id} {'drums' if part.is_drums else part.program} {part.name}" for part in score.parts)
+    for number in range(1, score.measure_count + 1):
+        for index, part in enumerate(score.parts):
+            events = score.measures[part.part_id][number - 1]
+            # 全休符の小節は省略する。ただし最後の小節は小節数を保つため最初のパートの分を書く
+            last_measure_placeholder = number == score.measure_count and index == 0 and all(
+                event.is_rest for p in score.parts for event in score.measures[p.part_id][number - 1]
+            )
+            if last_measure_placeholder or any(not event.is_rest for event in events):
+                lines.append(f"{number} {part.part_id}: {' '.join(_format_event(e, part) for e in events)}")
+    return "\n".join(lines)
+
+
+def note_score_from_musicxml(musicxml_content: str) -> Optional[NoteScore]:
+    """
+    render_musicxml で組み立てた MusicXML から NoteScore を取り出す。
+    埋め込まれたノートイベントから同じ MusicXML が再現できない場合（後から編集された等）は None。
+    """
+    match = _SOURCE_COMMENT_RE.search(musicxml_content)
+    if match is None:
+        return None
+    try:
+        score = parse_note_events(match.group(1))
+    except NoteEventsError:
+        return None
+    return score if render_musicxml(score) == musicxml_content else None
+
+
+# --- MusicXML ---------------------------------------------------------------------
+
+def _midi_channels(parts: Sequence[PartSpec]) -> Dict[str, int]:
+    """パートごとの MIDI チャンネル (1〜16)。ドラムは 10、それ以外は 10 を避けて順に割り当てる。"""
+    channels = {}
+    available = [channel for channel in range(1, 17) if channel != 10]
+    for index, part in enumerate(p for p in parts if not p.is_drums):
+        channels[part.part_id] = available[index % len(available)]
+    for part in parts:
+        if part.is_drums:
+            channels[part.part_id] = 10
+    return channels
+
+
+def _drum_keys_used(score: NoteScore, part: PartSpec) -> List[int]:
+    return sorted({pitch.midi for measure in score.measures[part.part_id] for event in measure for pitch in event.pitches})
+
+
+def _clef(score: NoteScore, part: PartSpec) -> str:
+    if part.is_drums:
+        return "<clef><sign>percussion</sign></clef>"
+    pitches = [pitch.midi for measure in score.measures[part.part_id] for event in measure for pitch in event.pitches]
+    if pitches and sum(pitches) / len(pitches) < 57:
+        return "<clef><sign>F</sign><line>4</line></clef>"
+    return "<clef><sign>G</sign><line>2</line></clef>"
+
+
+def _score_part_xml(score: NoteScore, part: PartSpec, channel: int) -> str:
+    name = escape(part.name)
+    if part.is_drums:
+        keys = _drum_keys_used(score, part) or [DRUM_KEYS["kick"]]
+        instruments = "".join(
+            f'<score-instrument id="{part.part_id}-I{key}"><instrument-name>{escape(_DRUM_NAMES_BY_KEY.get(key, str(key)))}</instrument-name></score-instrument>'
+            for key in keys
+        )
+        midi = "".join(
+            f'<midi-instrument id="{part.part_id}-I{key}"><midi-channel>{channel}</midi-channel>'
+            f"<midi-unpitched>{key + 1}</midi-unpitched><volume>80</volume></midi-instrument>"
+            for key in keys
+        )
+        device_id = f"{part.part_id}-I{keys[0]}"
+    else:
+        instruments = f'<score-instrument id="{part.part_id}-I1"><instrument-name>{name}</instrument-name></score-instrument>'
+        midi = (
+            f'<midi-instrument id="{part.part_id}-I1"><midi-channel>{channel}</midi-channel>'
+            f"<midi-program>{part.program}</midi-program><volume>80</volume></midi-instrument>"
+        )
+        device_id = f"{part.part_id}-I1"
+    return (
+        f'<score-part id="{part.part_id}"><part-name>{name}</part-name>{instruments}'
+        f'<midi-device id="{device_id}" port="1"></midi-device>{midi}</score-part>'
+    )
+
+
+def _note_xml(event: NoteEvent, part: PartSpec) -> str:
+    timing = f"<duration>{event.duration}</duration>"
+    shape = f"<type>{event.note_type}</type>{'<dot/>' if event.dotted else ''}"
+    if event.triplet:
+        shape += "<time-modification><actual-notes>3</actual-notes><normal-notes>2</normal-notes></time-modification>"
+    if event.is_rest:
+        return f"<note><rest/>{timing}<voice>1</voice>{shape}</note>"
+
+    articulations = ("<staccato/>" if event.staccato else "") + ("<accent/>" if event.accent else "")
+    notations = f"<notations><articulations>{articulations}</articulations></notations>" if articulations else ""
+    notes = []
+    for index, pitch in enumerate(event.pitches):
+        chord = "<chord/>" if index else ""
+        if part.is_drums:
+            body = (
+                f"<unpitched><display-step>{pitch.step}</display-step><display-octave>{pitch.octave}</display-octave></unpitched>"
+                f'{timing}<instrument id="{part.part_id}-I{pitch.midi}"/>'
+            )
+        else:
+            alter = f"<alter>{pitch.alter}</alter>" if pitch.alter else ""
+            body = f"<pitch><step>{pitch.step}</step>{alter}<octave>{pitch.octave}</octave></pitch>{timing}"
+        notes.append(f"<note>{chord}{body}<voice>1</voice>{shape}{notations}</note>")
+    return "".join(notes)
+
+
+def render_musicxml(score: NoteScore) -> str:
+    """
+    NoteScore から再生用の MusicXML 4.0 を組み立てる。同じ入力からは常に同じ文字列になる。
+    正規化したノートイベントを先頭のコメントに埋め込む（note_score_from_musicxml で使用）。
+    """
+    channels = _midi_channels(score.parts)
+    part_list = "".join(_score_part_xml(score, part, channels[part.part_id]) for part in score.parts)
+    tempo_text = f"{score.tempo:g}"
+    body = []
+    for part_index, part in enumerate(score.parts):
+        measures = []
+        for number, events in enumerate(score.measures[part.part_id], start=1):
+            head = ""
+            if number == 1:
+                head = (
+                    f"<attributes><divisions>{DIVISIONS}</divisions>"
+                    f"<key><fifths>{score.key_fifths}</fifths><mode>{score.key_mode}</mode></key>"
+                    f"<time><beats>{score.beats}</beats><beat-type>{score.beat_type}</beat-type></time>"
+                    f"{_clef(score, part)}</attributes>"
+                )
+                if part_index == 0:
+                    head += (
+                        '<direction placement="above"><direction-type><metronome><beat-unit>quarter</beat-unit>'
+                        f"<per-minute>{tempo_text}</per-minute></metronome></direction-type><sound tempo=\"{tempo_text}\"/></direction>"
+                    )
+            notes = []
+            for event in events:
+                if event.dynamic:
+                    notes.append(
+                        f'<direction placement="below"><direction-type><dynamics><{event.dynamic}/></dynamics></direction-type></direction>'
+                    )
+                notes.append(_note_xml(event, part))
+            measures.append(f'<measure number="{number}">{head}{"".join(notes)}</measure>')
+        body.append(f'<part id="{part.part_id}">{"".join(measures)}</part>')
+    source = format_note_events(score)
+    # コメント内に "--" は書けないため、その場合（パート名に含まれる等）は埋め込まない
+    comment = f"<!-- sessionmuse:note-events\n{source}\n-->\n" if "--" not in source and not source.endswith("-") else ""
+    return (
+        f"{MUSICXML_HEADER}{comment}"
+        f'<score-partwise version="4.0"><part-list>{part_list}</part-list>{"".join(body)}</score-partwise>\n'
+    )
+
+
+# --- MIDI -----------------------------------------------------------------------
+
+def _var_len(value: int) -> bytes:
+    buffer = [value & 0x7F]
+    value >>= 7
+    while value:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(buffer))
+
+
+def _track_chunk(events: Iterable[Tuple[int, int, bytes]]) -> bytes:
+    """(tick, 同時刻内の順序, メッセージ) を差分時間付きのトラックチャンクにする。"""
+    data = bytearray()
+    last_tick = 0
+    for tick, _, message in sorted(events, key=lambda e: (e[0], e[1])):
+        data += _var_len(tick - last_tick) + message
+        last_tick = tick
+    data += b"\x00\xff\x2f\x00"
+    return b"MTrk" + struct.pack(">I", len(data)) + bytes(data)
+
+
+def render_midi(score: NoteScore, part_ids: Optional[Sequence[str]] = None) -> bytes:
+    """
+    NoteScore から Standard MIDI File (format 1) を組み立てる。part_ids を指定した場合はそのパートだけを含める。
+    強弱記号はベロシティに、アクセントは +16、スタッカートは音価の半分の長さとして反映する。
+    """
+    scale = MIDI_TICKS_PER_QUARTER // DIVISIONS
+    channels = _midi_channels(score.parts)
+    microseconds_per_quarter = int(round(60_000_000 / score.tempo))
+    key_fifths = score.key_fifths & 0xFF
+    conductor = [
+        (0, 0, b"\xff\x51\x03" + microseconds_per_quarter.to_bytes(3, "big")),
+        (0, 1, bytes([0xFF, 0x58, 0x04, score.beats, score.beat_type.bit_length() - 1, 24, 8])),
+        (0, 2, bytes([0xFF, 0x59, 0x02, key_fifths, 1 if score.key_mode == "minor" else 0])),
+    ]
+    tracks = [_track_chunk(conductor)]
+    for part in score.parts:
+        if part_ids is not None and part.part_id not in part_ids:
+            continue
+        channel = channels[part.part_id] - 1
+        events: List[Tuple[int, int, bytes]] = []
+        if not part.is_drums:
+            events.append((0, 0, bytes([0xC0 | channel, part.program - 1])))
+        velocity = DEFAULT_VELOCITY
+        tick = 0
+        for measure in score.measures[part.part_id]:
+            for event in measure:
+                length = event.duration * scale
+                if event.dynamic:
+                    velocity = DYNAMICS_VELOCITY[event.dynamic]
+                if not event.is_rest:
+                    note_velocity = min(127, velocity + 16) if event.accent else velocity
+                    sounding = max(1, length // 2) if event.staccato else length
+                    for pitch in event.pitches:
+                        # 同じ時刻では note off を note on より先に送る
+                        events.append((tick, 2, bytes([0x90 | channel, pitch.midi, note_velocity])))
+                        events.append((tick + sounding, 1, bytes([0x80 | channel, pitch.midi, 0])))
+                tick += length
+        tracks.append(_track_chunk(events))
+    header = b"MThd" + struct.pack(">IHHH", 6, 1, len(tracks), MIDI_TICKS_PER_QUARTER)
+    return header + b"".join(tracks)
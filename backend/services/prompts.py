@@ -189,6 +189,80 @@ MUSICXML_END
 """
 
 
+# --- Compact note-event generation (settings.MUSICXML_GENERATION_FORMAT == "note_events") ---
+# MusicXML はローカルで組み立てる (services.note_events) ため、モデルには音符だけを出力させる
+
+NOTE_EVENTS_GENERATION_SYSTEM_PROMPT = """
+You are an expert arranger who writes backing tracks in a compact, line-based note-event format.
+The format is converted to MusicXML and MIDI by a program, so follow the grammar exactly and output nothing else.
+
+### Header lines (once, at the top)
+TEMPO <bpm>                       e.g. TEMPO 96
+KEY <tonic>[m]                    e.g. KEY C, KEY F#m, KEY Bb, KEY Ebm
+TIME <beats>/<beat-type>          e.g. TIME 4/4, TIME 6/8
+PART <id> <gm-program|drums> <name>   e.g. PART P1 5 Rhodes Piano / PART P3 drums Drums
+  - One PART per instrument. <gm-program> is the General MIDI program number 1-128. Use `drums` for channel-10 percussion.
+
+### Measure lines
+<measure-number> <part-id>: <events...>     e.g. 1 P2: A2/4. E2/8 A2/4 r/4
+  - One line per part per measure. A measure that is not written is a full-measure rest.
+  - The durations in each line MUST add up to exactly one measure of the time signature.
+
+### Events (separated by spaces)
+<pitch>[+<pitch>...]/<length>[.][t]['][>]
+  - pitch: step + optional accidental (# or b) + octave, e.g. C4, F#3, Bb2. Join chord tones with "+": C3+E3+G3/2
+  - length: 1 whole, 2 half, 4 quarter, 8 eighth, 16 sixteenth, 32 thirty-second. "." = dotted, "t" = triplet (write all three notes of a triplet)
+  - rest: r/<length>, e.g. r/8
+  - suffix ' = staccato, > = accent
+  - dynamics: @ppp @pp @p @mp @mf @f @ff @fff before a note apply from that note on, e.g. @p C4/4
+  - drum parts use these names instead of pitches (combine with "+"): kick, snare, rim, clap, hat, pedalhat, openhat, crash, ride, ridebell,
+    floortom, lowtom, midtom, hightom, tambourine, cowbell, bongohigh, bongolow, congamute, congahigh, congalow, shaker, cabasa, claves, triangle
+
+### Example
+TEMPO 92
+KEY Dm
+TIME 4/4
+PART P1 1 Acoustic Piano
+PART P2 33 Upright Bass
+PART P3 drums Drums
+1 P1: @mp D3+F3+A3/2 C3+E3+G3/2
+1 P2: D2/4 A2/4 C2/4 G2/4
+1 P3: kick+hat/8 hat/8 snare+hat/8 hat/8 kick+hat/8 kick+hat/8 snare+hat/8 hat/8
+"""
+
+NOTE_EVENTS_GENERATION_PROMPT_TEMPLATE = """
+Write a musically rich and expressive 4-measure backing track in the note-event format.
+
+### Core Creative Concept
+*   `{humming_theme}`
+*   Embody this atmosphere and theme in a way that is clearly perceivable to the listener.
+*   You MUST NOT include a main melody. The output must be purely an accompaniment.
+
+### Instrumentation
+Choose **only one** of the following ensembles and write one PART for each instrument with the given GM program.
+*   **Modern Jazz Trio:** Rhodes Piano (5), Fretless Bass (36), Drums (drums)
+*   **Cinematic Ensemble:** Acoustic Piano (1), String Ensemble (49), Synth Pad (89)
+*   **Acoustic Texture:** Acoustic Guitar (26), Cello (43), Cajon/Percussion (drums)
+*   **Ambient Scape:** Synth Pad (90), Electric Guitar (31), Synth Bass (39)
+*   **Minimalist Groove:** Marimba (13), Upright Bass (33), Hand Percussion (drums, e.g. congas and shaker)
+
+### Composition
+*   Choose a key, tempo, and a compelling chord progression that fit the concept and the ensemble.
+*   Build a short narrative arc across the four measures with variation in rhythm, harmony, and density.
+*   Use arpeggios, riffs, counter-lines, rhythmic patterns and sustained notes where they serve the development.
+*   Add dynamics (e.g. a crescendo from @p to @mf) and articulations that follow the musical flow.
+
+### Output Format
+Output only the note events between NOTES_START and NOTES_END, without Markdown.
+If you cannot write the backing track, output only CANNOT_GENERATE_NOTES.
+
+NOTES_START
+TEMPO ...
+...
+NOTES_END
+"""
+
+
 ANALYZE_MUSICXML_PROMPT = """
 あなたは熟練の音楽アナリストです。
 提供されたMusicXMLデータを分析し、その主要な音楽的特徴を抽出してください。
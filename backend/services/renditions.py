@@ -0,0 +1,166 @@
+# backend/services/renditions.py
+"""
+合成するオーディオのレンディション（品質違いの出力）の定義
+
+- preview: 低いサンプリングレート・モノラル・低ビットレート（既定は Opus）で、リバーブ/コーラスを切って軽く合成する。
+  /api/process の応答前に合成し、ユーザーがすぐに試聴できるようにする（既定では full を応答後に合成する場合のみ）
+- full: 44.1kHz ステレオ 192kbps の MP3。preview の後に合成し、既定では保存を終えてから応答する
+  （PROCESS_SYNTHESIS_MODE / リクエストの synthesis_mode が background・deferred の場合は応答後に合成する）
+
+リクエストごとに生成するレンディションとプレビューの形式を選べます。
+また、楽器（MusicXML の score-part）ごとに合成した音声を「ステム」として保存でき、
+クライアントは再合成なしに楽器ごとのミュート・ソロができます。
+"""
+
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from config import settings
+from exceptions import InvalidRequestDataException
+
+RENDITION_NAMES = ("preview", "full")
+PREVIEW_FORMATS = ("opus", "mp3")
+SYNTHESIS_MODES = ("inline", "background", "deferred")
+
+
+@dataclass(frozen=True)
+class RenditionSpec:
+    name: str
+    format: str  # "mp3" または "opus"
+    sample_rate: int
+    channels: int
+    bitrate_kbps: int
+    lightweight: bool = False  # リバーブ・コーラスを無効にし、同時発音数を抑えて合成を軽くする
+
+    @property
+    def content_type(self) -> str:
+        return "audio/ogg" if self.format == "opus" else "audio/mpeg"
+
+    @property
+    def extension(self) -> str:
+        return ".opus" if self.format == "opus" else ".mp3"
+
+    def fluidsynth_options(self) -> List[str]:
+        """FluidSynth に渡す追加の設定（-o オプション）。出力はサンプリングレートのみ spec に合わせ、常にステレオ。"""
+        if not self.lightweight:
+            return []
+        return [
+            "-o", "synth.reverb.active=0",
+            "-o", "synth.chorus.active=0",
+            "-o", "synth.polyphony=64",
+        ]
+
+    def encoder_args(self) -> List[str]:
+        """ffmpeg の出力側の引数（標準出力にそのまま書き出せる形式にする）。"""
+        common = ["-ac", str(self.channels), "-ar", str(self.sample_rate), "-b:a", f"{self.bitrate_kbps}k"]
+        if self.format == "opus":
+            return ["-c:a", "libopus", "-application", "audio", *common, "-f", "ogg"]
+        # パイプ出力では Xing ヘッダーを書き戻せないため出力しない
+        return ["-c:a", "libmp3lame", *common, "-write_xing", "0", "-id3v2_version", "0", "-f", "mp3"]
+
+
+FULL_RENDITION = RenditionSpec(name="full", format="mp3", sample_rate=44100, channels=2, bitrate_kbps=192)
+
+
+def stem_rendition(spec: RenditionSpec) -> RenditionSpec:
+    """spec の合成と同時に書き出すステムの形式。クライアント側でミックスするため、サンプリングレートは spec にそろえる。"""
+    return RenditionSpec(
+        name="stem",
+        format="mp3",
+        sample_rate=spec.sample_rate,
+        channels=2,
+        bitrate_kbps=settings.SYNTHESIS_STEM_BITRATE_KBPS,
+    )
+
+
+@dataclass(frozen=True)
+class ScorePart:
+    part_id: str
+    name: str
+
+
+@dataclass
+class StemAudio:
+    """1パート分の合成結果。全ステムはミックスと同じ長さにそろえてある。"""
+    index: int
+    part_id: str
+    name: str
+    data: bytes
+
+
+@dataclass
+class RenderedAudio:
+    data: bytes
+    stems: List[StemAudio] = field(default_factory=list)
+
+
+def list_score_parts(musicxml_content: str) -> List[ScorePart]:
+    """
+    MusicXML の part-list からパートの一覧を返す（music21 を使わない軽量な読み取り）。
+    XMLとして読めない場合は空のリスト。
+    """
+    try:
+        root = ET.fromstring(musicxml_content.encode("utf-8"))
+    except ET.ParseError:
+        return []
+    parts = []
+    for score_part in root.iterfind("./part-list/score-part"):
+        part_id = score_part.get("id", "")
+        name = (score_part.findtext("part-name") or "").strip()
+        parts.append(ScorePart(part_id=part_id, name=name or part_id))
+    return parts
+
+
+def preview_rendition(format: Optional[str] = None) -> RenditionSpec:
+    """設定値からプレビューのレンディションを作る。format を指定した場合は形式だけ上書きする。"""
+    return RenditionSpec(
+        name="preview",
+        format=format or settings.SYNTHESIS_PREVIEW_FORMAT,
+        sample_rate=settings.SYNTHESIS_PREVIEW_SAMPLE_RATE,
+        channels=1,
+        bitrate_kbps=settings.SYNTHESIS_PREVIEW_BITRATE_KBPS,
+        lightweight=True,
+    )
+
+
+def default_rendition_names(synthesis_mode: str) -> str:
+    """レンディションの既定値。inline では応答が full の合成を待つため、プレビューは作らない。"""
+    if settings.PROCESS_RENDITIONS:
+        return settings.PROCESS_RENDITIONS
+    return "full" if synthesis_mode == "inline" else "preview,full"
+
+
+def parse_rendition_names(value: Optional[str], synthesis_mode: Optional[str] = None) -> List[str]:
+    """
+    カンマ区切りのレンディション名を検証し、重複を除いて preview, full の順に並べる。
+    未指定の場合は synthesis_mode（None の場合は PROCESS_SYNTHESIS_MODE）に応じた既定値。
+    """
+    raw = value if value is not None and value.strip() else default_rendition_names(synthesis_mode or settings.PROCESS_SYNTHESIS_MODE)
+    names = {name.strip().lower() for name in raw.split(",") if name.strip()}
+    unknown = names - set(RENDITION_NAMES)
+    if unknown or not names:
+        raise InvalidRequestDataException(
+            message=f"不正なレンディションが指定されました: {raw}。指定できる値: {', '.join(RENDITION_NAMES)}",
+        )
+    return [name for name in RENDITION_NAMES if name in names]
+
+
+def generated_mp3_blob_name(track_id: str) -> str:
+    return f"generated_mp3/{track_id}.mp3"
+
+
+def generated_musicxml_blob_name(track_id: str) -> str:
+    return f"generated_musicxml/{track_id}.musicxml"
+
+
+def rendition_blob_name(track_id: str, spec: RenditionSpec) -> str:
+    if spec.name == "full":
+        # 既存のクライアント・ストリーミング配信と同じパスに保存する
+        return generated_mp3_blob_name(track_id)
+    return f"generated_{spec.name}/{track_id}{spec.extension}"
+
+
+def stem_blob_name(track_id: str, index: int, spec: RenditionSpec) -> str:
+    # パートIDは任意の文字列になりうるため、パスには score-part の順番を使う
+    return f"generated_stems/{track_id}/{index + 1:02d}{spec.extension}"
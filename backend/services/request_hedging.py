@@ -0,0 +1,124 @@
+"""
+リクエストヘッジング
+
+最初のリクエストが学習済みのレイテンシパーセンタイルまでに応答しない場合に、
+同一リクエストをもう1本送り、先に完了した方を採用します（もう一方はキャンセル）。
+追加負荷はタスクごとに上限を設けます。
+"""
+
+import asyncio
+import logging
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from services.latency_stats import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RequestHedger:
+    """1つのタスク（呼び出し種別）に対するヘッジング制御とその統計。"""
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 0.95,
+        min_samples: int = 20,
+        default_delay_seconds: Optional[float] = None,
+        max_extra_load_ratio: float = 0.1,
+        window: Optional[LatencyWindow] = None,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay_seconds = default_delay_seconds
+        self.max_extra_load_ratio = max_extra_load_ratio
+        self.window = window or LatencyWindow()
+        self.requests = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        self.latency_saved_seconds = 0.0
+
+    def hedge_delay(self) -> Optional[float]:
+        """ヘッジを送るまでの待ち時間。十分なサンプルがなければ既定値（None ならヘッジしない）。"""
+        if self.window.count >= self.min_samples:
+            return self.window.percentile(self.percentile)
+        return self.default_delay_seconds
+
+    def _hedge_budget_available(self) -> bool:
+        return self.hedges_sent + 1 <= self.max_extra_load_ratio * self.requests
+
+    def _estimate_saved(self, winner_elapsed: float) -> float:
+        """
+        キャンセルした1本目の所要時間は観測できないため、
+        「winner_elapsed 時点で未完了だった」という条件付きの過去サンプル中央値から推定する。
+        """
+        slower = self.window.samples_above(winner_elapsed)
+        if not slower:
+            return 0.0
+        return max(0.0, statistics.median(slower) - winner_elapsed)
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """
+        call を実行し、必要に応じてヘッジする。
+        :return: (結果, ヘッジ側が採用されたか)
+        """
+        self.requests += 1
+        start = time.monotonic()
+        primary = asyncio.ensure_future(call())
+        delay = self.hedge_delay()
+        tasks = {primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._hedge_budget_available():
+                    self.hedges_sent += 1
+                    hedge = asyncio.ensure_future(call())
+                    tasks.add(hedge)
+                    logger.info(
+                        f"ヘッジリクエストを送信しました ({self.name})。待機時間: {delay:.2f}s",
+                        extra={"hedge_task": self.name, "hedge_delay_seconds": round(delay, 3)},
+                    )
+                    winner = await self._first_successful(tasks, primary)
+                    elapsed = time.monotonic() - start
+                    if winner is hedge:
+                        self.hedge_wins += 1
+                        self.latency_saved_seconds += self._estimate_saved(elapsed)
+                    # ヘッジ側が採用された場合も、呼び出し元が待った時間（1本目の所要時間の下限）を記録する。
+                    # ヘッジ側だけの所要時間を記録するとパーセンタイルが下がり続け、ヘッジが早く送られるようになる
+                    self.window.record(elapsed)
+                    return winner.result(), winner is hedge
+
+            result = await primary
+            self.window.record(time.monotonic() - start)
+            return result, False
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    async def _first_successful(tasks: set, primary: "asyncio.Future[Any]") -> "asyncio.Future[Any]":
+        """最初に成功したタスクを返す。すべて失敗した場合は1本目の例外を送出する。"""
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None:
+                    return task
+        primary.result()  # 1本目の例外を送出
+        raise RuntimeError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedges_sent": self.hedges_sent,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": (self.hedges_sent / self.requests) if self.requests else 0.0,
+            "latency_saved_seconds": round(self.latency_saved_seconds, 3),
+            "current_hedge_delay_seconds": self.hedge_delay(),
+            "latency_samples": self.window.count,
+        }
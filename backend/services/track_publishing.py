@@ -0,0 +1,161 @@
+# backend/services/track_publishing.py
+"""
+生成したトラックの保存・合成
+
+/api/process のワークフローは MusicXML の生成・解析に続けて、ここにある段階を LangGraph のノードとして実行します。
+- store_generated_musicxml: 生成した MusicXML を GCS に保存する
+- publish_preview: プレビューを合成して保存する
+- publish_full: full レンディション（とステム）を synthesis_mode (PROCESS_SYNTHESIS_MODE) に従って合成・保存する（または予約する）
+
+各段階の結果は GCS 上の blob 名などからなる JSON にできる dict で、ワークフローのチェックポイントに保存されます。
+再開時には完了済みの段階をやり直しません。ジョブキュー (JOB_QUEUE_BACKEND) がある場合、合成はワーカーで行います。
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from config import settings
+from services.audio_synthesis_service import AudioSynthesisService
+from services.gcs_service import GCSService
+from services.job_queue import JobQueue
+from services.jobs import JOB_KIND_RENDER, render_job_dedup_key, render_job_payload, run_job
+from services.renditions import (
+    FULL_RENDITION,
+    generated_musicxml_blob_name,
+    list_score_parts,
+    preview_rendition,
+    rendition_blob_name,
+    stem_blob_name,
+    stem_rendition,
+)
+from services.track_streaming import get_track_stream_registry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrackPublishOptions:
+    rendition_names: List[str]
+    preview_format: Optional[str]
+    with_stems: bool
+    # full レンディションの合成方法 (SYNTHESIS_MODES)。None の場合は PROCESS_SYNTHESIS_MODE
+    synthesis_mode: Optional[str] = None
+
+
+async def store_generated_musicxml(file_id: str, musicxml_data: str, gcs_service: GCSService) -> str:
+    """生成した MusicXML を保存し、GCS URI を返す。"""
+    return await gcs_service.upload_data_to_gcs(
+        data=musicxml_data,
+        bucket_name=settings.GCS_TRACK_BUCKET,
+        destination_blob_name=generated_musicxml_blob_name(file_id),
+        content_type="application/vnd.recordare.musicxml+xml"
+    )
+
+
+async def publish_preview(
+    file_id: str,
+    musicxml_gcs_uri: str,
+    musicxml_data: str,
+    preview_format: Optional[str],
+    gcs_service: GCSService,
+    audio_synthesis_service: AudioSynthesisService,
+    job_queue: Optional[JobQueue],
+) -> Dict[str, Any]:
+    """軽いプレビューを合成して保存する。結果は {"blob_name": ...}。"""
+    preview_spec = preview_rendition(preview_format)
+    logger.info(f"プレビューの合成を開始します。ファイルID: {file_id}")
+    if job_queue is not None:
+        preview_job = await run_job(
+            job_queue, JOB_KIND_RENDER, render_job_payload(file_id, musicxml_gcs_uri, preview_spec),
+            dedup_key=render_job_dedup_key(file_id, preview_spec),
+        )
+        return {"blob_name": preview_job["blob_name"]}
+    preview = await audio_synthesis_service.render_rendition(musicxml_data, preview_spec)
+    preview_blob_name = rendition_blob_name(file_id, preview_spec)
+    await gcs_service.upload_data_to_gcs(
+        data=preview.data,
+        bucket_name=settings.GCS_TRACK_BUCKET,
+        destination_blob_name=preview_blob_name,
+        content_type=preview_spec.content_type
+    )
+    return {"blob_name": preview_blob_name}
+
+
+async def publish_full(
+    file_id: str,
+    musicxml_gcs_uri: str,
+    musicxml_data: str,
+    with_stems: bool,
+    gcs_service: GCSService,
+    audio_synthesis_service: AudioSynthesisService,
+    job_queue: Optional[JobQueue],
+    synthesis_mode: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    full レンディションを合成・保存する（synthesis_mode=inline）か、合成を予約する。
+    synthesis_mode が None の場合は PROCESS_SYNTHESIS_MODE に従う。
+    結果は {"status": "ready" | "pending", "blob_name": ..., "stems": [{"index", "part_id", "name", "blob_name"}]}。
+    pending の場合、full の blob_name は None。ステムの blob_name は保存先（パスは固定）で、完了後に取得できる。
+    """
+    synthesis_mode = synthesis_mode or settings.PROCESS_SYNTHESIS_MODE
+    if synthesis_mode == "inline" and job_queue is not None:
+        logger.info(f"MusicXMLからMP3への変換をワーカーに依頼します。ファイルID: {file_id}")
+        full_job = await run_job(
+            job_queue, JOB_KIND_RENDER, render_job_payload(file_id, musicxml_gcs_uri, FULL_RENDITION, with_stems=with_stems),
+            dedup_key=render_job_dedup_key(file_id, FULL_RENDITION),
+        )
+        return {"status": "ready", "blob_name": full_job["blob_name"], "stems": full_job["stems"]}
+
+    if synthesis_mode == "inline":
+        # MusicXMLからMP3への変換
+        logger.info(f"MusicXMLからMP3への変換を開始します。ファイルID: {file_id}")
+        rendered = await audio_synthesis_service.render_rendition(musicxml_data, FULL_RENDITION, with_stems=with_stems)
+        logger.info(f"MusicXMLからMP3への変換が完了しました。ファイルID: {file_id}")
+
+        # ステム、生成されたMP3データの順にGCSにアップロード（MP3が保存済みなら、ステムもすべて保存済み）
+        stem_spec = stem_rendition(FULL_RENDITION)
+        stems = []
+        for stem in rendered.stems:
+            stem_blob = stem_blob_name(file_id, stem.index, stem_spec)
+            await gcs_service.upload_data_to_gcs(
+                data=stem.data,
+                bucket_name=settings.GCS_TRACK_BUCKET,
+                destination_blob_name=stem_blob,
+                content_type=stem_spec.content_type
+            )
+            stems.append({"index": stem.index, "part_id": stem.part_id, "name": stem.name, "blob_name": stem_blob})
+        gcs_blob_name_mp3 = rendition_blob_name(file_id, FULL_RENDITION)
+        await gcs_service.upload_data_to_gcs(
+            data=rendered.data,
+            bucket_name=settings.GCS_TRACK_BUCKET,
+            destination_blob_name=gcs_blob_name_mp3,
+            content_type="audio/mpeg"
+        )
+        return {"status": "ready", "blob_name": gcs_blob_name_mp3, "stems": stems}
+
+    # ステムはストリーミング配信できないため、要求された場合は deferred でもバックグラウンドで合成する
+    if (synthesis_mode == "background" or with_stems) and job_queue is not None:
+        # 完了を待たずに投入し、ワーカーが合成・保存する
+        # stream_url へのリクエストは同じ dedup_key でこのジョブに合流する（API プロセスで重ねて合成しない）
+        full_job = await job_queue.enqueue(
+            JOB_KIND_RENDER, render_job_payload(file_id, musicxml_gcs_uri, FULL_RENDITION, with_stems=with_stems),
+            dedup_key=render_job_dedup_key(file_id, FULL_RENDITION),
+        )
+        logger.info(f"MP3の合成をワーカーに依頼しました。ファイルID: {file_id}, job_id={full_job.id}")
+    elif synthesis_mode == "background" or with_stems:
+        # 応答後も合成を続け、完了したら GCS に保存する。合成中に stream_url へ来たリクエストはこの合成に合流する
+        get_track_stream_registry().start(
+            file_id, musicxml_data, audio_synthesis_service, gcs_service, with_stems=with_stems,
+        )
+        logger.info(f"MP3の合成をバックグラウンドで開始しました。ファイルID: {file_id}")
+    else:
+        # 合成は stream_url へのリクエスト時に、再生と並行して行う
+        logger.info(f"MP3の合成をストリーミング配信まで遅延します。ファイルID: {file_id}")
+    # 合成前のため、ステムのパートの一覧は MusicXML の part-list から作る
+    stem_spec = stem_rendition(FULL_RENDITION)
+    stems = [
+        {"index": index, "part_id": part.part_id, "name": part.name, "blob_name": stem_blob_name(file_id, index, stem_spec)}
+        for index, part in enumerate(list_score_parts(musicxml_data))
+    ] if with_stems else []
+    return {"status": "pending", "blob_name": None, "stems": stems}
@@ -0,0 +1,163 @@
+# backend/services/track_streaming.py
+"""
+合成中のトラックのプログレッシブ配信
+
+GET /api/tracks/{id}/stream で、レンダラーが出力したMP3フレームをその場でクライアントに送ります。
+合成はリクエストとは独立したタスクで実行し、出力は TrackStream に蓄積して
+同じトラックを要求した全クライアント（途中から参加したクライアントを含む）に先頭から配信します。
+合成が終わると完成したファイルを GCS に保存し、以降のリクエストは保存済みオブジェクトへリダイレクトされます。
+"""
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+from exceptions import AppException, AudioSynthesisException
+from services.renditions import FULL_RENDITION, generated_mp3_blob_name, stem_blob_name, stem_rendition
+
+if TYPE_CHECKING:
+    from services.audio_synthesis_service import AudioSynthesisService
+    from services.gcs_service import GCSService
+
+logger = logging.getLogger(__name__)
+
+
+class TrackStream:
+    """1トラック分の合成出力。追記されたチャンクを複数の購読者に配信する（イベントループ上でのみ操作する）。"""
+
+    def __init__(self, track_id: str):
+        self.track_id = track_id
+        self.chunks: List[bytes] = []
+        self.total_bytes = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.started_at = time.monotonic()
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        # 待機中の購読者をすべて起こし、次の変化用に新しいイベントを用意する
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.total_bytes += len(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[Exception] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def wait_started(self) -> None:
+        """最初のチャンクが届くか、合成が終了するまで待つ。"""
+        while not self.chunks and not self.done:
+            await self._changed.wait()
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    # 送信開始後はステータスを変えられないため、ログに残して打ち切る
+                    logger.warning(f"トラック {self.track_id} の合成が途中で失敗したため配信を打ち切りました: {self.error}")
+                return
+            await changed.wait()
+
+    def data(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+class TrackStreamRegistry:
+    """合成中（および GCS への保存中）のトラックを保持する。同じトラックの合成は1回だけ実行する。"""
+
+    def __init__(self, max_concurrent_syntheses: int = settings.TRACK_STREAM_MAX_CONCURRENT_SYNTHESES):
+        self._streams: Dict[str, TrackStream] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._semaphore = asyncio.Semaphore(max_concurrent_syntheses)
+
+    def get(self, track_id: str) -> Optional[TrackStream]:
+        return self._streams.get(track_id)
+
+    def start(
+        self, track_id: str, musicxml_content: str,
+        synthesis_service: "AudioSynthesisService", gcs_service: "GCSService", with_stems: bool = False,
+    ) -> TrackStream:
+        existing = self._streams.get(track_id)
+        if existing is not None:
+            return existing
+        stream = TrackStream(track_id)
+        self._streams[track_id] = stream
+        # クライアントが切断しても合成と保存は続ける
+        task = asyncio.create_task(self._produce(stream, musicxml_content, synthesis_service, gcs_service, with_stems))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return stream
+
+    async def _produce(
+        self, stream: TrackStream, musicxml_content: str,
+        synthesis_service: "AudioSynthesisService", gcs_service: "GCSService", with_stems: bool,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._semaphore:
+                # チャンクはワーカースレッドからイベントループへ順番どおりに受け渡す
+                stems = await run_in_threadpool(
+                    synthesis_service.stream_musicxml_to_mp3_sync, musicxml_content,
+                    lambda chunk: loop.call_soon_threadsafe(stream.append, chunk), with_stems,
+                )
+        except Exception as e:
+            error = e if isinstance(e, AppException) else AudioSynthesisException(detail=str(e))
+            stream.finish(error)
+            self._streams.pop(stream.track_id, None)
+            return
+
+        stream.finish()
+        logger.info(
+            f"トラック {stream.track_id} のストリーミング合成が完了しました。GCSに保存します。",
+            extra={"track_id": stream.track_id, "mp3_bytes": stream.total_bytes, "duration_seconds": round(time.monotonic() - stream.started_at, 3)},
+        )
+        try:
+            # ステムを先に保存する（MP3が保存済みなら、ステムもすべて保存済みとみなせるようにする）
+            stem_spec = stem_rendition(FULL_RENDITION)
+            for stem in stems:
+                await gcs_service.upload_data_to_gcs(
+                    data=stem.data,
+                    bucket_name=settings.GCS_TRACK_BUCKET,
+                    destination_blob_name=stem_blob_name(stream.track_id, stem.index, stem_spec),
+                    content_type=stem_spec.content_type,
+                )
+            await gcs_service.upload_data_to_gcs(
+                data=stream.data(),
+                bucket_name=settings.GCS_TRACK_BUCKET,
+                destination_blob_name=generated_mp3_blob_name(stream.track_id),
+                content_type="audio/mpeg",
+            )
+        except Exception:
+            # 保存に失敗した場合は、次のリクエストで再度合成する
+            logger.error(f"トラック {stream.track_id} のMP3のGCS保存に失敗しました。", exc_info=True)
+        finally:
+            self._streams.pop(stream.track_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_streams": len(self._streams),
+            "synthesizing": sum(1 for stream in self._streams.values() if not stream.done),
+        }
+
+
+_track_stream_registry_instance: Optional[TrackStreamRegistry] = None
+
+def get_track_stream_registry() -> TrackStreamRegistry:
+    global _track_stream_registry_instance
+    if _track_stream_registry_instance is None:
+        _track_stream_registry_instance = TrackStreamRegistry()
+    return _track_stream_registry_instance
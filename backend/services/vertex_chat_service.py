@@ -1,41 +1,65 @@
 # backend/services/vertex_chat_service.py
 import logging
 import asyncio
-from typing import Union, List, AsyncGenerator, Optional
+import time
+from typing import TYPE_CHECKING, Dict, Union, List, AsyncGenerator, Optional
 
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessageChunk
-from langchain_google_vertexai import ChatVertexAI, HarmCategory, HarmBlockThreshold
 
 from models import ChatMessage, ErrorCode
 from config import settings
+from metrics import CHAT_TOTAL, CHAT_TTFT
 from exceptions import VertexAIAPIErrorException, InternalServerErrorException # Changed
 from services import prompts
+from services.vertex_resilience import get_vertex_resilience
+from services.model_cascade import resolve_model_cascade, run_model_cascade, should_escalate, get_model_cascade_stats
+from services.llm_usage import record_llm_call
+
+if TYPE_CHECKING:
+    from langchain_google_vertexai import ChatVertexAI # 実行時は初回のモデル初期化時に読み込む
 
 logger = logging.getLogger(__name__)
 
 class VertexChatService:
-    def __init__(self, llm_client: Optional[ChatVertexAI] = None):
+    def __init__(self, llm_client: Optional["ChatVertexAI"] = None):
+        self._llms: Dict[str, "ChatVertexAI"] = {}
         if llm_client:
             self.llm = llm_client
+            self.model_name = getattr(llm_client, "model_name", None) or settings.CHAT_GEMINI_MODEL_NAME
+            self.models = [self.model_name]
+            self._llms[self.model_name] = llm_client
         else:
-            try:
-                safety_settings_vertex = {
-                    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                }
-                self.llm = ChatVertexAI(
-                    location=settings.VERTEX_AI_LOCATION,
-                    model_name=settings.CHAT_GEMINI_MODEL_NAME,
-                    temperature=0.7,
-                    request_timeout=settings.VERTEX_AI_TIMEOUT_SECONDS,
-                    safety_settings=safety_settings_vertex,
-                )
-                logger.info(f"ChatVertexAI initialized for chat service with model '{settings.CHAT_GEMINI_MODEL_NAME}', Location: {settings.VERTEX_AI_LOCATION}).")
-            except Exception as e:
-                logger.error(f"Failed to initialize ChatVertexAI for chat service: {e}", exc_info=True)
-                raise VertexAIAPIErrorException(message="Failed to initialize Vertex AI LLM for chat.", detail=str(e), error_code=ErrorCode.VERTEX_AI_API_ERROR)
+            self.models = resolve_model_cascade(settings.CHAT_GEMINI_MODEL_CASCADE, settings.CHAT_GEMINI_MODEL_NAME)
+            self.model_name = self.models[0]
+            self.llm = self._get_llm(self.model_name)
+        self.resilience = get_vertex_resilience()
+
+    def _get_llm(self, model_name: str) -> "ChatVertexAI":
+        """カスケード内の各モデル用クライアントを必要になった時点で初期化する。"""
+        if model_name in self._llms:
+            return self._llms[model_name]
+        from langchain_google_vertexai import ChatVertexAI, HarmBlockThreshold, HarmCategory
+        try:
+            safety_settings_vertex = {
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            }
+            llm = ChatVertexAI(
+                location=settings.VERTEX_AI_LOCATION,
+                model_name=model_name,
+                temperature=0.7,
+                request_timeout=settings.VERTEX_AI_TIMEOUT_SECONDS,
+                max_retries=1, # リトライは vertex_resilience のリトライ予算内で行う
+                safety_settings=safety_settings_vertex,
+            )
+            logger.info(f"ChatVertexAI initialized for chat service with model '{model_name}', Location: {settings.VERTEX_AI_LOCATION}).")
+        except Exception as e:
+            logger.error(f"Failed to initialize ChatVertexAI for chat service: {e}", exc_info=True)
+            raise VertexAIAPIErrorException(message="Failed to initialize Vertex AI LLM for chat.", detail=str(e), error_code=ErrorCode.VERTEX_AI_API_ERROR)
+        self._llms[model_name] = llm
+        return llm
 
     def build_vertex_chat_messages(
         self,
@@ -74,16 +98,45 @@ class VertexChatService:
         messages: List[Union[SystemMessage, HumanMessage, AIMessage]]
     ) -> AsyncGenerator[str, None]:
         full_response_content = ""
+        task = "Chat (streaming)"
+        cascade_stats = get_model_cascade_stats()
+        stream_start = time.perf_counter()
         try:
-            async for chunk in self.llm.astream(messages):
-                if not isinstance(chunk, BaseMessageChunk):
-                    logger.warning(f"Unexpected chunk type in stream: {type(chunk)}. Skipping.")
+            for index, model_name in enumerate(self.models):
+                llm = self._get_llm(model_name)
+                chunk_stream = self.resilience.stream(
+                    model_name, settings.VERTEX_AI_LOCATION, task, lambda: llm.astream(messages)
+                )
+                start_time = time.monotonic()
+                merged_chunk: Optional[BaseMessageChunk] = None # usage_metadata はチャンクごとの差分のため加算して合計する
+                model_ttft: Optional[float] = None
+                try:
+                    async for chunk in chunk_stream:
+                        if not isinstance(chunk, BaseMessageChunk):
+                            logger.warning(f"Unexpected chunk type in stream: {type(chunk)}. Skipping.")
+                            continue
+                        merged_chunk = chunk if merged_chunk is None else merged_chunk + chunk
+                        content_piece = chunk.content
+                        if content_piece:
+                            if not full_response_content:
+                                model_ttft = time.monotonic() - start_time
+                                CHAT_TTFT.observe(time.perf_counter() - stream_start)
+                            sse_chat_message = ChatMessage(role="assistant", content=str(content_piece))
+                            yield f"data: {sse_chat_message.model_dump_json()}\n\n"
+                            full_response_content += str(content_piece)
+                except Exception as e:
+                    # 出力を送り始める前のタイムアウトのみ、次のモデルへエスカレーションする
+                    escalate = not full_response_content and index < len(self.models) - 1 and should_escalate(e)
+                    cascade_stats.record(task, model_name, success=False, duration_seconds=time.monotonic() - start_time, escalated=escalate)
+                    if not escalate:
+                        raise
+                    logger.warning(f"Chat stream with model '{model_name}' failed before the first chunk; escalating to '{self.models[index + 1]}'.")
                     continue
-                content_piece = chunk.content
-                if content_piece:
-                    sse_chat_message = ChatMessage(role="assistant", content=str(content_piece))
-                    yield f"data: {sse_chat_message.model_dump_json()}\n\n"
-                    full_response_content += str(content_piece)
+                duration = time.monotonic() - start_time
+                cascade_stats.record(task, model_name, success=True, duration_seconds=duration)
+                record_llm_call(task, model_name, merged_chunk, duration, ttft_seconds=model_ttft, streaming=True)
+                break
+            CHAT_TOTAL.labels("streaming").observe(time.perf_counter() - stream_start)
             logger.info(f"Finished streaming Vertex AI response. Total length: {len(full_response_content)}")
         except Exception as e:
             error_code_to_use = ErrorCode.VERTEX_AI_API_ERROR
@@ -110,11 +163,22 @@ class VertexChatService:
         self,
         messages: List[Union[SystemMessage, HumanMessage, AIMessage]]
     ) -> ChatMessage:
+        start = time.perf_counter()
+
+        async def attempt(model_name: str) -> AIMessage:
+            attempt_start = time.monotonic()
+            response = await self.resilience.call(
+                model_name, settings.VERTEX_AI_LOCATION, "Chat", lambda: self._get_llm(model_name).ainvoke(messages)
+            )
+            record_llm_call("Chat", model_name, response, time.monotonic() - attempt_start)
+            return response
+
         try:
-            ai_response: AIMessage = await self.llm.ainvoke(messages)
+            ai_response: AIMessage = await run_model_cascade("Chat", self.models, attempt)
             if not ai_response.content or not isinstance(ai_response.content, str):
                 logger.error(f"Vertex AI API returned empty or invalid content: {ai_response.content}")
                 raise VertexAIAPIErrorException(message="AI response was empty or in an unexpected format (Vertex AI).", error_code=ErrorCode.VERTEX_AI_API_ERROR)
+            CHAT_TOTAL.labels("non_streaming").observe(time.perf_counter() - start)
             logger.info(f"Received non-streaming AI response: '{str(ai_response.content)[:100]}...'")
             return ChatMessage(role="assistant", content=ai_response.content)
         except Exception as e:
@@ -128,5 +192,11 @@ class VertexChatService:
             else: # Wrap other exceptions
                 raise VertexAIAPIErrorException(message="An unexpected error occurred while communicating with the AI (Vertex AI).", detail=str(e), error_code=ErrorCode.VERTEX_AI_API_ERROR)
 
+_vertex_chat_service_instance: Optional[VertexChatService] = None
+
 def get_vertex_chat_service() -> VertexChatService:
-    return VertexChatService()
+    # ChatVertexAI クライアントはモデルごとにキャッシュされるため、サービス自体をプロセス内で共有する
+    global _vertex_chat_service_instance
+    if _vertex_chat_service_instance is None:
+        _vertex_chat_service_instance = VertexChatService()
+    return _vertex_chat_service_instance
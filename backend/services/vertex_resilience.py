@@ -0,0 +1,337 @@
+"""
+Vertex AI 呼び出しのレジリエンス層
+
+AudioAnalyzer と VertexChatService で共有される以下の仕組みを提供します。
+- 観測レイテンシに基づくタスクごとの適応的タイムアウト
+- ジッター付き指数バックオフによる一時的エラーのリトライ（全体のリトライ予算内）
+- (モデル, ロケーション) ごとのサーキットブレーカー
+"""
+
+import asyncio
+import logging
+import random
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from google.api_core import exceptions as google_exceptions
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+
+from config import settings
+from exceptions import VertexAIAPIErrorException
+from models import ErrorCode
+from services.latency_stats import LatencyWindow
+from tracing import set_token_usage, tracer
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+TRANSIENT_EXCEPTIONS: Tuple[type, ...] = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.Aborted,
+)
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    return isinstance(exc, TRANSIENT_EXCEPTIONS)
+
+
+async def _aclose_quietly(iterator: AsyncIterator[Any]) -> None:
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is None:
+        return
+    try:
+        await aclose()
+    except Exception:
+        pass
+
+
+class CircuitBreaker:
+    """連続失敗回数で開き、一定時間後に1件の試行（half-open）で回復を確認するブレーカー。"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def retry_after_seconds(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout_seconds - time.monotonic())
+
+    def allow_request(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.retry_after_seconds() <= 0:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self) -> None:
+        """half-open の試行が結果を残さず中断された場合に、次の試行を許可する。"""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"サーキットブレーカーを閉じました ({self.name})。")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"サーキットブレーカーを開きました ({self.name})。連続失敗数: {self.consecutive_failures}",
+                    extra={"circuit_breaker": self.name, "consecutive_failures": self.consecutive_failures},
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class RetryBudget:
+    """
+    リクエストごとに ratio 分のトークンを積み、リトライ1回につき1トークン消費する。
+    障害時にリトライがリクエスト数の ratio 倍を超えて増幅しないようにする。
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_request(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+
+class VertexResilience:
+    def __init__(self):
+        self.max_attempts = max(1, settings.VERTEX_RETRY_MAX_ATTEMPTS)
+        self.base_delay_seconds = settings.VERTEX_RETRY_BASE_DELAY_SECONDS
+        self.max_delay_seconds = settings.VERTEX_RETRY_MAX_DELAY_SECONDS
+        self.retry_budget = RetryBudget(settings.VERTEX_RETRY_BUDGET_RATIO, settings.VERTEX_RETRY_BUDGET_MAX_TOKENS)
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._latency: Dict[str, LatencyWindow] = {}
+
+    def get_breaker(self, model_name: str, location: str) -> CircuitBreaker:
+        key = (model_name, location)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                f"{model_name}@{location}",
+                failure_threshold=settings.VERTEX_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout_seconds=settings.VERTEX_CIRCUIT_RESET_SECONDS,
+            )
+            self._breakers[key] = breaker
+        return breaker
+
+    def deadline_for(self, task: str) -> float:
+        """
+        タスクの1試行あたりの期限（秒）。十分なサンプルがあれば観測パーセンタイル×倍率、
+        なければ VERTEX_AI_TIMEOUT_SECONDS。常に [最小値, VERTEX_AI_TIMEOUT_SECONDS] に収める。
+        """
+        ceiling = float(settings.VERTEX_AI_TIMEOUT_SECONDS)
+        window = self._latency.get(task)
+        if window is None or window.count < settings.VERTEX_ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            return ceiling
+        observed = window.percentile(settings.VERTEX_ADAPTIVE_TIMEOUT_PERCENTILE) or ceiling
+        adaptive = observed * settings.VERTEX_ADAPTIVE_TIMEOUT_MULTIPLIER
+        return min(ceiling, max(settings.VERTEX_ADAPTIVE_TIMEOUT_MIN_SECONDS, adaptive))
+
+    def _record_latency(self, task: str, duration_seconds: float) -> None:
+        self._latency.setdefault(task, LatencyWindow()).record(duration_seconds)
+
+    def _record_timeout(self, task: str, exc: BaseException, deadline: float, start: float) -> None:
+        """
+        期限切れの試行も、到達した期限をレイテンシとして記録する（実際の所要時間はそれ以上）。
+        成功した試行だけで期限を決めると、応答が遅くなったときに期限が短いまま上がらず、期限切れが増え続ける。
+        """
+        if isinstance(exc, asyncio.TimeoutError) and time.monotonic() - start >= deadline:
+            self._record_latency(task, deadline)
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        """Full jitter: [0, min(max, base * 2^attempt)] の一様乱数"""
+        return random.uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * (2 ** attempt)))
+
+    def _circuit_open_error(self, breaker: CircuitBreaker) -> VertexAIAPIErrorException:
+        return VertexAIAPIErrorException(
+            message="Vertex AIが一時的に利用できないため、リクエストを中断しました（サーキットブレーカー作動中）。",
+            detail=f"circuit={breaker.name}, retry_after_seconds={breaker.retry_after_seconds():.1f}",
+            error_code=ErrorCode.VERTEX_AI_API_ERROR,
+        )
+
+    def _should_retry(self, exc: BaseException, attempt: int, task: str, breaker: CircuitBreaker) -> bool:
+        if not is_transient_error(exc):
+            return False
+        breaker.record_failure()
+        if breaker.state == CircuitBreaker.OPEN or attempt + 1 >= self.max_attempts:
+            return False
+        if not self.retry_budget.try_spend():
+            logger.warning(f"リトライ予算が枯渇しているためリトライしません ({task})。", extra={"task": task})
+            return False
+        return True
+
+    async def call(self, model_name: str, location: str, task: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """
+        factory() が返すコルーチンを、期限・リトライ・サーキットブレーカー付きで実行する。
+        """
+        with tracer.start_as_current_span(
+            f"vertex_ai {task}", kind=SpanKind.CLIENT,
+            attributes={"gen_ai.system": "vertex_ai", "gen_ai.request.model": model_name,
+                        "vertex.location": location, "vertex.task": task},
+        ) as span:
+            result = await self._call(model_name, location, task, factory, span)
+            set_token_usage(span, result)
+            return result
+
+    async def _call(self, model_name: str, location: str, task: str, factory: Callable[[], Awaitable[T]], span: Span) -> T:
+        breaker = self.get_breaker(model_name, location)
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            if not breaker.allow_request():
+                raise self._circuit_open_error(breaker)
+            deadline = self.deadline_for(task)
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(factory(), timeout=deadline)
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                raise
+            except Exception as e:
+                self._record_timeout(task, e, deadline, start)
+                if not self._should_retry(e, attempt, task, breaker):
+                    if not is_transient_error(e):
+                        breaker.record_success()  # 応答自体は返っている（安全フィルター等）
+                    raise
+                delay = self._backoff_seconds(attempt)
+                span.add_event("retry", {"attempt": attempt + 1, "error.type": type(e).__name__, "backoff_seconds": delay})
+                logger.warning(
+                    f"Vertex AI呼び出しの一時的なエラーのためリトライします ({task}, 試行 {attempt + 1}/{self.max_attempts}): {type(e).__name__}",
+                    extra={"task": task, "vertex_model": model_name, "attempt": attempt + 1,
+                           "deadline_seconds": round(deadline, 2), "backoff_seconds": round(delay, 2)},
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            breaker.record_success()
+            self._record_latency(task, time.monotonic() - start)
+            return result
+
+    async def stream(self, model_name: str, location: str, task: str, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """
+        ストリーミング呼び出し。最初のチャンクまでの期限とリトライを適用し、
+        チャンクの送出開始後はリトライしない（重複出力を避けるため）。
+        """
+        # ジェネレーターは yield をまたいでコンテキストを保持できないため、カレントスパンにはしない
+        span = tracer.start_span(
+            f"vertex_ai {task}", kind=SpanKind.CLIENT,
+            attributes={"gen_ai.system": "vertex_ai", "gen_ai.request.model": model_name,
+                        "vertex.location": location, "vertex.task": task, "vertex.streaming": True},
+        )
+        try:
+            async with aclosing(self._stream(model_name, location, task, factory, span)) as chunks:
+                async for chunk in chunks:
+                    set_token_usage(span, chunk)
+                    yield chunk
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(Status(StatusCode.ERROR, type(e).__name__))
+            raise
+        finally:
+            span.end()
+
+    async def _stream(self, model_name: str, location: str, task: str, factory: Callable[[], AsyncIterator[Any]], span: Span) -> AsyncIterator[Any]:
+        breaker = self.get_breaker(model_name, location)
+        self.retry_budget.record_request()
+        attempt = 0
+        while True:
+            if not breaker.allow_request():
+                raise self._circuit_open_error(breaker)
+            deadline = self.deadline_for(task)
+            start = time.monotonic()
+            iterator = factory().__aiter__()
+            try:
+                first_chunk = await asyncio.wait_for(iterator.__anext__(), timeout=deadline)
+            except StopAsyncIteration:
+                breaker.record_success()
+                return
+            except asyncio.CancelledError:
+                breaker.release_probe()
+                await _aclose_quietly(iterator)
+                raise
+            except Exception as e:
+                await _aclose_quietly(iterator)
+                self._record_timeout(task, e, deadline, start)
+                if not self._should_retry(e, attempt, task, breaker):
+                    if not is_transient_error(e):
+                        breaker.record_success()
+                    raise
+                delay = self._backoff_seconds(attempt)
+                span.add_event("retry", {"attempt": attempt + 1, "error.type": type(e).__name__, "backoff_seconds": delay})
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            breaker.record_success()
+            self._record_latency(task, time.monotonic() - start)
+            span.add_event("first_chunk", {"attempt": attempt + 1})
+            break
+
+        yield first_chunk
+        try:
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            if is_transient_error(e):
+                breaker.record_failure()
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retry_budget_tokens": round(self.retry_budget.tokens, 2),
+            "retries": self.retry_budget.retries,
+            "retry_budget_exhausted": self.retry_budget.exhausted,
+            "circuit_breakers": {
+                breaker.name: {"state": breaker.state, "consecutive_failures": breaker.consecutive_failures}
+                for breaker in self._breakers.values()
+            },
+            "deadlines_seconds": {task: round(self.deadline_for(task), 2) for task in self._latency},
+        }
+
+
+# 依存性注入のための関数（プロセス内で共有）
+_vertex_resilience_instance: Optional[VertexResilience] = None
+
+def get_vertex_resilience() -> VertexResilience:
+    global _vertex_resilience_instance
+    if _vertex_resilience_instance is None:
+        _vertex_resilience_instance = VertexResilience()
+    return _vertex_resilience_instance
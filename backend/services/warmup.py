@@ -0,0 +1,159 @@
+# backend/services/warmup.py
+"""
+起動時のウォームアップ
+
+最初のリクエストが支払っていた初期化コスト（重いモジュールの読み込み、LangGraph ワークフローの
+コンパイル、Vertex AI / GCS クライアントの生成、SoundFont の確認と music21 の初回パース）を
+アプリケーションの lifespan 中に前払いします。完了するまで（既定では失敗した場合も）/ready は 503 を返し、
+Cloud Run のスタートアッププローブ（cloudbuild.yml）が /ready を見るため、
+トラフィックがコールドなインスタンスに届くことはありません。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# ウォームアップ用の最小のスコア（1パート・1小節、テンポ指定あり）
+WARMUP_MUSICXML = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<!DOCTYPE score-partwise PUBLIC "-//Recordare//DTD MusicXML 3.1 Partwise//EN" "http://www.musicxml.org/dtds/partwise.dtd">
+<score-partwise version="3.1">
+  <part-list>
+    <score-part id="P1"><part-name>Warmup</part-name></score-part>
+  </part-list>
+  <part id="P1">
+    <measure number="1">
+      <attributes>
+        <divisions>1</divisions>
+        <key><fifths>0</fifths></key>
+        <time><beats>4</beats><beat-type>4</beat-type></time>
+        <clef><sign>G</sign><line>2</line></clef>
+      </attributes>
+      <direction placement="above">
+        <direction-type><metronome><beat-unit>quarter</beat-unit><per-minute>120</per-minute></metronome></direction-type>
+        <sound tempo="120"/>
+      </direction>
+      <note><pitch><step>C</step><octave>4</octave></pitch><duration>4</duration><type>whole</type></note>
+    </measure>
+  </part>
+</score-partwise>
+"""
+
+
+class WarmupState:
+    """ウォームアップの進行状況。/ready の判定に使う。"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(self):
+        self.status = self.PENDING
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.duration_seconds: Optional[float] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.status == self.READY
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable[Any]]) -> bool:
+        start = time.perf_counter()
+        try:
+            await step()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            duration = time.perf_counter() - start
+            error = f"{type(e).__name__}: {e}"
+            if getattr(e, "detail", None):
+                error += f" ({e.detail})"
+            self.steps[name] = {"ok": False, "duration_seconds": round(duration, 3), "error": error}
+            logger.warning(f"ウォームアップ手順 '{name}' に失敗しました: {error}", extra={"warmup_step": name})
+            return False
+        duration = time.perf_counter() - start
+        self.steps[name] = {"ok": True, "duration_seconds": round(duration, 3)}
+        logger.info(f"ウォームアップ手順 '{name}' が完了しました ({duration:.2f}s)。", extra={"warmup_step": name})
+        return True
+
+    async def run(self) -> None:
+        """全手順を実行する。WARMUP_STRICT の場合、いずれかの手順が失敗すると ready にならない。"""
+        self.status = self.RUNNING
+        start = time.perf_counter()
+        results = [
+            await self._run_step("workflow", _warm_workflow),
+            await self._run_step("vertex_clients", _warm_vertex_clients),
+            await self._run_step("gcs_client", _warm_gcs_client),
+            await self._run_step("synthesis", _warm_synthesis),
+        ]
+        self.duration_seconds = round(time.perf_counter() - start, 3)
+        if all(results) or not settings.WARMUP_STRICT:
+            self.status = self.READY
+            logger.info(f"ウォームアップが完了しました ({self.duration_seconds:.2f}s)。", extra={"warmup_steps": self.steps})
+        else:
+            self.status = self.FAILED
+            logger.error("ウォームアップに失敗したため、このインスタンスは ready になりません。", extra={"warmup_steps": self.steps})
+
+    def mark_ready(self) -> None:
+        self.status = self.READY
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"status": self.status, "duration_seconds": self.duration_seconds, "steps": self.steps}
+
+
+async def _warm_workflow() -> None:
+    # LangGraph / langchain_google_vertexai の読み込みとワークフローのコンパイル
+    def build() -> None:
+        from services.audio_analysis_service import get_app_graph, get_audio_analyzer
+        get_app_graph()
+        get_audio_analyzer()
+    await run_in_threadpool(build)
+
+
+async def _warm_vertex_clients() -> None:
+    # 認証情報の解決を含む ChatVertexAI クライアントの生成（実際のAPI呼び出しは行わない）
+    from services.audio_analysis_service import get_audio_analyzer
+    from services.vertex_chat_service import get_vertex_chat_service
+
+    def build() -> None:
+        get_vertex_chat_service()
+        analyzer = get_audio_analyzer()
+        analyzer._get_llm("Warmup", analyzer.analyzer_models[0])
+    await run_in_threadpool(build)
+
+
+async def _warm_gcs_client() -> None:
+    from services.gcs_service import get_gcs_service
+    await run_in_threadpool(get_gcs_service)
+
+
+async def _warm_synthesis() -> None:
+    # SoundFont の確認と music21 の初回パース。WARMUP_SYNTHESIS_DRY_RUN なら MP3 までの合成も1回行う
+    from services.audio_synthesis_service import get_audio_synthesis_service
+
+    service = await run_in_threadpool(get_audio_synthesis_service)
+    if settings.WARMUP_SYNTHESIS_DRY_RUN:
+        mp3_data = await service.synthesize_musicxml_to_mp3(WARMUP_MUSICXML)
+        if not mp3_data:
+            raise RuntimeError("ウォームアップの合成結果が空です。")
+    else:
+        def parse() -> None:
+            from music21 import converter
+            converter.parse(WARMUP_MUSICXML)
+        await run_in_threadpool(parse)
+
+
+# プロセス内で共有する状態
+_warmup_state_instance: Optional[WarmupState] = None
+
+def get_warmup_state() -> WarmupState:
+    global _warmup_state_instance
+    if _warmup_state_instance is None:
+        _warmup_state_instance = WarmupState()
+    return _warmup_state_instance
@@ -0,0 +1,655 @@
+# backend/services/workflow_checkpoints.py
+"""
+ワークフロー (LangGraph) のチェックポイント保存先
+
+run_audio_analysis_workflow は workflow_run_id を LangGraph の thread_id として、ノードが完了するごとに状態を保存します。
+合成・保存の段階で失敗した実行は、POST /api/process/{workflow_run_id}/resume で最後に完了したノードの続きから
+実行できるため、Vertex AI の呼び出し（口ずさみ解析・バッキングトラック生成・MusicXML解析）をやり直しません。
+
+バックエンド (WORKFLOW_CHECKPOINT_BACKEND):
+- sqlite: SQLite ファイル。同じホスト（または共有ボリューム）上のプロセスで共有する
+- file: workflow_run_id ごとの JSON ファイル。複数インスタンスで再開する場合は共有ボリュームに置く
+
+チャネルの値（生成した MusicXML など）はバージョンごとに1度だけ保存し、各チェックポイントからはバージョンで参照します。
+WORKFLOW_CHECKPOINT_RETENTION_SECONDS の間に保存のなかった実行は削除します。
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# serde.dumps_typed の戻り値 (型名, バイト列)
+TypedValue = Tuple[str, bytes]
+# 値のないチャネル（バージョンだけが進んだもの）に保存する印
+_EMPTY: TypedValue = ("empty", b"")
+# 期限切れの実行の削除を行う間隔（秒）
+_CLEANUP_INTERVAL_SECONDS = 60.0
+
+
+@dataclass
+class StoredCheckpoint:
+    thread_id: str
+    checkpoint_ns: str
+    checkpoint_id: str
+    parent_checkpoint_id: Optional[str]
+    checkpoint: TypedValue # channel_values を除いたチェックポイント
+    metadata: TypedValue
+
+
+@dataclass
+class StoredWrite:
+    task_id: str
+    idx: int
+    channel: str
+    value: TypedValue
+    task_path: str
+
+
+class PersistentCheckpointSaver(BaseCheckpointSaver[str], ABC):
+    """
+    LangGraph の BaseCheckpointSaver を、保存先ごとの少数の同期メソッド（_put_checkpoint など）で実装する。
+    非同期版はスレッドプールで同期版を呼ぶ。
+    """
+
+    backend_name = "base"
+
+    def __init__(self, retention_seconds: float, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.retention_seconds = retention_seconds
+        self._last_cleanup = 0.0
+
+    # --- 保存先ごとの実装 ---
+
+    @abstractmethod
+    def _put_checkpoint(self, stored: StoredCheckpoint, blobs: Dict[str, Tuple[str, TypedValue]]) -> None:
+        """チェックポイントと、新しいバージョンのチャネルの値 (チャネル -> (バージョン, 値)) を保存する。"""
+
+    @abstractmethod
+    def _get_checkpoint(self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]) -> Optional[StoredCheckpoint]:
+        """checkpoint_id が None の場合は最新のチェックポイントを返す。"""
+
+    @abstractmethod
+    def _list_checkpoints(
+        self, thread_id: Optional[str], checkpoint_ns: Optional[str], before_checkpoint_id: Optional[str]
+    ) -> List[StoredCheckpoint]:
+        """新しい順。thread_id / checkpoint_ns が None の場合はすべて。"""
+
+    @abstractmethod
+    def _get_blobs(self, thread_id: str, checkpoint_ns: str, versions: Dict[str, str]) -> Dict[str, TypedValue]:
+        ...
+
+    @abstractmethod
+    def _put_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, writes: List[StoredWrite]) -> None:
+        """idx が0以上の書き込みは既存のものを残し、負の書き込み（エラー・割り込みなど）は置き換える。"""
+
+    @abstractmethod
+    def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[StoredWrite]:
+        ...
+
+    @abstractmethod
+    def _delete_thread(self, thread_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def _delete_threads_before(self, cutoff: float) -> int:
+        """最後の保存が cutoff より前の実行を削除し、削除した件数を返す。"""
+
+    # --- BaseCheckpointSaver ---
+
+    def _to_tuple(self, stored: StoredCheckpoint) -> CheckpointTuple:
+        checkpoint: Checkpoint = self.serde.loads_typed(stored.checkpoint)
+        versions = {channel: str(version) for channel, version in checkpoint["channel_versions"].items()}
+        blobs = self._get_blobs(stored.thread_id, stored.checkpoint_ns, versions)
+        writes = self._get_writes(stored.thread_id, stored.checkpoint_ns, stored.checkpoint_id)
+
+        def config_for(checkpoint_id: str) -> RunnableConfig:
+            return {"configurable": {"thread_id": stored.thread_id, "checkpoint_ns": stored.checkpoint_ns, "checkpoint_id": checkpoint_id}}
+
+        return CheckpointTuple(
+            config=config_for(stored.checkpoint_id),
+            checkpoint={
+                **checkpoint,
+                "channel_values": {channel: self.serde.loads_typed(value) for channel, value in blobs.items() if value[0] != _EMPTY[0]},
+            },
+            metadata=self.serde.loads_typed(stored.metadata),
+            parent_config=config_for(stored.parent_checkpoint_id) if stored.parent_checkpoint_id else None,
+            pending_writes=[(write.task_id, write.channel, self.serde.loads_typed(write.value)) for write in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        stored = self._get_checkpoint(configurable["thread_id"], configurable.get("checkpoint_ns", ""), get_checkpoint_id(config))
+        return self._to_tuple(stored) if stored is not None else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        configurable = config["configurable"] if config else {}
+        checkpoint_id = get_checkpoint_id(config) if config else None
+        stored_checkpoints = self._list_checkpoints(
+            configurable.get("thread_id"), configurable.get("checkpoint_ns"), get_checkpoint_id(before) if before else None
+        )
+        for stored in stored_checkpoints:
+            if checkpoint_id and stored.checkpoint_id != checkpoint_id:
+                continue
+            if filter:
+                metadata = self.serde.loads_typed(stored.metadata)
+                if not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+            if limit is not None:
+                if limit <= 0:
+                    break
+                limit -= 1
+            yield self._to_tuple(stored)
+
+    def put(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_without_values = checkpoint.copy()
+        values = checkpoint_without_values.pop("channel_values") # type: ignore[misc]
+        blobs = {
+            channel: (str(version), self.serde.dumps_typed(values[channel]) if channel in values else _EMPTY)
+            for channel, version in new_versions.items()
+        }
+        self._put_checkpoint(StoredCheckpoint(
+            thread_id=thread_id,
+            checkpoint_ns=checkpoint_ns,
+            checkpoint_id=checkpoint["id"],
+            parent_checkpoint_id=configurable.get("checkpoint_id"),
+            checkpoint=self.serde.dumps_typed(checkpoint_without_values),
+            metadata=self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+        ), blobs)
+        self._cleanup_expired()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        configurable = config["configurable"]
+        self._put_writes(configurable["thread_id"], configurable.get("checkpoint_ns", ""), configurable["checkpoint_id"], [
+            StoredWrite(
+                task_id=task_id, idx=WRITES_IDX_MAP.get(channel, idx), channel=channel,
+                value=self.serde.dumps_typed(value), task_path=task_path,
+            )
+            for idx, (channel, value) in enumerate(writes)
+        ])
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._delete_thread(thread_id)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await run_in_threadpool(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await run_in_threadpool(lambda: [*self.list(config, filter=filter, before=before, limit=limit)])
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(
+        self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions
+    ) -> RunnableConfig:
+        return await run_in_threadpool(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        await run_in_threadpool(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await run_in_threadpool(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # InMemorySaver と同じ形式（整数部で順序付けし、小数部で同じ番号の衝突を避ける）
+        if current is None:
+            current_version = 0
+        elif isinstance(current, int):
+            current_version = current
+        else:
+            current_version = int(current.split(".")[0])
+        return f"{current_version + 1:032}.{random.random():016}"
+
+    def _cleanup_expired(self) -> None:
+        now = time.time()
+        if now - self._last_cleanup < _CLEANUP_INTERVAL_SECONDS:
+            return
+        self._last_cleanup = now
+        removed = self._delete_threads_before(now - self.retention_seconds)
+        if removed:
+            logger.info(f"保存期間を過ぎたワークフローのチェックポイントを削除しました: {removed} 件")
+
+
+class SQLiteCheckpointSaver(PersistentCheckpointSaver):
+    """チェックポイント・チャネルの値・書き込みを別々のテーブルに保存する。"""
+
+    backend_name = "sqlite"
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        parent_checkpoint_id TEXT,
+        checkpoint_type TEXT NOT NULL,
+        checkpoint BLOB NOT NULL,
+        metadata_type TEXT NOT NULL,
+        metadata BLOB NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+    );
+    CREATE INDEX IF NOT EXISTS checkpoints_by_created_at ON checkpoints (created_at);
+    CREATE TABLE IF NOT EXISTS checkpoint_blobs (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        channel TEXT NOT NULL,
+        version TEXT NOT NULL,
+        type TEXT NOT NULL,
+        value BLOB NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+    );
+    CREATE TABLE IF NOT EXISTS checkpoint_writes (
+        thread_id TEXT NOT NULL,
+        checkpoint_ns TEXT NOT NULL,
+        checkpoint_id TEXT NOT NULL,
+        task_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        channel TEXT NOT NULL,
+        type TEXT NOT NULL,
+        value BLOB NOT NULL,
+        task_path TEXT NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+    );
+    """
+    _TABLES = ("checkpoints", "checkpoint_blobs", "checkpoint_writes")
+
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._connect().executescript(self._SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 接続はスレッドごとに作り、スレッドプールのスレッドで使い回す
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _row_to_checkpoint(row: sqlite3.Row) -> StoredCheckpoint:
+        return StoredCheckpoint(
+            thread_id=row["thread_id"],
+            checkpoint_ns=row["checkpoint_ns"],
+            checkpoint_id=row["checkpoint_id"],
+            parent_checkpoint_id=row["parent_checkpoint_id"],
+            checkpoint=(row["checkpoint_type"], row["checkpoint"]),
+            metadata=(row["metadata_type"], row["metadata"]),
+        )
+
+    def _put_checkpoint(self, stored: StoredCheckpoint, blobs: Dict[str, Tuple[str, TypedValue]]) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO checkpoint_blobs (thread_id, checkpoint_ns, channel, version, type, value) VALUES (?, ?, ?, ?, ?, ?)",
+                [(stored.thread_id, stored.checkpoint_ns, channel, version, *value) for channel, (version, value) in blobs.items()],
+            )
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO checkpoints (
+                    thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                    checkpoint_type, checkpoint, metadata_type, metadata, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    stored.thread_id, stored.checkpoint_ns, stored.checkpoint_id, stored.parent_checkpoint_id,
+                    *stored.checkpoint, *stored.metadata, time.time(),
+                ),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _get_checkpoint(self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]) -> Optional[StoredCheckpoint]:
+        conn = self._connect()
+        if checkpoint_id:
+            row = conn.execute(
+                "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT * FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1",
+                (thread_id, checkpoint_ns),
+            ).fetchone()
+        return self._row_to_checkpoint(row) if row is not None else None
+
+    def _list_checkpoints(
+        self, thread_id: Optional[str], checkpoint_ns: Optional[str], before_checkpoint_id: Optional[str]
+    ) -> List[StoredCheckpoint]:
+        conditions, params = [], []
+        for column, value, operator in (
+            ("thread_id", thread_id, "="), ("checkpoint_ns", checkpoint_ns, "="), ("checkpoint_id", before_checkpoint_id, "<"),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connect().execute(f"SELECT * FROM checkpoints {where} ORDER BY checkpoint_id DESC", params).fetchall()
+        return [self._row_to_checkpoint(row) for row in rows]
+
+    def _get_blobs(self, thread_id: str, checkpoint_ns: str, versions: Dict[str, str]) -> Dict[str, TypedValue]:
+        conn = self._connect()
+        blobs: Dict[str, TypedValue] = {}
+        for channel, version in versions.items():
+            row = conn.execute(
+                "SELECT type, value FROM checkpoint_blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, version),
+            ).fetchone()
+            if row is not None:
+                blobs[channel] = (row["type"], row["value"])
+        return blobs
+
+    def _put_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, writes: List[StoredWrite]) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for write in writes:
+                conn.execute(
+                    f"""
+                    INSERT OR {'REPLACE' if write.idx < 0 else 'IGNORE'} INTO checkpoint_writes (
+                        thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (thread_id, checkpoint_ns, checkpoint_id, write.task_id, write.idx, write.channel, *write.value, write.task_path),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[StoredWrite]:
+        rows = self._connect().execute(
+            "SELECT * FROM checkpoint_writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return [
+            StoredWrite(task_id=row["task_id"], idx=row["idx"], channel=row["channel"], value=(row["type"], row["value"]), task_path=row["task_path"])
+            for row in rows
+        ]
+
+    def _delete_thread(self, thread_id: str) -> None:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in self._TABLES:
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _delete_threads_before(self, cutoff: float) -> int:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            thread_ids = [
+                (row["thread_id"],)
+                for row in conn.execute("SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?", (cutoff,))
+            ]
+            for table in self._TABLES:
+                conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", thread_ids)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(thread_ids)
+
+    def close(self) -> None:
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+class FileCheckpointSaver(PersistentCheckpointSaver):
+    """
+    実行 (thread_id) ごとに1つの JSON ファイルに保存する。保存のたびに一時ファイルへ書き出して置き換えるため、
+    途中で落ちても直前の内容が残る。1つの実行の状態は小さい（数十KB）ため、毎回全体を書き直す。
+    """
+
+    backend_name = "file"
+
+    _SAFE_THREAD_ID = re.compile(r"[A-Za-z0-9_-]{1,128}")
+    _SUFFIX = ".json"
+
+    def __init__(self, directory: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, thread_id: str) -> str:
+        name = thread_id if self._SAFE_THREAD_ID.fullmatch(thread_id) else hashlib.sha256(thread_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + self._SUFFIX)
+
+    @staticmethod
+    def _encode(value: TypedValue) -> List[str]:
+        return [value[0], base64.b64encode(value[1]).decode("ascii")]
+
+    @staticmethod
+    def _decode(value: List[str]) -> TypedValue:
+        return value[0], base64.b64decode(value[1])
+
+    def _load(self, path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save(self, path: str, document: Dict[str, Any]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _load_thread(self, thread_id: str) -> Dict[str, Any]:
+        # ns ごとに checkpoints: {checkpoint_id: {...}}, blobs: {channel: {version: 値}}, writes: {checkpoint_id: [...]}
+        return self._load(self._path(thread_id)) or {"thread_id": thread_id, "namespaces": {}}
+
+    @staticmethod
+    def _namespace(document: Dict[str, Any], checkpoint_ns: str) -> Dict[str, Any]:
+        return document["namespaces"].setdefault(checkpoint_ns, {"checkpoints": {}, "blobs": {}, "writes": {}})
+
+    def _stored(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, entry: Dict[str, Any]) -> StoredCheckpoint:
+        return StoredCheckpoint(
+            thread_id=thread_id,
+            checkpoint_ns=checkpoint_ns,
+            checkpoint_id=checkpoint_id,
+            parent_checkpoint_id=entry["parent_checkpoint_id"],
+            checkpoint=self._decode(entry["checkpoint"]),
+            metadata=self._decode(entry["metadata"]),
+        )
+
+    def _put_checkpoint(self, stored: StoredCheckpoint, blobs: Dict[str, Tuple[str, TypedValue]]) -> None:
+        with self._lock:
+            document = self._load_thread(stored.thread_id)
+            namespace = self._namespace(document, stored.checkpoint_ns)
+            for channel, (version, value) in blobs.items():
+                namespace["blobs"].setdefault(channel, {}).setdefault(version, self._encode(value))
+            namespace["checkpoints"][stored.checkpoint_id] = {
+                "parent_checkpoint_id": stored.parent_checkpoint_id,
+                "checkpoint": self._encode(stored.checkpoint),
+                "metadata": self._encode(stored.metadata),
+            }
+            self._save(self._path(stored.thread_id), document)
+
+    def _get_checkpoint(self, thread_id: str, checkpoint_ns: str, checkpoint_id: Optional[str]) -> Optional[StoredCheckpoint]:
+        document = self._load(self._path(thread_id))
+        checkpoints = ((document or {}).get("namespaces", {}).get(checkpoint_ns) or {}).get("checkpoints") or {}
+        if not checkpoints:
+            return None
+        checkpoint_id = checkpoint_id or max(checkpoints)
+        entry = checkpoints.get(checkpoint_id)
+        return self._stored(thread_id, checkpoint_ns, checkpoint_id, entry) if entry is not None else None
+
+    def _list_checkpoints(
+        self, thread_id: Optional[str], checkpoint_ns: Optional[str], before_checkpoint_id: Optional[str]
+    ) -> List[StoredCheckpoint]:
+        if thread_id is not None:
+            paths = [self._path(thread_id)]
+        else:
+            paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(self._SUFFIX)]
+        stored_checkpoints = []
+        for path in paths:
+            document = self._load(path)
+            if document is None:
+                continue
+            for ns, namespace in document["namespaces"].items():
+                if checkpoint_ns is not None and ns != checkpoint_ns:
+                    continue
+                stored_checkpoints.extend(
+                    self._stored(document["thread_id"], ns, checkpoint_id, entry)
+                    for checkpoint_id, entry in namespace["checkpoints"].items()
+                    if before_checkpoint_id is None or checkpoint_id < before_checkpoint_id
+                )
+        stored_checkpoints.sort(key=lambda stored: stored.checkpoint_id, reverse=True)
+        return stored_checkpoints
+
+    def _get_blobs(self, thread_id: str, checkpoint_ns: str, versions: Dict[str, str]) -> Dict[str, TypedValue]:
+        document = self._load(self._path(thread_id))
+        blobs = ((document or {}).get("namespaces", {}).get(checkpoint_ns) or {}).get("blobs") or {}
+        return {
+            channel: self._decode(blobs[channel][version])
+            for channel, version in versions.items()
+            if version in blobs.get(channel, {})
+        }
+
+    def _put_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, writes: List[StoredWrite]) -> None:
+        with self._lock:
+            document = self._load_thread(thread_id)
+            stored_writes = self._namespace(document, checkpoint_ns)["writes"].setdefault(checkpoint_id, [])
+            positions = {(write["task_id"], write["idx"]): position for position, write in enumerate(stored_writes)}
+            for write in writes:
+                entry = {
+                    "task_id": write.task_id, "idx": write.idx, "channel": write.channel,
+                    "value": self._encode(write.value), "task_path": write.task_path,
+                }
+                position = positions.get((write.task_id, write.idx))
+                if position is None:
+                    positions[(write.task_id, write.idx)] = len(stored_writes)
+                    stored_writes.append(entry)
+                elif write.idx < 0:
+                    stored_writes[position] = entry
+            self._save(self._path(thread_id), document)
+
+    def _get_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[StoredWrite]:
+        document = self._load(self._path(thread_id))
+        writes = ((document or {}).get("namespaces", {}).get(checkpoint_ns) or {}).get("writes", {}).get(checkpoint_id, [])
+        return [
+            StoredWrite(task_id=write["task_id"], idx=write["idx"], channel=write["channel"], value=self._decode(write["value"]), task_path=write["task_path"])
+            for write in writes
+        ]
+
+    def _delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            try:
+                os.remove(self._path(thread_id))
+            except FileNotFoundError:
+                pass
+
+    def _delete_threads_before(self, cutoff: float) -> int:
+        removed = 0
+        with self._lock:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    # 一時ファイルも、書き込み途中で落ちて残ったものは同じ期限で消す
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += name.endswith(self._SUFFIX)
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+def create_workflow_checkpointer() -> Optional[PersistentCheckpointSaver]:
+    try:
+        if settings.WORKFLOW_CHECKPOINT_BACKEND == "sqlite":
+            return SQLiteCheckpointSaver(
+                settings.WORKFLOW_CHECKPOINT_SQLITE_PATH, retention_seconds=settings.WORKFLOW_CHECKPOINT_RETENTION_SECONDS
+            )
+        if settings.WORKFLOW_CHECKPOINT_BACKEND == "file":
+            return FileCheckpointSaver(
+                settings.WORKFLOW_CHECKPOINT_DIR, retention_seconds=settings.WORKFLOW_CHECKPOINT_RETENTION_SECONDS
+            )
+    except (OSError, sqlite3.Error) as e:
+        # 保存先が使えなくてもワークフローは実行できる（再開できないだけ）
+        logger.warning(f"ワークフローのチェックポイントの保存先を初期化できませんでした ({settings.WORKFLOW_CHECKPOINT_BACKEND}): {e}")
+    return None
+
+
+_workflow_checkpointer_instance: Optional[PersistentCheckpointSaver] = None
+_workflow_checkpointer_initialized = False
+
+
+def get_workflow_checkpointer() -> Optional[PersistentCheckpointSaver]:
+    """WORKFLOW_CHECKPOINT_BACKEND=none または初期化に失敗した場合は None。"""
+    global _workflow_checkpointer_instance, _workflow_checkpointer_initialized
+    if not _workflow_checkpointer_initialized:
+        _workflow_checkpointer_instance = create_workflow_checkpointer()
+        _workflow_checkpointer_initialized = True
+    return _workflow_checkpointer_instance
@@ -0,0 +1,107 @@
+# tracing.py
+"""
+OpenTelemetry トレーシング
+
+リクエストごとのサーバースパンを起点に、音声変換・GCS操作・ワークフローノード・
+Vertex AI 呼び出し・音声合成の各段階を子スパンとして記録します。
+受信したトレースコンテキストは W3C (traceparent) と Cloud Trace (X-Cloud-Trace-Context)
+の両形式から取り込み、送信時も両形式で伝播します。
+
+TRACING_ENABLED が無効な場合は TracerProvider を設定しないため、
+スパンの生成は OpenTelemetry API の no-op 実装となりほぼコストがかかりません。
+"""
+
+import functools
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, TypeVar
+
+from opentelemetry import propagate, trace
+from opentelemetry.propagators.cloud_trace_propagator import CloudTraceFormatPropagator
+from opentelemetry.propagators.composite import CompositePropagator
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SERVICE_NAME = "sessionmuse-backend"
+
+tracer = trace.get_tracer("sessionmuse")
+
+
+class FileSpanExporter(SpanExporter):
+    """終了したスパンを1行1スパンのJSON (JSON Lines) でローカルファイルに追記する。オフライン解析用。"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._file = open(file_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+        try:
+            with self._lock:
+                self._file.write(lines)
+                self._file.flush()
+        except OSError:
+            logger.warning(f"トレースファイルへの書き込みに失敗しました: {self.file_path}", exc_info=True)
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _create_exporter() -> SpanExporter:
+    if settings.TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter(service_name=SERVICE_NAME)
+    return FileSpanExporter(settings.TRACING_FILE_PATH)
+
+
+def setup_tracing() -> None:
+    """トレースコンテキストの伝播形式を設定し、有効な場合は TracerProvider とエクスポーターを登録する。"""
+    propagate.set_global_textmap(CompositePropagator([TraceContextTextMapPropagator(), CloudTraceFormatPropagator()]))
+    if not settings.TRACING_ENABLED:
+        return
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(_create_exporter()))
+    trace.set_tracer_provider(provider)
+    logger.info(
+        f"OpenTelemetryトレーシングを有効にしました。エクスポーター: {settings.TRACING_EXPORTER}",
+        extra={"tracing_file_path": settings.TRACING_FILE_PATH if settings.TRACING_EXPORTER == "file" else None},
+    )
+
+
+def traced(span_name: str) -> Callable[[Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]]:
+    """非同期関数の実行全体を span_name の子スパンとして記録するデコレーター。"""
+
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            with tracer.start_as_current_span(span_name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_token_usage(span: trace.Span, response: Any) -> None:
+    """LangChainの応答 (AIMessage / AIMessageChunk) の usage_metadata があればトークン数をスパンに付与する。"""
+    usage: Optional[Dict[str, Any]] = getattr(response, "usage_metadata", None)
+    if not usage or not span.is_recording():
+        return
+    for key in ("input_tokens", "output_tokens", "total_tokens"):
+        if usage.get(key) is not None:
+            span.set_attribute(f"gen_ai.usage.{key}", usage[key])
@@ -0,0 +1,124 @@
+# worker.py
+"""
+レンダリング・変換ワーカー
+
+ジョブキュー (JOB_QUEUE_BACKEND=sqlite / redis) から音声変換・音声合成のジョブを取得して実行します。
+APIサーバーとは別のプロセス（コンテナ）として起動し、APIとは独立に台数をスケールできます。
+SIGTERM / SIGINT を受け取ると新しいジョブの取得をやめ、実行中のジョブを終えてから終了します。
+
+使い方 (backend ディレクトリで実行):
+    JOB_QUEUE_BACKEND=sqlite python worker.py [--kinds convert,render] [--concurrency 2]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+from typing import List, Optional, Sequence
+
+from config import settings
+from exceptions import AppException
+from logging_config import setup_app_logging
+from tracing import setup_tracing
+from services.job_queue import Job, JobQueue, get_job_queue
+from services.jobs import JOB_KINDS, execute_job, job_error_payload
+
+logger = logging.getLogger("worker")
+
+
+class Worker:
+    """concurrency 個のループがそれぞれジョブを取得・実行する。実行中はリースを定期的に延長する。"""
+
+    def __init__(self, queue: JobQueue, kinds: Sequence[str], concurrency: int, worker_id: Optional[str] = None):
+        self.queue = queue
+        self.kinds = list(kinds)
+        self.concurrency = concurrency
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._stopping = asyncio.Event()
+
+    def stop(self) -> None:
+        if not self._stopping.is_set():
+            logger.info("ワーカーを停止します。実行中のジョブの完了を待っています。")
+            self._stopping.set()
+
+    async def run(self) -> None:
+        logger.info(f"ワーカーを起動しました: id={self.worker_id}, kinds={','.join(self.kinds)}, concurrency={self.concurrency}")
+        await asyncio.gather(*(self._loop() for _ in range(self.concurrency)))
+        logger.info("ワーカーを停止しました。")
+
+    async def _loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                # 停止の要求にすぐ応じられるよう、取得待ちは短く区切る
+                job = await self.queue.claim(self.kinds, self.worker_id, timeout=1.0)
+            except Exception as e:
+                logger.error(f"ジョブの取得に失敗しました: {e}", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+            if job is not None:
+                await self._execute(job)
+
+    async def _execute(self, job: Job) -> None:
+        logger.info(f"ジョブを開始します: {job.kind} (job_id={job.id}, attempt={job.attempts})")
+        heartbeat = asyncio.create_task(self._keep_lease(job))
+        try:
+            result = await execute_job(job)
+        except Exception as e:
+            # AppException は想定内の失敗（不正な入力など）のためスタックトレースを出さない
+            logger.error(f"ジョブが失敗しました: {job.kind} (job_id={job.id}): {e}", exc_info=not isinstance(e, AppException))
+            await self.queue.fail(job.id, self.worker_id, job_error_payload(e))
+        else:
+            logger.info(f"ジョブが完了しました: {job.kind} (job_id={job.id})")
+            await self.queue.complete(job.id, self.worker_id, result)
+        finally:
+            heartbeat.cancel()
+
+    async def _keep_lease(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                if not await self.queue.extend_lease(job.id, self.worker_id):
+                    logger.warning(f"ジョブ {job.id} のリースを失いました。結果は記録されません。")
+                    return
+            except Exception as e:
+                logger.warning(f"ジョブ {job.id} のリースを延長できませんでした: {e}")
+
+
+def parse_kinds(value: str) -> List[str]:
+    kinds = [kind.strip() for kind in value.split(",") if kind.strip()]
+    unknown = set(kinds) - set(JOB_KINDS)
+    if unknown or not kinds:
+        raise SystemExit(f"不正なジョブの種類です: {value}。指定できる値: {', '.join(JOB_KINDS)}")
+    return kinds
+
+
+async def main_async(kinds: Sequence[str], concurrency: int) -> None:
+    queue = get_job_queue()
+    if queue is None:
+        raise SystemExit("ワーカーを起動するには JOB_QUEUE_BACKEND に sqlite または redis を設定してください。")
+    worker = Worker(queue, kinds, concurrency)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await queue.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", default=settings.WORKER_JOB_KINDS, help="実行するジョブの種類（カンマ区切り）")
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY, help="同時に実行するジョブ数")
+    args = parser.parse_args()
+
+    setup_app_logging(settings.LOG_LEVEL)
+    setup_tracing()
+    asyncio.run(main_async(parse_kinds(args.kinds), max(1, args.concurrency)))
+
+
+if __name__ == "__main__":
+    main()